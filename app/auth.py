@@ -0,0 +1,158 @@
+import argparse
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from app.config import AUTH_REQUIRED, AUTH_SECRET, AUTH_TOKEN_TTL, AUTH_CACHE_SIZE, PUBLIC_SECRETS
+from app.metrics import Collected
+
+
+def check_secret(required=AUTH_REQUIRED, secret=AUTH_SECRET):
+    """Refuse AUTH_REQUIRED with a public key: anyone could sign a token for any user."""
+    if required and secret in PUBLIC_SECRETS:
+        raise RuntimeError("AUTH_REQUIRED=1 needs AUTH_SECRET set to a secret of your own")
+
+
+check_secret()
+
+# Without a secret, tokens only verify in the process that minted them (tests)
+_KEY = AUTH_SECRET.encode() if AUTH_SECRET not in PUBLIC_SECRETS else secrets.token_bytes(32)
+_HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=").decode()
+
+STATS = {"verified": 0, "cached": 0, "rejected": 0}
+
+Collected("chat_auth_handshakes_total", "WebSocket handshakes by token check outcome.", kind="counter",
+          labelnames=["result"], fn=lambda: {(k,): v for k, v in STATS.items()})
+
+
+# ------------------------
+# Tokens (JWT, HS256)
+# ------------------------
+# Any issuer that signs {"sub": <username>, "exp": <unix seconds>} with
+# AUTH_SECRET works; `python -m app.auth <username>` mints one for testing.
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue(username, ttl=AUTH_TOKEN_TTL, now=None):
+    claims = {"sub": username, "exp": int(time.time() if now is None else now) + ttl}
+    payload = f"{_HEADER}.{_b64(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{payload}.{_b64(hmac.new(_KEY, payload.encode(), hashlib.sha256).digest())}"
+
+
+def verify(token, now=None):
+    """(username, expiry) for a well-signed, unexpired token, else None. Does the crypto every time."""
+    try:
+        header, claims, sig = token.split(".")
+        expected = hmac.new(_KEY, f"{header}.{claims}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(_unb64(sig), expected):
+            return None
+        if json.loads(_unb64(header)).get("alg") != "HS256":
+            return None
+        claims = json.loads(_unb64(claims))
+        username, exp = claims["sub"], claims["exp"]
+    except (ValueError, KeyError, TypeError, AttributeError, binascii.Error):
+        return None
+    if not isinstance(username, str) or not isinstance(exp, (int, float)):
+        return None
+    return (username, exp) if exp > (time.time() if now is None else now) else None
+
+
+# ------------------------
+# Verified-token cache
+# ------------------------
+class TokenCache:
+    """
+    LRU of tokens that verified, each kept only until it expires: a client
+    reconnecting with the same token (reconnect storms, flaky networks)
+    costs a dict lookup instead of an HMAC and two JSON parses. Failures
+    are not cached, so forged tokens cannot push valid ones out. Locked:
+    every LOOP_SHARDS loop checks handshakes.
+    """
+
+    def __init__(self, size=AUTH_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()  # token -> (username, expiry)
+        self.lock = threading.Lock()
+
+    def authenticate(self, token, now=None):
+        """Username for `token`, or None."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None:
+                if entry[1] > now:
+                    self.entries.move_to_end(token)
+                    STATS["cached"] += 1
+                    return entry[0]
+                del self.entries[token]
+        entry = verify(token, now)
+        if entry is None:
+            STATS["rejected"] += 1
+            return None
+        STATS["verified"] += 1
+        if self.size > 0:
+            with self.lock:
+                self.entries[token] = entry
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return entry[0]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+CACHE = TokenCache()
+
+
+# ------------------------
+# Handshake
+# ------------------------
+def token_from(request):
+    """The bearer token of an upgrade request: Authorization header, or ?token= for browsers."""
+    header = request.headers.get("Authorization", "")
+    if header[:7].lower() == "bearer ":
+        return header[7:].strip()
+    query = urlsplit(request.path).query
+    return parse_qs(query).get("token", [None])[0] if "token=" in query else None
+
+
+def process_request(connection, request):
+    """
+    websockets.serve(process_request=...): with AUTH_REQUIRED, a request
+    without a valid token gets a 401 before the upgrade, so no handler runs
+    and nothing is registered for it. A valid one binds the connection to
+    its user once (connection.username); frames are not checked again.
+    """
+    if not AUTH_REQUIRED:
+        return None
+    token = token_from(request)
+    username = CACHE.authenticate(token) if token else None
+    if username is None:
+        if not token:
+            STATS["rejected"] += 1
+        return connection.respond(HTTPStatus.UNAUTHORIZED, "Missing, invalid or expired token.\n")
+    connection.username = username
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mint a handshake token signed with AUTH_SECRET")
+    parser.add_argument("username")
+    parser.add_argument("--ttl", type=int, default=AUTH_TOKEN_TTL, help="seconds (default %(default)s)")
+    args = parser.parse_args()
+    if AUTH_SECRET in PUBLIC_SECRETS:
+        parser.error("set AUTH_SECRET to the server's secret")
+    print(issue(args.username, args.ttl))
@@ -0,0 +1,445 @@
+import asyncio
+import os
+import struct
+from abc import ABC, abstractmethod
+from app.config import BACKPLANE, REDIS_URL, NODE_ID, NODE_TTL, IPC_SOCKET
+from app.frames import dumps, loads
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Membership events replicated between nodes:
+#   {"op": "create_room" | "join" | "leave", "room": ..., "user": ...}
+#   {"op": "online", "user": ...}
+#   {"op": "offline", "user": ..., "rooms": [...]}
+# Every event also carries the "node" that produced it.
+
+
+def apply_to_state(state, event):
+    """Apply an event to a {"rooms": {room: set}, "online": {user: node}} snapshot."""
+    op = event.get("op")
+    rooms, online = state["rooms"], state["online"]
+    if op == "create_room":
+        rooms.setdefault(event["room"], set()).add(event["user"])
+    elif op == "join":
+        rooms.setdefault(event["room"], set()).add(event["user"])
+    elif op == "leave":
+        rooms.get(event["room"], set()).discard(event["user"])
+    elif op == "online":
+        online[event["user"]] = event["node"]
+    elif op == "offline":
+        if online.get(event["user"]) == event["node"]:
+            online.pop(event["user"], None)
+        for room in event.get("rooms", ()):
+            rooms.get(room, set()).discard(event["user"])
+
+
+# ------------------------
+# Interface
+# ------------------------
+class Backplane(ABC):
+    """
+    Carries room frames and membership events between server nodes.
+
+    Each node publishes the frames of its local senders and gets called back
+    (`on_frame(room, frame)`) only for rooms it has `watch()`ed, i.e. rooms with
+    members connected to it. Membership events go to every node
+    (`on_event(event)`) so each keeps a replica of rooms and presence.
+    publish()/publish_event() never wait on the network; a backend without
+    them can't be constructed.
+    """
+
+    def __init__(self, node_id=NODE_ID):
+        self.node_id = node_id
+        self.on_frame = None
+        self.on_event = None
+
+    async def start(self, on_frame, on_event):
+        """Register callbacks; returns the current cluster snapshot."""
+        self.on_frame = on_frame
+        self.on_event = on_event
+        return {"rooms": {}, "online": {}}
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    def publish(self, room, frame):
+        """Send a room frame to the nodes watching `room`."""
+
+    @abstractmethod
+    def publish_event(self, event):
+        """Send a membership event to every node."""
+
+    def watch(self, room):
+        pass
+
+    def unwatch(self, room):
+        pass
+
+
+# ------------------------
+# In-process loopback
+# ------------------------
+class LoopbackHub:
+    """Shared state for LocalBackplane nodes living in the same process."""
+
+    def __init__(self):
+        self.nodes = []
+        self.state = {"rooms": {}, "online": {}}
+
+
+class LocalBackplane(Backplane):
+    """
+    In-process backplane. With its own hub it is the single-node default and
+    publishing is nearly free; several nodes sharing a hub behave like a
+    cluster, which is what the tests use.
+    """
+
+    def __init__(self, hub=None, node_id=NODE_ID):
+        super().__init__(node_id)
+        self.hub = hub or LoopbackHub()
+        self.watching = set()
+
+    async def start(self, on_frame, on_event):
+        await super().start(on_frame, on_event)
+        self.hub.nodes.append(self)
+        state = self.hub.state
+        return {"rooms": {r: set(m) for r, m in state["rooms"].items()}, "online": dict(state["online"])}
+
+    async def stop(self):
+        if self in self.hub.nodes:
+            self.hub.nodes.remove(self)
+
+    def publish(self, room, frame):
+        for node in self.hub.nodes:
+            if node is not self and room in node.watching:
+                asyncio.ensure_future(node.on_frame(room, frame))
+
+    def publish_event(self, event):
+        event = {**event, "node": self.node_id}
+        apply_to_state(self.hub.state, event)
+        for node in self.hub.nodes:
+            if node is not self:
+                asyncio.get_running_loop().call_soon(node.on_event, event)
+
+    def watch(self, room):
+        self.watching.add(room)
+
+    def unwatch(self, room):
+        self.watching.discard(room)
+
+
+# ------------------------
+# Redis pub/sub
+# ------------------------
+class RedisBackplane(Backplane):
+    """
+    Redis-backed backplane. Room frames go to one channel per room, so a node
+    only receives rooms it watches. Events go to one shared channel and are
+    also written to Redis (hash of online users, one set per room) so a node
+    that starts later can load a snapshot. Each node refreshes a TTL key;
+    users of nodes whose key expired (crashed) are left out of snapshots.
+    """
+
+    PREFIX = "chat:"
+    EVENTS = b"chat:events"
+
+    def __init__(self, url=REDIS_URL, node_id=NODE_ID):
+        super().__init__(node_id)
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:  # optional dependency
+            raise RuntimeError("BACKPLANE=redis needs the 'redis' package (pip install redis)")
+        self.redis = aioredis.Redis.from_url(url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.tag = node_id.encode() + b"|"
+        self.outbox = None
+        self.tasks = []
+
+    def _room_channel(self, room):
+        return f"{self.PREFIX}room:{room}".encode()
+
+    async def start(self, on_frame, on_event):
+        await super().start(on_frame, on_event)
+        self.outbox = asyncio.Queue()
+        await self._heartbeat_once()
+        await self.pubsub.subscribe(self.EVENTS)
+        self.tasks = [
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self._writer()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+        return await self._snapshot()
+
+    async def stop(self):
+        # Let queued publishes go out before closing
+        if self.outbox is not None:
+            self.outbox.put_nowait(None)
+            await asyncio.gather(self.tasks[1], return_exceptions=True)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.redis.delete(f"{self.PREFIX}node:{self.node_id}")
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    def publish(self, room, frame):
+        self.outbox.put_nowait(("publish", self._room_channel(room), self.tag + frame))
+
+    def publish_event(self, event):
+        event = {**event, "node": self.node_id}
+        self.outbox.put_nowait(("event", event, self.tag + dumps(event)))
+
+    def watch(self, room):
+        asyncio.ensure_future(self.pubsub.subscribe(self._room_channel(room)))
+
+    def unwatch(self, room):
+        asyncio.ensure_future(self.pubsub.unsubscribe(self._room_channel(room)))
+
+    async def _writer(self):
+        # Drain whatever is queued into one pipeline per round trip
+        while True:
+            batch = [await self.outbox.get()]
+            while not self.outbox.empty() and len(batch) < 1024:
+                batch.append(self.outbox.get_nowait())
+            done = None in batch
+            pipe = self.redis.pipeline(transaction=False)
+            for item in batch:
+                if item is None:
+                    continue
+                if item[0] == "publish":
+                    pipe.publish(item[1], item[2])
+                else:
+                    self._store_event(pipe, item[1])
+                    pipe.publish(self.EVENTS, item[2])
+            try:
+                await pipe.execute()
+            except Exception as e:
+                logger.error("Backplane publish failed (%d items): %s", len(batch), e)
+            if done:
+                return
+
+    def _store_event(self, pipe, event):
+        op, p = event["op"], self.PREFIX
+        if op in ("create_room", "join"):
+            pipe.sadd(f"{p}rooms", event["room"])
+            pipe.sadd(f"{p}members:{event['room']}", event["user"])
+        elif op == "leave":
+            pipe.srem(f"{p}members:{event['room']}", event["user"])
+        elif op == "online":
+            pipe.hset(f"{p}online", event["user"], self.node_id)
+        elif op == "offline":
+            pipe.hdel(f"{p}online", event["user"])
+            for room in event.get("rooms", ()):
+                pipe.srem(f"{p}members:{room}", event["user"])
+
+    async def _reader(self):
+        events = self.EVENTS
+        prefix_len = len(self._room_channel(""))
+        async for message in self.pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            node, _, body = message["data"].partition(b"|")
+            if node == self.tag[:-1]:
+                continue  # our own publish
+            try:
+                if message["channel"] == events:
+                    self.on_event(loads(body))
+                else:
+                    await self.on_frame(message["channel"][prefix_len:].decode(), body)
+            except Exception as e:
+                logger.error("Backplane delivery failed: %s", e)
+
+    async def _heartbeat_once(self):
+        await self.redis.set(f"{self.PREFIX}node:{self.node_id}", 1, ex=NODE_TTL)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(NODE_TTL / 3)
+            try:
+                await self._heartbeat_once()
+            except Exception as e:
+                logger.error("Backplane heartbeat failed: %s", e)
+
+    async def _snapshot(self):
+        p = self.PREFIX
+        online = {k.decode(): v.decode() for k, v in (await self.redis.hgetall(f"{p}online")).items()}
+        nodes = set(online.values())
+        alive = {n for n in nodes if await self.redis.exists(f"{p}node:{n}")}
+        online = {u: n for u, n in online.items() if n in alive}
+        rooms = [r.decode() for r in await self.redis.smembers(f"{p}rooms")]
+        pipe = self.redis.pipeline(transaction=False)
+        for room in rooms:
+            pipe.smembers(f"{p}members:{room}")
+        members = await pipe.execute()
+        return {
+            "rooms": {room: {m.decode() for m in ms if m.decode() in online} for room, ms in zip(rooms, members)},
+            "online": online,
+        }
+
+
+# ------------------------
+# Unix socket IPC (multi-worker mode)
+# ------------------------
+# Length-prefixed messages; the first byte says what follows:
+#   H<node id>            worker -> hub, once after connecting
+#   S<json snapshot>      hub -> worker, reply to H
+#   W<room> / U<room>     worker -> hub, watch / unwatch a room
+#   P<room>\0<frame>      room frame, forwarded as-is to watching workers
+#   E<json event>         membership event, forwarded to every other worker
+_LEN = struct.Struct("!I")
+
+
+def _pack(kind, body):
+    return _LEN.pack(len(body) + 1) + kind + body
+
+
+async def _read_message(reader):
+    size, = _LEN.unpack(await reader.readexactly(4))
+    return await reader.readexactly(size)
+
+
+def _encode_state(state):
+    return dumps({"rooms": {r: sorted(m) for r, m in state["rooms"].items()}, "online": state["online"]})
+
+
+class IpcBackplane(Backplane):
+    """Worker side of the multi-worker backplane; talks to IpcHub over a Unix socket."""
+
+    def __init__(self, path=IPC_SOCKET, node_id=NODE_ID):
+        super().__init__(node_id)
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.task = None
+
+    async def start(self, on_frame, on_event):
+        await super().start(on_frame, on_event)
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.writer.write(_pack(b"H", self.node_id.encode()))
+        snapshot = loads((await _read_message(self.reader))[1:])
+        self.task = asyncio.create_task(self._read())
+        return {"rooms": {r: set(m) for r, m in snapshot["rooms"].items()}, "online": snapshot["online"]}
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    def publish(self, room, frame):
+        self.writer.write(_pack(b"P", room.encode() + b"\0" + frame))
+
+    def publish_event(self, event):
+        event = {**event, "node": self.node_id}
+        self.writer.write(_pack(b"E", dumps(event)))
+
+    def watch(self, room):
+        self.writer.write(_pack(b"W", room.encode()))
+
+    def unwatch(self, room):
+        self.writer.write(_pack(b"U", room.encode()))
+
+    async def _read(self):
+        try:
+            while True:
+                msg = await _read_message(self.reader)
+                kind = msg[:1]
+                try:
+                    if kind == b"P":
+                        room, _, frame = msg[1:].partition(b"\0")
+                        await self.on_frame(room.decode(), frame)
+                    elif kind == b"E":
+                        self.on_event(loads(msg[1:]))
+                except Exception as e:
+                    logger.error("Backplane delivery failed: %s", e)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.error("Lost connection to the worker supervisor")
+
+
+class IpcHub:
+    """
+    Supervisor side of the IPC backplane. Routes room frames to the workers
+    watching the room, fans events out to every worker and keeps the cluster
+    state for snapshots. When a worker's connection drops (crash or exit),
+    its users are announced offline so the other workers stay consistent.
+    """
+
+    def __init__(self, path=IPC_SOCKET):
+        self.path = path
+        self.server = None
+        self.workers = {}  # writer -> {"node": id, "watching": set()}
+        self.state = {"rooms": {}, "online": {}}
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket from a previous run
+        self.server = await asyncio.start_unix_server(self._serve, self.path)
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _emit(self, event, raw, sender=None):
+        apply_to_state(self.state, event)
+        for writer in self.workers:
+            if writer is not sender:
+                writer.write(raw)
+
+    async def _serve(self, reader, writer):
+        node = None
+        try:
+            hello = await _read_message(reader)
+            node = hello[1:].decode()
+            writer.write(_pack(b"S", _encode_state(self.state)))
+            info = self.workers[writer] = {"node": node, "watching": set()}
+            while True:
+                msg = await _read_message(reader)
+                kind = msg[:1]
+                if kind == b"P":
+                    room = msg[1:msg.index(b"\0")].decode()
+                    raw = _LEN.pack(len(msg)) + msg
+                    for other, other_info in self.workers.items():
+                        if other is not writer and room in other_info["watching"]:
+                            other.write(raw)
+                elif kind == b"E":
+                    self._emit(loads(msg[1:]), _LEN.pack(len(msg)) + msg, sender=writer)
+                elif kind == b"W":
+                    info["watching"].add(msg[1:].decode())
+                elif kind == b"U":
+                    info["watching"].discard(msg[1:].decode())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.workers.pop(writer, None)
+            writer.close()
+            if node is not None:
+                self._forget(node)
+
+    def _forget(self, node):
+        # Users of a dead worker are gone; tell everyone else
+        for user, owner in list(self.state["online"].items()):
+            if owner != node:
+                continue
+            rooms = [r for r, members in self.state["rooms"].items() if user in members]
+            event = {"op": "offline", "user": user, "rooms": rooms, "node": node}
+            self._emit(event, _pack(b"E", dumps(event)))
+
+
+def create(kind=BACKPLANE):
+    if kind == "redis":
+        return RedisBackplane()
+    if kind == "ipc":
+        return IpcBackplane()
+    if kind == "local":
+        return LocalBackplane()
+    raise ValueError(f"Unknown BACKPLANE: {kind}")
+
+
+# Backplane used by the handlers; replaced at startup by app.server.main
+node = LocalBackplane()
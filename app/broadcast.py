@@ -0,0 +1,228 @@
+import asyncio
+import threading
+import websockets
+from time import perf_counter
+from app.config import (
+    OUTBOUND_QUEUE_SIZE,
+    SLOW_CONSUMER_POLICY,
+    BACKPRESSURE_TIMEOUT,
+    BROADCAST_WRITE_LIMIT,
+    WS_COMPRESSION_MAX_FANOUT,
+)
+from app import runtime
+from app.logger import get_logger
+from app.metrics import Collected, Histogram, SIZE_BUCKETS
+
+logger = get_logger(__name__)
+
+# Slow consumer policies
+DROP_OLDEST = "drop_oldest"          # discard the oldest queued frame to make room
+DROP_CONNECTION = "drop_connection"  # close the connection that can't keep up
+BACKPRESSURE = "backpressure"        # make the sender wait until there is room
+POLICIES = (DROP_OLDEST, DROP_CONNECTION, BACKPRESSURE)
+
+# Close code used when a slow consumer is kicked (1013 = try again later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Global counters (per-connection numbers live on each Outbound)
+STATS = {
+    "enqueued": 0,
+    "sent": 0,
+    "direct": 0,
+    "dropped": 0,
+    "disconnected": 0,
+}
+
+# Frames waiting in outbound queues: one counter per event loop thread, so
+# each is only ever changed by one thread (LOOP_SHARDS > 1) and sums exactly
+QUEUED = []
+_loop_counters = threading.local()
+
+
+def _queued_counter():
+    counter = getattr(_loop_counters, "queued", None)
+    if counter is None:
+        counter = _loop_counters.queued = [0]
+        QUEUED.append(counter)
+    return counter
+
+
+def queued_frames():
+    """Frames waiting in every outbound queue of this process."""
+    return sum(counter[0] for counter in QUEUED)
+
+
+FANOUT_RECIPIENTS = Histogram("chat_fanout_recipients", "Local connections a frame was fanned out to.",
+                              buckets=SIZE_BUCKETS)
+FANOUT_SECONDS = Histogram("chat_fanout_seconds", "Time to hand one frame to every local recipient.")
+Collected("chat_frames_out_total", "Frames written to clients.", kind="counter", labelnames=["path"],
+          fn=lambda: {("direct",): STATS["direct"], ("queued",): STATS["sent"]})
+Collected("chat_frames_dropped_total", "Frames dropped by the slow consumer policy.",
+          lambda: STATS["dropped"], kind="counter")
+Collected("chat_slow_consumers_closed_total", "Connections closed for not keeping up.",
+          lambda: STATS["disconnected"], kind="counter")
+Collected("chat_outbound_queued_frames", "Frames waiting in outbound queues.", queued_frames)
+
+
+# ------------------------
+# Per-connection queue
+# ------------------------
+class Outbound:
+    """Bounded outbound queue for one websocket, drained by its own writer task."""
+
+    __slots__ = ("ws", "queue", "task", "dropped", "closed", "busy", "queued")
+
+    def __init__(self, ws, maxsize=OUTBOUND_QUEUE_SIZE):
+        self.ws = ws
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.queued = _queued_counter()  # this loop's count of queued frames
+        self.task = None
+        self.dropped = 0
+        self.closed = False
+        self.busy = False  # writer holds a frame it hasn't finished sending
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+        return self
+
+    async def stop(self):
+        self.closed = True
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        # Never sent: no longer queued
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queued[0] -= 1
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def queued_bytes(self):
+        """Bytes waiting in the queue; walks it, so meant for reports, not the send path."""
+        return sum(len(frame) for frame in self.queue._queue)
+
+    def can_write_direct(self):
+        """
+        True when a frame can be written straight to the socket without
+        overtaking queued frames or piling onto a congested transport.
+        """
+        if self.closed or self.busy or not self.queue.empty():
+            return False
+        transport = getattr(self.ws, "transport", None)
+        return transport is not None and transport.get_write_buffer_size() < BROADCAST_WRITE_LIMIT
+
+    def offer(self, frame, policy=SLOW_CONSUMER_POLICY):
+        """
+        Enqueue without awaiting. Returns False only when the frame could not
+        be queued and the caller has to apply backpressure.
+        """
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            self.queued[0] += 1
+        except asyncio.QueueFull:
+            if policy == DROP_OLDEST:
+                self.queue.get_nowait()
+                self.queue.put_nowait(frame)
+                self._drop()
+            elif policy == DROP_CONNECTION:
+                self._drop()
+                self._kick()
+            else:
+                return False
+        STATS["enqueued"] += 1
+        return True
+
+    async def put(self, frame, timeout=BACKPRESSURE_TIMEOUT):
+        """Wait for room in the queue; kick the connection if it never drains."""
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(self.queue.put(frame), timeout)
+            self.queued[0] += 1
+            STATS["enqueued"] += 1
+        except asyncio.TimeoutError:
+            self._drop()
+            self._kick()
+
+    def _drop(self):
+        self.dropped += 1
+        STATS["dropped"] += 1
+
+    def _kick(self):
+        if self.closed:
+            return
+        self.closed = True
+        STATS["disconnected"] += 1
+        logger.warning("Closing slow consumer (queue depth %d)", self.depth())
+        asyncio.ensure_future(self.ws.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="slow consumer"))
+
+    async def _writer(self):
+        queue = self.queue
+        while True:
+            frame = await queue.get()
+            self.queued[0] -= 1
+            self.busy = True
+            try:
+                # Frames are pre-encoded UTF-8 JSON; keep them as text frames
+                if isinstance(frame, bytes):
+                    await self.ws.send(frame, text=True)
+                else:
+                    await self.ws.send(frame)
+            except websockets.ConnectionClosed:
+                self.closed = True
+                return
+            finally:
+                self.busy = False
+            STATS["sent"] += 1
+
+
+# ------------------------
+# Fan-out
+# ------------------------
+async def fanout(frame, outbounds, policy=SLOW_CONSUMER_POLICY):
+    """
+    Deliver an already serialized frame to every outbound in a single pass.
+
+    Idle connections get the frame through websockets.broadcast(), which frames
+    the payload once per socket and writes it without a task hop. Connections
+    that are busy or congested get it queued instead so ordering and the
+    slow consumer policy still apply. Only waits when the backpressure policy
+    is active and some queues are full.
+    """
+    started = perf_counter()
+    FANOUT_RECIPIENTS.observe(len(outbounds))
+    direct = []
+    blocked = []
+    for o in outbounds:
+        if o.can_write_direct():
+            direct.append(o.ws)
+        elif not o.offer(frame, policy):
+            blocked.append(o)
+    if direct:
+        # Large rooms skip per-recipient deflate (only matters with WS_COMPRESSION=auto)
+        runtime.bypass_compression.on = len(direct) > WS_COMPRESSION_MAX_FANOUT
+        try:
+            websockets.broadcast(direct, frame, text=True)
+        finally:
+            runtime.bypass_compression.on = False
+        STATS["direct"] += len(direct)
+    if blocked:
+        await asyncio.gather(*(o.put(frame) for o in blocked))
+    FANOUT_SECONDS.observe(perf_counter() - started)
+
+
+def stats(outbounds=()):
+    """Snapshot of the global counters plus queue depth over the given outbounds."""
+    depths = [o.depth() for o in outbounds]
+    return {
+        **STATS,
+        "connections": len(depths),
+        "queue_depth": sum(depths),
+        "max_queue_depth": max(depths, default=0),
+    }
@@ -1,6 +1,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import socket
 
 # Load .env file
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -12,11 +13,15 @@ PORT = int(os.getenv("PORT", 8765))
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "chat_db")
 AUTH_TOKEN = os.getenv("AUTH_TOKEN", "dev-token")
+# Unset, or the placeholders in this repo and .env.example: public, so never used to sign anything
+PUBLIC_SECRETS = ("", "dev-token", "change-me")
 MAX_HISTORY = int(os.getenv("MAX_HISTORY", 100))
 
 #limits
 RATE_LIMIT = int(os.getenv("RATE_LIMIT", 5))
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", 10))
+RATE_LIMIT_PER_IP = int(os.getenv("RATE_LIMIT_PER_IP", 20))  # shared by every username on one address
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 1_000_000))
 MAX_MESSAGE_LENGTH = int(os.getenv("MAX_MESSAGE_LENGTH", 500))
 MAX_ROOM_NAME_LENGTH = int(os.getenv("MAX_ROOM_NAME_LENGTH", 50))
 MAX_USERNAME_LENGTH = int(os.getenv("MAX_USERNAME_LENGTH", 30))
@@ -24,3 +29,116 @@ MIN_USERNAME_LENGTH = int(os.getenv("MIN_USERNAME_LENGTH", 3))
 MAX_ROOMS_PER_USER = int(os.getenv("MAX_ROOMS_PER_USER", 10))
 MAX_USERS_PER_ROOM = int(os.getenv("MAX_USERS_PER_ROOM", 50))
 
+#fan-out
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", 256))
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "drop_oldest")  # drop_oldest | drop_connection | backpressure
+BACKPRESSURE_TIMEOUT = float(os.getenv("BACKPRESSURE_TIMEOUT", 5.0))
+BROADCAST_WRITE_LIMIT = int(os.getenv("BROADCAST_WRITE_LIMIT", 64 * 1024))  # bytes buffered before falling back to the queue
+
+#serialization
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")  # auto | orjson | json
+
+#persistence (write-behind)
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", 500))
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", 0.5))  # seconds
+PERSIST_MAX_PENDING = int(os.getenv("PERSIST_MAX_PENDING", 50000))  # messages buffered before dropping
+PERSIST_DRAIN_TIMEOUT = float(os.getenv("PERSIST_DRAIN_TIMEOUT", 10.0))
+HISTORY_MAX_ROOMS = int(os.getenv("HISTORY_MAX_ROOMS", 10000))  # rooms kept in the in-memory history buffer
+
+#rooms (persisted catalog + memberships)
+CATALOG_BATCH_SIZE = int(os.getenv("CATALOG_BATCH_SIZE", 10000))  # room names per MongoDB batch while loading the catalog
+ROOM_WRITE_TIMEOUT = float(os.getenv("ROOM_WRITE_TIMEOUT", 5.0))  # seconds a room/membership write may take before it is given up
+
+#search (in-memory inverted index, MongoDB text index behind it)
+SEARCH_MAX_MESSAGES = int(os.getenv("SEARCH_MAX_MESSAGES", 1_000_000))  # newest messages indexed in memory, all rooms together
+SEARCH_SEGMENT_SIZE = min(int(os.getenv("SEARCH_SEGMENT_SIZE", 65536)), 65536)  # messages per segment (evicted whole)
+SEARCH_MAX_TERMS = int(os.getenv("SEARCH_MAX_TERMS", 8))  # query words looked at
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 20))  # results per page unless the request asks for more (up to MAX_HISTORY)
+
+#presence (paged room/user lists, coalesced deltas for subscribers)
+PRESENCE_WINDOW = float(os.getenv("PRESENCE_WINDOW", 0.25))  # seconds of changes folded into one delta frame per subscriber
+PRESENCE_PAGE_SIZE = int(os.getenv("PRESENCE_PAGE_SIZE", 500))  # most names in one room_list/user_list page
+
+#message log (MONGO_URI=log://<dir>: embedded storage in local files instead of MongoDB, see app/msglog.py)
+MSGLOG_SEGMENT_BYTES = int(os.getenv("MSGLOG_SEGMENT_BYTES", 16 * 1024 * 1024))  # a room's segment file rolls over past this size
+MSGLOG_SEGMENT_SECONDS = int(os.getenv("MSGLOG_SEGMENT_SECONDS", 86400))  # ... or once its first message is this old
+MSGLOG_INDEX_INTERVAL = int(os.getenv("MSGLOG_INDEX_INTERVAL", 4096))  # bytes between sparse index entries
+MSGLOG_FSYNC_INTERVAL = float(os.getenv("MSGLOG_FSYNC_INTERVAL", 0.005))  # seconds appends wait to share one fsync; <0 = never fsync
+MSGLOG_RETENTION_DAYS = float(os.getenv("MSGLOG_RETENTION_DAYS", 0))  # older messages are dropped; 0 = keep forever
+MSGLOG_RETENTION_BYTES = int(os.getenv("MSGLOG_RETENTION_BYTES", 0))  # per room, oldest segments dropped first; 0 = no limit
+MSGLOG_MAINTENANCE_INTERVAL = float(os.getenv("MSGLOG_MAINTENANCE_INTERVAL", 300))  # seconds between retention/compaction passes; 0 = off
+MSGLOG_MAX_OPEN = int(os.getenv("MSGLOG_MAX_OPEN", 256))  # segment files kept open for appends, and mapped for reads
+
+#scale-out
+BACKPLANE = os.getenv("BACKPLANE", "local")  # local | redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+NODE_ID = os.getenv("NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+NODE_TTL = int(os.getenv("NODE_TTL", 30))  # seconds before a silent node's users drop out of snapshots
+WORKERS = int(os.getenv("WORKERS", 1))  # >1 forks SO_REUSEPORT workers under a supervisor
+IPC_SOCKET = os.getenv("IPC_SOCKET", f"/tmp/chat-cli-{PORT}.sock")  # worker <-> supervisor backplane
+LOOP_SHARDS = int(os.getenv("LOOP_SHARDS", 1))  # event loops (threads) per process; rooms are hashed to one of them, see app/shards.py
+
+#runtime profile (event loop + websockets.serve tuning)
+SERVER_PROFILE = os.getenv("SERVER_PROFILE", "default")  # default | latency | throughput | lowmem
+PROFILES = {
+    "default":    {"uvloop": "auto", "compression": "auto", "ping": 20, "read_buffer": 64 * 1024, "write_limit": 32 * 1024, "tcp_nodelay": True},
+    "latency":    {"uvloop": "auto", "compression": "off", "ping": 10, "read_buffer": 32 * 1024, "write_limit": 16 * 1024, "tcp_nodelay": True},
+    "throughput": {"uvloop": "auto", "compression": "off", "ping": 30, "read_buffer": 256 * 1024, "write_limit": 256 * 1024, "tcp_nodelay": False},
+    "lowmem":     {"uvloop": "auto", "compression": "on", "ping": 15, "read_buffer": 16 * 1024, "write_limit": 8 * 1024, "tcp_nodelay": True},
+}
+_profile = PROFILES[SERVER_PROFILE]
+USE_UVLOOP = os.getenv("USE_UVLOOP", _profile["uvloop"])  # auto | on | off
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", _profile["compression"])  # off | on | auto
+WS_COMPRESSION_MIN_SIZE = int(os.getenv("WS_COMPRESSION_MIN_SIZE", 512))  # auto: smaller frames go uncompressed
+WS_COMPRESSION_MAX_FANOUT = int(os.getenv("WS_COMPRESSION_MAX_FANOUT", 16))  # auto: bigger rooms go uncompressed
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", _profile["ping"]))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", _profile["ping"]))
+WS_READ_BUFFER = int(os.getenv("WS_READ_BUFFER", _profile["read_buffer"]))  # bytes of unread client frames per connection
+WS_WRITE_LIMIT = int(os.getenv("WS_WRITE_LIMIT", _profile["write_limit"]))  # transport high-water mark
+TCP_NODELAY = os.getenv("TCP_NODELAY", str(_profile["tcp_nodelay"])).lower() in ("1", "true", "yes")
+# Largest legal client frame: MAX_MESSAGE_LENGTH characters of UTF-8 plus the JSON envelope
+WS_MAX_SIZE = int(os.getenv("WS_MAX_SIZE", MAX_MESSAGE_LENGTH * 4 + 1024))
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", max(1, WS_READ_BUFFER // WS_MAX_SIZE)))
+
+#sessions (resume after a reconnect)
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")  # must match on every node that may resume a session; required with WORKERS > 1 or a shared BACKPLANE
+SESSION_TTL = int(os.getenv("SESSION_TTL", 3600))  # seconds a session token stays valid
+
+#handshake auth (signed tokens checked before the WebSocket upgrade, see app/auth.py)
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "0").lower() in ("1", "true", "yes")  # refuse upgrades without a valid token
+AUTH_SECRET = os.getenv("AUTH_SECRET", "")  # HS256 key shared with whatever issues the tokens; required with AUTH_REQUIRED
+AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", 86400))  # seconds tokens minted by `python -m app.auth` last
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 100_000))  # verified tokens remembered (until they expire)
+
+#liveness (app-level heartbeats + idle reaper)
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", 30))  # seconds of silence before the server sends {"type":"ping"}; 0 = none
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", 90))  # seconds of silence before a connection is evicted; 0 disables the reaper
+REAPER_TICK = float(os.getenv("REAPER_TICK", 1.0))  # timer wheel resolution
+REAPER_BATCH = int(os.getenv("REAPER_BATCH", 1000))  # most evictions per tick
+CONNECTION_REPORT_INTERVAL = float(os.getenv("CONNECTION_REPORT_INTERVAL", 60))  # seconds between per-connection memory logs; 0 = off
+CONNECTION_REPORT_TOP = int(os.getenv("CONNECTION_REPORT_TOP", 5))  # connections named in that log
+
+#overload (admission control and load shedding driven by event loop lag, see app/overload.py)
+OVERLOAD_ENABLED = os.getenv("OVERLOAD_ENABLED", "1").lower() in ("1", "true", "yes")
+OVERLOAD_INTERVAL = float(os.getenv("OVERLOAD_INTERVAL", 0.05))  # seconds between lag probes on each event loop
+OVERLOAD_LAG_REJECT = float(os.getenv("OVERLOAD_LAG_REJECT", 0.05))  # seconds of loop lag before new connections are refused
+OVERLOAD_LAG_THROTTLE = float(os.getenv("OVERLOAD_LAG_THROTTLE", 0.1))  # ... before list/history/search are throttled
+OVERLOAD_LAG_SHED = float(os.getenv("OVERLOAD_LAG_SHED", 0.25))  # ... before chat is rate limited per room
+OVERLOAD_QUEUED_REJECT = int(os.getenv("OVERLOAD_QUEUED_REJECT", 50_000))  # frames waiting in outbound queues, same three steps
+OVERLOAD_QUEUED_THROTTLE = int(os.getenv("OVERLOAD_QUEUED_THROTTLE", 100_000))
+OVERLOAD_QUEUED_SHED = int(os.getenv("OVERLOAD_QUEUED_SHED", 200_000))
+OVERLOAD_COOLDOWN = float(os.getenv("OVERLOAD_COOLDOWN", 2.0))  # seconds below a level's thresholds before stepping down one
+OVERLOAD_EXPENSIVE_RATE = int(os.getenv("OVERLOAD_EXPENSIVE_RATE", 20))  # list/history/search per second per type while throttling
+OVERLOAD_ROOM_FANOUT = int(os.getenv("OVERLOAD_ROOM_FANOUT", 1000))  # deliveries per second per room while shedding (a message costs one per member)
+
+#metrics (Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # local only by default
+METRICS_PORT = int(os.getenv("METRICS_PORT", PORT + 1000))  # worker i uses METRICS_PORT + i; 0 = no endpoint
+
+#logging (a writer thread does formatting and I/O; see app/logger.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records waiting for the writer before new ones are dropped
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 100))  # records per message template per window below WARNING; 0 = keep all
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", 1.0))  # seconds
@@ -1,10 +1,32 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from .config import MONGO_URI, DB_NAME
+from .memdb import InMemoryDatabase
 
 # Initialize MongoDB client and database
-mongo_client = AsyncIOMotorClient(MONGO_URI)
-db = mongo_client[DB_NAME]
+# MONGO_URI=memory:// swaps in the in-process stand-in (offline benchmarks, demos)
+# MONGO_URI=log://<dir> stores everything under <dir> with the embedded engine (app/msglog.py)
+if MONGO_URI.startswith("memory://"):
+    mongo_client = None
+    db = InMemoryDatabase(DB_NAME)
+elif MONGO_URI.startswith("log://"):
+    from .msglog import LogDatabase
+    mongo_client = None
+    db = LogDatabase(MONGO_URI[len("log://"):] or "chatlog", DB_NAME)
+else:
+    mongo_client = AsyncIOMotorClient(MONGO_URI)
+    db = mongo_client[DB_NAME]
 users_collection = db["users"]
 messages_collection = db["messages"]
 rooms_collection = db["rooms"]
 
+
+async def start():
+    """Open what the storage engine needs open (nothing for MongoDB)."""
+    if hasattr(db, "start"):
+        await db.start()
+
+
+async def stop():
+    """Flush and close the storage engine, after the message writer drained into it."""
+    if hasattr(db, "close"):
+        await db.close()
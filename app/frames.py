@@ -0,0 +1,41 @@
+import json
+from app.config import JSON_BACKEND
+
+# Pick the JSON backend once at import time
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+
+if orjson is not None and JSON_BACKEND in ("auto", "orjson"):
+    BACKEND = "orjson"
+    dumps = orjson.dumps   # -> bytes (compact, UTF-8)
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+    loads = json.loads
+
+
+# ------------------------
+# Frame builders
+# ------------------------
+def encode(obj):
+    """Encode any JSON-safe object to a UTF-8 frame (bytes)."""
+    return dumps(obj)
+
+
+def message_frame(room, sender, content, msg_id=None, ts=None):
+    """Chat frame in the shape client/cli.py::recv_loop expects (plus id and ms timestamp)."""
+    return dumps({"type": "message", "data": {"room": room, "sender": sender, "content": content, "id": msg_id, "ts": ts}})
+
+
+def error_frame(message):
+    return dumps({"type": "error", "message": message})
@@ -1,73 +1,316 @@
 import asyncio
-from app.models import User, Message, Room
+from app.models import User, MessageRecord
+from app.membership import Membership, MembershipError
+from app.presence import Presence, ROOMS as ROOM_LIST, ONLINE as USER_LIST
+from app.broadcast import Outbound, fanout
+from app.persistence import persist
+from app import history
+from app import search
+from app import backplane
+from app import liveness
+from app import roomstore
+from app import shards
+from app.frames import encode, error_frame, message_frame, loads
+from app.protocol import command, Field, ROOM, OPTIONAL_ROOM, CURSOR
+from app.metrics import Collected, Counter
+from app.config import (
+    MAX_MESSAGE_LENGTH, MAX_HISTORY, MAX_ROOMS_PER_USER, MAX_ROOM_NAME_LENGTH, SEARCH_PAGE_SIZE,
+    MAX_USERNAME_LENGTH, PRESENCE_PAGE_SIZE,
+)
 
 # In-memory storage for demo
-USERS = {}   # username -> {"user": User, "ws": websocket}
-ROOMS = {}   # room_name -> Room object
+USERS = {}   # username -> {"user": User, "ws": websocket, "out": Outbound, "shard": loop it is on} (this node)
+MEMBERSHIP = Membership()  # room <-> user index (members across all nodes)
+ROOMS = MEMBERSHIP.rooms   # room_name -> Room object, for active rooms (MEMBERSHIP.catalog has them all)
+ONLINE = {}  # username -> node id, for every node in the cluster; changed under MEMBERSHIP.lock
+PRESENCE = Presence(ONLINE, MEMBERSHIP, lambda username, frame: _offer(username, frame))  # list snapshots and deltas (main loop)
+
+_MESSAGES = Counter("chat_messages_total", "Chat messages fanned out on this node.", ["origin"])
+MESSAGES_LOCAL = _MESSAGES.labels("local")    # sent by a client of this node
+MESSAGES_REMOTE = _MESSAGES.labels("remote")  # arrived over the backplane
+Collected("chat_connections", "Registered connections on this node.", lambda: len(USERS))
+Collected("chat_rooms", "Rooms known to this node.", lambda: len(MEMBERSHIP.catalog))
+Collected("chat_rooms_active", "Rooms someone joined since this node started.", lambda: len(ROOMS))
+Collected("chat_users_online", "Users online across the cluster.", lambda: len(ONLINE))
+
+def _local_members(room_name):
+    return [USERS[m]["out"] for m in MEMBERSHIP.members(room_name) if m in USERS]
+
+def _publish_event(op, **fields):
+    shards.post(shards.MAIN, _announce, {"op": op, **fields})
+
+def _announce(event):
+    """Main-loop side of a local membership change: other nodes, then this node's list subscribers."""
+    backplane.node.publish_event(event)
+    PRESENCE.note(event)
+
+def _offer(username, frame):
+    entry = USERS.get(username)
+    if entry:
+        shards.post(entry["shard"], entry["out"].offer, frame)
+
+async def _fanout(room_name, frame):
+    """Hand a frame to the room's members on this node; runs on the room's home loop."""
+    if len(shards.SHARDS) == 1:
+        await fanout(frame, _local_members(room_name))
+        return
+    groups = {}
+    for m in MEMBERSHIP.members(room_name):
+        entry = USERS.get(m)
+        if entry is not None:
+            groups.setdefault(entry["shard"], []).append(entry["out"])
+    # A socket is only written by the loop that accepted it
+    mine = groups.pop(shards.here(), None)
+    for shard, outs in groups.items():
+        shard.submit(fanout, frame, outs)
+    if mine:
+        await fanout(frame, mine)
+
+def _leave(room_name, username):
+    """Home-loop side of leaving a room; False if the user wasn't in it."""
+    if not MEMBERSHIP.leave(room_name, username):
+        return False
+    if not _local_members(room_name):
+        shards.post(shards.MAIN, backplane.node.unwatch, room_name)
+    return True
+
+def _create(room_name, username):
+    """Home-loop side of creating (or joining) a room; True if created. Raises MembershipError."""
+    created = MEMBERSHIP.create(room_name, username)
+    shards.post(shards.MAIN, backplane.node.watch, room_name)
+    _publish_event("create_room" if created else "join", room=room_name, user=username)
+    return created
+
+def _sorted_members(room_name):
+    """Home-loop side of a room's user list: its member set only changes there."""
+    return sorted(MEMBERSHIP.members(room_name))
 
 # ------------------------
 # User registration
 # ------------------------
 async def register_user(username, websocket):
-    user = User(username=username, email="", hashed_password="")
-    USERS[username] = {"user": user, "ws": websocket}
+    user = User(username=username)
+    previous = USERS.get(username)
+    if previous:
+        await shards.call(previous["shard"], previous["out"].stop)
+    out = Outbound(websocket).start()
+    USERS[username] = {"user": user, "ws": websocket, "out": out, "shard": shards.here()}
+    liveness.track(websocket, username, out)
+    with MEMBERSHIP.lock:
+        ONLINE[username] = backplane.node.node_id
+    _publish_event("online", user=username)
     return user
 
-async def unregister_user(username):
+async def unregister_user(username, websocket=None):
+    entry = USERS.get(username)
+    # A re-registration may already own this username with a newer socket
+    if entry is None or (websocket is not None and entry["ws"] is not websocket):
+        return
     USERS.pop(username, None)
-    for room in ROOMS.values():
-        room.members.discard(username)
+    liveness.forget(entry["ws"])
+    await entry["out"].stop()
+    # Only the rooms this user is in, each left on its home loop
+    left = []
+    for name in list(MEMBERSHIP.rooms_of(username)):
+        if await shards.call(shards.home(name), _leave, name, username):
+            left.append(name)
+    with MEMBERSHIP.lock:
+        ONLINE.pop(username, None)
+    shards.post(shards.MAIN, PRESENCE.drop, username)
+    _publish_event("offline", user=username, rooms=left)
+
+async def evict_idle(username, websocket):
+    """Reaper callback: drop a silent connection now, close the socket in the background."""
+    await unregister_user(username, websocket)
+    # A half-open peer never answers the close handshake; websockets aborts after close_timeout
+    asyncio.ensure_future(websocket.close(code=liveness.IDLE_CLOSE_CODE, reason="idle timeout"))
+
+async def resume_rooms(username, rooms):
+    """
+    Rejoin a resumed session's rooms in one step (recreating rooms a restart
+    lost) and collect what the client missed. `rooms` maps room name -> cursor
+    of the last message the client saw there, or None to skip the replay.
+    Returns (joined, errors, replay frames), one replay frame per room.
+    """
+    joined, errors, replays = [], {}, []
+    for name, cursor in list(rooms.items())[:MAX_ROOMS_PER_USER]:
+        if type(name) is not str or not 0 < len(name) <= MAX_ROOM_NAME_LENGTH:
+            continue
+        try:
+            created = await shards.call(shards.home(name), _create, name, username)
+        except MembershipError as e:
+            errors[name] = str(e)
+            continue
+        joined.append(name)
+        if created:
+            await shards.call(shards.MAIN, roomstore.room_created, name, username)
+        after = history.parse_cursor(cursor) if type(cursor) is str else None
+        if after is None:
+            continue
+        entries = await shards.call(shards.MAIN, history.fetch, name, MAX_HISTORY, None, after)
+        page = history.page_payload(name, entries)
+        page["type"] = "replay"
+        page["truncated"] = len(entries) >= MAX_HISTORY  # more may be missing: use history paging
+        replays.append(encode(page))
+    await shards.call(shards.MAIN, roomstore.joined, username, joined)
+    return joined, errors, replays
+
+async def restore_rooms(username):
+    """On register: put the user back in the rooms saved for them. Returns (joined, errors)."""
+    saved = await shards.call(shards.MAIN, roomstore.saved_rooms, username)
+    joined, errors, _ = await resume_rooms(username, dict.fromkeys(saved))
+    return joined, errors
+
+async def send_to(username, frame):
+    _offer(username, frame)
 
 # ------------------------
 # Message handling
 # ------------------------
+@command("message", rate_limited=True, home="room", shed="room", room=ROOM,
+         message=Field(max_length=MAX_MESSAGE_LENGTH, aliases=("content",)))
 async def handle_message(username, data):
-    room_name = data.get("room")
-    content = data.get("message", "")
-    if room_name in ROOMS:
-        room = ROOMS[room_name]
-        msg = Message(user_id=USERS[username]["user"].id, content=content)
-        # Send to all members
-        for member in room.members:
-            ws = USERS.get(member, {}).get("ws")
-            if ws:
-                await ws.send(f"{username}@{room_name}: {content}")
+    room_name = data["room"]
+    content = data["message"]
+    if room_name in MEMBERSHIP:
+        MESSAGES_LOCAL.inc()
+        msg = MessageRecord(USERS[username]["user"].id, room_name, username, content)
+        # Serialize once, then hand the same bytes to every member
+        frame = message_frame(room_name, username, content, msg.id, msg.ms)
+        await _fanout(room_name, frame)
+        shards.post(shards.MAIN, _keep, msg, frame)
+
+def _keep(msg, frame):
+    """Main-loop side of a message: other nodes, history, search and MongoDB."""
+    # Members on other nodes get the same frame through the backplane
+    backplane.node.publish(msg.room, frame)
+    history.record(msg.room, msg.id, msg.ms, msg.sender, msg.content)
+    search.index(msg.room, msg.id, msg.ms, msg.content)
+    # Write-behind: the flusher batches this into MongoDB later
+    persist(msg)
+
+async def deliver_remote(room_name, frame):
+    """Backplane callback: a frame published on another node for a room we watch."""
+    MESSAGES_REMOTE.inc()
+    await shards.call(shards.home(room_name), _fanout, room_name, frame, wait=False)
+    data = loads(frame)["data"]
+    history.record(room_name, data["id"], data["ts"], data["sender"], data["content"])
+    search.index(room_name, data["id"], data["ts"], data["content"])
+
+def apply_event(event):
+    """Backplane callback: mirror another node's membership change."""
+    op, user, room_name = event.get("op"), event.get("user"), event.get("room")
+    # Limits were enforced on the node that accepted the request
+    if op == "create_room":
+        # Two nodes may create the same room concurrently; keep both creators
+        shards.post(shards.home(room_name), MEMBERSHIP.create, room_name, user, False)
+    elif op == "join":
+        shards.post(shards.home(room_name), MEMBERSHIP.join, room_name, user, False)
+    elif op == "leave":
+        shards.post(shards.home(room_name), MEMBERSHIP.leave, room_name, user)
+    elif op == "online":
+        with MEMBERSHIP.lock:
+            ONLINE[user] = event["node"]
+    elif op == "offline":
+        with MEMBERSHIP.lock:
+            if ONLINE.get(user) == event["node"]:
+                ONLINE.pop(user, None)
+        for name in event.get("rooms", ()):
+            shards.post(shards.home(name), MEMBERSHIP.leave, name, user)
+    PRESENCE.note(event)
+
+def load_snapshot(snapshot):
+    """Seed ROOMS/ONLINE from the cluster state returned by the backplane."""
+    for name, members in snapshot["rooms"].items():
+        MEMBERSHIP.load(name, members)
+    with MEMBERSHIP.lock:
+        ONLINE.update(snapshot["online"])
+    PRESENCE.reset()
 
 # ------------------------
 # Room management
 # ------------------------
+# These run on the room's home loop; MongoDB and the backplane are the main loop's
+@command("create_room", home="room", room=ROOM)
 async def handle_create_room(username, data):
-    room_name = data.get("room")
-    if room_name and room_name not in ROOMS:
-        ROOMS[room_name] = Room(name=room_name, members={username})
+    room_name = data["room"]
+    if room_name not in MEMBERSHIP:
+        _create(room_name, username)
+        await shards.call(shards.MAIN, roomstore.room_created, room_name, username)
+        await shards.call(shards.MAIN, roomstore.joined, username, [room_name])
 
+@command("join_room", home="room", room=ROOM)
 async def handle_join_room(username, data):
-    room_name = data.get("room")
-    if room_name in ROOMS:
-        ROOMS[room_name].members.add(username)
+    room_name = data["room"]
+    if MEMBERSHIP.join(room_name, username):
+        shards.post(shards.MAIN, backplane.node.watch, room_name)
+        _publish_event("join", room=room_name, user=username)
+        await shards.call(shards.MAIN, roomstore.joined, username, [room_name])
 
+@command("leave_room", home="room", room=ROOM)
 async def handle_leave_room(username, data):
-    room_name = data.get("room")
-    if room_name in ROOMS:
-        ROOMS[room_name].members.discard(username)
+    room_name = data["room"]
+    if _leave(room_name, username):
+        _publish_event("leave", room=room_name, user=username)
+        await shards.call(shards.MAIN, roomstore.left, username, room_name)
 
 # ------------------------
 # Listing
 # ------------------------
-async def handle_list_rooms(username):
-    ws = USERS.get(username, {}).get("ws")
-    if ws:
-        await ws.send(f"Rooms: {list(ROOMS.keys())}")
+# Paged snapshots; subscribe=true adds the deltas (see app/presence.py), false stops them
+def _watch(username, topic, subscribe):
+    if subscribe:
+        PRESENCE.subscribe(username, topic)
+    elif subscribe is False:
+        PRESENCE.unsubscribe(username, topic)
+
+@command("list_rooms", home="main", shed="expensive", after=Field(required=False, max_length=MAX_ROOM_NAME_LENGTH),
+         limit=Field(int, required=False, default=PRESENCE_PAGE_SIZE), subscribe=Field(bool, required=False))
+async def handle_list_rooms(username, data):
+    # Only the active rooms: the catalog may hold millions
+    _watch(username, ROOM_LIST, data["subscribe"])
+    page = PRESENCE.rooms_page(data["after"], max(1, min(data["limit"], PRESENCE_PAGE_SIZE)))
+    await send_to(username, encode(page))
 
-async def handle_list_users(username):
-    ws = USERS.get(username, {}).get("ws")
-    if ws:
-        await ws.send(f"Users: {list(USERS.keys())}")
+@command("list_users", home="main", shed="expensive", room=OPTIONAL_ROOM,
+         after=Field(required=False, max_length=MAX_USERNAME_LENGTH),
+         limit=Field(int, required=False, default=PRESENCE_PAGE_SIZE), subscribe=Field(bool, required=False))
+async def handle_list_users(username, data):
+    # "/users <room>" lists that room's members, otherwise everyone online
+    room = data["room"]
+    _watch(username, ("users", room) if room else USER_LIST, data["subscribe"])
+    members = await shards.call(shards.home(room), _sorted_members, room) if room else None
+    page = PRESENCE.users_page(room, data["after"], max(1, min(data["limit"], PRESENCE_PAGE_SIZE)), members)
+    await send_to(username, encode(page))
+
+@command("pong")
+async def handle_pong(username, data):
+    # Reply to a heartbeat ping; receiving it already marked the connection active
+    pass
 
 # ------------------------
-# History (stub)
+# History
 # ------------------------
+@command("history", home="main", shed="expensive", room=ROOM, limit=Field(int, required=False, default=50),
+         before=CURSOR, after=CURSOR)
 async def handle_history(username, data):
-    ws = USERS.get(username, {}).get("ws")
-    if ws:
-        await ws.send("No history implemented yet")
+    room_name = data["room"]
+    cursors = {}
+    for key in ("before", "after"):
+        if data[key] is not None:
+            cursors[key] = history.parse_cursor(data[key])
+            if cursors[key] is None:
+                await send_to(username, error_frame(f"Invalid {key} cursor."))
+                return
+    entries = await history.fetch(room_name, data["limit"], **cursors)
+    await send_to(username, encode(history.page_payload(room_name, entries)))
+
+
+# ------------------------
+# Search
+# ------------------------
+@command("search", rate_limited=True, home="main", shed="expensive", room=ROOM, query=Field(max_length=200, aliases=("q",)),
+         limit=Field(int, required=False, default=SEARCH_PAGE_SIZE), offset=Field(int, required=False, default=0))
+async def handle_search(username, data):
+    results, next_offset = await search.search(data["room"], data["query"], data["limit"], data["offset"])
+    await send_to(username, encode(search.page_payload(data["room"], data["query"], results, data["offset"], next_offset)))
@@ -0,0 +1,214 @@
+import asyncio
+import calendar
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING
+from app.config import MAX_HISTORY, HISTORY_MAX_ROOMS
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Only the fields a history page needs are loaded from MongoDB
+PROJECTION = {"_id": 1, "timestamp": 1, "sender": 1, "content": 1}
+
+
+# ------------------------
+# Cursors
+# ------------------------
+# A cursor is "<timestamp in ms>:<message id>". Milliseconds match what BSON
+# stores, and the id breaks ties between messages sent in the same ms.
+def to_ms(dt):
+    return calendar.timegm(dt.utctimetuple()) * 1000 + dt.microsecond // 1000
+
+
+def from_ms(ms):
+    return _EPOCH + timedelta(milliseconds=ms)
+
+
+def make_cursor(entry):
+    return f"{entry[0]}:{entry[1]}"
+
+
+def parse_cursor(cursor):
+    """Return (ms, id) for a cursor string, or None if it is malformed."""
+    try:
+        ms, msg_id = str(cursor).split(":", 1)
+        return int(ms), msg_id
+    except ValueError:
+        return None
+
+
+# ------------------------
+# Per-room ring buffer
+# ------------------------
+class RoomHistory:
+    """
+    The newest MAX_HISTORY messages of one room, as (ms, id, sender, content)
+    tuples. `loaded` means the buffer was seeded from MongoDB, so nothing
+    newer than its oldest entry is missing.
+    """
+
+    __slots__ = ("entries", "loaded")
+
+    def __init__(self, maxlen=MAX_HISTORY):
+        self.entries = deque(maxlen=maxlen)
+        self.loaded = False
+
+    def complete(self):
+        # Seeded and never overflowed: the buffer holds the room's whole history
+        return self.loaded and len(self.entries) < self.entries.maxlen
+
+
+# room_name -> RoomHistory, least recently written first
+BUFFERS = OrderedDict()
+
+# Collection used for fallback pages; set by start()
+collection = None
+
+# room_name -> task seeding that room's buffer, shared by concurrent fetches
+_WARMING = {}
+
+
+def _buffer(room):
+    buf = BUFFERS.get(room)
+    if buf is None:
+        buf = BUFFERS[room] = RoomHistory()
+        if len(BUFFERS) > HISTORY_MAX_ROOMS:
+            BUFFERS.popitem(last=False)  # coldest room falls back to MongoDB
+    else:
+        BUFFERS.move_to_end(room)
+    return buf
+
+
+def record(room, msg_id, ms, sender, content):
+    """Append a message (timestamp in ms) to the room's ring buffer."""
+    _buffer(room).entries.append((ms, msg_id, sender, content))
+
+
+# ------------------------
+# MongoDB fallback
+# ------------------------
+async def start(coll=None):
+    """Bind the messages collection and create the history index."""
+    global collection
+    if coll is None:
+        from app.db import messages_collection
+        coll = messages_collection
+    collection = coll
+    try:
+        # (room, timestamp) serves range scans; _id makes same-ms ties index-ordered
+        await collection.create_index(
+            [("room", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+            name="room_timestamp",
+        )
+    except Exception as e:
+        logger.error("Could not create history index: %s", e)
+
+
+def _range_query(room, cursor, older):
+    ms, msg_id = cursor
+    ts = from_ms(ms)
+    op = "$lt" if older else "$gt"
+    return {
+        "room": room,
+        "$or": [{"timestamp": {op: ts}}, {"timestamp": ts, "_id": {op: msg_id}}],
+    }
+
+
+async def _query(room, limit, before=None, after=None):
+    """One page from MongoDB in chronological order, O(limit) via the index."""
+    if after is not None:
+        query, order = _range_query(room, after, older=False), ASCENDING
+    elif before is not None:
+        query, order = _range_query(room, before, older=True), DESCENDING
+    else:
+        query, order = {"room": room}, DESCENDING
+    cursor = collection.find(query, PROJECTION).sort([("timestamp", order), ("_id", order)]).limit(limit)
+    docs = await cursor.to_list(length=limit)
+    if order == DESCENDING:
+        docs.reverse()
+    return [(to_ms(d["timestamp"]), str(d["_id"]), d.get("sender"), d.get("content", "")) for d in docs]
+
+
+def _warm_once(room):
+    """_warm(room), run once for any number of concurrent callers (reconnect storms)."""
+    task = _WARMING.get(room)
+    if task is None:
+        task = _WARMING[room] = asyncio.ensure_future(_warm(room))
+        task.add_done_callback(lambda _: _WARMING.pop(room, None))
+    # A cancelled caller must not cancel the query the others wait on
+    return asyncio.shield(task)
+
+
+async def _warm(room):
+    """Seed a room's buffer with its newest messages from MongoDB."""
+    buf = _buffer(room)
+    if collection is None:
+        return buf  # not started (tests, offline): the buffer is all we have
+    stored = await _query(room, buf.entries.maxlen)
+    # Messages still waiting in the write-behind queue are only in the buffer
+    seen = {e[1] for e in stored}
+    pending = [e for e in buf.entries if e[1] not in seen]
+    buf.entries.clear()
+    buf.entries.extend(stored)
+    buf.entries.extend(pending)
+    buf.loaded = True
+    return buf
+
+
+# ------------------------
+# Pages
+# ------------------------
+async def fetch(room, limit=50, before=None, after=None):
+    """
+    Return up to `limit` messages of `room` in chronological order.
+    `before`/`after` are parsed cursors; without either, the newest page.
+    The ring buffer answers whenever it covers the requested range.
+    """
+    limit = max(1, min(int(limit), MAX_HISTORY))
+    buf = BUFFERS.get(room)
+    try:
+        if buf is None or (not buf.loaded and len(buf.entries) < limit):
+            buf = await _warm_once(room)
+    except Exception as e:
+        logger.error("History warm-up failed for room %s: %s", room, e)
+        buf = _buffer(room)
+    entries = buf.entries
+
+    if after is not None:
+        # Buffer covers (after, now] if its oldest entry is at or before the cursor
+        if buf.complete() or (entries and (entries[0][0], entries[0][1]) <= after):
+            return [e for e in entries if (e[0], e[1]) > after][:limit]
+        return await _query_or_empty(room, limit, after=after)
+
+    if before is not None:
+        older = [e for e in entries if (e[0], e[1]) < before]
+        if len(older) >= limit or (buf.complete() and entries):
+            return older[-limit:]
+        return await _query_or_empty(room, limit, before=before)
+
+    return list(entries)[-limit:]
+
+
+async def _query_or_empty(room, limit, before=None, after=None):
+    try:
+        return await _query(room, limit, before=before, after=after)
+    except Exception as e:
+        logger.error("History query failed for room %s: %s", room, e)
+        return []
+
+
+def page_payload(room, entries):
+    """History reply; `before`/`after` are the cursors for the next pages."""
+    return {
+        "type": "history",
+        "room": room,
+        "messages": [
+            {"id": msg_id, "sender": sender, "content": content, "timestamp": ms}
+            for ms, msg_id, sender, content in entries
+        ],
+        "before": make_cursor(entries[0]) if entries else None,
+        "after": make_cursor(entries[-1]) if entries else None,
+    }
@@ -0,0 +1,289 @@
+import asyncio
+import threading
+import time
+from app.config import (
+    HEARTBEAT_INTERVAL,
+    IDLE_TIMEOUT,
+    REAPER_TICK,
+    REAPER_BATCH,
+    CONNECTION_REPORT_INTERVAL,
+    CONNECTION_REPORT_TOP,
+)
+from app.frames import encode
+from app.logger import get_logger
+from app.metrics import Collected
+
+logger = get_logger(__name__)
+
+# Close code for evicted idle connections (4000-4999 is for applications)
+IDLE_CLOSE_CODE = 4408
+
+PING_FRAME = encode({"type": "ping"})
+
+
+# ------------------------
+# Timer wheel
+# ------------------------
+class TimerWheel:
+    """
+    Hashed timing wheel: `slots` buckets of `tick` seconds each. schedule()
+    puts a key in the bucket its deadline falls into, advance() empties every
+    bucket the clock has passed. A deadline more than a full turn away comes
+    back early; callers recheck what advance() returns anyway.
+    """
+
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.position = None  # absolute tick number of the next bucket to expire
+
+    def _tick_of(self, deadline):
+        n = int(deadline / self.tick)
+        if self.position is not None and n < self.position:
+            n = self.position  # already due: fire on the next advance()
+        return n
+
+    def schedule(self, key, deadline):
+        """Arm `key`; returns the tick to hand back to cancel()."""
+        n = self._tick_of(deadline)
+        self.slots[n % len(self.slots)].add(key)
+        return n
+
+    def cancel(self, key, n):
+        self.slots[n % len(self.slots)].discard(key)
+
+    def advance(self, now):
+        """Keys whose bucket is due at `now`, in deadline order of their buckets."""
+        end = int(now / self.tick)
+        if self.position is None:
+            self.position = end
+        # Sleeping through more than a turn: each bucket only needs emptying once
+        self.position = max(self.position, end - len(self.slots) + 1)
+        due = []
+        while self.position <= end:
+            slot = self.slots[self.position % len(self.slots)]
+            if slot:
+                due.extend(slot)
+                slot.clear()
+            self.position += 1
+        return due
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+
+# ------------------------
+# Heartbeats + idle reaper
+# ------------------------
+class Reaper:
+    """
+    Application heartbeats and idle eviction for every connection on this node.
+
+    A connection silent for `heartbeat` seconds is sent {"type":"ping"} (the
+    client answers "pong"); one still silent after `idle_timeout` seconds is
+    handed to `on_evict`. Inbound frames only stamp the time in touch(): the
+    wheel rechecks a connection when its deadline comes up and reschedules it
+    if it was active meanwhile, so there is no asyncio timer per socket. At
+    most `batch` connections are evicted per tick; the rest wait one more tick.
+    """
+
+    def __init__(self, on_evict, heartbeat=HEARTBEAT_INTERVAL, idle_timeout=IDLE_TIMEOUT,
+                 tick=REAPER_TICK, batch=REAPER_BATCH, clock=time.monotonic):
+        self.on_evict = on_evict
+        self.heartbeat = heartbeat if 0 < heartbeat < idle_timeout else 0
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+        self.batch = batch
+        self.clock = clock
+        self.wheel = TimerWheel(tick, int(idle_timeout / tick) + 2)
+        self.conns = {}  # websocket -> [last_seen, armed tick, pinged, username, Outbound]
+        self.task = None
+        self.stats = {"pings": 0, "evicted": 0, "deferred": 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def add(self, ws, username, out):
+        now = self.clock()
+        first = self.heartbeat or self.idle_timeout
+        self.conns[ws] = [now, self.wheel.schedule(ws, now + first), False, username, out]
+
+    def touch(self, ws):
+        entry = self.conns.get(ws)
+        if entry is not None:
+            entry[0] = self.clock()
+            entry[2] = False
+
+    def remove(self, ws):
+        entry = self.conns.pop(ws, None)
+        if entry is not None:
+            self.wheel.cancel(ws, entry[1])
+
+    def check(self, now=None):
+        """Send due pings; return the (username, websocket) pairs to evict."""
+        now = self.clock() if now is None else now
+        evict = []
+        for ws in self.wheel.advance(now):
+            entry = self.conns.get(ws)
+            if entry is None:
+                continue
+            last_seen, _, pinged, username, out = entry
+            idle = now - last_seen
+            if idle >= self.idle_timeout:
+                if len(evict) < self.batch:
+                    del self.conns[ws]
+                    evict.append((username, ws))
+                    continue
+                self.stats["deferred"] += 1
+                deadline = now  # over the batch: next tick
+            elif self.heartbeat and not pinged and idle >= self.heartbeat:
+                entry[2] = True
+                out.offer(PING_FRAME)
+                self.stats["pings"] += 1
+                deadline = last_seen + self.idle_timeout
+            elif pinged or not self.heartbeat:
+                deadline = last_seen + self.idle_timeout
+            else:
+                deadline = last_seen + self.heartbeat
+            entry[1] = self.wheel.schedule(ws, deadline)
+        self.stats["evicted"] += len(evict)
+        return evict
+
+    async def _run(self):
+        last_report = self.clock()
+        while True:
+            await asyncio.sleep(self.tick)
+            evict = self.check()
+            for username, ws in evict:
+                try:
+                    await self.on_evict(username, ws)
+                except Exception as e:
+                    logger.error("Evicting %s failed: %s", username, e)
+            if evict:
+                logger.info("Evicted %d idle connections", len(evict))
+            if CONNECTION_REPORT_INTERVAL and self.clock() - last_report >= CONNECTION_REPORT_INTERVAL:
+                last_report = self.clock()
+                logger.info("Connections: %s", format_report(self.report(CONNECTION_REPORT_TOP)))
+
+    # ------------------------
+    # Memory accounting
+    # ------------------------
+    def usage(self, ws):
+        """Bytes and frames one connection holds on this node right now."""
+        last_seen, _, _, username, out = self.conns[ws]
+        transport = getattr(ws, "transport", None)
+        # websockets' inbound frame queue (not part of its public API)
+        pending = getattr(getattr(getattr(ws, "recv_messages", None), "frames", None), "queue", ())
+        row = {
+            "user": username,
+            "outbound_frames": out.depth(),
+            "outbound_bytes": out.queued_bytes(),
+            "write_buffer_bytes": transport.get_write_buffer_size() if transport is not None else 0,
+            "read_frames": len(pending),
+            "read_bytes": sum(len(frame.data) for frame in pending),
+            "dropped": out.dropped,
+            "idle_s": round(self.clock() - last_seen, 1),
+        }
+        row["bytes"] = row["outbound_bytes"] + row["write_buffer_bytes"] + row["read_bytes"]
+        return row
+
+    def report(self, top=10):
+        """Totals over every connection plus the `top` holding the most bytes."""
+        rows = [self.usage(ws) for ws in self.conns]
+        rows.sort(key=lambda row: row["bytes"], reverse=True)
+        return {
+            "connections": len(rows),
+            "bytes": sum(row["bytes"] for row in rows),
+            "outbound_frames": sum(row["outbound_frames"] for row in rows),
+            **self.stats,
+            "top": rows[:top],
+        }
+
+
+def format_report(report):
+    top = ", ".join(f"{row['user']}={row['bytes']}B/{row['outbound_frames']}f" for row in report["top"] if row["bytes"])
+    return (f"{report['connections']} open, {report['bytes']} bytes buffered, "
+            f"{report['outbound_frames']} frames queued; top: {top or '-'}")
+
+
+# ------------------------
+# Process-wide reaper
+# ------------------------
+reaper = None
+
+# Room shards (LOOP_SHARDS > 1) reap the connections their own loop accepted
+_shard = threading.local()
+SHARD_REAPERS = []
+
+
+def _reapers():
+    return [r for r in (reaper, *SHARD_REAPERS) if r is not None]
+
+
+Collected("chat_heartbeat_pings_total", "Heartbeat pings sent to silent connections.",
+          lambda: sum(r.stats["pings"] for r in _reapers()), kind="counter")
+Collected("chat_idle_evictions_total", "Connections evicted by the idle reaper.",
+          lambda: sum(r.stats["evicted"] for r in _reapers()), kind="counter")
+
+
+def _current():
+    return getattr(_shard, "reaper", reaper)
+
+
+def track(ws, username, out):
+    """Start watching a registered connection (no-op until start() was called)."""
+    current = _current()
+    if current is not None:
+        current.add(ws, username, out)
+
+
+def touch(ws):
+    current = _current()
+    if current is not None:
+        current.touch(ws)
+
+
+def forget(ws):
+    current = _current()
+    if current is not None:
+        current.remove(ws)
+
+
+async def start(on_evict):
+    global reaper
+    if IDLE_TIMEOUT > 0:
+        reaper = Reaper(on_evict).start()
+    return reaper
+
+
+async def stop():
+    global reaper
+    if reaper is not None:
+        await reaper.stop()
+        reaper = None
+
+
+async def start_local(on_evict):
+    """A reaper for the connections of the room shard running in this thread."""
+    if IDLE_TIMEOUT > 0:
+        _shard.reaper = Reaper(on_evict).start()
+        SHARD_REAPERS.append(_shard.reaper)
+    return getattr(_shard, "reaper", None)
+
+
+async def stop_local():
+    current = getattr(_shard, "reaper", None)
+    if current is not None:
+        await current.stop()
+        SHARD_REAPERS.remove(current)
+        del _shard.reaper
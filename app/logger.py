@@ -1,14 +1,168 @@
-import logging, sys
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from app.config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_STANDARD = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "suppressed"}
+
+
+# ------------------------
+# Formatters (run on the writer thread)
+# ------------------------
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, any extra={...} fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, "suppressed", 0):
+            line += f" (+{record.suppressed} similar suppressed)"
+        return line
+
+
+# ------------------------
+# Loop side: filter and enqueue, never block
+# ------------------------
+class Sampler(logging.Filter):
+    """
+    Lets at most `burst` records of one message template (per logger) through
+    every `window` seconds; the rest are dropped and counted, and the next one
+    let through carries suppressed=N. WARNING and above always pass. Keyed on
+    the unformatted msg, so callers must pass %-style args, not f-strings.
+    """
+
+    MAX_KEYS = 10_000
+
+    def __init__(self, burst=LOG_SAMPLE_BURST, window=LOG_SAMPLE_WINDOW, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.clock = clock
+        self.seen = {}  # (logger name, msg) -> [window start, passed, suppressed]
+        self.dropped = 0
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = self.clock()
+        entry = self.seen.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            if entry is None and len(self.seen) >= self.MAX_KEYS:
+                self.seen.clear()  # f-string messages would grow this forever
+            elif entry is not None and entry[2]:
+                record.suppressed = entry[2]
+            self.seen[key] = [now, 1, 0]
+            return True
+        if entry[1] < self.burst:
+            entry[1] += 1
+            return True
+        entry[2] += 1
+        self.dropped += 1
+        return False
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread as they are. The stock QueueHandler
+    formats in prepare(), on the caller's thread; here the message is only
+    built by the writer. A full queue drops the record (counted) instead of
+    making the event loop wait for a slow sink.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # waits for room; only called on shutdown
+
+
+# ------------------------
+# Process-wide pipeline
+# ------------------------
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+_sampler = Sampler()
+_handler = AsyncQueueHandler(_queue)
+_handler.addFilter(_sampler)
+_listener = None
+
+
+def configure(stream=None, fmt=LOG_FORMAT, sample_burst=None):
+    """
+    (Re)start the writer thread with a new sink. Loggers keep their handler,
+    so this can run at any time; records already queued go to the new sink.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    if sample_burst is not None:
+        _sampler.burst = sample_burst
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+    _listener = _Listener(_queue, sink)
+    _listener.start()
+    return sink
+
+
+def shutdown():
+    """Write out everything still queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
+
+
+def stats():
+    return {"queued": _queue.qsize(), "dropped_full": _handler.dropped, "dropped_sampled": _sampler.dropped}
 
 
 # Function to get a configured logger
-def get_logger(name= __name__, level=logging.INFO):
+def get_logger(name=__name__, level=None):
     logger = logging.getLogger(name)
     if logger.handlers:
         return logger
-    handler = logging.StreamHandler(sys.stdout)
-    fmt = "%(asctime)s %(levelname)s %(name)s: %(message)s"
-    handler.setFormatter(logging.Formatter(fmt))
-    logger.addHandler(handler)
-    logger.setLevel(level)
-    return logger
\ No newline at end of file
+    if _listener is None:
+        configure()
+    logger.addHandler(_handler)
+    logger.setLevel(level or LOG_LEVEL)
+    return logger
@@ -0,0 +1,124 @@
+import threading
+from app.config import MAX_ROOMS_PER_USER, MAX_USERS_PER_ROOM
+from app.models import Room
+from app.protocol import ProtocolError
+
+_NONE = frozenset()
+
+
+class MembershipError(ProtocolError):
+    """A join the limits don't allow; sent back to the client as an error frame."""
+
+
+# ------------------------
+# Room membership index
+# ------------------------
+class Membership:
+    """
+    Room -> members and user -> rooms, kept in sync. Join, leave and lookups
+    are O(1); dropping a user only touches the rooms that user is in.
+
+    `catalog` holds every room name that exists (loaded from MongoDB at
+    start); `rooms` only the active ones, as Room models whose `members` set
+    is the index's own, so callers can keep reading room.members. A catalog
+    room gets its Room on the first join. Limits apply to local requests
+    (enforce=True); changes replicated from other nodes were checked there.
+
+    With LOOP_SHARDS > 1 a room's members are only changed on its home loop
+    (app/shards.py), but one user's rooms can change on several loops at
+    once, so `user_rooms` updates take a lock. So does adding to `rooms`:
+    the main loop lists it (active()) while the home loops add to it.
+    """
+
+    def __init__(self, max_rooms_per_user=MAX_ROOMS_PER_USER, max_users_per_room=MAX_USERS_PER_ROOM):
+        self.max_rooms_per_user = max_rooms_per_user
+        self.max_users_per_room = max_users_per_room
+        self.catalog = set()  # every known room name
+        self.rooms = {}       # name -> Room, for rooms someone joined since start
+        self.user_rooms = {}  # username -> set of room names
+        self.lock = threading.Lock()  # guards user_rooms and the keys of rooms
+
+    def __contains__(self, name):
+        return name in self.catalog
+
+    def members(self, name):
+        room = self.rooms.get(name)
+        return room.members if room else _NONE
+
+    def active(self):
+        """Names of the active rooms, unsorted: a copy taken under the lock."""
+        with self.lock:
+            return list(self.rooms)
+
+    def rooms_of(self, user):
+        return self.user_rooms.get(user, _NONE)
+
+    def _check(self, name, user):
+        joined = self.user_rooms.get(user, _NONE)
+        if name in joined:
+            return
+        if len(joined) >= self.max_rooms_per_user:
+            raise MembershipError(f"You can be in at most {self.max_rooms_per_user} rooms.")
+        room = self.rooms.get(name)
+        if room is not None and len(room.members) >= self.max_users_per_room:
+            raise MembershipError(f"Room {name} is full ({self.max_users_per_room} users).")
+
+    def create(self, name, user, enforce=True):
+        """Create `name` with `user` in it; an existing room is joined instead. True if created."""
+        if name in self.catalog:
+            self.join(name, user, enforce)
+            return False
+        if enforce:
+            self._check(name, user)
+        self.catalog.add(name)
+        self._add(name, user)
+        return True
+
+    def join(self, name, user, enforce=True):
+        """Add `user` to an existing room; False if there is no such room."""
+        if name not in self.catalog:
+            return False
+        if enforce:
+            self._check(name, user)
+        self._add(name, user)
+        return True
+
+    def _add(self, name, user):
+        room = self.rooms.get(name)
+        with self.lock:
+            if room is None:
+                room = self.rooms[name] = Room(name=name)
+            joined = self.user_rooms.get(user)
+            if joined is None:
+                joined = self.user_rooms[user] = set()
+            joined.add(name)
+        room.members.add(user)
+
+    def leave(self, name, user):
+        """Remove `user` from `name`; False if they weren't in it."""
+        with self.lock:
+            joined = self.user_rooms.get(user)
+            if not joined or name not in joined:
+                return False
+            joined.discard(name)
+            if not joined:
+                del self.user_rooms[user]
+        self.rooms[name].members.discard(user)
+        return True
+
+    def load(self, name, members):
+        """Set a room's members wholesale (cluster snapshot)."""
+        for user in self.members(name) - set(members):
+            self.leave(name, user)
+        self.catalog.add(name)
+        if members and name not in self.rooms:
+            with self.lock:
+                self.rooms[name] = Room(name=name)
+        for user in members:
+            self._add(name, user)
+
+    def clear(self):
+        self.catalog.clear()
+        with self.lock:
+            self.rooms.clear()
+            self.user_rooms.clear()
@@ -0,0 +1,190 @@
+import re
+from types import SimpleNamespace
+from bson import ObjectId
+
+_WORD = re.compile(r"\w+")
+
+# In-process stand-in for the parts of a motor collection the app uses.
+# Handy for tests and offline benchmarks; nothing here talks to MongoDB.
+
+
+def _match_value(value, cond):
+    if isinstance(cond, dict) and any(k.startswith("$") for k in cond):
+        for op, arg in cond.items():
+            if value is None:
+                return False
+            if op == "$lt" and not value < arg:
+                return False
+            if op == "$lte" and not value <= arg:
+                return False
+            if op == "$gt" and not value > arg:
+                return False
+            if op == "$gte" and not value >= arg:
+                return False
+            if op == "$in" and value not in arg:
+                return False
+        return True
+    return value == cond
+
+
+def _text_score(doc, search):
+    """$text on `content`: how many of the search words it contains (no stemming)."""
+    words = set(_WORD.findall(str(doc.get("content", "")).lower()))
+    return sum(1 for w in set(_WORD.findall(search.lower())) if w in words)
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$text":
+            if not _text_score(doc, cond["$search"]):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif not _match_value(doc.get(key), cond):
+            return False
+    return True
+
+
+def _apply(doc, update, inserting):
+    for field, value in update.get("$set", {}).items():
+        doc[field] = value
+    if inserting:
+        for field, value in update.get("$setOnInsert", {}).items():
+            doc[field] = value
+    for field, value in update.get("$addToSet", {}).items():
+        items = doc.setdefault(field, [])
+        for item in value["$each"] if isinstance(value, dict) and "$each" in value else [value]:
+            if item not in items:
+                items.append(item)
+    for field, value in update.get("$pull", {}).items():
+        gone = value["$in"] if isinstance(value, dict) and "$in" in value else [value]
+        doc[field] = [item for item in doc.get(field, []) if item not in gone]
+
+
+class InMemoryCursor:
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+        self._skip = 0
+        self._pos = 0  # to_list() hands out each document once, like a motor cursor
+
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction or 1)]
+        # Stable sorts applied from the least significant key up
+        for key, direction in reversed(keys):
+            if isinstance(direction, dict):  # {"$meta": "textScore"}: best first
+                direction = -1
+            self._docs.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        return self  # everything is already in memory
+
+    def _project(self, doc):
+        if not self._projection:
+            return dict(doc)
+        keep = {k for k, v in self._projection.items() if v}
+        out = {k: v for k, v in doc.items() if k in keep}
+        if self._projection.get("_id", 1):
+            out["_id"] = doc.get("_id")
+        return out
+
+    async def to_list(self, length=None):
+        if self._skip:
+            self._docs, self._skip = self._docs[self._skip:], 0
+        end = min(self._limit, len(self._docs)) if self._limit else len(self._docs)
+        if length is not None:
+            end = min(end, self._pos + length)
+        docs, self._pos = self._docs[self._pos:end], max(self._pos, end)
+        return [self._project(d) for d in docs]
+
+
+class InMemoryCollection:
+    def __init__(self, name="collection"):
+        self.name = name
+        self.docs = []
+        self.by_id = {}  # the _id index
+        self.indexes = []
+        self.insert_calls = 0
+        self.find_calls = 0
+        self.update_calls = 0
+
+    def _insert(self, doc):
+        doc = dict(doc)
+        doc.setdefault("_id", str(ObjectId()))
+        self.docs.append(doc)
+        self.by_id[doc["_id"]] = doc
+        return doc["_id"]
+
+    def _first(self, query):
+        if set(query) == {"_id"} and not isinstance(query["_id"], dict):
+            return self.by_id.get(query["_id"])
+        return next((d for d in self.docs if matches(d, query)), None)
+
+    async def insert_many(self, documents, ordered=True):
+        self.insert_calls += 1
+        ids = [self._insert(doc) for doc in documents]
+        return SimpleNamespace(inserted_ids=ids, acknowledged=True)
+
+    async def insert_one(self, document):
+        self.insert_calls += 1
+        return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    async def find_one(self, query=None, projection=None):
+        self.find_calls += 1
+        doc = self._first(query or {})
+        return InMemoryCursor([], projection)._project(doc) if doc is not None else None
+
+    async def update_one(self, query, update, upsert=False):
+        """$set, $setOnInsert, $addToSet (with $each) and $pull (value or $in)."""
+        self.update_calls += 1
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            fields = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc = self.by_id[self._insert(fields)]
+            _apply(doc, update, inserting=True)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        _apply(doc, update, inserting=False)
+        return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+
+    def find(self, query=None, projection=None):
+        self.find_calls += 1
+        query = query or {}
+        docs = [d for d in self.docs if matches(d, query)]
+        if "$text" in query:
+            docs = [{**d, "score": float(_text_score(d, query["$text"]["$search"]))} for d in docs]
+        return InMemoryCursor(docs, projection)
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs if matches(d, query))
+
+    async def create_index(self, keys, **kwargs):
+        self.indexes.append(list(keys))
+        return "_".join(f"{k}_{v}" for k, v in keys)
+
+
+class InMemoryDatabase:
+    def __init__(self, name="db"):
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = InMemoryCollection(name)
+        return self.collections[name]
@@ -0,0 +1,226 @@
+import asyncio
+from bisect import bisect_left
+from app.config import METRICS_ENABLED
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+REGISTRY = []  # every metric, in the order it was created
+
+# Seconds; from 50µs (a dispatch) up to 10s (a stuck Mongo flush)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Recipients per fan-out
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+# ------------------------
+# Children (what the hot path touches)
+# ------------------------
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _NoopChild:
+    """Bound instead of real children when METRICS_ENABLED is off."""
+
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    set = dec = observe = inc
+
+
+_NOOP = _NoopChild()
+
+
+# ------------------------
+# Metrics
+# ------------------------
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}  # label values -> child
+        REGISTRY.append(self)
+        if not self.labelnames and hasattr(self, "_child"):
+            # Unlabelled: expose the single child's methods on the metric itself
+            child = self.labels()
+            for method in ("inc", "set", "dec", "observe"):
+                if hasattr(child, method):
+                    setattr(self, method, getattr(child, method))
+
+    def labels(self, *values):
+        """
+        The child for these label values. Bind it once (at import or setup)
+        and keep it: the lookup is the part that costs on a hot path.
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._child() if METRICS_ENABLED else _NOOP
+        return child
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def collect(self):
+        lines = self._header()
+        for values, child in self.children.items():
+            if child is not _NOOP:
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def collect(self):
+        lines = self._header()
+        for values, child in self.children.items():
+            if child is _NOOP:
+                continue
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), child.counts):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {total}")
+            labels = _labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Collected(_Metric):
+    """
+    A counter or gauge read at scrape time from state the code keeps anyway
+    (STATS dicts, len(USERS)), so the hot path pays nothing for it. `fn`
+    returns a number, or with labelnames a dict of label values -> number.
+    """
+
+    def __init__(self, name, help, fn, kind="gauge", labelnames=()):
+        self.fn = fn
+        self.kind = kind
+        super().__init__(name, help, labelnames)
+
+    def labels(self, *values):
+        raise TypeError(f"{self.name} is read from its callback")
+
+    def collect(self):
+        lines = self._header()
+        try:
+            value = self.fn()
+        except Exception as e:  # a broken callback must not break the scrape
+            logger.error("Collecting %s failed: %s", self.name, e)
+            return lines
+        if not self.labelnames:
+            value = {(): value}
+        for values, number in value.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {number}")
+        return lines
+
+
+def render():
+    """Every registered metric in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return ("\n".join(lines) + "\n").encode()
+
+
+# ------------------------
+# /metrics endpoint
+# ------------------------
+_NOT_FOUND = b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+async def _handle(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+        parts = request.split(b" ", 2)
+        if len(parts) == 3 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            body = render()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+        else:
+            writer.write(_NOT_FOUND)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    """Serve GET /metrics on host:port; None (and a warning) if the port is taken."""
+    try:
+        server = await asyncio.start_server(_handle, host, port)
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+        return None
+    logger.info("Metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -1,10 +1,20 @@
+import os
+import threading
+import time
 from pydantic import BaseModel, Field, field_validator
-from datetime import datetime
-from typing import Set, Optional
+from datetime import datetime, timedelta
+from typing import List, Set, Optional
 from bson import ObjectId
+from pydantic_core import core_schema
+from app.config import MIN_USERNAME_LENGTH, MAX_USERNAME_LENGTH
 
 # Custom Pydantic field for MongoDB ObjectId
 class PyObjectId(str):
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        # Validate (and serialize) as a plain string
+        return core_schema.no_info_after_validator_function(str, core_schema.str_schema())
+
     @classmethod
     def __get_pydantic_json_schema__(cls, core_schema, handler):
         return {"type": "string"}
@@ -12,11 +22,13 @@ class PyObjectId(str):
 # User model
 class User(BaseModel):
     id: PyObjectId = Field(default_factory=lambda: str(ObjectId()), alias="_id")
-    username: str
-    email: str
-    hashed_password: str
+    username: str = Field(min_length=MIN_USERNAME_LENGTH, max_length=MAX_USERNAME_LENGTH)
+    email: str = ""
+    hashed_password: str = ""
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    last_active: datetime = Field(default_factory=datetime.utcnow)
+    rooms: Set[str] = Field(default_factory=set)
     roles: Set[str] = Field(default_factory=set)
     is_active: bool = True
     is_superuser: bool = False
@@ -55,8 +67,10 @@ class Config:
 
 # Message model
 class Message(BaseModel):
-    id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
-    user_id: PyObjectId
+    id: PyObjectId = Field(default_factory=lambda: str(ObjectId()), alias="_id")
+    user_id: Optional[PyObjectId] = None
+    room: Optional[str] = None
+    sender: Optional[str] = None
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     is_read: bool = False
@@ -85,6 +99,7 @@ class Room(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     members: Set[PyObjectId] = Field(default_factory=set)
+    messages: List[PyObjectId] = Field(default_factory=list)
     # Additional fields can be added as needed
     class Config:
         # Config class to handle ObjectId serialization
@@ -99,3 +114,68 @@ class Room(BaseModel):
             }
         }
 
+
+# ------------------------
+# Hot-path message record
+# ------------------------
+# Chat lines are built from fields the server already checked, so they skip
+# Pydantic entirely; Message above stays the schema for what is stored.
+_EPOCH = datetime(1970, 1, 1)
+_ID_PROCESS = os.urandom(5).hex()  # ObjectId layout: 4B seconds, 5B process, 3B counter
+# One lock for the clock and the counter, as in bson.ObjectId: room shard
+# threads build records at the same time
+_id_lock = threading.Lock()
+_last_ms = 0
+_id_seconds = -1  # seconds field of the ids being handed out
+_id_prefix = ""   # "<seconds><process>" hex for it
+_id_count = 0     # next counter value under that prefix
+
+
+def _next_id():
+    """
+    (ms, id): ms never goes backwards within a process, even if the wall
+    clock does, and ids increase. The counter starts over each second; past
+    2**24 ids in one second it carries into the seconds field instead of
+    wrapping.
+    """
+    global _last_ms, _id_seconds, _id_prefix, _id_count
+    now = time.time_ns() // 1_000_000
+    with _id_lock:
+        if now > _last_ms:
+            _last_ms = now
+        if now // 1000 > _id_seconds or _id_count > 0xFFFFFF:
+            _id_seconds = max(now // 1000, _id_seconds + 1)
+            _id_prefix = f"{_id_seconds:08x}{_ID_PROCESS}"
+            _id_count = 0
+        ms, prefix, n = _last_ms, _id_prefix, _id_count
+        _id_count = n + 1
+    return ms, f"{prefix}{n:06x}"
+
+
+class MessageRecord:
+    """
+    One chat message on the hot path. The id is a valid ObjectId hex string
+    that increases within a process; `ms` is the UTC timestamp in
+    milliseconds, taken once and reused for the frame, history and storage.
+    """
+
+    __slots__ = ("id", "user_id", "room", "sender", "content", "ms")
+
+    def __init__(self, user_id, room, sender, content):
+        self.ms, self.id = _next_id()
+        self.user_id = user_id
+        self.room = room
+        self.sender = sender
+        self.content = content
+
+    def to_document(self):
+        """The MongoDB document, shaped like Message.model_dump(by_alias=True)."""
+        return {
+            "_id": self.id,
+            "user_id": self.user_id,
+            "room": self.room,
+            "sender": self.sender,
+            "content": self.content,
+            "timestamp": _EPOCH + timedelta(milliseconds=self.ms),
+            "is_read": False,
+        }
@@ -0,0 +1,887 @@
+import array
+import asyncio
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from time import perf_counter
+from types import SimpleNamespace
+from bson import ObjectId, json_util
+from app.config import (
+    MSGLOG_SEGMENT_BYTES,
+    MSGLOG_SEGMENT_SECONDS,
+    MSGLOG_INDEX_INTERVAL,
+    MSGLOG_FSYNC_INTERVAL,
+    MSGLOG_RETENTION_DAYS,
+    MSGLOG_RETENTION_BYTES,
+    MSGLOG_MAINTENANCE_INTERVAL,
+    MSGLOG_MAX_OPEN,
+)
+from app.frames import BACKEND, dumps, loads
+from app.history import to_ms, from_ms
+from app.logger import get_logger
+from app.memdb import InMemoryCollection, InMemoryCursor, matches, _text_score
+from app.metrics import Collected, Histogram
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory lock on the data directory
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# Embedded storage engine: MONGO_URI=log://<dir> runs the server with no
+# MongoDB at all. Messages go to per-room append-only segment files (read
+# back through mmap); users and rooms, which are small, live in memory with
+# a JSON-lines journal. Single process: --workers 1 (LOOP_SHARDS is fine).
+
+# Record: header, then the body (JSON of every field but _id, room, timestamp)
+#   body length, crc32 of everything after the crc field, seq, ms, ObjectId
+HEADER = struct.Struct("<IIQq12s")
+NO_ID = bytes(12)  # _id is not an ObjectId: it is kept in the body instead
+_IMPLIED = ("_id", "room", "timestamp")  # stored in the header or the file's directory
+
+# Sparse index (.idx next to a sealed .log): (last seq, last ms, file size), then (seq, ms, offset) entries
+INDEX = struct.Struct("<QqQ")
+
+FSYNC_SECONDS = Histogram("chat_msglog_fsync_seconds", "Message log group commit: one fsync pass per window.")
+
+LOGS = weakref.WeakSet()
+
+
+def _load_view(view):
+    return loads(view) if BACKEND == "orjson" else loads(bytes(view))  # orjson parses the mapped bytes in place
+
+
+def _pack_id(value):
+    if isinstance(value, ObjectId):
+        return value.binary
+    if isinstance(value, str) and len(value) == 24 and value == value.lower():
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+    return None
+
+
+def encode(doc, seq):
+    """One record for `doc` as sequence number `seq`: (bytes, ms)."""
+    oid = _pack_id(doc.get("_id"))
+    fields = {k: v for k, v in doc.items() if k not in _IMPLIED}
+    if oid is None and "_id" in doc:
+        fields["_id"] = doc["_id"]
+    ts = doc.get("timestamp")
+    ms = to_ms(ts) if ts is not None else int(time.time() * 1000)
+    body = dumps(fields)
+    record = bytearray(HEADER.size + len(body))
+    HEADER.pack_into(record, 0, len(body), 0, seq, ms, oid or NO_ID)
+    record[HEADER.size:] = body
+    struct.pack_into("<I", record, 4, zlib.crc32(memoryview(record)[8:]))
+    return record, ms
+
+
+def _remove(path):
+    for name in (path, path[:-4] + ".idx"):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def _dirname(room):
+    name = room.encode().hex()
+    return name if len(name) <= 200 else "h" + hashlib.sha256(room.encode()).hexdigest()
+
+
+# ------------------------
+# Segments
+# ------------------------
+class Segment:
+    """
+    One file of a room's log: records back to back, named after the seq it
+    started at. In memory it keeps a sparse index, one (seq, ms, offset)
+    entry every `interval` bytes, so a seek reads at most one block too many.
+    """
+
+    __slots__ = ("path", "base", "size", "first_seq", "last_seq", "first_ms", "last_ms",
+                 "seqs", "mss", "offsets", "indexed_at", "mm")
+
+    def __init__(self, path):
+        self.path = path
+        self.base = int(os.path.basename(path)[:-4])
+        self.size = 0
+        self.first_seq = self.last_seq = None
+        self.first_ms = self.last_ms = None
+        self.seqs = array.array("Q")
+        self.mss = array.array("q")
+        self.offsets = array.array("Q")
+        self.indexed_at = 0
+        self.mm = None
+
+    def note(self, offset, seq, ms, end, interval):
+        """Account for the record at [offset, end)."""
+        if not self.offsets or offset - self.indexed_at >= interval:
+            self.seqs.append(seq)
+            self.mss.append(ms)
+            self.offsets.append(offset)
+            self.indexed_at = offset
+        if self.first_seq is None:
+            self.first_seq, self.first_ms = seq, ms
+        self.last_seq, self.last_ms, self.size = seq, ms, end
+
+    def block(self, i):
+        """Byte range of the records between index entries i and i + 1."""
+        return self.offsets[i], self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+
+    def full(self, ms, max_bytes, max_ms):
+        return self.size >= max_bytes or (max_ms > 0 and ms - self.first_ms >= max_ms)
+
+    def save_index(self):
+        if self.first_seq is None or not os.path.exists(self.path):
+            return
+        path = self.path[:-4] + ".idx"
+        with open(path + ".tmp", "wb") as f:
+            f.write(INDEX.pack(self.last_seq, self.last_ms, self.size))
+            for entry in zip(self.seqs, self.mss, self.offsets):
+                f.write(INDEX.pack(*entry))
+        os.replace(path + ".tmp", path)
+
+    def load_index(self):
+        """Adopt the saved index if it describes the file as it is now; False means scan instead."""
+        try:
+            with open(self.path[:-4] + ".idx", "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        if len(data) < 2 * INDEX.size or len(data) % INDEX.size:
+            return False
+        last_seq, last_ms, size = INDEX.unpack_from(data, 0)
+        if size != os.path.getsize(self.path):
+            return False
+        for seq, ms, offset in INDEX.iter_unpack(memoryview(data)[INDEX.size:]):
+            self.seqs.append(seq)
+            self.mss.append(ms)
+            self.offsets.append(offset)
+        self.first_seq, self.first_ms = self.seqs[0], self.mss[0]
+        self.last_seq, self.last_ms, self.size = last_seq, last_ms, size
+        self.indexed_at = self.offsets[-1]
+        return True
+
+    def scan_file(self, interval):
+        """Rebuild the index from the file, verifying each record; a torn tail is cut off."""
+        with open(self.path, "rb") as f:
+            data = f.read()
+        view = memoryview(data)
+        pos = 0
+        while pos + HEADER.size <= len(data):
+            n, crc, seq, ms, _ = HEADER.unpack_from(data, pos)
+            end = pos + HEADER.size + n
+            if end > len(data) or zlib.crc32(view[pos + 8:end]) != crc:
+                break
+            self.note(pos, seq, ms, end, interval)
+            pos = end
+        view.release()
+        self.size = pos
+        if pos < len(data):
+            logger.warning("Message log %s: dropping %d bytes of torn or corrupt tail", self.path, len(data) - pos)
+            os.truncate(self.path, pos)
+
+
+# ------------------------
+# One room's log
+# ------------------------
+class RoomLog:
+    """A room's segments, oldest first. Only the last one takes appends."""
+
+    def __init__(self, owner, room, path):
+        self.owner = owner
+        self.room = room
+        self.path = path
+        self.segments = []
+        self.next_seq = 1
+        self.fd = None  # O_APPEND descriptor of the last segment, while in owner.fds
+
+    def _open(self):
+        """Recover the segments on disk: blocking file I/O, run in a worker thread (see MessageLog._room)."""
+        names = sorted(os.listdir(self.path))
+        logs = [n for n in names if n.endswith(".log")]
+        for name in names:
+            # Leftovers of an interrupted compaction or index write, and indexes of dropped segments
+            if name.endswith((".compact", ".tmp")) or (name.endswith(".idx") and name[:-4] + ".log" not in logs):
+                os.remove(os.path.join(self.path, name))
+        interval = self.owner.index_interval
+        for name in logs:
+            seg = Segment(os.path.join(self.path, name))
+            if not seg.load_index():
+                seg.scan_file(interval)
+            prev = self.segments[-1] if self.segments else None
+            if seg.first_seq is None and name != logs[-1]:
+                _remove(seg.path)
+                continue
+            if prev is not None and seg.last_seq is not None and seg.last_seq <= prev.last_seq:
+                # Already merged into prev: compaction stopped before removing it
+                _remove(seg.path)
+                continue
+            self.segments.append(seg)
+        if self.segments:
+            last = self.segments[-1]
+            self.next_seq = max(last.base, (last.last_seq or 0) + 1)
+
+    def _active(self):
+        if not self.segments:
+            self.segments.append(Segment(os.path.join(self.path, f"{self.next_seq:020d}.log")))
+        return self.segments[-1]
+
+    def _fd(self):
+        if self.fd is None:
+            self.fd = os.open(self._active().path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.owner._touch(self)
+        return self.fd
+
+    def append(self, docs):
+        """Append `docs` in order: one write() per segment they land in. Returns the bytes written."""
+        owner = self.owner
+        max_ms = owner.segment_seconds * 1000
+        seg = self._active()
+        start, buf, written = seg.size, bytearray(), 0
+        for doc in docs:
+            record, ms = encode(doc, self.next_seq)
+            if seg.first_seq is not None and seg.full(ms, owner.segment_bytes, max_ms):
+                written += self._write(seg, start, buf)
+                self._seal()
+                seg = self._active()
+                start, buf = 0, bytearray()
+            seg.note(seg.size, self.next_seq, ms, seg.size + len(record), owner.index_interval)
+            buf += record
+            self.next_seq += 1
+        return written + self._write(seg, start, buf)
+
+    def _write(self, seg, start, buf):
+        if not buf:
+            return 0
+        fd = self._fd()
+        try:
+            view = memoryview(buf)
+            while view:
+                view = view[os.write(fd, view):]
+        except OSError:
+            # Disk full and the like: put the file and its index back to before this batch
+            os.ftruncate(fd, start)
+            self.owner._unmap(seg)
+            fresh = Segment(seg.path)
+            fresh.scan_file(self.owner.index_interval)
+            self.segments[-1] = fresh
+            self.next_seq = max(fresh.base, (fresh.last_seq or 0) + 1)
+            raise
+        self.owner._written(fd)
+        return len(buf)
+
+    def _seal(self):
+        """Close the last segment for appends; the next append starts a new one."""
+        seg = self.segments[-1]
+        self.owner._retire(self, seg)
+        self.segments.append(Segment(os.path.join(self.path, f"{self.next_seq:020d}.log")))
+
+    def scan(self, lo=None, hi=None, reverse=False):
+        """Docs with lo <= ms <= hi in append order (newest first if reverse), seeking through the sparse index."""
+        segs = [s for s in self.segments if s.first_seq is not None
+                and (lo is None or s.last_ms >= lo) and (hi is None or s.first_ms <= hi)]
+        read = self.owner._read
+        if reverse:
+            for seg in reversed(segs):
+                last = len(seg.offsets) - 1 if hi is None else bisect.bisect_right(seg.mss, hi) - 1
+                for i in range(last, -1, -1):
+                    block = read(self.room, seg, *seg.block(i), lo, hi)
+                    yield from reversed(block)
+                    if lo is not None and seg.mss[i] < lo:
+                        return
+            return
+        for seg in segs:
+            first = 0 if lo is None else max(bisect.bisect_left(seg.mss, lo) - 1, 0)
+            for i in range(first, len(seg.offsets)):
+                if hi is not None and seg.mss[i] > hi:
+                    return
+                yield from read(self.room, seg, *seg.block(i), lo, hi)
+
+    def expire(self, cutoff, max_bytes):
+        """Drop whole segments from the front: older than cutoff (ms), or past max_bytes for the room."""
+        dropped = 0
+        total = sum(s.size for s in self.segments)
+        while self.segments:
+            seg = self.segments[0]
+            active = seg is self.segments[-1]
+            aged = cutoff is not None and seg.last_ms is not None and seg.last_ms < cutoff
+            if not aged and not (max_bytes and total > max_bytes and not active):
+                break
+            if active:
+                self.owner._retire(self, None)
+            self.owner._unmap(seg)
+            _remove(seg.path)
+            self.segments.pop(0)
+            total -= seg.size
+            dropped += 1
+        if not self.segments and dropped:
+            # Keep the numbering: an empty segment named after the next seq survives a restart
+            open(self._active().path, "ab").close()
+        return dropped
+
+    def compaction_runs(self, max_bytes):
+        """Runs of neighbouring sealed segments that fit in one: quiet rooms roll by age into small files."""
+        runs, run, size = [], [], 0
+        for seg in self.segments[:-1]:
+            if run and size + seg.size > max_bytes:
+                if len(run) > 1:
+                    runs.append(run)
+                run, size = [], 0
+            run.append(seg)
+            size += seg.size
+        if len(run) > 1:
+            runs.append(run)
+        return runs
+
+    def swap(self, run, merged):
+        """Put the merged file (written next to run[0] by _merge) in place of `run`."""
+        at = self.segments.index(run[0])
+        for seg in run:
+            self.owner._unmap(seg)
+        try:
+            os.remove(run[0].path[:-4] + ".idx")  # stale the moment the file is replaced
+        except FileNotFoundError:
+            pass
+        os.replace(run[0].path + ".compact", run[0].path)
+        if merged.first_seq is None:  # everything in it had expired
+            _remove(run[0].path)
+            self.segments[at:at + len(run)] = []
+        else:
+            merged.save_index()
+            self.segments[at:at + len(run)] = [merged]
+        for seg in run[1:]:
+            _remove(seg.path)
+
+
+def _merge(run, cutoff, interval):
+    """Copy the records of `run` into run[0].path + ".compact", skipping those older than cutoff (ms)."""
+    merged = Segment(run[0].path)
+    with open(run[0].path + ".compact", "wb") as out:
+        for seg in run:
+            with open(seg.path, "rb") as f:
+                data = f.read(seg.size)
+            pos = 0
+            while pos < len(data):
+                n, _, seq, ms, _ = HEADER.unpack_from(data, pos)
+                end = pos + HEADER.size + n
+                if cutoff is None or ms >= cutoff:
+                    merged.note(merged.size, seq, ms, merged.size + end - pos, interval)
+                    out.write(data[pos:end])
+                pos = end
+        out.flush()
+        os.fsync(out.fileno())
+    return merged
+
+
+def _sync_files(fds, retired, durable):
+    """Group commit, in a worker thread: flush the written files, then close and index the retired ones."""
+    sync = getattr(os, "fdatasync", os.fsync)
+    try:
+        if durable:
+            for fd in fds:
+                sync(fd)
+    finally:
+        for fd, seg in retired:
+            try:
+                if durable:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            if seg is not None:
+                seg.save_index()  # only once its data is on disk
+
+
+# ------------------------
+# The messages collection
+# ------------------------
+class LogCursor(InMemoryCursor):
+    """Reads nothing until to_list(); then seeks with the sort, skip and limit it was given."""
+
+    def __init__(self, log, query, projection):
+        super().__init__(None, projection)
+        self._log = log
+        self._query = query
+        self._keys = None
+
+    def sort(self, keys, direction=None):
+        self._keys = [(keys, direction or 1)] if isinstance(keys, str) else list(keys)
+        return self
+
+    async def to_list(self, length=None):
+        if self._docs is None:
+            wanted = self._skip + self._limit if self._limit else 0
+            log = self._log
+            self._docs = log._select(await log._logs(self._query), self._query, self._keys, wanted)
+            if self._keys:
+                super().sort(self._keys)
+        return await super().to_list(length)
+
+
+def _range(cond):
+    if isinstance(cond, datetime):
+        return to_ms(cond), to_ms(cond)
+    lo = hi = None
+    if isinstance(cond, dict):
+        for op, value in cond.items():
+            if isinstance(value, datetime) and op in ("$gt", "$gte"):
+                lo = to_ms(value)
+            elif isinstance(value, datetime) and op in ("$lt", "$lte"):
+                hi = to_ms(value)  # inclusive: matches() applies the exact bound
+    return lo, hi
+
+
+def _narrow(a, b):
+    lo = b[0] if a[0] is None else a[0] if b[0] is None else max(a[0], b[0])
+    hi = b[1] if a[1] is None else a[1] if b[1] is None else min(a[1], b[1])
+    return lo, hi
+
+
+def _bounds(query):
+    """The ms range a query's timestamp conditions (including $and/$or branches) allow; None = open."""
+    span = _range(query["timestamp"]) if "timestamp" in query else (None, None)
+    for branch in query.get("$and", ()):
+        span = _narrow(span, _bounds(branch))
+    if query.get("$or"):
+        spans = [_bounds(branch) for branch in query["$or"]]
+        lo = None if any(s[0] is None for s in spans) else min(s[0] for s in spans)
+        hi = None if any(s[1] is None for s in spans) else max(s[1] for s in spans)
+        span = _narrow(span, (lo, hi))
+    return span
+
+
+class MessageLog:
+    """
+    The messages collection as one append-only log per room under `root`.
+    Appends are buffered per batch and written with one write() per room;
+    insert_many() returns once they are on disk, and batches that arrive
+    within `fsync_interval` of each other share one fsync pass (group
+    commit). Reads seek by timestamp through the segments' sparse indexes
+    and decode records straight out of mmap'ed files.
+
+    Queries that name a room and sort by timestamp (history pages, search
+    hydration) only read the blocks they need, assuming a room's timestamps
+    never go backwards; anything else ($text, other sorts, no room) is a
+    scan. _id is not checked for uniqueness.
+    """
+
+    def __init__(self, root, segment_bytes=MSGLOG_SEGMENT_BYTES, segment_seconds=MSGLOG_SEGMENT_SECONDS,
+                 index_interval=MSGLOG_INDEX_INTERVAL, fsync_interval=MSGLOG_FSYNC_INTERVAL,
+                 retention_days=MSGLOG_RETENTION_DAYS, retention_bytes=MSGLOG_RETENTION_BYTES,
+                 maintenance_interval=MSGLOG_MAINTENANCE_INTERVAL, max_open=MSGLOG_MAX_OPEN):
+        self.name = "messages"
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.index_interval = index_interval
+        self.fsync_interval = fsync_interval
+        self.retention_days = retention_days
+        self.retention_bytes = retention_bytes
+        self.maintenance_interval = maintenance_interval
+        self.max_open = max(1, max_open)
+        os.makedirs(root, exist_ok=True)
+        self.rooms = {}  # room -> RoomLog, opened on first use
+        self.opening = {}  # room -> task recovering its RoomLog in a worker thread
+        self.paths = {}  # room -> its directory, for every room on disk
+        for entry in os.scandir(root):
+            if entry.is_dir():
+                try:
+                    with open(os.path.join(entry.path, "NAME"), "rb") as f:
+                        self.paths[f.read().decode()] = entry.path
+                except FileNotFoundError:
+                    logger.warning("Message log: %s has no NAME file, skipped", entry.path)
+        self.fds = OrderedDict()   # RoomLogs holding an append fd, least recently written first
+        self.maps = OrderedDict()  # Segments mapped for reading, least recently read first
+        self.dirty = set()         # fds written since the last group commit
+        self.retired = []          # (fd, sealed Segment or None) to fsync and close at the next one
+        self.waiter = None         # future of the group commit new appends join
+        self.commit_lock = asyncio.Lock()
+        self.maintenance = None
+        self.lock_fd = None
+        self.stats = {"appended": 0, "bytes": 0, "commits": 0, "dropped": 0, "compactions": 0}
+        LOGS.add(self)
+
+    # -- rooms, fds and maps --
+
+    async def _room(self, room, create=False):
+        """
+        The room's RoomLog, or None. The first use recovers it in a worker
+        thread: after a crash that is a scan of every segment without an
+        index, which must not hold up the event loop. Callers that come
+        meanwhile wait for the same recovery.
+        """
+        log = self.rooms.get(room)
+        if log is not None:
+            return log
+        opening = self.opening.get(room)
+        if opening is None:
+            path = self.paths.get(room)
+            if path is None:
+                if not create:
+                    return None
+                path = os.path.join(self.root, _dirname(room))
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, "NAME"), "wb") as f:
+                    f.write(room.encode())
+                self.paths[room] = path
+            opening = self.opening[room] = asyncio.ensure_future(self._recover(RoomLog(self, room, path)))
+        return await asyncio.shield(opening)
+
+    async def _recover(self, log):
+        try:
+            await asyncio.to_thread(log._open)
+            self.rooms[log.room] = log
+            return log
+        finally:
+            del self.opening[log.room]
+
+    def _touch(self, log):
+        self.fds[log] = None
+        self.fds.move_to_end(log)
+        while len(self.fds) > self.max_open:
+            self._retire(next(iter(self.fds)), None)
+
+    def _written(self, fd):
+        if self.fsync_interval >= 0:
+            self.dirty.add(fd)
+
+    def _retire(self, log, seg):
+        """Take `log`'s append fd out of use; it is fsynced and closed (and seg indexed) by the next commit."""
+        self.fds.pop(log, None)
+        fd, log.fd = log.fd, None
+        if fd is None:
+            if seg is not None:
+                seg.save_index()
+            return
+        self.dirty.discard(fd)
+        if self.fsync_interval < 0:
+            os.close(fd)
+            if seg is not None:
+                seg.save_index()
+        else:
+            self.retired.append((fd, seg))
+
+    def _map(self, seg):
+        if seg.mm is None or len(seg.mm) < seg.size:
+            if seg.mm is not None:
+                seg.mm.close()
+            with open(seg.path, "rb") as f:
+                seg.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[seg] = None
+        self.maps.move_to_end(seg)
+        while len(self.maps) > self.max_open:
+            self._unmap(next(iter(self.maps)))
+        return seg.mm
+
+    def _unmap(self, seg):
+        self.maps.pop(seg, None)
+        if seg.mm is not None:
+            seg.mm.close()
+            seg.mm = None
+
+    def _read(self, room, seg, start, end, lo=None, hi=None):
+        """Decode the records in [start, end) of `seg` that fall in the ms range."""
+        mm = self._map(seg)
+        out = []
+        with memoryview(mm) as view:
+            pos = start
+            while pos < end:
+                n, _, _, ms, oid = HEADER.unpack_from(mm, pos)
+                body, pos = pos + HEADER.size, pos + HEADER.size + n
+                if (lo is not None and ms < lo) or (hi is not None and ms > hi):
+                    continue
+                doc = _load_view(view[body:pos])
+                if oid != NO_ID:
+                    doc["_id"] = oid.hex()
+                doc["room"] = room
+                doc["timestamp"] = from_ms(ms)
+                out.append(doc)
+        return out
+
+    def _room_names(self):
+        return list(self.paths)
+
+    # -- collection interface --
+
+    async def insert_many(self, documents, ordered=True):
+        ids, by_room = [], {}
+        for doc in documents:
+            if "_id" not in doc:
+                doc["_id"] = ObjectId()  # like pymongo, which sets it on the caller's dict
+            if not isinstance(doc.get("room"), str):
+                raise ValueError("message log documents need a room")
+            ids.append(doc["_id"])
+            by_room.setdefault(doc["room"], []).append(doc)
+        for room in by_room:
+            await self._room(room, create=True)
+        for room, docs in by_room.items():
+            self.stats["bytes"] += self.rooms[room].append(docs)
+        self.stats["appended"] += len(ids)
+        await self.sync()
+        return SimpleNamespace(inserted_ids=ids, acknowledged=True)
+
+    async def insert_one(self, document):
+        result = await self.insert_many([document])
+        return SimpleNamespace(inserted_id=result.inserted_ids[0], acknowledged=True)
+
+    def find(self, query=None, projection=None):
+        return LogCursor(self, query or {}, projection)
+
+    async def find_one(self, query=None, projection=None):
+        docs = await self.find(query, projection).limit(1).to_list(length=1)
+        return docs[0] if docs else None
+
+    async def count_documents(self, query):
+        return len(self._select(await self._logs(query), query, None, 0))
+
+    async def create_index(self, keys, **kwargs):
+        return kwargs.get("name") or "_".join(f"{k}_{v}" for k, v in keys)  # the log is its own index
+
+    async def _logs(self, query):
+        """The RoomLogs a query reads: its room's, or every room's."""
+        room = query.get("room")
+        logs = [await self._room(r) for r in ([room] if isinstance(room, str) else self._room_names())]
+        return [log for log in logs if log is not None]
+
+    def _select(self, logs, query, keys, wanted):
+        """Matching docs, unsorted unless seeking; at least `wanted` of the first ones in sort order (0 = all)."""
+        key, direction = keys[0] if keys else ("timestamp", 1)
+        lo, hi = _bounds(query)
+        docs = []
+        if len(logs) == 1 and "$text" not in query and key == "timestamp" and not isinstance(direction, dict):
+            tie = None
+            for doc in logs[0].scan(lo, hi, reverse=direction < 0):
+                if tie is not None and doc["timestamp"] != tie:
+                    break  # past the ties of the last wanted doc: the sort orders those by _id
+                if matches(doc, query):
+                    docs.append(doc)
+                    if len(docs) == wanted:
+                        tie = doc["timestamp"]
+            return docs
+        for log in logs:
+            docs.extend(doc for doc in log.scan(lo, hi) if matches(doc, query))
+        if "$text" in query:
+            for doc in docs:
+                doc["score"] = float(_text_score(doc, query["$text"]["$search"]))
+        return docs
+
+    # -- durability --
+
+    async def sync(self):
+        """Return once everything appended so far is on disk; callers in one window share the fsync."""
+        if self.fsync_interval < 0 or not (self.dirty or self.retired):
+            return
+        if self.waiter is None:
+            self.waiter = asyncio.get_running_loop().create_future()
+            asyncio.ensure_future(self._group_commit(self.waiter))
+        await asyncio.shield(self.waiter)
+
+    async def _group_commit(self, waiter):
+        await asyncio.sleep(self.fsync_interval)
+        async with self.commit_lock:  # one pass at a time: a retired fd is closed only after it was synced
+            if self.waiter is waiter:
+                self.waiter = None
+            fds, retired = list(self.dirty), self.retired
+            self.dirty, self.retired = set(), []
+            started = perf_counter()
+            try:
+                await asyncio.to_thread(_sync_files, fds, retired, True)
+            except Exception as e:
+                logger.error("Message log fsync failed: %s", e)
+                waiter.set_exception(e)
+                return
+            FSYNC_SECONDS.observe(perf_counter() - started)
+            self.stats["commits"] += 1
+            waiter.set_result(None)
+
+    # -- retention and compaction --
+
+    async def maintain(self, now_ms=None):
+        """One retention and compaction pass over every room; returns (segments dropped, runs merged)."""
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        cutoff = now_ms - int(self.retention_days * 86_400_000) if self.retention_days > 0 else None
+        dropped = merged = 0
+        for room in self._room_names():
+            log = await self._room(room)
+            dropped += log.expire(cutoff, self.retention_bytes)
+            for run in log.compaction_runs(self.segment_bytes):
+                # Sealed segments only: appends never touch them, reads keep using them until the swap
+                segment = await asyncio.to_thread(_merge, run, cutoff, self.index_interval)
+                log.swap(run, segment)
+                merged += 1
+        self.stats["dropped"] += dropped
+        self.stats["compactions"] += merged
+        if dropped or merged:
+            logger.info("Message log maintenance: %d segment(s) dropped, %d run(s) compacted", dropped, merged)
+        return dropped, merged
+
+    async def _maintain_forever(self):
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error("Message log maintenance failed: %s", e)
+
+    # -- lifecycle --
+
+    async def start(self):
+        """Lock the directory (one server process per log) and start the maintenance task."""
+        if fcntl is not None and self.lock_fd is None:
+            fd = os.open(os.path.join(self.root, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                raise RuntimeError(f"Message log {self.root} is in use by another process "
+                                   f"(MONGO_URI=log:// serves one process: run with --workers 1)") from None
+            self.lock_fd = fd
+        if self.maintenance_interval > 0 and self.maintenance is None:
+            self.maintenance = asyncio.ensure_future(self._maintain_forever())
+
+    async def close(self):
+        """Sync and close every file; the log can be reopened afterwards."""
+        if self.maintenance is not None:
+            self.maintenance.cancel()
+            try:
+                await self.maintenance
+            except asyncio.CancelledError:
+                pass
+            self.maintenance = None
+        async with self.commit_lock:
+            for log in list(self.fds):
+                self._retire(log, None)
+            fds, retired = list(self.dirty), self.retired
+            self.dirty, self.retired = set(), []
+            await asyncio.to_thread(_sync_files, fds, retired, self.fsync_interval >= 0)
+        for log in self.rooms.values():
+            if log.segments:
+                log.segments[-1].save_index()  # saves the scan on the next start
+        for seg in list(self.maps):
+            self._unmap(seg)
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+
+Collected("chat_msglog_appended_total", "Messages appended to the message log.", kind="counter",
+          fn=lambda: sum(log.stats["appended"] for log in LOGS))
+Collected("chat_msglog_written_bytes_total", "Bytes appended to the message log.", kind="counter",
+          fn=lambda: sum(log.stats["bytes"] for log in LOGS))
+Collected("chat_msglog_group_commits_total", "fsync passes (each covers every append in its window).",
+          kind="counter", fn=lambda: sum(log.stats["commits"] for log in LOGS))
+Collected("chat_msglog_segments", "Segment files of the rooms opened since start.",
+          fn=lambda: sum(len(r.segments) for log in LOGS for r in log.rooms.values()))
+Collected("chat_msglog_segments_dropped_total", "Segments removed by retention.", kind="counter",
+          fn=lambda: sum(log.stats["dropped"] for log in LOGS))
+Collected("chat_msglog_compactions_total", "Runs of small segments merged into one.", kind="counter",
+          fn=lambda: sum(log.stats["compactions"] for log in LOGS))
+
+
+# ------------------------
+# Small collections
+# ------------------------
+class JournaledCollection(InMemoryCollection):
+    """
+    An in-memory collection (users, rooms) made durable by a JSON-lines
+    journal: each write appends the document's new state and opening
+    replays it, last state per _id winning. Lines are flushed to the OS per
+    write, not fsynced. The journal is rewritten when mostly superseded.
+    """
+
+    def __init__(self, name, path):
+        super().__init__(name)
+        self.path = path
+        self.lines = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._restore(json_util.loads(line))
+                        self.lines += 1
+        if self.lines > 2 * len(self.docs) + 1000:
+            self._rewrite()
+        self.journal = open(path, "a", encoding="utf-8")
+
+    def _restore(self, doc):
+        old = self.by_id.get(doc["_id"])
+        if old is None:
+            super()._insert(doc)
+        else:
+            old.clear()
+            old.update(doc)
+
+    def _rewrite(self):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for doc in self.docs:
+                f.write(json_util.dumps(doc) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.lines = len(self.docs)
+
+    def _log(self, doc):
+        self.journal.write(json_util.dumps(doc) + "\n")
+        self.journal.flush()
+        self.lines += 1
+
+    async def insert_many(self, documents, ordered=True):
+        result = await super().insert_many(documents, ordered)
+        for _id in result.inserted_ids:
+            self._log(self.by_id[_id])
+        return result
+
+    async def insert_one(self, document):
+        result = await super().insert_one(document)
+        self._log(self.by_id[result.inserted_id])
+        return result
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self._first(query)
+        result = await super().update_one(query, update, upsert)
+        doc = doc if doc is not None else self.by_id.get(result.upserted_id)
+        if doc is not None:
+            self._log(doc)
+        return result
+
+    def close(self):
+        self.journal.close()
+
+
+class LogDatabase:
+    """db["messages"] is a MessageLog under `root`; every other collection is journaled."""
+
+    def __init__(self, root, name="db"):
+        self.name = name
+        self.root = os.path.join(root, name)
+        self.collections = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            if name == "messages":
+                self.collections[name] = MessageLog(os.path.join(self.root, "messages"))
+            else:
+                self.collections[name] = JournaledCollection(name, os.path.join(self.root, f"{name}.jsonl"))
+        return self.collections[name]
+
+    async def start(self):
+        await self["messages"].start()
+
+    async def close(self):
+        for collection in self.collections.values():
+            if isinstance(collection, MessageLog):
+                await collection.close()
+            else:
+                collection.close()
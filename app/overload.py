@@ -0,0 +1,222 @@
+import asyncio
+import math
+import threading
+import time
+from http import HTTPStatus
+from app.config import (
+    OVERLOAD_ENABLED,
+    OVERLOAD_INTERVAL,
+    OVERLOAD_LAG_REJECT,
+    OVERLOAD_LAG_THROTTLE,
+    OVERLOAD_LAG_SHED,
+    OVERLOAD_QUEUED_REJECT,
+    OVERLOAD_QUEUED_THROTTLE,
+    OVERLOAD_QUEUED_SHED,
+    OVERLOAD_COOLDOWN,
+    OVERLOAD_EXPENSIVE_RATE,
+    OVERLOAD_ROOM_FANOUT,
+)
+from app.broadcast import queued_frames
+from app.frames import encode
+from app.logger import get_logger
+from app.metrics import Collected
+from app.utils import RateLimiter
+
+logger = get_logger(__name__)
+
+# Each level sheds what the ones below it do, plus one more kind of work
+NORMAL, REJECT, THROTTLE, SHED = range(4)
+LEVELS = ("normal", "reject_connections", "throttle_expensive", "shed_chat")
+
+SMOOTHING = 0.25  # weight of a new lag sample: one stall (a GC pass) is not an overload
+
+
+# ------------------------
+# Controller
+# ------------------------
+class Controller:
+    """
+    Admission control and load shedding for one process.
+
+    Every event loop runs probe(): it sleeps `interval` and records how
+    late it woke up, smoothed. update() turns the worst loop's lag and the
+    frames waiting in outbound queues into a level, each threshold crossed
+    one step up: REJECT refuses new connections (503 + Retry-After, before
+    the upgrade), THROTTLE also lets list/history/search through at only
+    `expensive_rate` per second per type, SHED also limits each room to
+    `room_fanout` deliveries per second: a message to a room of 200 costs
+    200, so the big rooms that make the fan-out expensive slow down first
+    and small ones hardly notice. Connected users keep talking until the
+    last step. Rising is immediate; falling goes one level per
+    `cooldown` seconds below the current level's thresholds, so the
+    controller doesn't flap around one threshold. THROTTLE and SHED
+    also wait until they have refused nothing for `cooldown` seconds:
+    while they still refuse, the calm is their doing, and stepping down
+    would let the held-back clients in all at once.
+    """
+
+    def __init__(self, lag=(OVERLOAD_LAG_REJECT, OVERLOAD_LAG_THROTTLE, OVERLOAD_LAG_SHED),
+                 queued=(OVERLOAD_QUEUED_REJECT, OVERLOAD_QUEUED_THROTTLE, OVERLOAD_QUEUED_SHED),
+                 interval=OVERLOAD_INTERVAL, cooldown=OVERLOAD_COOLDOWN, expensive_rate=OVERLOAD_EXPENSIVE_RATE,
+                 room_fanout=OVERLOAD_ROOM_FANOUT, members=None, measure_queued=queued_frames,
+                 clock=time.monotonic):
+        self.lag_levels = lag
+        self.queued_levels = queued
+        self.interval = interval
+        self.cooldown = cooldown
+        self.measure_queued = measure_queued
+        self.members = members  # room -> its members (on this node and others)
+        self.clock = clock
+        self.level = NORMAL
+        self.lags = {}  # event loop (shard index) -> smoothed lag, seconds
+        self.queued = 0
+        self.calm_since = None
+        self.refused_at = {THROTTLE: float("-inf"), SHED: float("-inf")}  # last refusal by each level's own step
+        self.expensive = RateLimiter(expensive_rate, 1.0, clock=clock)  # key: command type
+        self.rooms = RateLimiter(room_fanout, 1.0, clock=clock)         # key: room, cost: its members
+        self.retry_after = max(1, math.ceil(cooldown))
+        self.busy_frame = encode({"type": "error", "message": "Server busy, try again shortly.",
+                                  "retry_after": self.retry_after})
+        self.room_busy_frame = encode({"type": "error", "message": "Room busy, slow down.",
+                                       "retry_after": self.retry_after})
+        self.stats = {"connection": 0, "expensive": 0, "chat": 0}
+        self.shed_at_change = dict(self.stats)
+        self.task = None  # the main loop's probe
+
+    # -- measuring --
+
+    def sample(self, loop_id, lag):
+        previous = self.lags.get(loop_id, lag)
+        self.lags[loop_id] = previous + (lag - previous) * SMOOTHING
+
+    def lag(self):
+        return max(self.lags.values(), default=0.0)
+
+    async def probe(self, loop_id, evaluate=False):
+        """Measure this loop's lag until cancelled; the main loop's probe also runs update()."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.sample(loop_id, max(0.0, loop.time() - started - self.interval))
+            if evaluate:
+                self.update()
+
+    def update(self, now=None):
+        """Re-evaluate the level from the current lag and queue depth."""
+        now = self.clock() if now is None else now
+        lag, self.queued = self.lag(), self.measure_queued()
+        target = max(sum(lag >= t for t in self.lag_levels), sum(self.queued >= t for t in self.queued_levels))
+        if target > self.level:
+            self._set(target, lag)
+            self.calm_since = None
+        elif target < self.level:
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= self.cooldown and not self._refusing(now):
+                self._set(self.level - 1, lag)
+                self.calm_since = now
+        else:
+            self.calm_since = None
+        return self.level
+
+    def _refusing(self, now):
+        return now - self.refused_at.get(self.level, float("-inf")) < self.cooldown
+
+    def _set(self, level, lag):
+        shed = {k: v - self.shed_at_change[k] for k, v in self.stats.items()}
+        self.shed_at_change = dict(self.stats)
+        log = logger.warning if level > self.level else logger.info
+        log("Overload level %d (%s), was %d: loop lag %.0f ms, %d frames queued; shed meanwhile %s",
+            level, LEVELS[level], self.level, lag * 1000, self.queued, shed)
+        self.level = level
+
+    # -- shedding --
+
+    def admit(self, connection):
+        """None to go on with the handshake, else the 503 to answer it with."""
+        if self.level < REJECT:
+            return None
+        self.stats["connection"] += 1
+        response = connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server overloaded, retry later.\n")
+        response.headers["Retry-After"] = str(self.retry_after)
+        return response
+
+    def refuse(self, cmd, data):
+        """The error frame to answer `cmd` with if the current level sheds it, else None."""
+        if cmd.shed == "expensive":
+            if self.level >= THROTTLE and not self.expensive.allow(cmd.type):
+                self.stats["expensive"] += 1
+                self.refused_at[THROTTLE] = self.clock()
+                return self.busy_frame
+        elif cmd.shed == "room" and self.level >= SHED:
+            # A room bigger than the whole budget still gets one message per second
+            size = len(self.members(data["room"])) if self.members else 1
+            if not self.rooms.allow(data["room"], min(max(size, 1), self.rooms.capacity)):
+                self.stats["chat"] += 1
+                self.refused_at[SHED] = self.clock()
+                return self.room_busy_frame
+        return None
+
+
+# ------------------------
+# Process-wide controller
+# ------------------------
+controller = None
+
+# Room shards (LOOP_SHARDS > 1) each probe their own loop
+_shard = threading.local()
+
+Collected("chat_overload_level", "Load shedding level: 0 normal, 1 rejecting connections, "
+          "2 throttling list/history/search, 3 rate limiting chat per room.",
+          lambda: controller.level if controller else 0)
+Collected("chat_event_loop_lag_seconds", "How late each event loop's timers fire (smoothed).",
+          lambda: {(str(k),): v for k, v in controller.lags.items()} if controller else {}, labelnames=["loop"])
+Collected("chat_overload_shed_total", "Connections and commands refused by the overload controller.",
+          lambda: {(k,): v for k, v in controller.stats.items()} if controller else {},
+          kind="counter", labelnames=["kind"])
+
+
+def admit(connection, request):
+    """websockets.serve(process_request=...) step: refuse new connections while overloaded."""
+    return controller.admit(connection) if controller is not None else None
+
+
+def refuse(cmd, data):
+    return controller.refuse(cmd, data) if controller is not None else None
+
+
+async def start(members=None):
+    global controller
+    if OVERLOAD_ENABLED:
+        controller = Controller(members=members)
+        controller.task = asyncio.create_task(controller.probe(0, evaluate=True))
+    return controller
+
+
+async def stop():
+    global controller
+    if controller is not None:
+        controller.task.cancel()
+        try:
+            await controller.task
+        except asyncio.CancelledError:
+            pass
+        controller = None
+
+
+async def start_local(index):
+    """Probe the room shard loop running in this thread."""
+    if controller is not None:
+        _shard.task = asyncio.create_task(controller.probe(index))
+
+
+async def stop_local():
+    task = getattr(_shard, "task", None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        del _shard.task
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from pymongo.errors import BulkWriteError
+from app.config import (
+    PERSIST_BATCH_SIZE,
+    PERSIST_FLUSH_INTERVAL,
+    PERSIST_MAX_PENDING,
+    PERSIST_DRAIN_TIMEOUT,
+)
+from app.logger import get_logger
+from app.metrics import Collected, Histogram
+from app.models import MessageRecord
+
+logger = get_logger(__name__)
+
+_STOP = object()  # queue sentinel that tells the flusher to drain and exit
+
+FLUSH_SECONDS = Histogram("chat_persist_flush_seconds", "MongoDB insert_many latency per batch.")
+FLUSH_BATCH = Histogram("chat_persist_batch_size", "Messages per MongoDB batch.",
+                        buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+
+
+# ------------------------
+# Write-behind batch writer
+# ------------------------
+class MessageWriter:
+    """
+    Collects messages in memory and writes them with insert_many(ordered=False).
+    A batch is flushed when it reaches `batch_size` or `interval` seconds after
+    its first message, whichever comes first. submit() never waits on MongoDB;
+    once `max_pending` messages are waiting, new ones are dropped and counted.
+    """
+
+    def __init__(self, collection, batch_size=PERSIST_BATCH_SIZE,
+                 interval=PERSIST_FLUSH_INTERVAL, max_pending=PERSIST_MAX_PENDING):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.queue = asyncio.Queue()  # bounded by hand so the stop sentinel always fits
+        self.task = None
+        self.stats = {
+            "submitted": 0,
+            "persisted": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    def submit(self, message):
+        """Queue a MessageRecord, Message or plain document for persistence. Never blocks."""
+        if self.queue.qsize() >= self.max_pending:
+            self.stats["dropped"] += 1
+            return False
+        self.queue.put_nowait(message)
+        self.stats["submitted"] += 1
+        return True
+
+    async def close(self, timeout=PERSIST_DRAIN_TIMEOUT):
+        """Flush everything still queued, then stop the flusher."""
+        if self.task is None:
+            return
+        self.queue.put_nowait(_STOP)
+        try:
+            await asyncio.wait_for(self.task, timeout)
+        except asyncio.TimeoutError:
+            logger.error("Message writer drain timed out with %d messages pending", self.queue.qsize())
+        self.task = None
+
+    def metrics(self):
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "pending": self.queue.qsize(),
+            "avg_batch_size": self.stats["persisted"] / batches if batches else 0.0,
+            "avg_flush_ms": self.stats["total_flush_ms"] / batches if batches else 0.0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self.queue
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                # Take whatever is already queued before waiting again
+                if not queue.empty():
+                    item = queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+        # Drain anything that arrived behind the sentinel
+        rest = []
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        for i in range(0, len(rest), self.batch_size):
+            await self._flush(rest[i:i + self.batch_size])
+
+    async def _flush(self, batch):
+        docs = [_to_document(m) for m in batch]
+        started = time.perf_counter()
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+            self.stats["persisted"] += len(docs)
+        except BulkWriteError as e:
+            # ordered=False: everything except the reported errors was written
+            failed = len(e.details.get("writeErrors", []))
+            self.stats["persisted"] += len(docs) - failed
+            self.stats["failed"] += failed
+            logger.error("Partial message batch failure: %d of %d not written", failed, len(docs))
+        except Exception as e:
+            self.stats["failed"] += len(docs)
+            logger.error("Failed to persist %d messages: %s", len(docs), e)
+        elapsed = (time.perf_counter() - started) * 1000
+        FLUSH_SECONDS.observe(elapsed / 1000)
+        FLUSH_BATCH.observe(len(docs))
+        stats = self.stats
+        stats["batches"] += 1
+        stats["last_batch_size"] = len(docs)
+        stats["max_batch_size"] = max(stats["max_batch_size"], len(docs))
+        stats["last_flush_ms"] = elapsed
+        stats["max_flush_ms"] = max(stats["max_flush_ms"], elapsed)
+        stats["total_flush_ms"] += elapsed
+
+
+def _to_document(message):
+    if isinstance(message, MessageRecord):
+        return message.to_document()
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(by_alias=True)
+
+
+# ------------------------
+# Process-wide writer
+# ------------------------
+writer = None
+
+Collected("chat_persist_messages_total", "Messages by write-behind outcome.", kind="counter",
+          labelnames=["outcome"],
+          fn=lambda: {(k,): writer.stats[k] if writer else 0 for k in ("persisted", "dropped", "failed")})
+Collected("chat_persist_pending", "Messages waiting for the next MongoDB batch.",
+          lambda: writer.queue.qsize() if writer else 0)
+
+
+def persist(message):
+    """Hand a message to the running writer (no-op until start() was called)."""
+    if writer is not None:
+        writer.submit(message)
+
+
+async def start(collection=None):
+    global writer
+    if collection is None:
+        from app.db import messages_collection
+        collection = messages_collection
+    writer = MessageWriter(collection).start()
+    return writer
+
+
+async def stop():
+    global writer
+    if writer is not None:
+        await writer.close()
+        writer = None
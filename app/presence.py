@@ -0,0 +1,207 @@
+import asyncio
+import bisect
+import weakref
+from app.config import PRESENCE_WINDOW, PRESENCE_PAGE_SIZE
+from app.frames import encode
+from app.metrics import Collected
+
+ROOMS = ("rooms", None)  # topic: the room list
+ONLINE = ("users", None)  # topic: everyone online; ("users", room) is one room's members
+
+_ALL = weakref.WeakSet()  # every Presence, for the metrics
+
+
+# ------------------------
+# Snapshots and deltas
+# ------------------------
+class Presence:
+    """
+    Paged room_list/user_list snapshots, and deltas for whoever subscribed
+    to one. Lives on the main loop, which sees every membership event, from
+    this node or another (note()). For topics that have subscribers it keeps
+    only the first and last change per name, and `window` seconds after the
+    first one sends each subscriber one frame per topic with the net change,
+    encoded once: a mass disconnect is one delta frame, not thousands.
+
+    With loop shards `online` and the active rooms change on other loops
+    too, so the first page copies them under `membership.lock` and sorts
+    the copy; note() keeps the sorted lists in step from then on.
+    """
+
+    def __init__(self, online, membership, send, window=PRESENCE_WINDOW):
+        self.online = online          # username -> node, cluster-wide; changed under membership.lock
+        self.membership = membership
+        self.send = send              # send(username, frame), sync
+        self.window = window
+        self.subscribers = {}         # topic -> set of usernames (on this node)
+        self.topics_of = {}           # username -> set of topics
+        self.pending = {}             # topic -> {name: [added first?, added last?]}
+        self.created = set()          # rooms created this window (for ROOMS subscribers)
+        self.counted = set()          # rooms whose member count changed this window
+        self.flush_handle = None
+        self.users = None             # sorted online usernames, built by the first page, then kept in step
+        self.rooms = None             # sorted active room names, likewise
+        self.stats = {"events": 0, "delta_frames": 0, "delta_bytes": 0, "snapshots": 0}
+        _ALL.add(self)
+
+    # -- subscriptions --
+
+    def subscribe(self, username, topic):
+        self.subscribers.setdefault(topic, set()).add(username)
+        self.topics_of.setdefault(username, set()).add(topic)
+
+    def unsubscribe(self, username, topic):
+        subs = self.subscribers.get(topic)
+        if subs is not None:
+            subs.discard(username)
+            if not subs:
+                del self.subscribers[topic]
+                self.pending.pop(topic, None)
+        topics = self.topics_of.get(username)
+        if topics is not None:
+            topics.discard(topic)
+            if not topics:
+                del self.topics_of[username]
+
+    def drop(self, username):
+        """A disconnect: forget every subscription of `username`."""
+        for topic in list(self.topics_of.get(username, ())):
+            self.unsubscribe(username, topic)
+
+    # -- snapshots --
+
+    def _sorted_users(self):
+        if self.users is None:
+            with self.membership.lock:
+                users = list(self.online)
+            self.users = sorted(users)
+        return self.users
+
+    def _sorted_rooms(self):
+        if self.rooms is None:
+            self.rooms = sorted(self.membership.active())
+        return self.rooms
+
+    @staticmethod
+    def _page(names, after, limit):
+        start = bisect.bisect_right(names, after) if after else 0
+        page = names[start:start + limit]
+        return page, page[-1] if page and start + limit < len(names) else None
+
+    def users_page(self, room=None, after=None, limit=PRESENCE_PAGE_SIZE, members=None):
+        """
+        One user_list page: a room's members, or everyone online. `next` is
+        the `after` of the next page. With loop shards the room's member set
+        changes on its home loop, so the caller sorts it there and passes
+        `members`.
+        """
+        self.stats["snapshots"] += 1
+        if room:
+            names = members if members is not None else sorted(self.membership.members(room))
+        else:
+            names = self._sorted_users()
+        page, nxt = self._page(names, after, limit)
+        return {"type": "user_list", "room": room, "users": page, "total": len(names), "next": nxt}
+
+    def rooms_page(self, after=None, limit=PRESENCE_PAGE_SIZE):
+        """One room_list page of the active rooms, with member counts."""
+        self.stats["snapshots"] += 1
+        names = self._sorted_rooms()
+        page, nxt = self._page(names, after, limit)
+        rooms = [{"name": name, "members": len(self.membership.members(name))} for name in page]
+        return {"type": "room_list", "rooms": rooms, "active": len(names),
+                "total": len(self.membership.catalog), "next": nxt}
+
+    def reset(self):
+        """State was replaced wholesale (a cluster snapshot): sort again on the next page."""
+        self.users = self.rooms = None
+
+    # -- changes --
+
+    def note(self, event):
+        """A membership event ("online", "offline", "create_room", "join", "leave"), after it was applied."""
+        self.stats["events"] += 1
+        op, user, room = event.get("op"), event.get("user"), event.get("room")
+        if op in ("online", "offline"):
+            self._keep_user(user)
+            self._touch(ONLINE, user, op == "online")
+            for name in event.get("rooms", ()):
+                self._touch(("users", name), user, False)
+                self._count(name)
+        elif op in ("create_room", "join", "leave"):
+            if op != "leave":
+                self._keep_room(room, created=op == "create_room")
+            self._touch(("users", room), user, op != "leave")
+            self._count(room)
+
+    def _keep_user(self, user):
+        if self.users is None:
+            return
+        i = bisect.bisect_left(self.users, user)
+        listed = i < len(self.users) and self.users[i] == user
+        if user in self.online and not listed:
+            self.users.insert(i, user)
+        elif user not in self.online and listed:
+            del self.users[i]
+
+    def _keep_room(self, room, created):
+        if self.rooms is not None:
+            i = bisect.bisect_left(self.rooms, room)
+            if i == len(self.rooms) or self.rooms[i] != room:
+                self.rooms.insert(i, room)
+        if created and ROOMS in self.subscribers:
+            self.created.add(room)
+            self._schedule()
+
+    def _count(self, room):
+        if ROOMS in self.subscribers:
+            self.counted.add(room)
+            self._schedule()
+
+    def _touch(self, topic, name, added):
+        if topic not in self.subscribers:
+            return
+        changes = self.pending.setdefault(topic, {})
+        change = changes.get(name)
+        if change is None:
+            changes[name] = [added, added]
+        else:
+            change[1] = added
+        self._schedule()
+
+    def _schedule(self):
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        """Send the window's net changes: one frame per topic, the same bytes to each subscriber."""
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        frames = []
+        if self.created or self.counted:
+            members = {name: len(self.membership.members(name)) for name in sorted(self.counted)}
+            frames.append((ROOMS, {"type": "room_delta", "created": sorted(self.created), "members": members}))
+            self.created, self.counted = set(), set()
+        for topic, changes in pending.items():
+            # Same first and last change: that is the net one; different: back where it started
+            added = sorted(name for name, (first, last) in changes.items() if first and last)
+            removed = sorted(name for name, (first, last) in changes.items() if not first and not last)
+            if added or removed:
+                frames.append((topic, {"type": "user_delta", "room": topic[1], "added": added, "removed": removed}))
+        for topic, frame in frames:
+            subs = self.subscribers.get(topic)
+            if not subs:
+                continue
+            data = encode(frame)
+            for username in subs:
+                self.send(username, data)
+            self.stats["delta_frames"] += len(subs)
+            self.stats["delta_bytes"] += len(data) * len(subs)
+
+
+Collected("chat_presence_subscriptions", "Room/user list subscriptions on this node.",
+          lambda: sum(len(s) for p in _ALL for s in p.subscribers.values()))
+Collected("chat_presence_delta_frames_total", "Presence delta frames sent to subscribers.", kind="counter",
+          fn=lambda: sum(p.stats["delta_frames"] for p in _ALL))
+Collected("chat_presence_delta_bytes_total", "Bytes of presence delta frames sent to subscribers.", kind="counter",
+          fn=lambda: sum(p.stats["delta_bytes"] for p in _ALL))
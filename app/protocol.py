@@ -0,0 +1,158 @@
+from app.config import MAX_MESSAGE_LENGTH, MAX_ROOM_NAME_LENGTH, MIN_USERNAME_LENGTH, MAX_USERNAME_LENGTH
+from app.frames import loads
+from app.metrics import Histogram
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+# Encodings a client may pick at register time, in order of preference
+ENCODINGS = ("msgpack", "json") if msgpack is not None else ("json",)
+
+# No command needs more than its longest text fields (at most 4 UTF-8 bytes
+# per character) plus the envelope; anything bigger is refused undecoded
+MAX_FRAME_BYTES = 4 * (MAX_MESSAGE_LENGTH + MAX_ROOM_NAME_LENGTH) + 256
+
+_JSON_START = frozenset(b"{[ \t\r\n")
+
+DISPATCH_SECONDS = Histogram("chat_dispatch_seconds", "Time spent in a command handler.", ["type"])
+
+
+class ProtocolError(Exception):
+    """A bad client frame; the message is sent back as an error frame."""
+
+
+# ------------------------
+# Schemas
+# ------------------------
+class Field:
+    """
+    One field of a command. `kind` is the exact type required (str or int);
+    str fields must be min_length..max_length characters. `aliases` are older
+    names accepted for the same field.
+    """
+
+    __slots__ = ("kind", "required", "default", "min_length", "max_length", "aliases")
+
+    def __init__(self, kind=str, required=True, default=None, min_length=1, max_length=None, aliases=()):
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.min_length = min_length
+        self.max_length = max_length
+        self.aliases = aliases
+
+
+ROOM = Field(max_length=MAX_ROOM_NAME_LENGTH, aliases=("name",))
+OPTIONAL_ROOM = Field(required=False, max_length=MAX_ROOM_NAME_LENGTH, aliases=("name",))
+CURSOR = Field(required=False, max_length=64)
+
+
+class Command:
+    """A message type: its handler and the fields it accepts, compiled once."""
+
+    __slots__ = ("type", "handler", "fields", "rate_limited", "home", "shed", "latency")
+
+    def __init__(self, msg_type, handler, fields, rate_limited=False, home=None, shed=None):
+        self.type = msg_type
+        self.handler = handler
+        self.rate_limited = rate_limited
+        self.home = home
+        self.shed = shed
+        self.latency = DISPATCH_SECONDS.labels(msg_type)  # bound once, observed per frame
+        self.fields = tuple(
+            (name, (name, *f.aliases), f.kind, f.required, f.default, f.min_length, f.max_length)
+            for name, f in fields.items()
+        )
+
+    def validate(self, data):
+        """Return the fields under their canonical names, or raise ProtocolError."""
+        out = {}
+        for name, keys, kind, required, default, min_length, max_length in self.fields:
+            for key in keys:
+                value = data.get(key)
+                if value is not None:
+                    break
+            if value is None:
+                if required:
+                    raise ProtocolError(f"{self.type}: '{name}' is required.")
+                out[name] = default
+                continue
+            if type(value) is not kind:
+                raise ProtocolError(f"{self.type}: '{name}' must be {kind.__name__}.")
+            if kind is str and (len(value) < min_length or max_length and len(value) > max_length):
+                raise ProtocolError(f"{self.type}: '{name}' must be {min_length}-{max_length} characters.")
+            out[name] = value
+        return out
+
+
+COMMANDS = {}  # message type -> Command
+
+REGISTER = Command("register", None, {
+    "username": Field(min_length=MIN_USERNAME_LENGTH, max_length=MAX_USERNAME_LENGTH),
+    "encoding": Field(required=False, default="json"),
+})
+
+# Instead of register after a reconnect: rooms maps each joined room to the
+# cursor of the last message the client saw there (or null)
+RESUME = Command("resume", None, {
+    "session": Field(max_length=256),
+    "rooms": Field(dict, required=False),
+    "encoding": Field(required=False, default="json"),
+})
+
+
+def command(msg_type, rate_limited=False, home=None, shed=None, **fields):
+    """
+    Decorator: route `msg_type` frames to the handler, validated against
+    `fields`. `home` is the event loop it runs on with LOOP_SHARDS > 1:
+    "room" for the home loop of its room, "main" for the loop that owns
+    MongoDB, history and search, None for the connection's own loop.
+    `shed` is what the overload controller may do to it (app/overload.py):
+    "expensive" commands are throttled first, "room" ones (chat) are rate
+    limited per room last; None is never refused.
+    """
+    def register(handler):
+        COMMANDS[msg_type] = Command(msg_type, handler, fields, rate_limited, home, shed)
+        return handler
+    return register
+
+
+# ------------------------
+# Decoding
+# ------------------------
+def negotiate(requested):
+    """Encoding the server will accept from a client that asked for `requested`."""
+    return requested if requested in ENCODINGS else "json"
+
+
+def decode(raw, encoding="json"):
+    """
+    Decode one client frame (bytes) into a dict. Size is checked before any
+    parsing; MessagePack is only accepted once the client negotiated it.
+    """
+    if len(raw) > MAX_FRAME_BYTES:
+        raise ProtocolError("Frame too large.")
+    if encoding != "msgpack" or raw[:1] and raw[0] in _JSON_START:
+        try:
+            data = loads(raw)
+        except ValueError:  # json.JSONDecodeError and orjson.JSONDecodeError
+            raise ProtocolError("Invalid JSON format.") from None
+    else:
+        try:
+            data = msgpack.unpackb(raw)
+        except (ValueError, TypeError, msgpack.UnpackException):  # TypeError: unhashable map keys
+            raise ProtocolError("Invalid MessagePack frame.") from None
+    if type(data) is not dict:
+        raise ProtocolError("Frame must be an object.")
+    return data
+
+
+def parse(raw, encoding="json"):
+    """Decode and validate a frame: returns (Command, fields)."""
+    data = decode(raw, encoding)
+    cmd = COMMANDS.get(data.get("type"))
+    if cmd is None:
+        raise ProtocolError(f"Unknown message type: {data.get('type')}")
+    return cmd, cmd.validate(data)
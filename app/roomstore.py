@@ -0,0 +1,128 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from app.config import CATALOG_BATCH_SIZE, ROOM_WRITE_TIMEOUT
+from app.logger import get_logger
+from app.metrics import Collected
+
+logger = get_logger(__name__)
+
+
+# ------------------------
+# Rooms and memberships in MongoDB
+# ------------------------
+class RoomStore:
+    """
+    Durable copy of the room catalog and of each user's rooms. The in-memory
+    Membership index stays the source for every read; this only writes
+    through to MongoDB and reads back at start (catalog) or when a user
+    connects (their rooms).
+
+    rooms: {_id: room name, created_by, created_at}
+    users: {_id: username, rooms: [room names], last_seen}
+    """
+
+    def __init__(self, rooms, users, batch_size=CATALOG_BATCH_SIZE, timeout=ROOM_WRITE_TIMEOUT):
+        self.rooms = rooms
+        self.users = users
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.stats = {"loaded": 0, "load_ms": 0.0, "writes": 0, "failed": 0}
+
+    async def load_catalog(self, catalog):
+        """Stream every room name into `catalog` (a set), `batch_size` names per round trip."""
+        started = time.perf_counter()
+        cursor = self.rooms.find({}, {"_id": 1}).batch_size(self.batch_size)
+        loaded = 0
+        while True:
+            batch = await cursor.to_list(length=self.batch_size)
+            if not batch:
+                break
+            catalog.update(doc["_id"] for doc in batch)
+            loaded += len(batch)
+        self.stats["loaded"] = loaded
+        self.stats["load_ms"] = (time.perf_counter() - started) * 1000
+        return loaded
+
+    async def saved_rooms(self, username):
+        """The rooms `username` had joined, as of their last create/join/leave."""
+        try:
+            doc = await asyncio.wait_for(self.users.find_one({"_id": username}, {"rooms": 1}), self.timeout)
+        except Exception as e:
+            logger.error("Could not load rooms of %s: %s", username, e, extra={"user": username})
+            return []
+        return list(doc.get("rooms", ())) if doc else []
+
+    async def room_created(self, name, username):
+        await self._write(self.rooms, {"_id": name}, {
+            "$setOnInsert": {"created_by": username, "created_at": datetime.now(timezone.utc)},
+        })
+
+    async def joined(self, username, names):
+        await self._write(self.users, {"_id": username}, {
+            "$addToSet": {"rooms": {"$each": list(names)}},
+            "$set": {"last_seen": datetime.now(timezone.utc)},
+        })
+
+    async def left(self, username, name):
+        await self._write(self.users, {"_id": username}, {
+            "$pull": {"rooms": name},
+            "$set": {"last_seen": datetime.now(timezone.utc)},
+        })
+
+    async def _write(self, collection, query, update):
+        # The cache already changed; a failed write is logged, not sent to the client
+        self.stats["writes"] += 1
+        try:
+            await asyncio.wait_for(collection.update_one(query, update, upsert=True), self.timeout)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error("Room state write to %s failed: %s", collection.name, e)
+
+
+# ------------------------
+# Process-wide store
+# ------------------------
+store = None
+
+Collected("chat_room_writes_total", "Room and membership writes to MongoDB.", kind="counter",
+          labelnames=["outcome"],
+          fn=lambda: {("ok",): store.stats["writes"] - store.stats["failed"] if store else 0,
+                      ("failed",): store.stats["failed"] if store else 0})
+
+
+async def start(catalog, rooms=None, users=None):
+    """Load the room catalog into `catalog`; writes go through from here on."""
+    global store
+    if rooms is None or users is None:
+        from app.db import rooms_collection, users_collection
+        rooms, users = rooms_collection, users_collection
+    store = RoomStore(rooms, users)
+    await store.load_catalog(catalog)
+    logger.info("Loaded %d rooms in %.0f ms", store.stats["loaded"], store.stats["load_ms"])
+    return store
+
+
+def stop():
+    global store
+    store = None
+
+
+# No-ops until start(), like persistence.persist()
+async def saved_rooms(username):
+    return await store.saved_rooms(username) if store else []
+
+
+async def room_created(name, username):
+    if store:
+        await store.room_created(name, username)
+
+
+async def joined(username, names):
+    if store and names:
+        await store.joined(username, names)
+
+
+async def left(username, name):
+    if store:
+        await store.left(username, name)
@@ -0,0 +1,124 @@
+import asyncio
+import socket
+import threading
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import Opcode
+from app.config import (
+    SERVER_PROFILE,
+    USE_UVLOOP,
+    WS_COMPRESSION,
+    WS_COMPRESSION_MIN_SIZE,
+    WS_PING_INTERVAL,
+    WS_PING_TIMEOUT,
+    WS_WRITE_LIMIT,
+    WS_MAX_SIZE,
+    WS_MAX_QUEUE,
+    TCP_NODELAY,
+)
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+class _Bypass(threading.local):
+    on = False
+
+
+# Set by broadcast.fanout() while writing to a large room: compressing the
+# same frame once per recipient would cost more CPU than the bytes it saves.
+# Per thread, as every loop shard fans out at once and encodes on its own.
+bypass_compression = _Bypass()
+
+
+# ------------------------
+# Event loop
+# ------------------------
+def install_event_loop():
+    """Install uvloop's policy if requested/available; returns the loop name."""
+    if USE_UVLOOP == "off":
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:  # optional dependency
+        if USE_UVLOOP == "on":
+            raise RuntimeError("USE_UVLOOP=on but uvloop is not installed")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+# ------------------------
+# permessage-deflate
+# ------------------------
+class SelectiveDeflate(PerMessageDeflate):
+    """
+    permessage-deflate that sends small frames, and anything written while
+    bypass_compression is on in this thread, uncompressed. RFC 7692 allows this per message
+    (RSV1 stays clear) and the compressor state is untouched.
+    """
+
+    min_size = WS_COMPRESSION_MIN_SIZE
+
+    def encode(self, frame):
+        if frame.opcode is not Opcode.CONT and frame.fin and (bypass_compression.on or len(frame.data) < self.min_size):
+            return frame
+        return super().encode(frame)
+
+
+class SelectiveDeflateFactory(ServerPerMessageDeflateFactory):
+    def process_request_params(self, params, accepted_extensions):
+        response, ext = super().process_request_params(params, accepted_extensions)
+        return response, SelectiveDeflate(
+            ext.remote_no_context_takeover,
+            ext.local_no_context_takeover,
+            ext.remote_max_window_bits,
+            ext.local_max_window_bits,
+            ext.compress_settings,
+        )
+
+
+def _compression_kwargs():
+    if WS_COMPRESSION == "off":
+        return {"compression": None}
+    if WS_COMPRESSION == "on":
+        return {"compression": "deflate"}
+    # auto: same window/memory settings as websockets' default deflate
+    return {
+        "compression": None,
+        "extensions": [SelectiveDeflateFactory(
+            server_max_window_bits=12,
+            client_max_window_bits=12,
+            compress_settings={"memLevel": 5},
+        )],
+    }
+
+
+# ------------------------
+# websockets.serve settings
+# ------------------------
+def serve_kwargs():
+    return {
+        "max_size": WS_MAX_SIZE,
+        "max_queue": WS_MAX_QUEUE,
+        "write_limit": WS_WRITE_LIMIT,
+        "ping_interval": WS_PING_INTERVAL or None,
+        "ping_timeout": WS_PING_TIMEOUT or None,
+        **_compression_kwargs(),
+    }
+
+
+def tune_socket(websocket):
+    """Apply per-connection socket options (asyncio enables TCP_NODELAY by default)."""
+    if TCP_NODELAY:
+        return
+    sock = websocket.transport.get_extra_info("socket")
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+
+
+def describe(loop_name):
+    return (f"profile={SERVER_PROFILE} loop={loop_name} compression={WS_COMPRESSION} "
+            f"max_size={WS_MAX_SIZE} max_queue={WS_MAX_QUEUE} write_limit={WS_WRITE_LIMIT} "
+            f"ping={WS_PING_INTERVAL}/{WS_PING_TIMEOUT} tcp_nodelay={TCP_NODELAY}")
@@ -0,0 +1,376 @@
+import asyncio
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate, chain
+from operator import sub
+from sys import intern
+from pymongo import ASCENDING, TEXT
+from app import history
+from app.config import MAX_HISTORY, SEARCH_MAX_MESSAGES, SEARCH_SEGMENT_SIZE, SEARCH_MAX_TERMS
+from app.logger import get_logger
+from app.metrics import Collected
+
+logger = get_logger(__name__)
+
+# 2-32 word characters; a longer run (pasted id, hash, URL) is cut into pieces the same way in queries
+_WORD = re.compile(r"\w{2,32}")
+MAX_OFFSET = 1000  # deepest result served; past that, refine the query
+
+
+def tokenize(text):
+    """The distinct searchable words of `text`, lowercased."""
+    # Interned: every segment holding a word shares one string for it
+    return set(map(intern, _WORD.findall(text.lower())))
+
+
+# ------------------------
+# Segments: append-only, evicted whole
+# ------------------------
+class Segment:
+    """
+    Up to SEARCH_SEGMENT_SIZE messages of one room, numbered 0.. in arrival
+    order. While it takes messages, `postings` maps a word to its message
+    number (seen once) or an array('H') of them. Once full it is packed:
+    the words sorted into a tuple, and each posting list stored as the gaps
+    between its numbers in one shared array('B') (1 byte a posting, when
+    every gap is under 256) or array('H'), found through `offsets`/`ends`.
+    itertools.accumulate() turns gaps back into numbers at C speed.
+    """
+
+    __slots__ = ("ids", "ms", "postings", "words", "offsets", "ends", "narrow", "wide")
+
+    def __init__(self):
+        self.ids = bytearray()  # 12-byte ObjectIds, message n at [12n, 12n + 12)
+        self.ms = array("q")    # timestamps, same numbering
+        self.postings = {}      # word -> n | array('H') of n, until packed
+        self.words = None
+
+    def __len__(self):
+        return len(self.ms)
+
+    def full(self):
+        return len(self.ms) >= SEARCH_SEGMENT_SIZE
+
+    def add(self, oid, ms, words):
+        n = len(self.ms)
+        self.ids += oid
+        self.ms.append(ms)
+        postings = self.postings
+        for word in words:
+            seen = postings.get(word)
+            if seen is None:
+                postings[word] = n
+            elif type(seen) is int:
+                postings[word] = array("H", (seen, n))
+            else:
+                seen.append(n)
+
+    def packed(self):
+        """The packed posting lists (pure function of `postings`; safe to run in a thread)."""
+        words = tuple(sorted(self.postings))
+        offsets, ends = array("I"), array("I")
+        narrow, wide = array("B"), array("H")
+        for word in words:
+            numbers = self.postings[word]
+            if type(numbers) is int:
+                numbers = (numbers,)
+            gaps = array("H", map(sub, numbers, chain((0,), numbers)))
+            if max(gaps) < 256:
+                offsets.append(len(narrow))
+                narrow.extend(array("B", gaps))
+                ends.append(len(narrow))
+            else:
+                offsets.append(len(wide) | _WIDE)
+                wide.extend(gaps)
+                ends.append(len(wide))
+        return words, offsets, ends, narrow, wide
+
+    def install(self, packed):
+        self.words, self.offsets, self.ends, self.narrow, self.wide = packed
+        self.postings = None
+
+    def docs(self, word):
+        """Message numbers containing `word`, ascending."""
+        if self.postings is not None:
+            numbers = self.postings.get(word, ())
+            return (numbers,) if type(numbers) is int else numbers
+        i = bisect_left(self.words, word)
+        if i == len(self.words) or self.words[i] != word:
+            return ()
+        start = self.offsets[i]
+        data = self.wide if start & _WIDE else self.narrow
+        return accumulate(data[start & ~_WIDE:self.ends[i]])
+
+    def count(self, word):
+        if self.postings is not None:
+            numbers = self.postings.get(word, ())
+            return 1 if type(numbers) is int else len(numbers)
+        i = bisect_left(self.words, word)
+        if i == len(self.words) or self.words[i] != word:
+            return 0
+        return self.ends[i] - (self.offsets[i] & ~_WIDE)
+
+    def oid(self, n):
+        return self.ids[12 * n:12 * n + 12].hex()
+
+
+_WIDE = 1 << 31  # offsets flag: the list is in `wide`
+
+
+def _seal(segment):
+    """Pack a full segment, in a worker thread when a loop is running (tens of ms for a big room)."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        segment.install(segment.packed())
+        return
+    def done(future):
+        # Runs on the loop; queries read the unpacked lists until then
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Packing a search segment failed: %s", future.exception())
+            return
+        segment.install(future.result())
+
+    loop.run_in_executor(None, segment.packed).add_done_callback(done)
+
+
+class RoomIndex:
+    """A room's segments, oldest first; only the newest one takes new messages."""
+
+    __slots__ = ("segments", "count")
+
+    def __init__(self):
+        self.segments = []
+        self.count = 0
+
+    def floor_ms(self):
+        """Timestamp of the oldest message indexed; older ones are only in MongoDB."""
+        return self.segments[0].ms[0]
+
+    def df(self, word):
+        return sum(s.count(word) for s in self.segments)
+
+
+# room_name -> RoomIndex
+INDEXES = {}
+# (room_name, segment) in creation order; the oldest segment goes first when over budget
+_SEGMENTS = deque()
+_indexed = 0
+
+# MongoDB text index fallback; set by start()
+collection = None
+
+Collected("chat_search_indexed_messages", "Messages in the in-memory search index.", lambda: _indexed)
+Collected("chat_search_segments", "Search index segments in memory.", lambda: len(_SEGMENTS))
+
+
+def index(room, msg_id, ms, content):
+    """Add one message to its room's index (called as messages flow through the handlers)."""
+    global _indexed
+    words = tokenize(content)
+    if not words:
+        return
+    try:
+        oid = bytes.fromhex(msg_id)
+    except (TypeError, ValueError):
+        return
+    if len(oid) != 12:
+        return
+    room_index = INDEXES.get(room)
+    if room_index is None:
+        room_index = INDEXES[room] = RoomIndex()
+    segments = room_index.segments
+    if not segments or segments[-1].full():
+        segments.append(Segment())
+        _SEGMENTS.append((room, segments[-1]))
+    segment = segments[-1]
+    segment.add(oid, ms, words)
+    if segment.full():
+        _seal(segment)
+    room_index.count += 1
+    _indexed += 1
+    while _indexed > SEARCH_MAX_MESSAGES and len(_SEGMENTS) > 1:
+        _evict()
+
+
+def _evict():
+    global _indexed
+    room, segment = _SEGMENTS.popleft()
+    room_index = INDEXES[room]
+    room_index.segments.remove(segment)  # almost always segments[0]
+    room_index.count -= len(segment)
+    _indexed -= len(segment)
+    if not room_index.segments:
+        del INDEXES[room]
+
+
+def clear():
+    global _indexed
+    INDEXES.clear()
+    _SEGMENTS.clear()
+    _indexed = 0
+
+
+# ------------------------
+# Ranking
+# ------------------------
+def rank(room, words, need):
+    """
+    The best `need` in-memory matches for `words` in `room`, as
+    (score, ms, message id). A word scores log(1 + N / df), so rare words
+    count more. Messages with every word rank first, newest first; those
+    are found by set intersection segment by segment, newest segment
+    first, and usually fill the page before the older segments are read.
+    Only if they don't are partial matches scored, and the most common
+    word's postings are only walked in C (set lookups), never in Python.
+    """
+    room_index = INDEXES.get(room)
+    if room_index is None or need <= 0:
+        return []
+    weights = {}
+    for word in words:
+        df = room_index.df(word)
+        if df:
+            weights[word] = math.log(1 + room_index.count / df)
+    if not weights:
+        return []
+    top = sum(weights.values())
+    ordered = sorted(weights, key=weights.get, reverse=True)  # rarest first
+    full_words = len(weights) == len(words)  # some word appears nowhere: no message has them all
+    hits = []
+    if full_words:
+        for segment in reversed(room_index.segments):
+            if len(ordered) == 1:
+                newest = list(segment.docs(ordered[0]))[:-(need - len(hits)) - 1:-1]
+            else:
+                found = set(segment.docs(ordered[0]))
+                for word in ordered[1:]:
+                    if not found:
+                        break
+                    found.intersection_update(segment.docs(word))
+                newest = sorted(found, reverse=True)
+            for n in newest:
+                hits.append((top, segment.ms[n], segment.oid(n)))
+            if len(hits) >= need:
+                return hits[:need]
+        if len(ordered) == 1:
+            return hits  # one word: every match was a full match
+    rest = need - len(hits)
+    cutoff = top - 1e-9 if full_words else math.inf  # full matches are in `hits` already
+    common, rarer = ordered[-1], ordered[:-1]
+    partial = []
+    for segment in room_index.segments:
+        scores = {}
+        for word in rarer:
+            weight = weights[word]
+            for n in segment.docs(word):
+                scores[n] = scores.get(n, 0.0) + weight
+        if scores:
+            for n in set(segment.docs(common)).intersection(scores):
+                scores[n] += weights[common]
+        candidates = ((score, segment.ms[n], n) for n, score in scores.items() if score < cutoff)
+        partial += [(score, ms, n, segment) for score, ms, n in heapq.nlargest(rest, candidates)]
+    best = heapq.nlargest(rest, partial, key=lambda h: (h[0], h[1]))
+    hits += [(score, ms, segment.oid(n)) for score, ms, n, segment in best]
+    if len(best) < rest:
+        # Then messages with only the most common word, which all score the same: newest first
+        for segment in reversed(room_index.segments):
+            scored = set().union(*(segment.docs(w) for w in rarer))
+            for n in reversed(list(segment.docs(common))):
+                if n not in scored:
+                    hits.append((weights[common], segment.ms[n], segment.oid(n)))
+                    if len(hits) >= need:
+                        return hits
+    return hits
+
+
+# ------------------------
+# MongoDB fallback and pages
+# ------------------------
+async def start(coll=None):
+    """Bind the messages collection and create its text index."""
+    global collection
+    if coll is None:
+        from app.db import messages_collection
+        coll = messages_collection
+    collection = coll
+    try:
+        # room prefix: every search names its room, so MongoDB only scans that room's entries
+        await collection.create_index([("room", ASCENDING), ("content", TEXT)],
+                                      name="room_content_text", default_language="none")
+    except Exception as e:
+        logger.error("Could not create search index: %s", e)
+
+
+async def _stored(room, words, skip, limit, before_ms):
+    """Ranked matches from MongoDB's text index, older than what is in memory."""
+    query = {"room": room, "$text": {"$search": " ".join(words)}}
+    if before_ms is not None:
+        query["timestamp"] = {"$lt": history.from_ms(before_ms)}
+    projection = {**history.PROJECTION, "score": {"$meta": "textScore"}}
+    cursor = collection.find(query, projection).sort(
+        [("score", {"$meta": "textScore"}), ("timestamp", -1)]).skip(skip).limit(limit)
+    docs = await cursor.to_list(length=limit)
+    return [{"id": str(d["_id"]), "sender": d.get("sender"), "content": d.get("content", ""),
+             "timestamp": history.to_ms(d["timestamp"]), "score": round(d.get("score", 0.0), 3)} for d in docs]
+
+
+async def _hydrate(room, hits):
+    """Sender and content for in-memory hits: the history buffer first, then MongoDB."""
+    buf = history.BUFFERS.get(room)
+    known = {e[1]: e for e in buf.entries} if buf else {}
+    missing = [h for h in hits if h[2] not in known]
+    if missing and collection is not None:
+        # room and time span: index bounds for MongoDB, the blocks to read for the message log
+        query = {"room": room, "_id": {"$in": [h[2] for h in missing]},
+                 "timestamp": {"$gte": history.from_ms(min(h[1] for h in missing)),
+                               "$lte": history.from_ms(max(h[1] for h in missing))}}
+        try:
+            docs = await collection.find(query, history.PROJECTION).to_list(length=len(missing))
+        except Exception as e:
+            logger.error("Search hydrate failed for room %s: %s", room, e)
+            docs = []
+        for d in docs:
+            known[str(d["_id"])] = (history.to_ms(d["timestamp"]), str(d["_id"]), d.get("sender"), d.get("content", ""))
+    # A hit in neither place is still in the write-behind queue; it shows up a moment later
+    return [{"id": oid, "sender": known[oid][2], "content": known[oid][3], "timestamp": ms, "score": round(score, 3)}
+            for score, ms, oid in hits if oid in known]
+
+
+async def search(room, query, limit=20, offset=0):
+    """
+    One page of `room` messages matching `query`, best first: the in-memory
+    index for recent messages, MongoDB's text index for anything older.
+    Returns (results, offset of the next page or None).
+    """
+    limit = max(1, min(int(limit), MAX_HISTORY))
+    offset = max(0, min(int(offset), MAX_OFFSET))
+    words = sorted(tokenize(query))[:SEARCH_MAX_TERMS]
+    if not words:
+        return [], None
+    need = offset + limit + 1  # one extra says whether there is a next page
+    hits = rank(room, words, need)
+    results = await _hydrate(room, hits[offset:offset + limit])
+    more = len(hits) > offset + limit
+    if len(hits) < need and collection is not None:
+        room_index = INDEXES.get(room)
+        floor = room_index.floor_ms() if room_index else None
+        try:
+            stored = await _stored(room, words, max(0, offset - len(hits)), limit - len(results) + 1, floor)
+        except Exception as e:
+            logger.error("Search fallback failed for room %s: %s", room, e)
+            stored = []
+        more = len(stored) > limit - len(results)
+        results += stored[:limit - len(results)]
+    return results, (offset + limit if more else None)
+
+
+def page_payload(room, query, results, offset, next_offset):
+    return {"type": "search", "room": room, "query": query, "results": results,
+            "offset": offset, "next": next_offset}
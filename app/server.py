@@ -1,93 +1,151 @@
+import argparse
 import asyncio
-import json
 import logging
+import signal
 import websockets
-from websockets import WebSocketServerProtocol
-from app.config import PORT
-from app.logger import get_logger
+from time import perf_counter
+from pydantic import ValidationError
+from websockets.asyncio.server import ServerConnection
+from app.config import (
+    HOST, PORT, WORKERS, MIN_USERNAME_LENGTH, MAX_USERNAME_LENGTH, METRICS_HOST, METRICS_PORT,
+)
+from app.logger import get_logger, stats as log_stats
+from app.frames import encode, error_frame
+from app.protocol import REGISTER, RESUME, ProtocolError, decode, negotiate, parse
+from app import auth, overload, persistence, history, search, backplane, runtime, sessions, liveness, metrics, roomstore, shards
+from app.utils import rate_limited
+# Importing the handlers registers their commands in protocol.COMMANDS
 from app.handlers import (
     register_user,
     unregister_user,
-    handle_message,
-    handle_create_room,
-    handle_join_room,
-    handle_leave_room,
-    handle_list_rooms,
-    handle_list_users,
-    handle_history,
+    resume_rooms,
+    restore_rooms,
+    evict_idle,
+    deliver_remote,
+    apply_event,
+    load_snapshot,
+    MEMBERSHIP,
 )
 logger = get_logger()
 
+FRAMES_IN = metrics.Counter("chat_frames_in_total", "Frames received from registered clients.")
+PROTOCOL_ERRORS = metrics.Counter("chat_protocol_errors_total", "Frames refused by the protocol layer.")
+metrics.Collected("chat_log_records_dropped_total", "Log records not written (queue full or sampled out).",
+                  lambda: {("queue_full",): log_stats()["dropped_full"], ("sampled",): log_stats()["dropped_sampled"]},
+                  kind="counter", labelnames=["reason"])
+
+
+async def dispatch(websocket, username, message, encoding, remote_ip):
+    """One frame from a registered client: parse, rate limit, run its command."""
+    FRAMES_IN.inc()
+    try:
+        cmd, data = parse(message, encoding)
+        if cmd.rate_limited and rate_limited(username, remote_ip):
+            await websocket.send(error_frame("Rate limit exceeded, slow down."), text=True)
+            return
+        # Overloaded: list/history/search are throttled, then chat per room
+        busy = overload.refuse(cmd, data) if cmd.shed else None
+        if busy is not None:
+            await websocket.send(busy, text=True)
+            if cmd.shed == "room":
+                # Stop reading from this client for a while: what it keeps sending
+                # backs up in websockets' bounded queue and then in TCP, not here
+                await asyncio.sleep(overload.controller.retry_after)
+            return
+        # With LOOP_SHARDS > 1 room commands run on the room's home loop
+        await shards.call(shards.owner(cmd, data), run, cmd, username, data)
+
+    except ProtocolError as e:
+        PROTOCOL_ERRORS.inc()
+        await websocket.send(error_frame(str(e)), text=True)
+    except Exception as e:
+        logger.error("Error handling message from %s: %s", username, e, extra={"user": username})
+        await websocket.send(error_frame("Internal server error."), text=True)
+
+
+def process_request(connection, request):
+    """Before the upgrade: refuse new connections while overloaded, then check the token."""
+    return overload.admit(connection, request) or auth.process_request(connection, request)
+
+
+async def run(cmd, username, data):
+    """A command's handler, timed, on the loop that owns what it touches."""
+    started = perf_counter()
+    await cmd.handler(username, data)
+    cmd.latency.observe(perf_counter() - started)
 
-async def handler(websocket: websockets.WebSocketServerProtocol):
+
+async def handler(websocket: ServerConnection):
     # Handle new WebSocket connection
+    runtime.tune_socket(websocket)
+    # With AUTH_REQUIRED the handshake already checked the token and bound its user
+    identity = getattr(websocket, "username", None)
     try:
-        register_msg = await websocket.recv()
-        register_data = json.loads(register_msg)
-
-        # Ensure the first message is registration
-        if register_data.get("type") != "register" or "username" not in register_data:
-            await websocket.send(json.dumps({
-                "type": "error",
-                "message": "First message must be registration with a username."
-            }))
+        # decode=False: frames stay bytes, which the JSON/MessagePack decoders take directly
+        register_msg = await websocket.recv(decode=False)
+        started = perf_counter()
+        try:
+            register_data = decode(register_msg)
+            # Ensure the first message is registration (or resumes an earlier session)
+            if register_data.get("type") == "resume":
+                fields = RESUME.validate(register_data)
+                username = sessions.verify(fields["session"])
+                if username is None:
+                    raise ProtocolError("Session expired or invalid; register again.")
+            elif register_data.get("type") == "register":
+                fields = REGISTER.validate(register_data)
+                username = fields["username"].strip()
+            else:
+                raise ProtocolError("First message must be registration with a username.")
+            if identity is not None and username != identity:
+                raise ProtocolError("Token was issued to another user.")
+        except ProtocolError as e:
+            PROTOCOL_ERRORS.inc()
+            await websocket.send(error_frame(str(e)), text=True)
             return
 
-        username = register_data["username"].strip()
         if not username:
             # Username cannot be empty
-            await websocket.send(json.dumps({
-                "type": "error",
-                "message": "Username cannot be empty."
-            }))
+            await websocket.send(error_frame("Username cannot be empty."), text=True)
             return
 
         # Register user inside the try block
-        user = await register_user(username, websocket)
-        await websocket.send(json.dumps({
+        try:
+            user = await register_user(username, websocket)
+        except ValidationError:
+            await websocket.send(error_frame(
+                f"Username must be {MIN_USERNAME_LENGTH}-{MAX_USERNAME_LENGTH} characters."), text=True)
+            return
+        # Frames from this client may use MessagePack from now on if both sides support it
+        encoding = negotiate(fields["encoding"])
+        reply = {
             "type": "registered",
-            "data": user.model_dump(by_alias=True)  # <- Pydantic V2
-        }, default=str))  # <- handles datetime/ObjectId serialization
-        logger.info(f"User {username} connected.")
-
-        # Main message handling loop
-        async for message in websocket:
-            try:
-                data = json.loads(message)
-                msg_type = data.get("type")
-
-                # Dispatch based on message type
-                if msg_type == "message":
-                    await handle_message(username, data)
-                elif msg_type == "create_room":
-                    await handle_create_room(username, data)
-                elif msg_type == "join_room":
-                    await handle_join_room(username, data)
-                elif msg_type == "leave_room":
-                    await handle_leave_room(username, data)
-                elif msg_type == "list_rooms":
-                    await handle_list_rooms(username)
-                elif msg_type == "list_users":
-                    await handle_list_users(username)
-                elif msg_type == "history":
-                    await handle_history(username, data)
-                else:
-                    await websocket.send(json.dumps({
-                        "type": "error",
-                        "message": f"Unknown message type: {msg_type}"
-                    }))
-
-            except json.JSONDecodeError:
-                await websocket.send(json.dumps({
-                    "type": "error",
-                    "message": "Invalid JSON format."
-                }))
-            except Exception as e:
-                logger.error(f"Error handling message from {username}: {e}")
-                await websocket.send(json.dumps({
-                    "type": "error",
-                    "message": "Internal server error."
-                }))
+            "encoding": encoding,
+            # Present this in a "resume" frame after a reconnect; message frames
+            # carry ts and id, and "<ts>:<id>" is the per-room sequence to resume from
+            "session": sessions.issue(username),
+            "data": user.model_dump(by_alias=True, mode="json"),  # <- JSON-safe datetimes/ids, no default=str
+        }
+        replays = []
+        if register_data["type"] == "resume":
+            joined, errors, replays = await resume_rooms(username, fields["rooms"] or {})
+            reply.update(type="resumed", rooms=joined, errors=errors)
+        else:
+            # Back into the rooms this user had joined before disconnecting (or a restart)
+            joined, errors = await restore_rooms(username)
+            reply.update(rooms=joined, errors=errors)
+        await websocket.send(encode(reply), text=True)
+        for frame in replays:
+            await websocket.send(frame, text=True)
+        (RESUME if register_data["type"] == "resume" else REGISTER).latency.observe(perf_counter() - started)
+        logger.info("User %s connected.", username, extra={"user": username})
+        remote_ip = websocket.remote_address[0] if websocket.remote_address else None
+
+        # Main message handling loop: COMMANDS maps each type to its schema and handler
+        while True:
+            message = await websocket.recv(decode=False)
+            liveness.touch(websocket)
+            await dispatch(websocket, username, message, encoding, remote_ip)
 
     except websockets.ConnectionClosed:
         # Handle disconnection
@@ -95,19 +153,82 @@ async def handler(websocket: websockets.WebSocketServerProtocol):
     finally:
         # Unregister user on disconnect
         if 'username' in locals():
-            await unregister_user(username)
-            logger.info(f"User {username} disconnected.")
+            await unregister_user(username, websocket)
+            logger.info("User %s disconnected.", username, extra={"user": username})
 
 
-async def main():
-    logger.info(f"Starting server on port {PORT}")
-    # New websockets API does NOT pass 'path' to handler
-    async with websockets.serve(handler, "0.0.0.0", PORT):
-        await asyncio.Future()  # run forever
+async def serve_shard(shard):
+    """Top of a room shard's loop: accept its share of connections on the same port."""
+    await liveness.start_local(evict_idle)
+    await overload.start_local(shard.index)
+    try:
+        async with websockets.serve(handler, HOST, PORT, reuse_port=True, process_request=process_request,
+                                    **runtime.serve_kwargs()):
+            await shard.closing.wait()
+    finally:
+        await overload.stop_local()
+        await liveness.stop_local()
+
+
+async def main(reuse_port=False, node=None, metrics_port=METRICS_PORT):
+    logger.info("Starting server on %s:%s", HOST, PORT)
+    loop_name = "uvloop" if type(asyncio.get_running_loop()).__module__.startswith("uvloop") else "asyncio"
+    logger.info("Runtime: %s", runtime.describe(loop_name))
+    stop = asyncio.get_running_loop().create_future()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.cancel)
+    except NotImplementedError:
+        pass  # Windows: Ctrl+C still works
+    from app import db  # connects (or opens the log directory) on import
+    await db.start()
+    await persistence.start()
+    await history.start()
+    await search.start()
+    # Room names only; a room's Room object is built when someone joins it
+    await roomstore.start(MEMBERSHIP.catalog)
+    backplane.node = node or backplane.create()
+    load_snapshot(await backplane.node.start(deliver_remote, apply_event))
+    logger.info("Node %s joined %s", backplane.node.node_id, type(backplane.node).__name__)
+    await liveness.start(evict_idle)
+    await overload.start(MEMBERSHIP.members)
+    metrics_server = await metrics.serve(METRICS_HOST, metrics_port) if metrics_port else None
+    try:
+        # New websockets API does NOT pass 'path' to handler
+        # reuse_port lets several worker processes (and room shards) accept on the same port
+        reuse_port = reuse_port or shards.COUNT > 1
+        async with websockets.serve(handler, HOST, PORT, reuse_port=reuse_port or None,
+                                    process_request=process_request, **runtime.serve_kwargs()):
+            await shards.start(serve_shard)
+            logger.info("Accepting on %d event loop(s)", len(shards.SHARDS))
+            await stop  # run until SIGTERM / Ctrl+C
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await shards.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await overload.stop()
+        await liveness.stop()
+        await backplane.node.stop()
+        roomstore.stop()
+        # Flush buffered messages before exiting
+        await persistence.stop()
+        logger.info("Message writer drained")
+        await db.stop()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat WebSocket server")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="worker processes sharing the port via SO_REUSEPORT (default: %(default)s)")
+    args = parser.parse_args()
+    runtime.install_event_loop()
     try:
-        asyncio.run(main())
+        if args.workers > 1:
+            sessions.check_secret(shared=True)  # each worker signs, any may resume
+            from app.workers import supervise
+            supervise(args.workers)
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
@@ -0,0 +1,50 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from app.config import SESSION_SECRET, SESSION_TTL, WORKERS, BACKPLANE, PUBLIC_SECRETS
+
+
+def check_secret(shared, secret=SESSION_SECRET):
+    """Refuse to share sessions between processes under a public key: anyone could resume as anyone."""
+    if shared and secret in PUBLIC_SECRETS:
+        raise RuntimeError("SESSION_SECRET must be set to a secret of your own when other processes resume "
+                           "sessions (--workers > 1 or BACKPLANE=redis)")
+
+
+check_secret(WORKERS > 1 or BACKPLANE != "local")
+
+# A single process without a secret signs with a key nobody else knows (sessions end with it)
+_KEY = (hashlib.sha256(b"chat-session:" + SESSION_SECRET.encode()).digest()
+        if SESSION_SECRET not in PUBLIC_SECRETS else secrets.token_bytes(32))
+
+
+# ------------------------
+# Session tokens
+# ------------------------
+# "<base64url username>.<issued ms>.<base64url HMAC-SHA256>". Stateless, so a
+# client can resume on any node (or after a restart) that shares the secret.
+def _sign(payload):
+    digest = hmac.new(_KEY, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def issue(username, now=None):
+    ms = int((time.time() if now is None else now) * 1000)
+    payload = f"{base64.urlsafe_b64encode(username.encode()).decode()}.{ms}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify(token, now=None, ttl=SESSION_TTL):
+    """Username the token was issued to, or None if it is forged, malformed or expired."""
+    try:
+        name, ms, sig = token.split(".")
+        payload = f"{name}.{ms}"
+        if not hmac.compare_digest(sig.encode(), _sign(payload).encode()):  # bytes: any sig, ASCII or not
+            return None
+        if (time.time() if now is None else now) * 1000 - int(ms) > ttl * 1000:
+            return None
+        return base64.urlsafe_b64decode(name.encode()).decode()
+    except (ValueError, AttributeError):
+        return None
@@ -0,0 +1,212 @@
+import asyncio
+import sys
+import threading
+from collections import deque
+from app.config import LOOP_SHARDS
+from app.logger import get_logger
+from app.metrics import Collected
+
+logger = get_logger(__name__)
+
+STOP_TIMEOUT = 10.0  # seconds a shard gets to close its connections on shutdown
+
+
+# ------------------------
+# One event loop and its inbox
+# ------------------------
+class Shard:
+    """
+    An event loop that other threads hand work to. submit() appends to a
+    deque and wakes the loop (call_soon_threadsafe, one self-pipe write) only
+    when no wake-up is pending yet, so a burst of hand-offs costs one. Work
+    runs in submission order; a coroutine becomes a task on this loop.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.loop = None
+        self.inbox = deque()
+        self.armed = False
+        self.thread = None
+        self.closing = None  # asyncio.Event: set to make main(shard) return
+        self.done = threading.Event()
+        # Bumped from several threads without a lock: close enough for metrics
+        self.stats = {"handoffs": 0, "wakeups": 0}
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on this loop soon. Thread-safe, never blocks."""
+        self.inbox.append((fn, args))
+        self.stats["handoffs"] += 1
+        if not self.armed:
+            self.armed = True
+            self.stats["wakeups"] += 1
+            self.loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        # Disarm first: whatever is appended from now on schedules its own pass
+        self.armed = False
+        inbox = self.inbox
+        for _ in range(len(inbox)):
+            fn, args = inbox.popleft()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                logger.error("Shard %d: %s failed: %s", self.index, getattr(fn, "__qualname__", fn), e)
+                continue
+            if asyncio.iscoroutine(result):
+                self.loop.create_task(result).add_done_callback(self._report)
+
+    def _report(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Shard %d: task failed: %s", self.index, task.exception())
+
+    def start(self, main):
+        """Run `main(self)` on a new event loop in its own thread."""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(main, ready), name=f"chat-shard-{self.index}",
+                                       daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def _run(self, main, ready):
+        _local.shard = self
+        self.loop = asyncio.new_event_loop()  # uvloop's when its policy is installed
+        asyncio.set_event_loop(self.loop)
+        self.closing = asyncio.Event()
+        task = self.loop.create_task(main(self))
+        task.add_done_callback(self._finished)
+        ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _finished(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Shard %d stopped: %s", self.index, task.exception())
+        self.done.set()
+
+
+# ------------------------
+# Process-wide shards
+# ------------------------
+# MAIN is the loop server.main() runs on. Besides being a room shard like
+# the others, it owns everything process-wide: MongoDB, the backplane, the
+# history buffers and the search index. With LOOP_SHARDS=1 it is the only
+# shard and every call below runs inline.
+MAIN = Shard(0)
+SHARDS = [MAIN]
+COUNT = max(1, LOOP_SHARDS)
+
+_local = threading.local()
+
+Collected("chat_shard_handoffs_total", "Calls handed to another event loop's inbox.", kind="counter",
+          labelnames=["shard"], fn=lambda: {(str(s.index),): s.stats["handoffs"] for s in SHARDS})
+Collected("chat_shard_wakeups_total", "Times an event loop was woken for its inbox.", kind="counter",
+          labelnames=["shard"], fn=lambda: {(str(s.index),): s.stats["wakeups"] for s in SHARDS})
+
+
+def here():
+    """The shard whose loop runs in this thread."""
+    return getattr(_local, "shard", MAIN)
+
+
+def home(room):
+    """The shard that owns `room`: its members are only read and changed there."""
+    return SHARDS[hash(room) % len(SHARDS)]
+
+
+def owner(cmd, data):
+    """Where a command runs: per its `home` (see protocol.command), else on this connection's loop."""
+    if cmd.home == "room" and data.get("room"):
+        return home(data["room"])
+    if cmd.home == "main":
+        return MAIN
+    return here()
+
+
+def post(shard, fn, *args):
+    """fn(*args) on `shard`: called now if that is this loop, else queued there. Result not returned."""
+    if shard is here():
+        fn(*args)
+    else:
+        shard.submit(fn, *args)
+
+
+async def call(shard, fn, *args, wait=True):
+    """
+    Run fn(*args) on `shard` and return its result, awaiting it if it is a
+    coroutine; exceptions propagate. Inline when `shard` is this loop. From
+    another loop the call and its result both travel through inboxes;
+    wait=False only hands the call over and returns None.
+    """
+    if shard is here():
+        result = fn(*args)
+        return await result if asyncio.iscoroutine(result) else result
+    if not wait:
+        shard.submit(fn, *args)
+        return None
+    origin = here()
+    future = origin.loop.create_future()
+    shard.submit(_run_for, origin, future, fn, args)
+    return await future
+
+
+def _run_for(origin, future, fn, args):
+    # On the target loop: run, then send the outcome back through origin's inbox
+    try:
+        result = fn(*args)
+    except Exception as e:
+        origin.submit(_resolve, future, None, e)
+        return
+    if not asyncio.iscoroutine(result):
+        origin.submit(_resolve, future, result, None)
+        return
+    task = asyncio.ensure_future(result)
+    task.add_done_callback(lambda t: origin.submit(_resolve, future, t, None))
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return  # the caller was cancelled meanwhile
+    if isinstance(result, asyncio.Task):
+        if result.cancelled():
+            future.cancel()
+            return
+        error = result.exception()
+        result = None if error is not None else result.result()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def start(main, count=None):
+    """Bind MAIN to the running loop and start `count` - 1 more shards, each running main(shard)."""
+    count = COUNT if count is None else count
+    MAIN.loop = asyncio.get_running_loop()
+    if count > 1 and getattr(sys, "_is_gil_enabled", lambda: True)():
+        logger.warning("LOOP_SHARDS=%d with the GIL enabled: the loops take turns on one core "
+                       "(use --workers to use more cores)", count)
+    for index in range(1, count):
+        SHARDS.append(Shard(index).start(main))
+    return SHARDS
+
+
+async def stop(timeout=STOP_TIMEOUT):
+    """
+    Stop every shard but MAIN. All of them close their connections first,
+    while every loop still runs (a closing connection leaves its rooms on
+    their home loops), then the loops stop.
+    """
+    others = SHARDS[1:]
+    for shard in others:
+        shard.loop.call_soon_threadsafe(shard.closing.set)
+    for shard in others:
+        if not await asyncio.to_thread(shard.done.wait, timeout):
+            logger.error("Shard %d did not close in %ss", shard.index, timeout)
+    for shard in others:
+        shard.loop.call_soon_threadsafe(shard.loop.stop)
+        await asyncio.to_thread(shard.thread.join, timeout)
+    del SHARDS[1:]
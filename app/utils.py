@@ -1,24 +1,84 @@
-import asyncio
-from datetime import datetime
-from typing import Dict, List
-from .config import RATE_LIMIT, RATE_LIMIT_WINDOW
+import threading
+import time
+from collections import OrderedDict
+from .config import RATE_LIMIT, RATE_LIMIT_WINDOW, RATE_LIMIT_PER_IP, RATE_LIMIT_MAX_KEYS
+from .metrics import Collected
+
+
+# ------------------------
+# Token bucket rate limiter
+# ------------------------
+class RateLimiter:
+    """
+    Token bucket per key: `limit` tokens, refilled evenly over `window` seconds.
+
+    Each key costs one [tokens, last_seen] pair in a plain dict. Buckets live in
+    two generations: every `window` seconds the current generation becomes the
+    previous one and the old previous one is dropped. A key untouched for a
+    whole window has a full bucket again, so dropping it loses nothing, and
+    memory stays bounded by the keys seen in the last two windows. With loop
+    shards every loop's connections check the same limiter, so a lock
+    makes each check (and a rotation) one step.
+    """
+
+    def __init__(self, limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW,
+                 max_keys=RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.capacity = float(limit)
+        self.rate = limit / window  # tokens per second
+        self.window = window
+        self.max_keys = max_keys
+        self.clock = clock
+        self.current = {}   # key -> [tokens, last_seen]
+        self.previous = {}
+        self.rotated_at = clock()
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self, key, cost=1.0):
+        """Take `cost` tokens (one by default) for `key`; False if the bucket holds fewer."""
+        with self.lock:
+            now = self.clock()
+            if now - self.rotated_at >= self.window or len(self.current) >= self.max_keys:
+                self._rotate(now)
+            bucket = self.current.get(key)
+            if bucket is None:
+                bucket = self.previous.pop(key, None)
+                if bucket is None and cost <= self.capacity:
+                    self.current[key] = [self.capacity - cost, now]
+                    return True
+                bucket = self.current[key] = bucket or [self.capacity, now]
+            tokens = bucket[0] + (now - bucket[1]) * self.rate
+            if tokens > self.capacity:
+                tokens = self.capacity
+            bucket[1] = now
+            if tokens < cost:
+                bucket[0] = tokens
+                self.rejected += 1
+                return False
+            bucket[0] = tokens - cost
+            return True
+
+    def _rotate(self, now):
+        # Hitting max_keys rotates early; evicted keys just start with a full bucket
+        self.previous = self.current
+        self.current = {}
+        self.rotated_at = now
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
+# Limits applied to chat messages
+user_limiter = RateLimiter(RATE_LIMIT, RATE_LIMIT_WINDOW)
+ip_limiter = RateLimiter(RATE_LIMIT_PER_IP, RATE_LIMIT_WINDOW)
+
+Collected("chat_rate_limited_total", "Messages refused by the rate limiter.", kind="counter",
+          labelnames=["scope"], fn=lambda: {("ip",): ip_limiter.rejected, ("user",): user_limiter.rejected})
 
-lock = asyncio.Lock()
-# In-memory store for rate limiting
-user_message_times: Dict[str, List[datetime]] = defaultdict(list)
 
 # Function to check if a user is rate limited
-async def rate_limited(username: str) -> bool:
-    async with lock:
-        return _check_rate_limit(username)
-
-    now = datetime.utcnow()
-    time = user_message_times[username]
-    # prune
-    times = [t for t in times if (now - t).total_seconds() < RATE_LIMIT_WINDOW]
-    user_message_times[username] = times
-    # check
-    if len(times) >= RATE_LIMIT:
+def rate_limited(username: str, ip: str = None) -> bool:
+    # Per-IP first so one address can't dodge the limit with many usernames
+    if ip is not None and not ip_limiter.allow(ip):
         return True
-    time.append(now)
-    return False
+    return not user_limiter.allow(username)
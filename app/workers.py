@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing
+import signal
+import time
+from app.config import NODE_ID, IPC_SOCKET, PERSIST_DRAIN_TIMEOUT, METRICS_PORT
+from app.backplane import IpcHub
+from app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Fresh interpreters: forking a process with a running event loop isn't safe
+_SPAWN = multiprocessing.get_context("spawn")
+
+MIN_BACKOFF = 0.5     # seconds before restarting a crashed worker
+MAX_BACKOFF = 30.0    # cap for workers that keep crashing right after start
+STABLE_AFTER = 10.0   # uptime after which a crash resets the backoff
+STOP_TIMEOUT = PERSIST_DRAIN_TIMEOUT + 5
+
+
+def run_worker(index, node_id):
+    """Entry point of one worker process."""
+    # Ctrl+C reaches the whole process group; only the supervisor acts on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from app import server, backplane, runtime
+    runtime.install_event_loop()
+    node = backplane.IpcBackplane(IPC_SOCKET, node_id=node_id)
+    try:
+        # One /metrics endpoint per worker: a shared port would answer for a random one
+        metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+        asyncio.run(server.main(reuse_port=True, node=node, metrics_port=metrics_port))
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor:
+    """
+    Runs N server workers that share the listening port through SO_REUSEPORT
+    (the kernel spreads new connections across them) and the IPC hub they use
+    to deliver rooms across workers. Crashed workers are restarted with
+    exponential backoff; SIGTERM/SIGINT stops every worker, letting each one
+    close its connections and drain its message writer first.
+    """
+
+    def __init__(self, workers):
+        self.count = workers
+        self.slots = {}  # index -> {"proc", "started", "backoff", "restart_at"}
+        self.stopping = None
+
+    def _spawn(self, index):
+        slot = self.slots.setdefault(index, {"backoff": MIN_BACKOFF})
+        proc = _SPAWN.Process(target=run_worker, args=(index, f"{NODE_ID}-w{index}"), name=f"chat-worker-{index}")
+        proc.start()
+        slot.update(proc=proc, started=time.monotonic(), restart_at=None)
+        logger.info("Worker %d started (pid %d)", index, proc.pid)
+
+    def _check(self):
+        now = time.monotonic()
+        for index, slot in self.slots.items():
+            proc = slot["proc"]
+            if slot["restart_at"] is None and not proc.is_alive():
+                uptime = now - slot["started"]
+                slot["backoff"] = MIN_BACKOFF if uptime > STABLE_AFTER else min(slot["backoff"] * 2, MAX_BACKOFF)
+                slot["restart_at"] = now + slot["backoff"]
+                logger.warning("Worker %d (pid %d) exited with %s after %.1fs; restarting in %.1fs",
+                               index, proc.pid, proc.exitcode, uptime, slot["backoff"])
+            elif slot["restart_at"] is not None and now >= slot["restart_at"]:
+                self._spawn(index)
+
+    async def run(self):
+        hub = await IpcHub(IPC_SOCKET).start()
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stopping.set)
+        for index in range(self.count):
+            self._spawn(index)
+        logger.info("Supervisor running %d workers", self.count)
+        while not self.stopping.is_set():
+            self._check()
+            try:
+                await asyncio.wait_for(self.stopping.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+        await self._shutdown()
+        await hub.stop()
+
+    async def _shutdown(self):
+        logger.info("Stopping workers")
+        procs = [s["proc"] for s in self.slots.values() if s["proc"].is_alive()]
+        for proc in procs:
+            proc.terminate()  # SIGTERM: worker drains, then exits
+        for proc in procs:
+            await asyncio.to_thread(proc.join, STOP_TIMEOUT)
+            if proc.is_alive():
+                logger.error("Worker pid %d did not drain in %ss; killing it", proc.pid, STOP_TIMEOUT)
+                proc.kill()
+                await asyncio.to_thread(proc.join)
+
+
+def supervise(workers):
+    asyncio.run(Supervisor(workers).run())
@@ -0,0 +1,3 @@
+# bench/__init__.py
+# Package marker for the benchmark scripts.
+# Run them as modules from the project root, e.g. `python -m bench.bench_frames`.
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+bench/bench_auth.py
+
+Handshakes per second with token auth: no auth, cold token cache, warm token cache, rejected.
+
+First times the token check alone: auth.verify() (HMAC-SHA256 and two JSON
+parses) against a hit in the verified-token cache. Then starts
+`python -m app.server` (in-memory Mongo stand-in) and opens --connections
+connections, --concurrency at a time, each doing the full handshake and a
+register round trip before closing:
+
+  no auth     AUTH_REQUIRED=0, the plain register frame
+  cold cache  AUTH_REQUIRED=1, a token the server has not seen (verified)
+  warm cache  the same tokens again, as in a reconnect storm (cache hits)
+  rejected    AUTH_REQUIRED=1 and no token: refused with a 401 before the upgrade
+
+How to run:
+    python -m bench.bench_auth [--connections 5000] [--concurrency 100]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+from time import perf_counter
+import websockets
+
+# The server refuses AUTH_REQUIRED without a secret of its own; server_env() passes this one on
+os.environ.setdefault("AUTH_SECRET", secrets.token_hex(16))
+from app import auth  # noqa: E402
+from bench.bench_backplane import server_env  # noqa: E402
+
+PORT = 9600
+
+
+def time_checks(n):
+    token = auth.issue("alice")
+    started = perf_counter()
+    for _ in range(n):
+        auth.verify(token)
+    verify_s = (perf_counter() - started) / n
+    cache = auth.TokenCache()
+    cache.authenticate(token)
+    started = perf_counter()
+    for _ in range(n):
+        cache.authenticate(token)
+    return verify_s, (perf_counter() - started) / n
+
+
+async def handshake(uri, username, token):
+    headers = {"Authorization": f"Bearer {token}"} if token else None
+    try:
+        async with websockets.connect(uri, additional_headers=headers, open_timeout=30) as ws:
+            await ws.send(json.dumps({"type": "register", "username": username}))
+            return json.loads(await ws.recv())["type"] == "registered"
+    except websockets.InvalidStatus:
+        return False
+
+
+async def storm(args, tokens):
+    """Every handshake once, --concurrency at a time: (handshakes/s, p50 ms, p99 ms, accepted)."""
+    uri = f"ws://127.0.0.1:{PORT}"
+    limit = asyncio.Semaphore(args.concurrency)
+    latencies, accepted = [], 0
+
+    async def one(i):
+        nonlocal accepted
+        async with limit:
+            started = perf_counter()
+            ok = await handshake(uri, f"user{i}", tokens[i] if tokens else None)
+            latencies.append(perf_counter() - started)
+            accepted += ok
+
+    started = perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.connections)))
+    elapsed = perf_counter() - started
+    latencies.sort()
+    return (args.connections / elapsed, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, accepted)
+
+
+async def wait_up(timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{PORT}"):
+                return
+        except websockets.InvalidStatus:
+            return  # up, and refusing us
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"server on port {PORT} did not start")
+
+
+async def rounds(args):
+    tokens = [auth.issue(f"user{i}") for i in range(args.connections)]
+    for required, plan in (("0", [("no auth", None)]),
+                           ("1", [("cold cache", tokens), ("warm cache", tokens), ("rejected", None)])):
+        proc = subprocess.Popen([sys.executable, "-m", "app.server"],
+                                env=server_env(PORT, {"AUTH_REQUIRED": required, "METRICS_PORT": "0"}),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            await wait_up()
+            for name, use in plan:
+                rate, p50, p99, accepted = await storm(args, use)
+                print(f"{name:>12} {rate:>12,.0f} {p50:>8.1f} {p99:>8.1f} {accepted:>9,}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--checks", type=int, default=100_000, help="iterations for the in-process timing")
+    args = parser.parse_args()
+    verify_s, cached_s = time_checks(args.checks)
+    print(f"token check: verify {verify_s * 1e6:.2f} us, cache hit {cached_s * 1e6:.2f} us "
+          f"({verify_s / cached_s:.0f}x)")
+    print(f"{'handshakes':>12} {'per sec':>12} {'p50 ms':>8} {'p99 ms':>8} {'accepted':>9}")
+    asyncio.run(rounds(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+bench/bench_backplane.py
+
+Multi-process scale-out benchmark: message throughput as server nodes are added.
+
+For each node count N it starts N `python -m app.server` processes sharing a
+backplane, plus one client process per node. Every client process opens
+--clients connections to its node, all of them join the same --rooms rooms
+(so every room spans every node), and each connection sends as fast as the
+server accepts for --seconds. It prints sent and delivered messages per
+second; near-linear growth with N means the backplane isn't the bottleneck.
+
+Needs a Redis server for the default backplane (REDIS_URL, default
+redis://localhost:6379/0) and enough cores for N servers + N clients.
+MongoDB is replaced by the in-memory stand-in (MONGO_URI=memory://).
+
+How to run:
+    python -m bench.bench_backplane [--nodes 1,2,4] [--clients 50] [--rooms 10] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import secrets
+import subprocess
+import sys
+import time
+import websockets
+
+BASE_PORT = 9100
+
+
+BENCH_SECRET = secrets.token_hex(16)
+
+
+def server_env(port, extra):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "MONGO_URI": "memory://",
+        # Measure the backplane, not the rate limiter or room limits
+        "RATE_LIMIT": "1000000000",
+        "RATE_LIMIT_PER_IP": "1000000000",
+        "MAX_USERS_PER_ROOM": "1000000000",
+        # Workers and nodes resume each other's sessions, so they need one shared secret
+        "SESSION_SECRET": BENCH_SECRET,
+    })
+    env.update(extra)
+    return env
+
+
+def start_nodes(count, extra):
+    procs = []
+    for i in range(count):
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "app.server"],
+            env=server_env(BASE_PORT + i, {**extra, "NODE_ID": f"bench-{i}"}),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ))
+    return procs
+
+
+async def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            ws = await websockets.connect(f"ws://127.0.0.1:{port}")
+            await ws.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def client_worker(port, index, clients, rooms, seconds, result):
+    uri = f"ws://127.0.0.1:{port}"
+    counts = {"sent": 0, "received": 0}
+    conns = []
+    for c in range(clients):
+        ws = await websockets.connect(uri, max_queue=None)
+        await ws.send(json.dumps({"type": "register", "username": f"n{index}c{c}"}))
+        await ws.recv()
+        room = f"room{c % rooms}"
+        await ws.send(json.dumps({"type": "create_room", "room": room}))
+        await ws.send(json.dumps({"type": "join_room", "room": room}))
+        conns.append((ws, room))
+    # Give membership events time to reach every node
+    await asyncio.sleep(1.0)
+    deadline = time.monotonic() + seconds
+
+    async def sender(ws, room):
+        payload = json.dumps({"type": "message", "room": room, "message": "x" * 64})
+        while time.monotonic() < deadline:
+            await ws.send(payload)
+            counts["sent"] += 1
+            await asyncio.sleep(0)
+
+    async def receiver(ws):
+        try:
+            async for raw in ws:
+                if time.monotonic() >= deadline:
+                    return
+                if raw.startswith('{"type":"message"'):
+                    counts["received"] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    tasks = [asyncio.create_task(sender(ws, room)) for ws, room in conns]
+    tasks += [asyncio.create_task(receiver(ws)) for ws, _ in conns]
+    await asyncio.wait(tasks, timeout=seconds + 2)
+    for t in tasks:
+        t.cancel()
+    for ws, _ in conns:
+        await ws.close()
+    result.put(counts)
+
+
+def run_client(port, index, clients, rooms, seconds, result):
+    asyncio.run(client_worker(port, index, clients, rooms, seconds, result))
+
+
+def run_round(nodes, args, extra):
+    procs = start_nodes(nodes, extra)
+    try:
+        for i in range(nodes):
+            asyncio.run(wait_for_port(BASE_PORT + i))
+        result = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=run_client,
+                                    args=(BASE_PORT + i, i, args.clients, args.rooms, args.seconds, result))
+            for i in range(nodes)
+        ]
+        for c in clients:
+            c.start()
+        totals = {"sent": 0, "received": 0}
+        for _ in clients:
+            counts = result.get(timeout=args.seconds + 60)
+            for k in totals:
+                totals[k] += counts[k]
+        for c in clients:
+            c.join()
+        return totals
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--nodes", default="1,2,4")
+    parser.add_argument("--clients", type=int, default=50, help="connections per node")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--backplane", default="redis")
+    args = parser.parse_args()
+    extra = {"BACKPLANE": args.backplane}
+    print(f"{'nodes':>5} {'sent/s':>12} {'delivered/s':>14} {'delivered/s/node':>18}")
+    for nodes in [int(n) for n in args.nodes.split(",")]:
+        totals = run_round(nodes, args, extra)
+        sent = totals["sent"] / args.seconds
+        delivered = totals["received"] / args.seconds
+        print(f"{nodes:>5} {sent:>12,.0f} {delivered:>14,.0f} {delivered / nodes:>18,.0f}")
+
+
+if __name__ == "__main__":
+    main()
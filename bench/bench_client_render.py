@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+bench/bench_client_render.py
+
+How far client/cli.py's receive loop falls behind a busy room: print per line vs Renderer.
+
+Feeds --frames chat message frames to recv_loop() at --rate per second,
+as a socket would deliver them, while the output goes to a sink whose
+writes block --write-us plus --byte-ns per byte, like a terminal that has
+to redraw. Reports how long the loop took to get through them and how
+late the last frame was handled (the backlog the server would be
+buffering, and eventually dropping or disconnecting for):
+- print:  one write + flush per line (CLIENT_RENDER_FPS=0, like print() on a tty)
+- render: lines coalesced into one write per frame at --fps
+
+How to run:
+    python -m bench.bench_client_render [--frames 50000] [--rate 20000] [--write-us 50]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from time import perf_counter
+from client import cli
+
+
+class SlowSink:
+    """A stream whose writes block like a terminal redrawing."""
+
+    def __init__(self, write_us, byte_ns):
+        self.write_s = write_us / 1e6
+        self.byte_s = byte_ns / 1e9
+        self.writes = 0
+
+    def write(self, text):
+        time.sleep(self.write_s + len(text) * self.byte_s)
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+class FeedSocket:
+    """Yields frames at `rate` per second from the moment iteration starts."""
+
+    def __init__(self, frames, rate):
+        self.frames = frames
+        self.rate = rate
+        self.worst_lag = 0.0
+
+    async def __aiter__(self):
+        start = perf_counter()
+        for i, frame in enumerate(self.frames):
+            due = start + i / self.rate
+            now = perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                self.worst_lag = max(self.worst_lag, now - due)
+                if i % 100 == 0:
+                    await asyncio.sleep(0)
+            yield frame
+
+    async def send(self, frame):
+        pass
+
+
+async def run(mode, args, frames):
+    sink = SlowSink(args.write_us, args.byte_ns)
+    cli.RENDER = cli.Renderer(sink, fps=args.fps if mode == "render" else 0, scrollback=args.scrollback)
+    cli.SEEN.clear()
+    cli.RENDER.start()
+    ws = FeedSocket(frames, args.rate)
+    started = perf_counter()
+    await cli.recv_loop(ws)
+    await cli.RENDER.stop()
+    return {"seconds": perf_counter() - started, "lag": ws.worst_lag, "writes": sink.writes,
+            "skipped": cli.RENDER.stats["skipped"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--frames", type=int, default=50_000)
+    parser.add_argument("--rate", type=float, default=20_000, help="frames per second arriving")
+    parser.add_argument("--write-us", type=float, default=50, help="µs each write to the sink blocks")
+    parser.add_argument("--byte-ns", type=float, default=5, help="extra ns per byte written")
+    parser.add_argument("--fps", type=float, default=cli.RENDER_FPS)
+    parser.add_argument("--scrollback", type=int, default=cli.SCROLLBACK)
+    args = parser.parse_args()
+    frames = [json.dumps({"type": "message", "data": {
+        "id": f"m{i}", "room": "busy", "sender": f"user{i % 50}", "content": f"message number {i} " + "x" * 40,
+        "ts": 1_700_000_000_000 + i}}) for i in range(args.frames)]
+    ideal = args.frames / args.rate
+    print(f"frames={args.frames} at {args.rate:,.0f}/s (ideal {ideal:.2f}s), "
+          f"sink {args.write_us:g}µs/write + {args.byte_ns:g}ns/byte, fps={args.fps:g}")
+    print(f"{'':>7} {'seconds':>8} {'frames/s':>10} {'max lag s':>10} {'writes':>8} {'skipped':>8}")
+    for mode in ("print", "render"):
+        r = asyncio.run(run(mode, args, frames))
+        print(f"{mode:>7} {r['seconds']:>8.2f} {args.frames / r['seconds']:>10,.0f} {r['lag']:>10.3f} "
+              f"{r['writes']:>8,} {r['skipped']:>8,}")
+
+
+if __name__ == "__main__":
+    main()
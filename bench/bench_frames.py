@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+bench/bench_frames.py
+
+Micro-benchmark for room fan-out CPU cost per message as the room grows.
+
+Compares:
+- per_recipient: the old path (f-string + `await ws.send()` for every member)
+- queued:        serialize once, push through the per-connection Outbound queues
+- broadcast:     serialize once, websockets.broadcast() to idle connections
+
+Sockets are real websockets Connection objects writing into a transport that
+discards bytes, so framing cost is measured but no kernel I/O is involved.
+
+How to run:
+    python -m bench.bench_frames [--sizes 1,10,100,1000,5000] [--messages 200]
+"""
+
+import argparse
+import asyncio
+import time
+from websockets.asyncio.connection import Connection
+from websockets.protocol import OPEN
+from websockets.server import ServerProtocol
+from app import frames
+from app.broadcast import Outbound, fanout
+
+
+class NullTransport(asyncio.Transport):
+    """Transport that swallows writes and never applies flow control."""
+
+    def __init__(self):
+        super().__init__()
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def can_write_eof(self):
+        return False
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+def open_connection():
+    conn = Connection(ServerProtocol(), ping_interval=None)
+    conn.connection_made(NullTransport())
+    conn.protocol.state = OPEN
+    return conn
+
+
+async def per_recipient(conns, outbounds, messages):
+    for i in range(messages):
+        for ws in conns:
+            await ws.send(f"alice@room: message {i}")
+
+
+async def queued(conns, outbounds, messages):
+    direct = Outbound.can_write_direct
+    Outbound.can_write_direct = lambda self: False  # force the queue path
+    try:
+        for i in range(messages):
+            await fanout(frames.message_frame("room", "alice", f"message {i}"), outbounds)
+            await asyncio.sleep(0)  # let the writer tasks drain
+    finally:
+        Outbound.can_write_direct = direct
+
+
+async def broadcast(conns, outbounds, messages):
+    for i in range(messages):
+        await fanout(frames.message_frame("room", "alice", f"message {i}"), outbounds)
+
+
+async def run(sizes, messages):
+    print(f"json backend: {frames.BACKEND}")
+    print(f"{'members':>8} {'per_recipient':>16} {'queued':>16} {'broadcast':>16}   (µs CPU per message)")
+    for size in sizes:
+        conns = [open_connection() for _ in range(size)]
+        outbounds = [Outbound(ws, maxsize=messages + 1).start() for ws in conns]
+        row = []
+        for strategy in (per_recipient, queued, broadcast):
+            start = time.process_time()
+            await strategy(conns, outbounds, messages)
+            row.append((time.process_time() - start) / messages * 1e6)
+        print(f"{size:>8} " + " ".join(f"{v:>16.1f}" for v in row))
+        for o in outbounds:
+            await o.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--sizes", default="1,10,100,1000,5000")
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+    asyncio.run(run(sizes, args.messages))
+
+
+if __name__ == "__main__":
+    main()
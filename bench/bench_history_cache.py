@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+bench/bench_history_cache.py
+
+History requests, messages fetched and time to first render of a heavy user's /history, with and without the client cache.
+
+Starts `python -m app.server` (in-memory Mongo stand-in). A poster fills
+--rooms rooms with --messages messages each; then a heavy user connects
+--sessions times (a restarted or reconnecting client), runs /history
+--repeat times on every room per session, and disconnects, while the
+poster adds --new messages per room between sessions. Without the cache
+each /history asks the server for the newest page; with it
+(client/history_cache.py, a fresh file) the cached page renders at once
+and only what came after is fetched. "First render" is the time until
+there is something to show: the reply, or the cached rows.
+
+How to run:
+    python -m bench.bench_history_cache [--rooms 20] [--messages 200] [--sessions 5] [--new 10]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import websockets
+from bench.bench_backplane import server_env, wait_for_port
+from client.history_cache import PAGE, HistoryCache
+
+PORT = 9720
+
+
+async def post(ws, rooms, count, sent):
+    """Send `count` messages to each room and wait until they have all come back."""
+    for room in rooms:
+        for _ in range(count):
+            sent[0] += 1
+            await ws.send(json.dumps({"type": "message", "room": room, "message": f"message {sent[0]}"}))
+    echoed = 0
+    while echoed < count * len(rooms):
+        if json.loads(await ws.recv()).get("type") == "message":
+            echoed += 1
+
+
+async def session(args, rooms, cache, wire):
+    """One connection of the heavy user; returns its first-render times in seconds."""
+    firsts = []
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}", max_queue=None) as ws:
+        await ws.send(json.dumps({"type": "register", "username": "heavy"}))
+        await ws.recv()
+        for room in rooms:
+            await ws.send(json.dumps({"type": "join_room", "room": room}))
+
+        async def reply():
+            while True:
+                raw = await ws.recv()
+                data = json.loads(raw)
+                if data.get("type") == "history":
+                    wire["bytes"] += len(raw)
+                    return data
+                if data.get("type") == "message" and cache is not None:
+                    d = data["data"]
+                    cache.add(d["room"], d["id"], d["ts"], d["sender"], d["content"])
+
+        for _ in range(args.repeat):
+            for room in rooms:
+                started = time.perf_counter()
+                if cache is None:
+                    wire["requests"] += 1
+                    await ws.send(json.dumps({"type": "history", "room": room, "limit": PAGE}))
+                    wire["fetched"] += len((await reply())["messages"])
+                    firsts.append(time.perf_counter() - started)
+                    continue
+                cached, payload = cache.history(room)
+                if cached:
+                    firsts.append(time.perf_counter() - started)
+                while payload is not None:
+                    wire["requests"] += 1
+                    await ws.send(json.dumps(payload))
+                    data = await reply()
+                    wire["fetched"] += len(data["messages"])
+                    if not cached:
+                        firsts.append(time.perf_counter() - started)
+                        cached = True
+                    _, payload = cache.on_page(data, joined=True)
+    if cache is not None:
+        cache.disconnected()
+    return firsts
+
+
+async def run(args, cached):
+    rooms = [f"hist{i}" for i in range(args.rooms)]
+    wire = {"requests": 0, "fetched": 0, "bytes": 0}
+    firsts, sent = [], [0]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = HistoryCache(os.path.join(directory, "cache.sqlite3")) if cached else None
+        proc = subprocess.Popen([sys.executable, "-m", "app.server"],
+                                env=server_env(PORT, {"LOG_LEVEL": "ERROR", "MAX_ROOMS_PER_USER": "1000",
+                                                     "OVERLOAD_ENABLED": "0"}),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            await wait_for_port(PORT)
+            async with websockets.connect(f"ws://127.0.0.1:{PORT}", max_queue=None) as poster:
+                await poster.send(json.dumps({"type": "register", "username": "poster"}))
+                await poster.recv()
+                for room in rooms:
+                    await poster.send(json.dumps({"type": "create_room", "room": room}))
+                    await poster.send(json.dumps({"type": "join_room", "room": room}))
+                await post(poster, rooms, args.messages, sent)
+                for _ in range(args.sessions):
+                    firsts += await session(args, rooms, cache, wire)
+                    await post(poster, rooms, args.new, sent)
+        finally:
+            proc.terminate()
+            proc.wait()
+            if cache is not None:
+                cache.close()
+    firsts.sort()
+    return wire, firsts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200, help="messages per room before the first session")
+    parser.add_argument("--sessions", type=int, default=5, help="connections of the heavy user")
+    parser.add_argument("--new", type=int, default=10, help="messages per room between sessions")
+    parser.add_argument("--repeat", type=int, default=2, help="/history per room per session")
+    args = parser.parse_args()
+    print(f"rooms={args.rooms} messages={args.messages} sessions={args.sessions} new={args.new} "
+          f"repeat={args.repeat} page={PAGE}")
+    print(f"{'':>8} {'requests':>9} {'fetched':>9} {'KB in':>9} {'first render p50 ms':>20} {'p99':>8}")
+    for cached in (False, True):
+        wire, firsts = asyncio.run(run(args, cached))
+        p50, p99 = firsts[len(firsts) // 2] * 1000, firsts[int(len(firsts) * 0.99)] * 1000
+        print(f"{'cache' if cached else 'no cache':>8} {wire['requests']:>9,} {wire['fetched']:>9,} "
+              f"{wire['bytes'] / 1e3:>9,.0f} {p50:>20.2f} {p99:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
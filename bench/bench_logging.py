@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+bench/bench_logging.py
+
+Event loop latency while logging bursts into a slow sink: old vs app.logger.
+
+Every --interval ms a burst of --burst connect/disconnect log lines is
+written; the sink sleeps --sink-ms per write, like a stdout pipe nobody
+is draining fast enough. A probe task sleeps 1 ms in a loop and records how
+late it wakes up, which is what every client on the loop feels.
+- sync:   the previous get_logger (StreamHandler on the loop thread, f-strings)
+- queue:  app.logger pipeline with sampling off (only the writer thread waits)
+- sample: app.logger pipeline as configured by default (LOG_SAMPLE_BURST)
+
+How to run:
+    python -m bench.bench_logging [--seconds 3] [--burst 500] [--sink-ms 0.2]
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from time import perf_counter
+from app import logger as log
+
+
+class SlowSink:
+    """A stream whose writes block like a full pipe."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+
+    def flush(self):
+        pass
+
+
+def sync_logger(sink):
+    # What app.logger.get_logger used to build
+    logger = logging.getLogger("bench.sync")
+    logger.handlers.clear()
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(log.TEXT_FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+async def run(mode, args):
+    sink = SlowSink(args.sink_ms / 1000)
+    if mode == "sync":
+        logger = sync_logger(sink)
+    else:
+        log.configure(sink, fmt="json", sample_burst=0 if mode == "queue" else log.LOG_SAMPLE_BURST)
+        logger = log.get_logger(f"bench.{mode}")
+    dropped_before = log.stats()
+    lags = []
+    stop = perf_counter() + args.seconds
+
+    async def probe():
+        while perf_counter() < stop:
+            t = perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(perf_counter() - t - 0.001)
+
+    async def bursts():
+        attempted = 0
+        while perf_counter() < stop:
+            for i in range(args.burst):
+                username = f"user{attempted + i}"
+                if mode == "sync":
+                    logger.info(f"User {username} connected.")
+                else:
+                    logger.info("User %s connected.", username, extra={"user": username})
+            attempted += args.burst
+            await asyncio.sleep(args.interval / 1000)
+        return attempted
+
+    _, attempted = await asyncio.gather(probe(), bursts())
+    if mode != "sync":
+        log.shutdown()  # let the writer finish so `written` is complete
+    after = log.stats()
+    lags.sort()
+    return {
+        "attempted": attempted,
+        "written": sink.lines,
+        "dropped": (after["dropped_full"] - dropped_before["dropped_full"])
+                   + (after["dropped_sampled"] - dropped_before["dropped_sampled"]),
+        "p50": lags[len(lags) // 2] * 1000,
+        "p99": lags[int(len(lags) * 0.99)] * 1000,
+        "max": lags[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--burst", type=int, default=500, help="log lines per burst")
+    parser.add_argument("--interval", type=float, default=50, help="ms between bursts")
+    parser.add_argument("--sink-ms", type=float, default=0.2, help="ms each write to the sink blocks")
+    args = parser.parse_args()
+    print(f"burst={args.burst} every {args.interval:g}ms for {args.seconds:g}s, sink {args.sink_ms:g}ms/write")
+    print(f"{'':>7} {'attempted':>10} {'written':>8} {'dropped':>8} {'lag p50 ms':>11} {'p99 ms':>8} {'max ms':>8}")
+    for mode in ("sync", "queue", "sample"):
+        r = asyncio.run(run(mode, args))
+        print(f"{mode:>7} {r['attempted']:>10,} {r['written']:>8,} {r['dropped']:>8,} "
+              f"{r['p50']:>11.2f} {r['p99']:>8.2f} {r['max']:>8.2f}")
+    log.configure(sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+bench/bench_membership.py
+
+Connect/disconnect churn with many rooms: full room scan vs app.membership.
+
+Creates --rooms rooms, then repeatedly connects a user, joins it to
+--rooms-per-user random rooms and disconnects it. `scan` is the previous
+unregister_user (walk every room, discard the user where present);
+`index` leaves only the user's rooms (Membership.rooms_of), as
+unregister_user does.
+
+How to run:
+    python -m bench.bench_membership [--rooms 100000] [--churn 2000] [--rooms-per-user 5]
+"""
+
+import argparse
+import random
+import time
+from app.membership import Membership
+
+
+def scan(names, picks):
+    room_members = {name: set() for name in names}
+    join = leave = 0.0
+    for i, chosen in enumerate(picks):
+        user = f"u{i}"
+        start = time.perf_counter()
+        for name in chosen:
+            room_members[name].add(user)
+        join += time.perf_counter() - start
+        start = time.perf_counter()
+        for name, members in room_members.items():
+            if user in members:
+                members.discard(user)
+        leave += time.perf_counter() - start
+    return join, leave
+
+
+def index(names, picks):
+    m = Membership(max_rooms_per_user=len(picks[0]), max_users_per_room=len(picks) + 1)
+    for name in names:
+        m.create(name, "owner", enforce=False)
+    join = leave = 0.0
+    for i, chosen in enumerate(picks):
+        user = f"u{i}"
+        start = time.perf_counter()
+        for name in chosen:
+            m.join(name, user)
+        join += time.perf_counter() - start
+        start = time.perf_counter()
+        for name in list(m.rooms_of(user)):
+            m.leave(name, user)
+        leave += time.perf_counter() - start
+    return join, leave
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--rooms", type=int, default=100_000)
+    parser.add_argument("--churn", type=int, default=2000, help="connect/disconnect cycles")
+    parser.add_argument("--rooms-per-user", type=int, default=5)
+    args = parser.parse_args()
+    names = [f"room{i}" for i in range(args.rooms)]
+    rng = random.Random(1)
+    picks = [rng.sample(names, args.rooms_per_user) for _ in range(args.churn)]
+    print(f"rooms={args.rooms} churn={args.churn} rooms_per_user={args.rooms_per_user}")
+    print(f"{'':>6} {'join µs':>10} {'disconnect µs':>14} {'cycles/s':>10}")
+    for name, strategy in (("scan", scan), ("index", index)):
+        join, leave = strategy(names, picks)
+        per_join = join / (args.churn * args.rooms_per_user) * 1e6
+        per_leave = leave / args.churn * 1e6
+        print(f"{name:>6} {per_join:>10.2f} {per_leave:>14.2f} {args.churn / (join + leave):>10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+bench/bench_messages.py
+
+Cost of building one chat message: Pydantic Message vs MessageRecord.
+
+For each representation it times the hot path (build the message, take its
+id and ms timestamp for the frame and history) and the persistence step
+(turn it into the MongoDB document), counts allocations per message with
+tracemalloc, and reports how much of one core 100k messages/sec would need.
+
+How to run:
+    python -m bench.bench_messages [--messages 100000]
+"""
+
+import argparse
+import time
+import tracemalloc
+from app import history
+from app.models import Message, MessageRecord
+from app.persistence import _to_document
+
+USER_ID = "60d5f483f8d2e3b1c8e4b8a1"
+
+
+def pydantic_message(i):
+    msg = Message(user_id=USER_ID, room="room", sender="alice", content="hello")
+    return msg, msg.id, history.to_ms(msg.timestamp)
+
+
+def message_record(i):
+    msg = MessageRecord(USER_ID, "room", "alice", "hello")
+    return msg, msg.id, msg.ms
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    for i in items:
+        fn(i)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def allocations(build, count):
+    """(blocks, bytes) allocated per message while building and keeping `count` messages."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [build(i)[0] for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    del kept
+    return blocks / count, size / count
+
+
+def run(messages):
+    rate = 100_000
+    print(f"{'':>18} {'build µs':>9} {'+ doc µs':>9} {'blocks/msg':>11} {'bytes/msg':>10} {'core @100k/s':>13}")
+    for name, build in (("pydantic Message", pydantic_message), ("MessageRecord", message_record)):
+        items = range(messages)
+        build_us = timed(build, items)
+        built = [build(i)[0] for i in items]
+        doc_us = timed(_to_document, built)
+        del built
+        blocks, size = allocations(build, min(messages, 20_000))
+        share = (build_us + doc_us) * rate / 1e6
+        print(f"{name:>18} {build_us:>9.2f} {doc_us:>9.2f} {blocks:>11.1f} {size:>10.0f} {share:>12.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--messages", type=int, default=100_000)
+    args = parser.parse_args()
+    run(args.messages)
+
+
+if __name__ == "__main__":
+    main()
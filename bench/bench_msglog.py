@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+bench/bench_msglog.py
+
+Append throughput and history page latency of the embedded message log (MONGO_URI=log://).
+
+Appends --messages messages (MessageRecord documents, --rooms rooms) in
+insert_many batches of --batch from --writers concurrent writers, the way
+the write-behind MessageWriter calls it, once with group-committed fsync
+and once with fsync off; then reads --pages history pages through
+history._query: the newest page of a random room, and a page before a
+random cursor deep in the room. With --mongo-uri the same runs against
+MongoDB through motor (skipped with a note when it is not reachable).
+
+How to run:
+    python -m bench.bench_msglog [--messages 200000] [--rooms 20] [--batch 500] [--writers 4] [--mongo-uri mongodb://localhost:27017]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+from time import perf_counter
+from bson import ObjectId
+from app import history
+from app.msglog import MessageLog
+
+BASE_MS = 1_700_000_000_000
+
+
+def documents(args):
+    rng = random.Random(1)
+    words = ["hello", "there", "deploy", "lunch", "ok", "thanks", "review", "later", "bug", "ship"]
+    for i in range(args.messages):
+        yield {"_id": str(ObjectId()), "user_id": str(ObjectId()), "room": f"room{i % args.rooms}",
+               "sender": f"user{rng.randrange(1000)}", "content": " ".join(rng.choices(words, k=8)),
+               "timestamp": history.from_ms(BASE_MS + i), "is_read": False}
+
+
+async def append(coll, args):
+    docs = list(documents(args))
+    batches = [docs[i:i + args.batch] for i in range(0, len(docs), args.batch)]
+
+    async def writer(mine):
+        for batch in mine:
+            await coll.insert_many(batch, ordered=False)
+
+    started = perf_counter()
+    await asyncio.gather(*(writer(batches[w::args.writers]) for w in range(args.writers)))
+    return len(docs) / (perf_counter() - started)
+
+
+def percentiles(samples):
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+
+async def pages(coll, args):
+    history.collection = coll
+    rng = random.Random(2)
+    per_room = args.messages // args.rooms
+    newest, deep = [], []
+    for _ in range(args.pages):
+        room = rng.randrange(args.rooms)
+        started = perf_counter()
+        await history._query(f"room{room}", args.page)
+        newest.append(perf_counter() - started)
+        # A cursor somewhere in the room's past: ms of its k-th message
+        k = rng.randrange(args.page, per_room)
+        started = perf_counter()
+        got = await history._query(f"room{room}", args.page, before=(BASE_MS + k * args.rooms + room, "f" * 24))
+        deep.append(perf_counter() - started)
+        assert len(got) == args.page, len(got)
+    return percentiles(newest), percentiles(deep)
+
+
+def report(name, rate, newest, deep):
+    print(f"{name:>22} {rate:>12,.0f} {newest[0]:>9.2f} {newest[1]:>9.2f} {deep[0]:>9.2f} {deep[1]:>9.2f}")
+
+
+async def run_log(args, fsync_interval, directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    log = MessageLog(directory, fsync_interval=fsync_interval, maintenance_interval=0)
+    rate = await append(log, args)
+    commits = log.stats["commits"]
+    newest, deep = await pages(log, args)
+    size = sum(s.size for r in log.rooms.values() for s in r.segments)
+    await log.close()
+    return rate, newest, deep, commits, size
+
+
+async def run_mongo(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(args.mongo_uri, serverSelectionTimeoutMS=2000)
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"{'motor':>22}  skipped: {args.mongo_uri} not reachable ({type(e).__name__})")
+        return
+    coll = client["bench_msglog"]["messages"]
+    await coll.drop()
+    await coll.create_index([("room", 1), ("timestamp", 1), ("_id", 1)], name="room_timestamp")
+    rate = await append(coll, args)
+    newest, deep = await pages(coll, args)
+    report("motor", rate, newest, deep)
+    await client.drop_database("bench_msglog")
+
+
+async def main(args):
+    print(f"messages={args.messages:,} rooms={args.rooms} batch={args.batch} writers={args.writers} "
+          f"page={args.page} pages={args.pages}")
+    print(f"{'store':>22} {'appends/s':>12} {'new p50':>9} {'new p99':>9} {'deep p50':>9} {'deep p99':>9}  (ms)")
+    directory = args.dir or tempfile.mkdtemp(prefix="bench_msglog")
+    try:
+        for name, interval in ((f"log, group fsync {args.fsync_interval * 1000:g}ms", args.fsync_interval),
+                               ("log, no fsync", -1)):
+            rate, newest, deep, commits, size = await run_log(args, interval, os.path.join(directory, "messages"))
+            report(name, rate, newest, deep)
+            if interval >= 0:
+                batches = -(-args.messages // args.batch)
+                print(f"{'':>22} {batches:,} batches shared {commits:,} fsync passes, "
+                      f"{size / args.messages:.0f} B/message on disk")
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+    if args.mongo_uri:
+        await run_mongo(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=500, help="messages per insert_many")
+    parser.add_argument("--writers", type=int, default=4, help="concurrent insert_many callers")
+    parser.add_argument("--fsync-interval", type=float, default=0.005, help="group commit window, seconds")
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--dir", help="where to write the log (default: a temporary directory)")
+    parser.add_argument("--mongo-uri", help="also run against this MongoDB")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+bench/bench_overload.py
+
+Soak past capacity: latency of the conversations already admitted while a storm of new clients hits the server.
+
+Starts `python -m app.server` (in-memory Mongo stand-in) once with
+OVERLOAD_ENABLED=0 and once with it on. --residents clients connect
+first, in rooms of --room-size, and each sends --resident-rate messages
+per second for the whole run; every message they get back from their own
+room is one latency sample. After --warmup seconds --storm-procs processes
+start the storm for --seconds: --storm clients each keep reconnecting,
+joining one big room and sending --storm-rate messages per second to it,
+plus list_users and history every --expensive-every messages. Every
+message fans out to the whole storm room, which is far past what one
+core delivers. Residents' messages that never come back count as
+infinitely late. Reports the residents' p50/p99/max before and during
+the storm, and what the storm got through: handshakes accepted and
+refused, refusals it saw, and the highest chat_overload_level and the
+shed counters on /metrics.
+
+How to run:
+    python -m bench.bench_overload [--residents 200] [--storm 400] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import subprocess
+import sys
+import time
+import websockets
+from bench.bench_backplane import server_env, wait_for_port
+
+PORT = 9700
+METRICS = PORT + 1000
+
+
+async def residents(args, storm_at, stop_at):
+    """Resident clients until `stop_at`: latency samples (seconds) before and during the storm."""
+    uri = f"ws://127.0.0.1:{PORT}"
+    before, during, counts = [], [], {"sent": 0, "sent_during": 0, "errors": 0}
+    per_second = {}  # second of the storm a message was sent in -> [sent, latencies]
+    conns = []
+    for i in range(args.residents):
+        ws = await websockets.connect(uri, max_queue=None)
+        await ws.send(json.dumps({"type": "register", "username": f"res{i}"}))
+        await ws.recv()
+        room = f"home{i // args.room_size}"
+        await ws.send(json.dumps({"type": "create_room", "room": room}))
+        await ws.send(json.dumps({"type": "join_room", "room": room}))
+        conns.append((ws, f"res{i}", room))
+
+    async def sender(ws, room):
+        interval = 1 / args.resident_rate
+        await asyncio.sleep(interval * (hash(room) % 100) / 100)
+        while time.monotonic() < stop_at:
+            now = time.monotonic()
+            await ws.send(json.dumps({"type": "message", "room": room, "message": repr(now)}))
+            counts["sent"] += 1
+            if now >= storm_at:
+                counts["sent_during"] += 1
+                per_second.setdefault(int(now - storm_at), [0, []])[0] += 1
+            await asyncio.sleep(interval)
+
+    async def receiver(ws, username):
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                if msg.get("type") == "message" and msg["data"]["sender"] == username:
+                    sent = float(msg["data"]["content"])
+                    latency = time.monotonic() - sent
+                    if sent >= storm_at:
+                        during.append(latency)
+                        per_second.setdefault(int(sent - storm_at), [0, []])[1].append(latency)
+                    else:
+                        before.append(latency)
+                elif msg.get("type") == "error":
+                    counts["errors"] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    tasks = [asyncio.create_task(sender(ws, room)) for ws, _, room in conns]
+    tasks += [asyncio.create_task(receiver(ws, username)) for ws, username, _ in conns]
+    await asyncio.sleep(max(0.0, stop_at - time.monotonic()) + 2.0)  # and the stragglers
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws, _, _ in conns), return_exceptions=True)
+    counts["per_second"] = per_second
+    return before, during, counts
+
+
+async def storm_proc(index, args, until, result):
+    """One storm process: --storm / --storm-procs clients hammering until `until`."""
+    uri = f"ws://127.0.0.1:{PORT}"
+    counts = {"accepted": 0, "refused": 0, "failed": 0, "sent": 0, "busy": 0, "room_busy": 0}
+
+    async def drain(ws):
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                if msg.get("type") == "error":
+                    counts["room_busy" if msg["message"].startswith("Room") else "busy"] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def client(c):
+        while time.monotonic() < until:
+            try:
+                async with websockets.connect(uri, max_queue=None, open_timeout=10) as ws:
+                    await ws.send(json.dumps({"type": "register", "username": f"storm{index}x{c}"}))
+                    await ws.recv()
+                    counts["accepted"] += 1
+                    reader = asyncio.create_task(drain(ws))
+                    await ws.send(json.dumps({"type": "create_room", "room": "storm"}))
+                    await ws.send(json.dumps({"type": "join_room", "room": "storm"}))
+                    n = 0
+                    while time.monotonic() < until:
+                        n += 1
+                        if n % args.expensive_every == 0:
+                            await ws.send(json.dumps({"type": "list_users"}))
+                            await ws.send(json.dumps({"type": "history", "room": "storm"}))
+                        await ws.send(json.dumps({"type": "message", "room": "storm", "message": "x" * 64}))
+                        counts["sent"] += 1
+                        await asyncio.sleep(1 / args.storm_rate)
+                    reader.cancel()
+            except websockets.InvalidStatus:
+                counts["refused"] += 1
+                await asyncio.sleep(0.05)  # a storm doesn't honour Retry-After
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                counts["failed"] += 1
+                await asyncio.sleep(0.05)
+
+    await asyncio.gather(*(client(c) for c in range(args.storm // args.storm_procs)))
+    result.put(counts)
+
+
+def run_storm(*args):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.run(storm_proc(*args))
+
+
+async def scrape_levels(stop_at):
+    """Highest chat_overload_level on /metrics until `stop_at`, and the last shed counters."""
+    highest, shed = 0, {}
+    while time.monotonic() < stop_at:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", METRICS)
+            writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+            body = (await reader.read()).decode()
+            writer.close()
+            for line in body.splitlines():
+                if line.startswith("chat_overload_level "):
+                    highest = max(highest, int(float(line.split()[1])))
+                elif line.startswith("chat_overload_shed_total{"):
+                    shed[line.split('"')[1]] = int(float(line.split()[1]))
+        except OSError:
+            pass
+        await asyncio.sleep(0.25)
+    return highest, shed
+
+
+def percentiles(samples, sent=0):
+    """p50, p99, max in ms; messages sent but never back count as infinitely late."""
+    samples = sorted(samples) + [float("inf")] * max(0, sent - len(samples))
+    if not samples:
+        return float("nan"), float("nan"), float("nan")
+    return (samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000, samples[-1] * 1000)
+
+
+async def soak(args, enabled):
+    proc = subprocess.Popen([sys.executable, "-m", "app.server"],
+                            env=server_env(PORT, {"OVERLOAD_ENABLED": enabled, "METRICS_PORT": str(METRICS),
+                                                  "LOG_LEVEL": "ERROR"}),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_port(PORT)
+        started = time.monotonic()
+        storm_at = started + args.warmup + args.residents / 500  # after the residents have connected
+        stop_at = storm_at + args.seconds
+        # Started from a running event loop: spawn, don't fork its state
+        context = multiprocessing.get_context("spawn")
+        result = context.Queue()
+        storm = [context.Process(target=run_storm, args=(i, args, stop_at, result))
+                 for i in range(args.storm_procs)]
+
+        async def start_storm():
+            await asyncio.sleep(max(0.0, storm_at - time.monotonic()))
+            for p in storm:
+                p.start()
+
+        (before, during, counts), (highest, shed), _ = await asyncio.gather(
+            residents(args, storm_at, stop_at), scrape_levels(stop_at + 1.0), start_storm())
+        totals = {}
+        for _ in storm:
+            for k, v in (await asyncio.to_thread(result.get, True, 30)).items():
+                totals[k] = totals.get(k, 0) + v
+        for p in storm:
+            p.join()
+        return before, during, counts, totals, highest, shed
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--residents", type=int, default=200)
+    parser.add_argument("--room-size", type=int, default=5)
+    parser.add_argument("--resident-rate", type=float, default=2.0, help="messages per second per resident")
+    parser.add_argument("--storm", type=int, default=400, help="storm clients, all processes together")
+    parser.add_argument("--storm-procs", type=int, default=2)
+    parser.add_argument("--storm-rate", type=float, default=10.0, help="messages per second per storm client")
+    parser.add_argument("--expensive-every", type=int, default=20, help="storm messages per list_users+history")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of residents alone")
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds of storm")
+    parser.add_argument("--series", action="store_true", help="residents' latency per second of the storm")
+    args = parser.parse_args()
+    print(f"residents={args.residents} ({args.resident_rate:g} msg/s each, rooms of {args.room_size}) "
+          f"storm={args.storm} clients ({args.storm_rate:g} msg/s each) for {args.seconds:g}s")
+    print(f"{'overload':>9} {'before p50/p99 ms':>18} {'during p50':>11} {'p99':>8} {'max':>8} "
+          f"{'level':>6} {'accepted':>9} {'refused':>8} {'busy':>7} {'room busy':>10} {'storm sent':>11}")
+    for enabled in ("0", "1"):
+        before, during, counts, storm, highest, shed = asyncio.run(soak(args, enabled))
+        b50, b99, _ = percentiles(before)
+        d50, d99, dmax = percentiles(during, counts["sent_during"])
+        print(f"{'on' if enabled == '1' else 'off':>9} {b50:>8.1f}/{b99:<9.1f} {d50:>11.1f} {d99:>8.1f} {dmax:>8.0f} "
+              f"{highest:>6} {storm.get('accepted', 0):>9,} {storm.get('refused', 0):>8,} {storm.get('busy', 0):>7,} "
+              f"{storm.get('room_busy', 0):>10,} {storm.get('sent', 0):>11,}")
+        print(f"{'':>9} residents: {len(during):,} of {counts['sent_during']:,} messages sent during the storm "
+              f"came back ({len(during) / max(1, counts['sent_during']):.0%}), {counts['errors']} errors; "
+              f"server shed {shed or '-'}")
+        if args.series:
+            for second, (sent, latencies) in sorted(counts["per_second"].items()):
+                p50, p99, _ = percentiles(latencies, sent)
+                print(f"{'':>9} second {second:>3}: {len(latencies):>5,}/{sent:<5,} back, p50 {p50:>8.1f} p99 {p99:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
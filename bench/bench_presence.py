@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+bench/bench_presence.py
+
+Bytes on the wire and server CPU of keeping --subscribers clients' user lists current while --users users churn.
+
+In process, no sockets: the "send" only counts bytes. Runs --seconds of
+simulated time in which --churn users per second go offline or come back
+online (and leave or rejoin their room), and compares three ways for the
+subscribers to follow that:
+
+  poll        the old list_users: each subscriber asks again every --poll
+              seconds and gets the whole list as one repr string
+  per event   a frame to every subscriber for each change
+  deltas      app/presence.py: one user_delta per PRESENCE_WINDOW with the
+              net changes, encoded once
+
+Then a mass disconnect (--storm users drop at once, e.g. a node dies):
+frames per subscriber, and the cost of one list request, the old full
+dump against one JSON page.
+
+How to run:
+    python -m bench.bench_presence [--users 10000] [--subscribers 100] [--churn 500] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from app.config import PRESENCE_WINDOW, PRESENCE_PAGE_SIZE
+from app.frames import encode
+from app.membership import Membership
+from app.presence import ONLINE, Presence
+
+
+class World:
+    """ONLINE and MEMBERSHIP as the main loop has them, with a Presence watching."""
+
+    def __init__(self, args):
+        self.online = {}
+        self.membership = Membership(max_rooms_per_user=10, max_users_per_room=args.users)
+        self.wire = {"frames": 0, "bytes": 0}
+        self.presence = Presence(self.online, self.membership, self.send, window=3600)  # flushed by hand
+        self.rooms = [f"room{i}" for i in range(args.rooms)]
+        for i in range(args.users):
+            self.up(f"user{i}")
+
+    def send(self, username, frame):
+        self.wire["frames"] += 1
+        self.wire["bytes"] += len(frame)
+
+    def up(self, user):
+        self.online[user] = "local"
+        room = self.rooms[hash(user) % len(self.rooms)]
+        self.membership.create(room, user)
+        return [{"op": "online", "user": user}, {"op": "join", "user": user, "room": room}]
+
+    def down(self, user):
+        del self.online[user]
+        rooms = [name for name in list(self.membership.rooms_of(user)) if self.membership.leave(name, user)]
+        return [{"op": "offline", "user": user, "rooms": rooms}]
+
+
+def churn(world, args, rng):
+    """Per window: the events of --churn flips per second."""
+    users = [f"user{i}" for i in range(args.users)]
+    per_window = max(1, int(args.churn * PRESENCE_WINDOW))
+    for _ in range(int(args.seconds / PRESENCE_WINDOW)):
+        events = []
+        for user in rng.sample(users, per_window):
+            events += world.down(user) if user in world.online else world.up(user)
+        yield events
+
+
+def run_poll(args):
+    world, rng = World(args), random.Random(1)
+    polls_per_window = PRESENCE_WINDOW / args.poll
+    due = 0.0
+    started = time.process_time()
+    for events in churn(world, args, rng):
+        due += polls_per_window
+        while due >= 1:
+            due -= 1
+            for _ in range(args.subscribers):
+                world.send(None, f"Users: {list(world.online.keys())}")
+    return time.process_time() - started, world.wire
+
+
+def run_per_event(args):
+    world, rng = World(args), random.Random(1)
+    started = time.process_time()
+    for events in churn(world, args, rng):
+        for event in events:
+            if event["op"] in ("online", "offline"):
+                frame = encode({"type": "user_delta", "room": None,
+                                "added": [event["user"]] if event["op"] == "online" else [],
+                                "removed": [event["user"]] if event["op"] == "offline" else []})
+                for s in range(args.subscribers):
+                    world.send(s, frame)
+    return time.process_time() - started, world.wire
+
+
+async def run_deltas(args):
+    world, rng = World(args), random.Random(1)
+    for s in range(args.subscribers):
+        world.presence.subscribe(f"watcher{s}", ONLINE)
+    started = time.process_time()
+    for events in churn(world, args, rng):
+        for event in events:
+            world.presence.note(event)
+        world.presence.flush()
+    return time.process_time() - started, world.wire
+
+
+async def run_storm(args):
+    """Frames per subscriber when --storm users drop within one window."""
+    world = World(args)
+    for s in range(args.subscribers):
+        world.presence.subscribe(f"watcher{s}", ONLINE)
+    started = time.process_time()
+    for i in range(args.storm):
+        for event in world.down(f"user{i}"):
+            world.presence.note(event)
+    world.presence.flush()
+    return time.process_time() - started, world.wire
+
+
+def time_lists(args, n=200):
+    """One list request: the old repr dump of everyone against one JSON page."""
+    world = World(args)
+    started = time.process_time()
+    for _ in range(n):
+        dump = f"Users: {list(world.online.keys())}".encode()
+    dump_s = (time.process_time() - started) / n
+    world.presence.users_page()  # the first page sorts; later ones are kept in step
+    started = time.process_time()
+    for _ in range(n):
+        page = encode(world.presence.users_page(after="user5", limit=PRESENCE_PAGE_SIZE))
+    return dump_s, len(dump), (time.process_time() - started) / n, len(page)
+
+
+def report(name, cpu, wire, args):
+    print(f"{name:>10} {wire['frames']:>12,} {wire['bytes'] / 1e6:>12,.1f} "
+          f"{wire['bytes'] / args.seconds / 1e6:>10,.2f} {cpu * 1000:>10,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--churn", type=int, default=500, help="users going offline or online per second")
+    parser.add_argument("--seconds", type=float, default=10.0, help="simulated time")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between polls (old way)")
+    parser.add_argument("--storm", type=int, default=5000, help="users dropping at once")
+    args = parser.parse_args()
+    print(f"users={args.users:,} subscribers={args.subscribers} churn={args.churn}/s seconds={args.seconds:g} "
+          f"window={PRESENCE_WINDOW * 1000:g}ms poll={args.poll:g}s")
+    print(f"{'':>10} {'frames':>12} {'MB total':>12} {'MB/s':>10} {'cpu ms':>10}")
+    report("poll", *run_poll(args), args)
+    report("per event", *run_per_event(args), args)
+    report("deltas", *asyncio.run(run_deltas(args)), args)
+    cpu, wire = asyncio.run(run_storm(args))
+    print(f"mass disconnect of {args.storm:,}: {wire['frames'] / args.subscribers:.0f} frame per subscriber "
+          f"({wire['bytes'] / args.subscribers / 1e3:,.1f} KB), {cpu * 1000:.0f} ms cpu; "
+          f"per event would be {args.storm:,} frames per subscriber")
+    dump_s, dump_bytes, page_s, page_bytes = time_lists(args)
+    print(f"one list request: full dump {dump_bytes / 1e3:,.0f} KB in {dump_s * 1000:.2f} ms, "
+          f"page of {PRESENCE_PAGE_SIZE} {page_bytes / 1e3:,.1f} KB in {page_s * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+bench/bench_profiles.py
+
+Runs the same load against each server runtime profile (SERVER_PROFILE in app/config.py).
+
+Each profile gets a fresh server and the bench_workers load: --clients
+connections over --rooms rooms sending --rate messages/sec each. Reports
+throughput, p50/p99/p999 latency and peak server RSS so settings can be
+picked from data. Extra KEY=VALUE pairs are passed to every server, e.g.
+USE_UVLOOP=off to compare event loops.
+
+How to run:
+    python -m bench.bench_profiles [--profiles default,latency,throughput,lowmem] [--seconds 10] [USE_UVLOOP=off ...]
+"""
+
+import argparse
+import json
+import os
+from app.config import PROFILES
+from bench.bench_workers import run_round
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=400)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=5, help="messages/sec per connection, 0 = unthrottled")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1), help="client processes")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per profile")
+    parser.add_argument("env", nargs="*", help="KEY=VALUE overrides for every server")
+    args = parser.parse_args()
+    overrides = dict(kv.split("=", 1) for kv in args.env)
+
+    if not args.json:
+        print(f"{'profile':>10} {'sent/s':>10} {'delivered/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'rss MB':>8}")
+    for profile in args.profiles.split(","):
+        row = run_round(args.workers, args, {"SERVER_PROFILE": profile, **overrides})
+        row["profile"] = profile
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{profile:>10} {row['sent_per_sec']:>10,.0f} {row['delivered_per_sec']:>12,.0f} "
+                  f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['p999_ms']:>8.1f} {row['peak_rss_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
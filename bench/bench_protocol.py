@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+bench/bench_protocol.py
+
+Parse + dispatch cost per message type: the old if/elif loop vs app.protocol.
+
+Compares:
+- if_elif:  the previous server loop (websockets decodes the text frame to str,
+            frames.loads, compare msg_type against every branch)
+- json:     protocol.parse() on the raw bytes (size check, JSON_BACKEND decode,
+            schema validation), then the registry lookup
+- msgpack:  the same with a MessagePack frame (skipped if msgpack is missing)
+
+Handlers are not run; the chosen one is only looked up, so this measures the
+protocol layer alone.
+
+How to run:
+    python -m bench.bench_protocol [--iterations 200000]
+    JSON_BACKEND=json python -m bench.bench_protocol   # without orjson
+"""
+
+import argparse
+import json
+import time
+from app import frames, protocol
+import app.handlers  # noqa: F401  registers the commands
+
+SAMPLES = {
+    "message": {"type": "message", "room": "lobby", "message": "hello there, how is everyone doing today?"},
+    "join_room": {"type": "join_room", "room": "lobby"},
+    "history": {"type": "history", "room": "lobby", "limit": 50, "before": "1700000000000:65a1b2c3d4e5f60718293a4b"},
+    "list_rooms": {"type": "list_rooms"},
+}
+
+OLD_TYPES = ("message", "create_room", "join_room", "leave_room", "list_rooms", "list_users", "history")
+
+
+def if_elif(raw, encoding):
+    data = frames.loads(raw.decode())
+    msg_type = data.get("type")
+    for t in OLD_TYPES:  # one string comparison per branch, like the old chain
+        if msg_type == t:
+            return t, data
+    return None, data
+
+
+def registry(raw, encoding):
+    cmd, data = protocol.parse(raw, encoding)
+    return cmd.handler, data
+
+
+def timed(fn, raw, encoding, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(raw, encoding)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run(iterations):
+    print(f"json backend: {frames.BACKEND}, msgpack: {'yes' if protocol.msgpack else 'no'}")
+    print(f"{'type':>12} {'if_elif':>10} {'json':>10} {'msgpack':>10}   (µs per frame)")
+    for name, obj in SAMPLES.items():
+        raw_json = json.dumps(obj).encode()
+        row = [timed(if_elif, raw_json, "json", iterations), timed(registry, raw_json, "json", iterations)]
+        if protocol.msgpack is not None:
+            row.append(timed(registry, protocol.msgpack.packb(obj), "msgpack", iterations))
+        print(f"{name:>12} " + " ".join(f"{v:>10.2f}" for v in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+    run(args.iterations)
+
+
+if __name__ == "__main__":
+    main()
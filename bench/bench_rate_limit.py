@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+bench/bench_rate_limit.py
+
+Checks per second for app.utils.RateLimiter with many distinct keys.
+
+How to run:
+    python -m bench.bench_rate_limit [--keys 100000] [--checks 2000000]
+"""
+
+import argparse
+import random
+import time
+from app.utils import RateLimiter
+
+
+def run(keys, checks):
+    names = [f"user{i}" for i in range(keys)]
+    # Random key order so the OrderedDict keeps reshuffling like real traffic
+    order = [random.choice(names) for _ in range(checks)]
+    limiter = RateLimiter(limit=5, window=10)
+    allow = limiter.allow
+    start = time.perf_counter()
+    for key in order:
+        allow(key)
+    elapsed = time.perf_counter() - start
+    print(f"keys={keys} checks={checks} elapsed={elapsed:.2f}s "
+          f"rate={checks / elapsed:,.0f} checks/s "
+          f"per_check={elapsed / checks * 1e9:.0f} ns "
+          f"tracked_keys={len(limiter)} rejected={limiter.rejected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--checks", type=int, default=2_000_000)
+    args = parser.parse_args()
+    run(args.keys, args.checks)
+
+
+if __name__ == "__main__":
+    main()
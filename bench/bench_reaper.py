@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+bench/bench_reaper.py
+
+Idle tracking for many connections: one asyncio timer per socket vs app.liveness.
+
+Arms --connections idle timers, then replays --frames inbound frames spread
+over random connections and finally expires everyone.
+- timers: loop.call_later per connection, cancelled and re-armed on every
+          inbound frame (the usual per-socket approach)
+- wheel:  liveness.Reaper; a frame only stamps the time, the timer wheel
+          rechecks a connection when its bucket comes up
+
+Reports memory for the armed timers, cost per inbound frame and the time to
+find and evict every connection once they all went idle.
+
+How to run:
+    python -m bench.bench_reaper [--connections 50000] [--frames 500000]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from app.liveness import Reaper
+
+IDLE_TIMEOUT = 90.0
+
+
+class Conn:
+    __slots__ = ("timer", "__weakref__")
+
+
+class Out:
+    # Stand-in for broadcast.Outbound: pings are only counted
+    __slots__ = ("pings",)
+
+    def __init__(self):
+        self.pings = 0
+
+    def offer(self, frame):
+        self.pings += 1
+
+
+async def timers(conns, order):
+    loop = asyncio.get_running_loop()
+    evicted = []
+    tracemalloc.start()
+    for c in conns:
+        c.timer = loop.call_later(IDLE_TIMEOUT, evicted.append, c)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for c in order:
+        c.timer.cancel()
+        c.timer = loop.call_later(IDLE_TIMEOUT, evicted.append, c)
+    per_frame = time.perf_counter() - start
+    # Expire everything: run the loop's timer heap as if IDLE_TIMEOUT had passed
+    start = time.perf_counter()
+    for c in conns:
+        c.timer._run()
+        c.timer.cancel()
+    expire = time.perf_counter() - start
+    assert len(evicted) == len(conns)
+    return memory, per_frame, expire
+
+
+async def wheel(conns, order):
+    clock = [0.0]
+    r = Reaper(None, heartbeat=30, idle_timeout=IDLE_TIMEOUT, tick=1.0,
+               batch=len(conns), clock=lambda: clock[0])
+    names = [f"u{i}" for i in range(len(conns))]
+    outs = [Out() for _ in conns]
+    tracemalloc.start()
+    for c, name, out in zip(conns, names, outs):
+        r.add(c, name, out)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for c in order:
+        r.touch(c)
+    per_frame = time.perf_counter() - start
+    start = time.perf_counter()
+    evicted = 0
+    while clock[0] <= IDLE_TIMEOUT + 2:
+        clock[0] += 1.0
+        evicted += len(r.check())
+    expire = time.perf_counter() - start
+    assert evicted == len(conns)
+    return memory, per_frame, expire
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--connections", type=int, default=50_000)
+    parser.add_argument("--frames", type=int, default=500_000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+    print(f"connections={args.connections} frames={args.frames}")
+    print(f"{'':>7} {'timer KB':>10} {'µs/frame':>10} {'expire ms':>10}")
+    for name, strategy in (("timers", timers), ("wheel", wheel)):
+        conns = [Conn() for _ in range(args.connections)]
+        order = [rng.choice(conns) for _ in range(args.frames)]
+        memory, per_frame, expire = asyncio.run(strategy(conns, order))
+        print(f"{name:>7} {memory / 1024:>10,.0f} {per_frame / args.frames * 1e6:>10.3f} {expire * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+bench/bench_reconnect.py
+
+Reconnect storm: kill -9 the server under --clients connections, restart it,
+and measure how long until every client is back and has caught up.
+
+Clients register, join --rooms rooms (clients spread evenly) and exchange one
+message per room so everyone holds a cursor. Then the server is killed,
+restarted after --downtime seconds, and every client reconnects with the
+CLI's jittered exponential backoff. Right after getting back in, the first
+--talkers clients of each room post one message; a client has fully
+recovered once it has seen every one of those messages in its room, whether
+delivered live or replayed.
+
+--mode resume  one "resume" frame: session token + last cursor per room,
+               missed messages come back as a replay frame
+--mode register  what a client without sessions does: register, create_room,
+               join_room, then fetch the history page to catch up
+
+Reports time to all-reconnected and to full recovery (from the restart),
+p50/p99 per client, frames each client sent to recover, and completeness.
+
+How to run:
+    python -m bench.bench_reconnect [--clients 5000] [--rooms 100] [--mode resume|register] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+import websockets
+from bench.bench_backplane import server_env, wait_for_port
+
+PORT = 9500
+
+
+def start_server(extra):
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.server"],
+        env=server_env(PORT, extra),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def client_proc(index, members, room_size, args, ready, talk, result):
+    from client.cli import backoff_delay  # picks up the CLIENT_RECONNECT_* set in run()
+    uri = f"ws://127.0.0.1:{PORT}"
+    stats = []
+    limit = asyncio.Semaphore(200)
+
+    async def one(c, room, rank):
+        st = {"session": None, "cursor": None, "post": set(), "frames": 0, "attempts": 0,
+              "reconnected_at": None, "recovered_at": None}
+        async with limit:
+            ws = await websockets.connect(uri, max_queue=None, open_timeout=60)
+            await ws.send(json.dumps({"type": "register", "username": f"rc{c}"}))
+            st["session"] = json.loads(await ws.recv())["session"]
+            await ws.send(json.dumps({"type": "create_room", "room": room}))
+            await ws.send(json.dumps({"type": "join_room", "room": room}))
+        return st, ws
+
+    def seen(st, room, msg_id, ts, content):
+        if ts is not None and (st["cursor"] is None or (ts, msg_id) > st["cursor"]):
+            st["cursor"] = (ts, msg_id)
+        if content.startswith("post "):
+            st["post"].add(content)
+
+    async def drain_until_closed(st, ws, room):
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                if msg.get("type") == "message":
+                    d = msg["data"]
+                    seen(st, room, d["id"], d["ts"], d["content"])
+        except websockets.ConnectionClosed:
+            pass
+
+    async def recover(c, room, rank, st):
+        expected = min(args.talkers, room_size[room])
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            st["attempts"] += 1
+            try:
+                async with websockets.connect(uri, max_queue=None, open_timeout=10) as ws:
+                    if args.mode == "resume":
+                        cursor = f"{st['cursor'][0]}:{st['cursor'][1]}" if st["cursor"] else None
+                        await ws.send(json.dumps({"type": "resume", "session": st["session"], "rooms": {room: cursor}}))
+                        st["frames"] += 1
+                        reply = json.loads(await ws.recv())
+                        if reply.get("type") != "resumed":
+                            raise RuntimeError(reply)
+                    else:
+                        await ws.send(json.dumps({"type": "register", "username": f"rc{c}"}))
+                        reply = json.loads(await ws.recv())
+                        await ws.send(json.dumps({"type": "create_room", "room": room}))
+                        await ws.send(json.dumps({"type": "join_room", "room": room}))
+                        await ws.send(json.dumps({"type": "history", "room": room}))
+                        st["frames"] += 4
+                    st["reconnected_at"] = time.monotonic()
+                    if rank < args.talkers:
+                        await ws.send(json.dumps({"type": "message", "room": room, "message": f"post {c}"}))
+                        st["frames"] += 1
+                    async for raw in ws:
+                        msg = json.loads(raw)
+                        typ = msg.get("type")
+                        if typ == "message":
+                            d = msg["data"]
+                            seen(st, room, d["id"], d["ts"], d["content"])
+                        elif typ in ("replay", "history"):
+                            for m in msg["messages"]:
+                                seen(st, room, m["id"], m["timestamp"], m["content"])
+                        if len(st["post"]) >= expected:
+                            st["recovered_at"] = time.monotonic()
+                            # Stay connected so later talkers still reach the others
+                            await asyncio.sleep(max(0.0, deadline - time.monotonic()) if args.linger else 0)
+                            return
+            except (OSError, asyncio.TimeoutError, RuntimeError, websockets.WebSocketException):
+                pass
+            if st["reconnected_at"] is not None:
+                return  # lost the connection after reconnecting; counted as not recovered
+            await asyncio.sleep(backoff_delay(st["attempts"] - 1))
+
+    opened = await asyncio.gather(*(one(c, room, rank) for c, room, rank in members))
+    ready.put(index)
+    await asyncio.to_thread(talk.wait)
+    # One pre-crash message per room so every member holds a cursor
+    for (c, room, rank), (st, ws) in zip(members, opened):
+        if rank == 0:
+            await ws.send(json.dumps({"type": "message", "room": room, "message": f"pre {c}"}))
+    drains = [asyncio.create_task(drain_until_closed(st, ws, room)) for (_, room, _), (st, ws) in zip(members, opened)]
+    await asyncio.gather(*drains)  # returns once the server is killed
+    await asyncio.gather(*(recover(c, room, rank, st) for (c, room, rank), (st, _) in zip(members, opened)))
+    for st, _ in opened:
+        stats.append({k: st[k] for k in ("frames", "attempts", "reconnected_at", "recovered_at")})
+    result.put(stats)
+
+
+def run_client(*args):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.run(client_proc(*args))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def run(args):
+    os.environ["CLIENT_RECONNECT_MIN"] = str(args.backoff_min)
+    os.environ["CLIENT_RECONNECT_MAX"] = str(args.backoff_max)
+    extra = {"SESSION_SECRET": "bench-reconnect"}
+    server = start_server(extra)
+    procs = []
+    try:
+        asyncio.run(wait_for_port(PORT))
+        room_size = {}
+        assignment = []
+        for c in range(args.clients):
+            room = f"rc{c % args.rooms}"
+            assignment.append((c, room, room_size.get(room, 0)))
+            room_size[room] = room_size.get(room, 0) + 1
+        ready, talk, result = multiprocessing.Queue(), multiprocessing.Event(), multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=run_client, args=(
+                i, assignment[i::args.procs], room_size, args, ready, talk, result))
+            for i in range(args.procs)
+        ]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.get(timeout=600)
+        talk.set()
+        time.sleep(args.settle)
+
+        server.kill()  # no drain, no goodbye: what a crashed node looks like
+        server.wait()
+        killed_at = time.monotonic()
+        time.sleep(args.downtime)
+        server = start_server(extra)
+        asyncio.run(wait_for_port(PORT))
+        restarted_at = time.monotonic()
+
+        stats = []
+        for _ in procs:
+            stats.extend(result.get(timeout=args.timeout + 120))
+        for p in procs:
+            p.join()
+    finally:
+        server.terminate()
+        server.wait()
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    reconnected = [s["reconnected_at"] - restarted_at for s in stats if s["reconnected_at"] is not None]
+    recovered = [s["recovered_at"] - restarted_at for s in stats if s["recovered_at"] is not None]
+    return {
+        "mode": args.mode,
+        "clients": args.clients,
+        "rooms": args.rooms,
+        "downtime_s": round(restarted_at - killed_at, 2),
+        "reconnected": len(reconnected),
+        "recovered": len(recovered),
+        "all_reconnected_s": round(max(reconnected), 2) if len(reconnected) == len(stats) else None,
+        "full_recovery_s": round(max(recovered), 2) if len(recovered) == len(stats) else None,
+        "reconnect_p50_s": round(percentile(reconnected, 0.5), 2) if reconnected else None,
+        "reconnect_p99_s": round(percentile(reconnected, 0.99), 2) if reconnected else None,
+        "recovery_p50_s": round(percentile(recovered, 0.5), 2) if recovered else None,
+        "recovery_p99_s": round(percentile(recovered, 0.99), 2) if recovered else None,
+        "frames_per_client": round(sum(s["frames"] for s in stats) / len(stats), 2),
+        "attempts_per_client": round(sum(s["attempts"] for s in stats) / len(stats), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--talkers", type=int, default=3, help="clients per room that post after reconnecting")
+    parser.add_argument("--mode", choices=("resume", "register"), default="resume")
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1), help="client processes")
+    parser.add_argument("--downtime", type=float, default=1.0, help="seconds between kill and restart")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds before the kill")
+    parser.add_argument("--backoff-min", type=float, default=0.5)
+    parser.add_argument("--backoff-max", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=120, help="give up on a client after this long")
+    parser.add_argument("--linger", action="store_true", help="keep recovered clients connected until the timeout")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
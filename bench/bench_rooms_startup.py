@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+bench/bench_rooms_startup.py
+
+Startup time and memory for the persisted room catalog at 10k / 100k / 1M rooms.
+
+Each size runs in a fresh process against the in-memory MongoDB stand-in
+(app.memdb), filled with one document per room; reads hand back fresh
+strings like a driver decoding BSON. Measured after the fill, so the
+stand-in's own documents are not counted:
+- catalog: roomstore.load_catalog(), names only, batches of CATALOG_BATCH_SIZE
+  (what server.main does; a room's Room object is built on its first join)
+- eager:   every full document read back and turned into a Room model, the
+           obvious alternative; skipped above --eager-max rooms
+RSS is the growth of the process's resident set. A real mongod adds network
+round trips per batch to the catalog numbers; the memory side carries over.
+
+How to run:
+    python -m bench.bench_rooms_startup [--sizes 10000 100000 1000000] [--eager-max 100000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+
+class Decoded:
+    """Cursor wrapper: fresh str objects per read, as a driver decoding BSON makes."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def batch_size(self, n):
+        self.cursor.batch_size(n)
+        return self
+
+    async def to_list(self, length=None):
+        docs = await self.cursor.to_list(length)
+        return [{k: v.encode().decode() if type(v) is str else v for k, v in d.items()} for d in docs]
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+async def measure(size, mode):
+    from datetime import datetime, timezone
+    from app.memdb import InMemoryCollection
+    from app.membership import Membership
+    from app.models import Room
+    from app.roomstore import RoomStore
+    rooms = InMemoryCollection("rooms")
+    find = rooms.find
+    rooms.find = lambda *a, **kw: Decoded(find(*a, **kw))
+    now = datetime.now(timezone.utc)
+    await rooms.insert_many({"_id": f"room-{i:07d}", "created_by": f"user{i % 5000}", "created_at": now}
+                            for i in range(size))
+    before = rss_mb()
+    started = perf_counter()
+    if mode == "catalog":
+        m = Membership()
+        await RoomStore(rooms, InMemoryCollection("users")).load_catalog(m.catalog)
+        count = len(m.catalog)
+    else:
+        docs = await rooms.find({}).to_list()
+        loaded = {d["_id"]: Room(name=d["_id"], created_at=d["created_at"]) for d in docs}
+        del docs
+        count = len(loaded)
+    elapsed = perf_counter() - started
+    return {"count": count, "seconds": elapsed, "rss_mb": rss_mb() - before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--eager-max", type=int, default=100_000, help="largest size to try eager loading at")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        size, mode = int(args.child[0]), args.child[1]
+        print(json.dumps(asyncio.run(measure(size, mode))))
+        return
+    env = {**os.environ, "MONGO_URI": "memory://", "METRICS_PORT": "0", "LOG_LEVEL": "WARNING"}
+    print(f"{'rooms':>10} {'mode':>8} {'load s':>8} {'RSS +MB':>8} {'bytes/room':>11}")
+    for size in args.sizes:
+        for mode in ("catalog", "eager"):
+            if mode == "eager" and size > args.eager_max:
+                print(f"{size:>10,} {mode:>8} {'skipped (--eager-max)':>29}")
+                continue
+            out = subprocess.run([sys.executable, "-m", "bench.bench_rooms_startup", "--child", str(size), mode],
+                                 env=env, capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+            r = json.loads(out)
+            assert r["count"] == size
+            print(f"{size:>10,} {mode:>8} {r['seconds']:>8.2f} {r['rss_mb']:>8.1f} "
+                  f"{r['rss_mb'] * 2**20 / size:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+bench/bench_search.py
+
+Query latency of app.search's in-memory index over 10M messages.
+
+Indexes --messages synthetic messages (--words words each, drawn from a
+Zipf-distributed vocabulary like real chat) spread over --rooms rooms, with
+SEARCH_MAX_MESSAGES raised so all of them stay in memory. Then ranks
+--queries first pages (and pages at --deep-offset) per query shape, in
+random rooms, and reports p50/p99 latency of search.rank(), the in-memory
+part of a search request (hydrating a page is one indexed MongoDB read).
+For scale, the same words are also looked up with a substring scan over
+one room's messages (what a $regex query does without an index).
+
+How to run:
+    python -m bench.bench_search [--messages 10000000] [--rooms 10] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import time
+from itertools import accumulate
+from time import perf_counter
+from app import search
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def vocabulary(size):
+    words = [f"w{i}" for i in range(size)]
+    return words, list(accumulate(1 / (rank + 1) ** 1.07 for rank in range(size)))
+
+
+def build(args, words, cum):
+    """Index every message; keep room 0's texts for the scan baseline."""
+    rng = random.Random(1)
+    scan = []
+    batch = 10_000
+    started = perf_counter()
+    for base in range(0, args.messages, batch):
+        n = min(batch, args.messages - base)
+        drawn = rng.choices(words, cum_weights=cum, k=n * args.words)
+        for i in range(n):
+            seq = base + i
+            content = " ".join(drawn[i * args.words:(i + 1) * args.words])
+            room = f"room{seq % args.rooms}"
+            search.index(room, seq.to_bytes(12, "big").hex(), 1_700_000_000_000 + seq, content)
+            if seq % args.rooms == 0:
+                scan.append(content)
+        if base and base % 1_000_000 == 0:
+            print(f"  indexed {base:,} ({base / (perf_counter() - started):,.0f}/s)", flush=True)
+    return perf_counter() - started, scan
+
+
+def percentiles(samples):
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--words", type=int, default=8, help="words per message")
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per shape")
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--deep-offset", type=int, default=200)
+    args = parser.parse_args()
+    search.SEARCH_MAX_MESSAGES = args.messages
+    words, cum = vocabulary(args.vocabulary)
+    print(f"messages={args.messages:,} rooms={args.rooms} words/message={args.words} vocabulary={args.vocabulary:,}")
+    before = rss_mb()
+    elapsed, scan = build(args, words, cum)
+    index_mb = rss_mb() - before - sum(len(s) + 49 for s in scan) / 2**20 - len(scan) * 8 / 2**20
+    segments = len(search._SEGMENTS)
+    packed = [s for _, s in search._SEGMENTS if s.postings is None]
+    gap_bytes = sum(len(s.narrow) + 2 * len(s.wide) for s in packed)
+    postings = sum(len(s.narrow) + len(s.wide) for s in packed)
+    word_bytes = sum(16 * len(s.words) for s in packed)
+    print(f"indexed in {elapsed:.1f}s ({args.messages / elapsed:,.0f}/s), {segments} segments, "
+          f"index ≈ {index_mb:,.0f} MB RSS ({index_mb * 2**20 / args.messages:.0f} B/message)")
+    print(f"packed segments: {postings:,} postings in {gap_bytes / 2**20:,.0f} MB of gaps "
+          f"({gap_bytes / max(postings, 1):.2f} B/posting), word tables {word_bytes / 2**20:,.0f} MB")
+
+    rng = random.Random(2)
+    shapes = {
+        "rare word":         lambda: [rng.choice(words[20_000:])],
+        "common word":       lambda: [rng.choice(words[:10])],
+        "2 common words":    lambda: rng.sample(words[:50], 2),
+        "2 mid words":       lambda: rng.sample(words[100:2000], 2),
+        "3 mixed words":     lambda: [rng.choice(words[:10]), rng.choice(words[100:1000]), rng.choice(words[1000:10_000])],
+    }
+    print(f"{'query':>16} {'p50 ms':>8} {'p99 ms':>8} {'deep p50':>9} {'deep p99':>9} {'hits/page':>10} {'scan ms':>8}")
+    for name, make in shapes.items():
+        first, deep, hits = [], [], 0
+        for _ in range(args.queries):
+            room, terms = f"room{rng.randrange(args.rooms)}", sorted(make())
+            t = perf_counter()
+            hits += len(search.rank(room, terms, args.page + 1))
+            first.append(perf_counter() - t)
+            t = perf_counter()
+            search.rank(room, terms, args.deep_offset + args.page + 1)
+            deep.append(perf_counter() - t)
+        terms = make()
+        t = perf_counter()
+        matched = [c for c in scan if all(w in c for w in terms)][-args.page:]
+        scan_ms = (perf_counter() - t) * 1000
+        p50, p99 = percentiles(first)
+        d50, d99 = percentiles(deep)
+        print(f"{name:>16} {p50:>8.2f} {p99:>8.2f} {d50:>9.2f} {d99:>9.2f} {hits / args.queries:>10.1f} {scan_ms:>8.0f}")
+        del matched
+
+
+if __name__ == "__main__":
+    main()
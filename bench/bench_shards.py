@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+bench/bench_shards.py
+
+Load test for LOOP_SHARDS: one server process with 1, 2, 4 room-sharded event loops.
+
+Same load as bench_workers (--clients connections over --rooms rooms, each
+sending --rate messages/sec, receivers measuring end-to-end latency), run
+against `python -m app.server` with LOOP_SHARDS set to each value in
+--shards and the connection count held equal. Reports delivered msgs/sec,
+p50/p99 latency and peak RSS per shard count. Under a GIL build the loops
+share one core, so this shows the cost of the cross-loop hand-offs; on a
+free-threaded build it shows what the extra loops buy.
+
+How to run:
+    python -m bench.bench_shards [--shards 1,2,4] [--clients 400] [--rooms 40] [--rate 5] [--seconds 10]
+"""
+
+import argparse
+import json
+import os
+import sys
+from bench.bench_workers import run_round
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--clients", type=int, default=400)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=5, help="messages/sec per connection, 0 = unthrottled")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1), help="client processes")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per shard count")
+    args = parser.parse_args()
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    if not args.json:
+        print(f"python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, {os.cpu_count()} CPUs")
+        print(f"{'shards':>7} {'sent/s':>10} {'delivered/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8}")
+    for count in [int(n) for n in args.shards.split(",")]:
+        row = run_round(1, args, {"LOOP_SHARDS": str(count)})
+        row["shards"] = count
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{count:>7} {row['sent_per_sec']:>10,.0f} {row['delivered_per_sec']:>12,.0f} "
+                  f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['peak_rss_mb']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+bench/bench_workers.py
+
+Load test for `python -m app.server --workers N`: msgs/sec and latency per worker count.
+
+For each worker count it starts the server, then --procs client processes
+that together open --clients connections spread over --rooms rooms. Every
+connection sends --rate messages/sec (0 = as fast as possible) carrying its
+send time; receivers record end-to-end latency. Prints delivered msgs/sec
+and p50/p99 latency for each worker count. MongoDB is replaced by the
+in-memory stand-in.
+
+How to run:
+    python -m bench.bench_workers [--workers 1,2,4,8] [--clients 400] [--rooms 40] [--rate 5] [--seconds 10]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import websockets
+from bench.bench_backplane import server_env, wait_for_port
+
+PORT = 9300
+
+
+async def client_worker(index, clients, rooms, rate, seconds, result):
+    uri = f"ws://127.0.0.1:{PORT}"
+    latencies = []
+    sent = 0
+    conns = []
+    for c in range(clients):
+        ws = await websockets.connect(uri, max_queue=None)
+        await ws.send(json.dumps({"type": "register", "username": f"p{index}c{c}"}))
+        await ws.recv()
+        room = f"room{c % rooms}"
+        await ws.send(json.dumps({"type": "create_room", "room": room}))
+        await ws.send(json.dumps({"type": "join_room", "room": room}))
+        conns.append((ws, room))
+    await asyncio.sleep(1.0)  # let joins settle on every worker
+    deadline = time.monotonic() + seconds
+
+    async def sender(ws, room):
+        nonlocal sent
+        interval = 1.0 / rate if rate else 0
+        next_at = time.monotonic()
+        while time.monotonic() < deadline:
+            await ws.send(json.dumps({"type": "message", "room": room, "message": repr(time.monotonic())}))
+            sent += 1
+            if interval:
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            else:
+                await asyncio.sleep(0)
+
+    async def receiver(ws):
+        try:
+            async for raw in ws:
+                now = time.monotonic()
+                if now >= deadline:
+                    return
+                msg = json.loads(raw)
+                if msg.get("type") == "message":
+                    latencies.append(now - float(msg["data"]["content"]))
+        except websockets.ConnectionClosed:
+            pass
+
+    tasks = [asyncio.create_task(sender(ws, room)) for ws, room in conns]
+    tasks += [asyncio.create_task(receiver(ws)) for ws, _ in conns]
+    await asyncio.wait(tasks, timeout=seconds + 2)
+    for t in tasks:
+        t.cancel()
+    for ws, _ in conns:
+        await ws.close()
+    result.put({"sent": sent, "latencies": latencies})
+
+
+def run_client(*args):
+    asyncio.run(client_worker(*args))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def peak_rss_mb(pid):
+    """Peak RSS (VmHWM) of a process and its children, from /proc (Linux only)."""
+    total_kb = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+def run_round(workers, args, extra=None):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--workers", str(workers)],
+        env=server_env(PORT, {"IPC_SOCKET": f"/tmp/chat-bench-{os.getpid()}.sock", **(extra or {})}),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(wait_for_port(PORT))
+        time.sleep(0.5 * workers)  # every worker has to bind before load starts
+        result = multiprocessing.Queue()
+        per_proc = args.clients // args.procs
+        procs = [
+            multiprocessing.Process(target=run_client,
+                                    args=(i, per_proc, args.rooms, args.rate, args.seconds, result))
+            for i in range(args.procs)
+        ]
+        for p in procs:
+            p.start()
+        sent, latencies = 0, []
+        for _ in procs:
+            r = result.get(timeout=args.seconds + 120)
+            sent += r["sent"]
+            latencies.extend(r["latencies"])
+        for p in procs:
+            p.join()
+        latencies.sort()
+        return {
+            "workers": workers,
+            "sent_per_sec": sent / args.seconds,
+            "delivered_per_sec": len(latencies) / args.seconds,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "p999_ms": percentile(latencies, 0.999) * 1000,
+            "peak_rss_mb": peak_rss_mb(server.pid),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--clients", type=int, default=400)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=5, help="messages/sec per connection, 0 = unthrottled")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1), help="client processes")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per worker count")
+    args = parser.parse_args()
+    if not args.json:
+        print(f"{'workers':>7} {'sent/s':>10} {'delivered/s':>12} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        row = run_round(workers, args)
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{row['workers']:>7} {row['sent_per_sec']:>10,.0f} {row['delivered_per_sec']:>12,.0f} "
+                  f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
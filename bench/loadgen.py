@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+bench/loadgen.py
+
+Load generator: end-to-end delivery latency, throughput and server RSS as JSON.
+
+Opens --clients WebSocket connections from --procs client processes, speaking
+the same register / create_room / join_room / message protocol as
+client/cli.py. Clients are spread over --rooms rooms by --room-dist
+(uniform, zipf or single), then send --rate messages/sec in total for
+--seconds. Each message carries its send time, so every delivery to every
+room member yields one latency sample in a log-linear histogram (about 1%
+precision, HdrHistogram-style). Results are printed (or written to --out)
+as one JSON document; --baseline compares against an earlier run.
+
+By default it starts `python -m app.server` itself with MongoDB replaced by
+the in-memory stand-in (MONGO_URI=memory://) and rate and room-size limits
+disabled, so it runs fully offline. Extra KEY=VALUE arguments are passed to
+that server.
+Use --uri (and --server-pid for RSS) to load an already running server.
+
+How to run:
+    python -m bench.loadgen [--clients 2000] [--rooms 100] [--room-dist zipf] [--rate 5000] [--seconds 10] [--out run.json]
+    python -m bench.loadgen --baseline run.json   # after a change
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import websockets
+from bench.bench_backplane import server_env, wait_for_port
+from bench.bench_workers import peak_rss_mb
+
+PORT = 9400
+DRAIN_SECONDS = 2.0  # receivers keep reading this long after the senders stop
+
+
+# ------------------------
+# Latency histogram
+# ------------------------
+class Histogram:
+    """
+    Log-linear histogram of integer microseconds: exact below 128, then 64
+    sub-buckets per power of two (<1.6% relative error). Buckets are keyed
+    by their lower bound, so histograms from several processes merge by
+    adding counts.
+    """
+
+    SUB_BITS = 7
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+        self.total = sum(self.counts.values())
+
+    def record(self, value):
+        value = max(0, int(value))
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        key = (value >> shift) << shift
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.total += 1
+
+    def merge(self, counts):
+        for key, n in counts.items():
+            key = int(key)
+            self.counts[key] = self.counts.get(key, 0) + n
+            self.total += n
+
+    def percentile(self, p):
+        if not self.total:
+            return None
+        rank = max(1, round(self.total * p))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return key
+        return max(self.counts)
+
+    def mean(self):
+        if not self.total:
+            return None
+        return sum(k * n for k, n in self.counts.items()) / self.total
+
+    def summary_ms(self):
+        points = {"p50": 0.50, "p90": 0.90, "p99": 0.99, "p999": 0.999, "max": 1.0}
+        out = {}
+        for name, p in points.items():
+            v = self.percentile(p)
+            out[name] = None if v is None else round(v / 1000, 3)
+        mean = self.mean()
+        out["mean"] = None if mean is None else round(mean / 1000, 3)
+        return out
+
+
+# ------------------------
+# Room assignment
+# ------------------------
+def assign_rooms(clients, rooms, dist, zipf_s, seed):
+    """Room name for every client index."""
+    names = [f"load{r}" for r in range(rooms)]
+    if dist == "single":
+        return [names[0]] * clients
+    if dist == "uniform":
+        return [names[c % rooms] for c in range(clients)]
+    # zipf: room k gets a share proportional to 1 / k**s (a few huge rooms, a long tail)
+    rng = random.Random(seed)
+    weights = [1 / (k ** zipf_s) for k in range(1, rooms + 1)]
+    return rng.choices(names, weights=weights, k=clients)
+
+
+# ------------------------
+# Client processes
+# ------------------------
+async def client_proc(uri, index, room_of, room_size, args, ready, go, result):
+    hist = Histogram()
+    counters = {"sent": 0, "expected": 0, "delivered": 0, "errors": 0, "connect_failures": 0}
+    padding = "x" * max(0, args.message_size - 20)
+    limit = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(c, room):
+        async with limit:
+            try:
+                ws = await websockets.connect(uri, max_queue=None, open_timeout=30)
+                await ws.send(json.dumps({"type": "register", "username": f"lg{index}u{c}"}))
+                await ws.recv()
+                await ws.send(json.dumps({"type": "create_room", "room": room}))
+                await ws.send(json.dumps({"type": "join_room", "room": room}))
+                return ws, room
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                counters["connect_failures"] += 1
+                return None
+
+    conns = [c for c in await asyncio.gather(*(connect(c, r) for c, r in room_of)) if c]
+    ready.put(index)
+    await asyncio.to_thread(go.wait)
+    await asyncio.sleep(args.settle)  # joins from every process reach the server
+    deadline = time.monotonic() + args.seconds
+    interval = args.clients / args.rate if args.rate else 0
+
+    async def sender(ws, room):
+        next_at = time.monotonic() + random.random() * interval  # spread the first sends
+        while True:
+            if interval:
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+                next_at += interval
+            else:
+                await asyncio.sleep(0)
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            await ws.send(json.dumps({"type": "message", "room": room, "message": f"{now!r} {padding}"}))
+            counters["sent"] += 1
+            counters["expected"] += room_size[room]
+
+    async def receiver(ws):
+        try:
+            async for raw in ws:
+                now = time.monotonic()
+                msg = json.loads(raw)
+                typ = msg.get("type")
+                if typ == "message":
+                    sent_at = float(msg["data"]["content"].split(" ", 1)[0])
+                    hist.record((now - sent_at) * 1e6)
+                    counters["delivered"] += 1
+                elif typ == "error":
+                    counters["errors"] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    senders = [asyncio.create_task(sender(ws, room)) for ws, room in conns]
+    receivers = [asyncio.create_task(receiver(ws)) for ws, _ in conns]
+    await asyncio.wait(senders, timeout=args.seconds + 5)
+    await asyncio.wait(receivers, timeout=DRAIN_SECONDS)
+    for t in senders + receivers:
+        t.cancel()
+    await asyncio.gather(*(ws.close() for ws, _ in conns), return_exceptions=True)
+    result.put({**counters, "connected": len(conns), "histogram": hist.counts})
+
+
+def run_client(*args):
+    # Thousands of sockets per process
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.run(client_proc(*args))
+
+
+# ------------------------
+# Driver
+# ------------------------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, overrides):
+    server = None
+    uri = args.uri
+    if uri is None:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "app.server", "--workers", str(args.workers)],
+            env=server_env(PORT, {"IPC_SOCKET": f"/tmp/chat-loadgen-{os.getpid()}.sock", **overrides}),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        uri = f"ws://127.0.0.1:{PORT}"
+    server_pid = server.pid if server else args.server_pid
+    try:
+        if server:
+            asyncio.run(wait_for_port(PORT))
+            time.sleep(0.5 * args.workers)  # every worker has to bind before load starts
+        rooms = assign_rooms(args.clients, args.rooms, args.room_dist, args.zipf_s, args.seed)
+        room_size = {}
+        for room in rooms:
+            room_size[room] = room_size.get(room, 0) + 1
+        ready, go, result = multiprocessing.Queue(), multiprocessing.Event(), multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=run_client, args=(
+                uri, i, [(c, rooms[c]) for c in range(i, args.clients, args.procs)],
+                room_size, args, ready, go, result))
+            for i in range(args.procs)
+        ]
+        for p in procs:
+            p.start()
+        started = time.monotonic()
+        for _ in procs:
+            ready.get(timeout=600)
+        connect_seconds = time.monotonic() - started
+        go.set()
+        hist = Histogram()
+        totals = {"connected": 0, "connect_failures": 0, "sent": 0, "expected": 0, "delivered": 0, "errors": 0}
+        for _ in procs:
+            r = result.get(timeout=args.settle + args.seconds + DRAIN_SECONDS + 120)
+            hist.merge(r.pop("histogram"))
+            for key in totals:
+                totals[key] += r[key]
+        for p in procs:
+            p.join()
+        rss = peak_rss_mb(server_pid) if server_pid else None
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    return {
+        "commit": git_commit(),
+        "config": {
+            "clients": args.clients, "procs": args.procs, "rooms": args.rooms,
+            "room_dist": args.room_dist, "largest_room": max(room_size.values()),
+            "rate": args.rate, "seconds": args.seconds, "message_size": args.message_size,
+            "workers": args.workers if server else None, "env": overrides,
+        },
+        **totals,
+        "connect_seconds": round(connect_seconds, 3),
+        "sent_per_sec": round(totals["sent"] / args.seconds, 1),
+        "delivered_per_sec": round(totals["delivered"] / args.seconds, 1),
+        "delivery_ratio": round(totals["delivered"] / totals["expected"], 4) if totals["expected"] else None,
+        "latency_ms": hist.summary_ms(),
+        "histogram_us": {str(k): n for k, n in sorted(hist.counts.items())},
+        "server_peak_rss_mb": None if rss is None else round(rss, 1),
+    }
+
+
+def compare(report, baseline):
+    """One line per headline metric: baseline -> current (change %)."""
+    rows = [("delivered_per_sec", report["delivered_per_sec"], baseline["delivered_per_sec"])]
+    for p in ("p50", "p99", "p999"):
+        rows.append((f"{p}_ms", report["latency_ms"][p], baseline["latency_ms"][p]))
+    rows.append(("server_peak_rss_mb", report["server_peak_rss_mb"], baseline["server_peak_rss_mb"]))
+    lines = [f"vs {baseline.get('commit') or 'baseline'}:"]
+    for name, now, before in rows:
+        if now is None or not before:
+            lines.append(f"  {name:>20}: {before} -> {now}")
+        else:
+            lines.append(f"  {name:>20}: {before} -> {now} ({(now - before) / before * 100:+.1f}%)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--uri", help="load a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid of the --uri server, for RSS")
+    parser.add_argument("--workers", type=int, default=1, help="--workers for the started server")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1), help="client processes")
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--room-dist", choices=("uniform", "zipf", "single"), default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="zipf exponent")
+    parser.add_argument("--rate", type=float, default=2000, help="total messages/sec, 0 = unthrottled")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--settle", type=float, default=1.0, help="pause after connecting, seconds")
+    parser.add_argument("--message-size", type=int, default=64, help="approximate content bytes")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="handshakes in flight per process")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against (printed to stderr)")
+    parser.add_argument("env", nargs="*", help="KEY=VALUE overrides for the started server")
+    args = parser.parse_args()
+    overrides = dict(kv.split("=", 1) for kv in args.env)
+
+    report = run(args, overrides)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,9 @@ client/cli.py
 Simple async CLI websocket client for the chat server.
 
 How to run:
-    python -m client.cli
+    python -m client.cli [--uri ws://...] [--username alice]
+    python -m client.cli --username bot1 --bot --rate 200 --quiet   # soak test
+    python -m client.cli --username bot2 --replay script.txt --rate 50
 
 Features:
 - Register a username on connect.
@@ -13,150 +15,473 @@ Features:
     /create <room>   -> create a room
     /join <room>     -> join a room
     /leave <room>    -> leave a room
-    /rooms           -> list rooms
-    /users <room>    -> list users in room
-    /history <room>  -> get history for room
+    /rooms [more|watch|unwatch]         -> list active rooms (next page; live changes)
+    /users [room] [more|watch|unwatch]  -> list users in room, or everyone online
+    /history <room>  -> get history for room (add "more" for older pages); shown from
+                        the local cache at once, then only newer messages are fetched
+    /search <room> <words> -> find messages (then "/search more" for the next page)
     /room <room>     -> set your current room (for sending messages)
+    /scrollback [n]  -> show the last n lines again
     /quit            -> exit cleanly
 - Plain lines (not starting with /) are sent as messages to the current room.
 - Reads server URI and optional username from environment (via .env) if present.
+- CLIENT_ENCODING=msgpack sends commands as MessagePack if the server agrees at register.
+- Reconnects with jittered exponential backoff and resumes the session: rooms are
+  rejoined and messages missed while disconnected are replayed.
+- Output is coalesced into one terminal write per frame (CLIENT_RENDER_FPS) and
+  the last CLIENT_SCROLLBACK lines are kept; a busy room can't make the receive
+  loop fall behind the server.
+- Messages are cached on disk per server and username (CLIENT_CACHE_DIR, SQLite):
+  /history shows the cached ones at once and asks only for what came after, and
+  asks nothing while the room is joined and every message since has been seen.
+  The newest CLIENT_HISTORY_CACHE_ROOM_SIZE messages of the
+  CLIENT_HISTORY_CACHE_ROOMS most recently used rooms are kept.
+  CLIENT_HISTORY_CACHE=0 turns it off.
+- --bot sends generated messages, --replay FILE the lines of FILE (commands or
+  messages, as typed), at --rate per second for soak tests. The server's
+  RATE_LIMIT / RATE_LIMIT_PER_IP have to allow that rate.
 """
 
+import argparse
 import asyncio
 import json
 import os
+import random
+import sqlite3
 import sys
+from collections import deque
 from typing import Optional
 import websockets
 from dotenv import load_dotenv
+from websockets.asyncio.client import ClientConnection
+from client import history_cache
+from client.history_cache import HistoryCache
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
 
 load_dotenv()  # optional .env in project root
 
 DEFAULT_URI = os.getenv("CLIENT_SERVER_URI", "ws://127.0.0.1:8765")
 DEFAULT_ROOM = os.getenv("DEFAULT_ROOM", "global")
+CLIENT_ENCODING = os.getenv("CLIENT_ENCODING", "json")
+RECONNECT_MIN = float(os.getenv("CLIENT_RECONNECT_MIN", 0.5))  # seconds, first retry window
+RECONNECT_MAX = float(os.getenv("CLIENT_RECONNECT_MAX", 30))   # cap on the retry window
+RENDER_FPS = float(os.getenv("CLIENT_RENDER_FPS", 30))          # terminal writes per second; 0 = one per line
+SCROLLBACK = int(os.getenv("CLIENT_SCROLLBACK", 1000))          # lines kept (and most written per frame)
+AUTH_TOKEN = os.getenv("CLIENT_AUTH_TOKEN")                     # sent in the handshake to servers with AUTH_REQUIRED
+HISTORY_CACHE = os.getenv("CLIENT_HISTORY_CACHE", "1") != "0"
+CACHE_DIR = os.getenv("CLIENT_CACHE_DIR") or history_cache.default_dir()
+CACHE_ROOMS = int(os.getenv("CLIENT_HISTORY_CACHE_ROOMS", 100))          # rooms kept, least recently used dropped
+CACHE_ROOM_SIZE = int(os.getenv("CLIENT_HISTORY_CACHE_ROOM_SIZE", 1000))  # newest messages kept per room
 
 PROMPT = "> "
 
+# room -> cursor of the oldest history message shown so far (for "/history <room> more")
+HISTORY_CURSORS = {}
+# The last search's room, query and next offset (for "/search more")
+LAST_SEARCH = {}
+# ("rooms", None) / ("users", room or None) -> `after` of the next page (for "/rooms more", "/users more")
+LIST_CURSORS = {}
+# Lists watched with "watch": subscribed again (with a fresh page) after a reconnect
+WATCHING = set()
+
+# Encoding for outgoing commands, as agreed in the server's "registered" reply
+ENCODING = "json"
+
+# Session token from "registered"/"resumed", presented again after a reconnect
+SESSION: Optional[str] = None
+# Joined room -> cursor "<ts>:<id>" of the newest message seen there (None until one arrives)
+JOINED = {}
+# room -> ids of recent messages already shown (replays and live frames may overlap)
+SEEN = {}
+# On-disk history cache (None when off, or after it failed)
+CACHE: Optional[HistoryCache] = None
+# Counters for the --bot / --replay status line
+STATS = {"sent": 0, "received": 0}
+
+
+# ------------------------
+# Terminal output
+# ------------------------
+class Renderer:
+    """
+    Collects output lines and writes them in one go `fps` times a second,
+    instead of one print (one write + flush on a terminal) per line. Keeps
+    the last `scrollback` lines; when more than that arrive within one
+    frame, the oldest are skipped and a marker says how many.
+    """
+
+    def __init__(self, stream=None, fps=RENDER_FPS, scrollback=SCROLLBACK):
+        self.stream = stream or sys.stdout
+        self.interval = 1 / fps if fps > 0 else 0
+        self.scrollback = deque(maxlen=scrollback)
+        self.pending = deque(maxlen=scrollback)
+        self.skipped = 0
+        self.quiet = False  # --quiet: chat messages are counted, not shown
+        self.task = None
+        self.stats = {"lines": 0, "writes": 0, "skipped": 0}
+
+    def show(self, line: str):
+        self.scrollback.append(line)
+        self.stats["lines"] += 1
+        if self.task is None:
+            self._write([line])  # not started (prompts, fps=0): write through
+            return
+        if len(self.pending) == self.pending.maxlen:
+            self.skipped += 1
+        self.pending.append(line)
+
+    def flush(self):
+        if not self.pending and not self.skipped:
+            return
+        lines = list(self.pending)
+        self.pending.clear()
+        if self.skipped:
+            lines.insert(0, f"... {self.skipped} lines skipped ...")
+            self.stats["skipped"] += self.skipped
+            self.skipped = 0
+        self._write(lines)
+
+    def last(self, n: int):
+        """Write the newest `n` scrollback lines again."""
+        self.flush()
+        self._write(list(self.scrollback)[-n:] or ["(scrollback is empty)"])
+
+    def _write(self, lines):
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+        self.stats["writes"] += 1
+
+    def start(self):
+        if self.interval:
+            self.task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+
+RENDER = Renderer()
+
+
+def show(line: str):
+    RENDER.show(line)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff, so a restarted server isn't hit by every client at once."""
+    return random.uniform(0, min(RECONNECT_MAX, RECONNECT_MIN * 2 ** attempt))
+
+
+def note_message(room: str, msg_id, ts) -> bool:
+    """Record a delivered message; False if it was already shown."""
+    seen = SEEN.setdefault(room, deque(maxlen=500))
+    if msg_id in seen:
+        return False
+    seen.append(msg_id)
+    if room in JOINED and ts is not None:
+        cursor = JOINED[room]
+        if cursor is None or (ts, str(msg_id)) > _cursor_key(cursor):
+            JOINED[room] = f"{ts}:{msg_id}"
+    return True
+
+
+def cache_call(method: str, *args):
+    """Run a CACHE method; a locked or broken cache file turns the cache off for this session."""
+    global CACHE
+    if CACHE is None:
+        return None
+    try:
+        return getattr(CACHE, method)(*args)
+    except sqlite3.Error as e:
+        show(f"(History cache off: {e})")
+        CACHE = None
+        return None
+
+
+def show_history(room: str, messages, header: str):
+    show(header)
+    for m in messages:
+        show(f"[{room}] {m.get('sender', 'unknown')}: {m.get('content', '')}")
+
+
+def _cursor_key(cursor: str):
+    ms, _, msg_id = cursor.partition(":")
+    return int(ms), msg_id
+
+
+def pack(obj: dict):
+    """Encode a command for the server (MessagePack bytes once negotiated, else JSON text)."""
+    if ENCODING == "msgpack":
+        return msgpack.packb(obj)
+    return json.dumps(obj, ensure_ascii=False)
+
 
 def pretty_print_system(obj: dict):
     """Print non-message server events in a readable single-line format."""
     typ = obj.get("type")
     if typ == "error":
-        print(f"[ERROR] {obj.get('message')}")
-    elif typ in ("registered", "room_created", "room_joined", "room_left", "room_list", "user_list", "history"):
-        print(f"[SERVER] {json.dumps(obj, ensure_ascii=False)}")
+        show(f"[ERROR] {obj.get('message')}")
+    elif typ in ("registered", "room_created", "room_joined", "room_left", "history"):
+        show(f"[SERVER] {json.dumps(obj, ensure_ascii=False)}")
     else:
         # fallback
-        print(f"[SERVER] {obj}")
+        show(f"[SERVER] {obj}")
 
 # Async input reader
-async def input_reader(loop):
+async def open_stdin():
     """
-    Async wrapper around blocking sys.stdin.readline using executor.
-    Returns a stripped line or empty string on EOF.
+    A StreamReader the event loop fills from stdin, so reading a line costs
+    no thread-pool hop. None where stdin can't be watched (a regular file,
+    Windows); input_reader then falls back to the executor.
     """
-    return (await loop.run_in_executor(None, sys.stdin.readline)).rstrip("\n")
+    reader = asyncio.StreamReader()
+    try:
+        await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except (ValueError, OSError, NotImplementedError):
+        return None
+    return reader
 
-# Send loop
-async def send_loop(ws: websockets.WebSocketClientProtocol, username: str):
+async def input_reader(reader):
+    """Next stdin line without its newline; None at EOF."""
+    if reader is None:
+        line = await asyncio.get_running_loop().run_in_executor(None, sys.stdin.readline)
+    else:
+        line = (await reader.readline()).decode(errors="replace")
+    return line.rstrip("\n") if line else None
+
+HELP_TEXT = (
+    "/create <room>   create a room\n"
+    "/join <room>     join room\n"
+    "/leave <room>    leave room\n"
+    "/rooms [more|watch|unwatch]  list active rooms (next page; live changes)\n"
+    "/users [room] [more|watch|unwatch]  list a room's users, or everyone online\n"
+    "/history <room>  get room history (/history <room> more for older)\n"
+    "/search <room> <words>  find messages (/search more for the next page)\n"
+    "/room <room>     set current room for messages\n"
+    "/scrollback [n]  show the last n lines again\n"
+    "/quit            exit"
+)
+
+# One typed (or replayed) line
+async def handle_line(conn: dict, state: dict, line: str) -> bool:
     """
-    Reads user input and sends relevant JSON commands to server.
-    Maintains a `current_room` used for plain messages.
+    Turn a line into a command or a message for state["room"] and send it.
+    False once the user asked to quit. `conn["ws"]` is the live connection,
+    None while reconnecting.
     """
-    loop = asyncio.get_event_loop()
-    current_room: Optional[str] = DEFAULT_ROOM
-    print(f"(Current room: {current_room}) — type /help for commands")
-    # Main input loop
-    while True:
-        try:
-            line = await input_reader(loop)
-            if line is None:
-                continue
-            line = line.strip()
-            if not line:
-                continue
+    line = line.strip()
+    if not line:
+        return True
 
-            # Commands
-            if line.startswith("/"):
-                parts = line.split(maxsplit=1)
-                cmd = parts[0].lower()
-
-                if cmd == "/quit":
-                    await ws.close()
-                    return
-
-                if cmd == "/help":
-                    help_text = (
-                        "/create <room>   create a room\n"
-                        "/join <room>     join room\n"
-                        "/leave <room>    leave room\n"
-                        "/rooms           list rooms\n"
-                        "/users <room>    list users in a room\n"
-                        "/history <room>  get room history\n"
-                        "/room <room>     set current room for messages\n"
-                        "/quit            exit\n"
-                    )
-                    print(help_text)
-                    continue
-
-                arg = parts[1].strip() if len(parts) > 1 else ""
-                # Handle commands with arguments
-                if cmd == "/create" and arg:
-                    await ws.send(json.dumps({"type": "create_room", "name": arg}, ensure_ascii=False))
-                    continue
-                # Handle commands with arguments
-                if cmd == "/join" and arg:
-                    await ws.send(json.dumps({"type": "join_room", "name": arg}, ensure_ascii=False))
-                    current_room = arg
-                    print(f"(Current room set to: {current_room})")
-                    continue
-                # Handle commands with arguments
-                if cmd == "/leave" and arg:
-                    await ws.send(json.dumps({"type": "leave_room", "name": arg}, ensure_ascii=False))
-                    if current_room == arg:
-                        current_room = None
-                        print("(Current room cleared)")
-                    continue
-                # Handle commands without arguments
-                if cmd == "/rooms":
-                    await ws.send(json.dumps({"type": "list_rooms"}, ensure_ascii=False))
-                    continue
-                # Handle commands with arguments
-                if cmd == "/users" and arg:
-                    await ws.send(json.dumps({"type": "list_users", "name": arg}, ensure_ascii=False))
-                    continue
-                # Handle commands with arguments
-                if cmd == "/history" and arg:
-                    await ws.send(json.dumps({"type": "history", "name": arg, "limit": 50}, ensure_ascii=False))
-                    continue
-                # Handle commands with arguments
-                if cmd == "/room" and arg:
-                    current_room = arg
-                    print(f"(Current room set to: {current_room})")
-                    continue
-
-                print("Unknown or malformed command. Type /help for commands.")
-                continue
+    # Commands
+    if line.startswith("/"):
+        parts = line.split(maxsplit=1)
+        cmd = parts[0].lower()
 
-            # Non-command: send as chat message to current_room
-            if not current_room:
-                print("No current room set. Use /join <room> or /room <room>.")
-                continue
+        if cmd == "/quit":
+            conn["quit"] = True
+            if conn["ws"] is not None:
+                await conn["ws"].close()
+            return False
+
+        if cmd == "/help":
+            show(HELP_TEXT)
+            return True
+
+        arg = parts[1].strip() if len(parts) > 1 else ""
+        # Handle commands with arguments
+        if cmd == "/room" and arg:
+            state["room"] = arg
+            show(f"(Current room set to: {arg})")
+            return True
+        if cmd == "/scrollback":
+            RENDER.last(int(arg) if arg.isdigit() else 20)
+            return True
+
+        ws = conn["ws"]
+        if ws is None:
+            show("(Not connected; reconnecting, try again in a moment.)")
+            return True
+        # Handle commands with arguments
+        if cmd == "/create" and arg:
+            await ws.send(pack({"type": "create_room", "room": arg}))
+            JOINED.setdefault(arg, None)
+            return True
+        # Handle commands with arguments
+        if cmd == "/join" and arg:
+            await ws.send(pack({"type": "join_room", "room": arg}))
+            JOINED.setdefault(arg, None)
+            state["room"] = arg
+            show(f"(Current room set to: {arg})")
+            return True
+        # Handle commands with arguments
+        if cmd == "/leave" and arg:
+            await ws.send(pack({"type": "leave_room", "room": arg}))
+            JOINED.pop(arg, None)
+            cache_call("left", arg)
+            if state["room"] == arg:
+                state["room"] = None
+                show("(Current room cleared)")
+            return True
+        # Handle commands with optional arguments
+        if cmd in ("/rooms", "/users"):
+            words = arg.split()
+            mode = words.pop() if words and words[-1] in ("more", "watch", "unwatch") else None
+            room = words[0] if words and cmd == "/users" else None
+            key = ("rooms", None) if cmd == "/rooms" else ("users", room)
+            payload = {"type": "list_rooms"} if cmd == "/rooms" else {"type": "list_users", "room": room}
+            if mode == "more":
+                if key not in LIST_CURSORS:
+                    show("No more to list.")
+                    return True
+                payload["after"] = LIST_CURSORS[key]
+            elif mode:
+                payload["subscribe"] = mode == "watch"
+                (WATCHING.add if mode == "watch" else WATCHING.discard)(key)
+            await ws.send(pack(payload))
+            return True
+        # Handle commands with arguments
+        if cmd == "/history" and arg:
+            room, _, more = arg.partition(" ")
+            payload = {"type": "history", "room": room, "limit": 50}
+            if more.strip() == "more":
+                if room not in HISTORY_CURSORS:
+                    show("No older history for this room yet.")
+                    return True
+                payload["before"] = HISTORY_CURSORS[room]
+                found = cache_call("older", room, payload["before"])
+            else:
+                found = cache_call("history", room)
+            if found is not None:
+                cached, payload = found
+                if cached or payload is None:
+                    show_history(room, cached, f"--- history for {room} ({len(cached)} cached) ---")
+                    if cached:
+                        HISTORY_CURSORS[room] = f"{cached[0]['timestamp']}:{cached[0]['id']}"
+            if payload is not None:
+                await ws.send(pack(payload))
+            return True
+        # Handle commands with arguments
+        if cmd == "/search" and arg:
+            if arg == "more":
+                if LAST_SEARCH.get("next") is None:
+                    show("No more results.")
+                    return True
+                room, query, offset = LAST_SEARCH["room"], LAST_SEARCH["query"], LAST_SEARCH["next"]
+            else:
+                room, _, query = arg.partition(" ")
+                offset = 0
+                if not query.strip():
+                    show("Usage: /search <room> <words>")
+                    return True
+            await ws.send(pack({"type": "search", "room": room, "query": query.strip(), "offset": offset}))
+            return True
+        show("Unknown or malformed command. Type /help for commands.")
+        return True
 
-            payload = {"type": "message", "room": current_room, "content": line}
-            await ws.send(json.dumps(payload, ensure_ascii=False))
+    # Non-command: send as chat message to the current room
+    if not state["room"]:
+        show("No current room set. Use /join <room> or /room <room>.")
+        return True
+    ws = conn["ws"]
+    if ws is None:
+        show("(Not connected; reconnecting, message not sent.)")
+        return True
+    await ws.send(pack({"type": "message", "room": state["room"], "message": line}))
+    STATS["sent"] += 1
+    return True
+
+# Send loop
+async def send_loop(conn: dict, state: dict):
+    """Reads user input and runs each line; EOF (Ctrl+D) quits."""
+    show(f"(Current room: {state['room']}) — type /help for commands")
+    reader = await open_stdin()
+    while True:
+        try:
+            line = await input_reader(reader)
+            if line is None:
+                line = "/quit"
+            if not await handle_line(conn, state, line):
+                return
         # Handle connection closed or other exceptions
         except websockets.ConnectionClosed:
-            print("Connection closed. Exiting send loop.")
-            return
+            # The connection loop reconnects; only this line was lost
+            show("(Connection lost; reconnecting, message not sent.)")
         except Exception as e:
-            print(f"Send loop error: {e}")
+            show(f"Send loop error: {e}")
             return
 
+# Scripted sender (--bot / --replay)
+async def bot_loop(conn: dict, state: dict, lines, rate: float, count: int):
+    """
+    Run `lines` through handle_line at `rate` lines per second (0 = as fast
+    as the socket takes them), stopping after `count` (0 = all of them).
+    Each line is due at start + i / rate: a late send is made up by the
+    next ones instead of lowering the rate, and sends never wait for replies.
+    """
+    loop = asyncio.get_running_loop()
+    while conn["ws"] is None and not conn["quit"]:
+        await asyncio.sleep(0.05)
+    start = loop.time()
+    for i, line in enumerate(lines):
+        if count and i >= count:
+            break
+        delay = start + i / rate - loop.time() if rate else 0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif i % 100 == 0:
+            await asyncio.sleep(0)  # behind schedule: still let the receive loop run
+        while conn["ws"] is None and not conn["quit"]:
+            await asyncio.sleep(0.05)  # reconnecting; the schedule catches up afterwards
+        if conn["quit"]:
+            return
+        try:
+            if not await handle_line(conn, state, line):
+                return
+        except websockets.ConnectionClosed:
+            pass
+    elapsed = loop.time() - start
+    await asyncio.sleep(1.0)  # collect the last deliveries
+    show(f"(Done: sent {STATS['sent']} in {elapsed:.1f}s = {STATS['sent'] / max(elapsed, 1e-9):.0f}/s, "
+         f"received {STATS['received']})")
+
+async def status_loop(interval: float = 1.0):
+    """One line per second with send/receive rates (--bot / --replay)."""
+    sent, received = STATS["sent"], STATS["received"]
+    while True:
+        await asyncio.sleep(interval)
+        show(f"(sent {(STATS['sent'] - sent) / interval:.0f}/s, received {(STATS['received'] - received) / interval:.0f}/s, "
+             f"{RENDER.stats['skipped']} lines skipped)")
+        sent, received = STATS["sent"], STATS["received"]
+
 # Receive loop
-async def recv_loop(ws: websockets.WebSocketClientProtocol):
+def list_page(key, after, hint):
+    """Remember where the next page of a room/user list starts."""
+    if after is None:
+        LIST_CURSORS.pop(key, None)
+    else:
+        LIST_CURSORS[key] = after
+        show(f"({hint} for the next page)")
+
+async def recv_loop(ws: ClientConnection):
     """
-    Receives messages from server and prints them.
+    Receives messages from server and hands them to the renderer.
     Expects messages with shape: {"type":"message","data":{...}} for chat messages.
     """
     try:
@@ -164,71 +489,238 @@ async def recv_loop(ws: websockets.WebSocketClientProtocol):
             try:
                 data = json.loads(raw)
             except Exception:
-                print(f"<raw> {raw}")
+                show(f"<raw> {raw}")
                 continue
 
             typ = data.get("type")
-            if typ == "message":
+            if typ == "ping":
+                # Server heartbeat: answer or get dropped as idle
+                await ws.send(pack({"type": "pong"}))
+            elif typ == "message":
                 d = data.get("data", {})
                 room = d.get("room", "?")
-                sender = d.get("sender", "unknown")
-                content = d.get("content", "")
-                print(f"[{room}] {sender}: {content}")
+                if note_message(room, d.get("id"), d.get("ts")):
+                    STATS["received"] += 1
+                    if d.get("ts") is not None:
+                        cache_call("add", room, d.get("id"), d["ts"], d.get("sender"), d.get("content", ""))
+                    if not RENDER.quiet:
+                        show(f"[{room}] {d.get('sender', 'unknown')}: {d.get('content', '')}")
+            elif typ == "replay":
+                # Messages sent while we were disconnected
+                room = data.get("room", "?")
+                cache_call("replayed", room, JOINED.get(room), data.get("messages", []), data.get("truncated"))
+                missed = [m for m in data.get("messages", []) if note_message(room, m.get("id"), m.get("timestamp"))]
+                STATS["received"] += len(missed)
+                show(f"--- missed in {room} ({len(missed)} messages) ---")
+                for m in missed:
+                    show(f"[{room}] {m.get('sender', 'unknown')}: {m.get('content', '')}")
+                if data.get("truncated"):
+                    show(f"(More was missed; /history {room} shows older messages.)")
+            elif typ == "history" and "messages" in data:
+                room = data.get("room", "?")
+                messages = data["messages"]
+                kind, follow = cache_call("on_page", data, room in JOINED) or ("newest", None)
+                if kind == "after":
+                    # Newer than what the cache showed (the sync may take several pages)
+                    if messages:
+                        show_history(room, messages, f"--- {len(messages)} newer in {room} ---")
+                        HISTORY_CURSORS.setdefault(room, data.get("before"))
+                else:
+                    show_history(room, messages, f"--- history for {room} ({len(messages)} messages) ---")
+                    if messages and data.get("before"):
+                        HISTORY_CURSORS[room] = data["before"]
+                    else:
+                        HISTORY_CURSORS.pop(room, None)
+                if follow is not None:
+                    await ws.send(pack(follow))
+            elif typ == "room_list":
+                rooms = data.get("rooms", [])
+                show(f"--- rooms ({data.get('active')} active, {data.get('total')} in all) ---")
+                show(", ".join(f"{r.get('name')} ({r.get('members')})" for r in rooms) or "(none)")
+                list_page(("rooms", None), data.get("next"), "/rooms more")
+            elif typ == "user_list":
+                room = data.get("room")
+                show(f"--- users {'in ' + room if room else 'online'} ({data.get('total')}) ---")
+                show(", ".join(data.get("users", [])) or "(none)")
+                list_page(("users", room), data.get("next"), f"/users {room + ' ' if room else ''}more")
+            elif typ == "room_delta":
+                created = data.get("created", [])
+                counts = ", ".join(f"{name} ({n})" for name, n in data.get("members", {}).items())
+                show(f"* rooms: {'new ' + ', '.join(created) + '; ' if created else ''}{counts}")
+            elif typ == "user_delta":
+                where = data.get("room") or "online"
+                added, removed = data.get("added", []), data.get("removed", [])
+                show(f"* {where}: " + "; ".join(part for part in (
+                    "+" + ", +".join(added) if added else "", "-" + ", -".join(removed) if removed else "") if part))
+            elif typ == "search":
+                room, results = data.get("room", "?"), data.get("results", [])
+                show(f"--- search in {room} for {data.get('query')!r} ({len(results)} results) ---")
+                for r in results:
+                    show(f"[{room}] {r.get('sender', 'unknown')}: {r.get('content', '')}")
+                LAST_SEARCH.update(room=room, query=data.get("query"), next=data.get("next"))
+                if data.get("next") is not None:
+                    show("(/search more for the next page)")
             else:
                 pretty_print_system(data)
     except websockets.ConnectionClosed:
-        print("Connection closed by server.")
+        show("Connection closed by server.")
     except Exception as e:
-        print(f"Receive loop error: {e}")
+        show(f"Receive loop error: {e}")
+
+async def handshake(ws, username: str) -> bool:
+    """
+    Register, or resume the previous session after a reconnect. On success the
+    server has our rooms again (resume) or we re-join them (fresh register).
+    """
+    global ENCODING, SESSION
+    if SESSION:
+        first = {"type": "resume", "session": SESSION, "rooms": JOINED}
+    else:
+        first = {"type": "register", "username": username}
+    if CLIENT_ENCODING == "msgpack" and msgpack is not None:
+        first["encoding"] = "msgpack"
+    ENCODING = "json"  # until the server agrees to anything else
+    await ws.send(pack(first))
+
+    data = json.loads(await asyncio.wait_for(ws.recv(), timeout=10.0))
+    typ = data.get("type")
+    if typ not in ("registered", "resumed"):
+        pretty_print_system(data)
+        if SESSION:
+            SESSION = None  # expired or unknown: register from scratch on the next attempt
+        return False
+    ENCODING = data.get("encoding", "json")
+    SESSION = data.get("session")
+    if typ == "resumed":
+        for room, reason in data.get("errors", {}).items():
+            JOINED.pop(room, None)
+            show(f"[ERROR] {room}: {reason}")
+        show(f"(Reconnected as {username}; rooms: {', '.join(data.get('rooms', [])) or 'none'})")
+    else:
+        show(f"Registered as {username}.")
+        # The server put us back in the rooms saved for this username
+        for room in data.get("rooms", []):
+            JOINED.setdefault(room, None)
+        if data.get("rooms"):
+            show(f"(Rejoined: {', '.join(data['rooms'])})")
+        # A fresh session (e.g. the old one expired): join our rooms again one by one
+        for room in JOINED:
+            await ws.send(pack({"type": "create_room", "room": room}))
+            await ws.send(pack({"type": "join_room", "room": room}))
+    # Subscriptions don't outlive a connection, and the deltas sent meanwhile are lost
+    for kind, room in WATCHING:
+        payload = {"type": "list_rooms"} if kind == "rooms" else {"type": "list_users", "room": room}
+        await ws.send(pack({**payload, "subscribe": True}))
+    return True
+
+
+async def connection_loop(uri: str, username: str, conn: dict, token: Optional[str] = None):
+    """Keep a connection open: reconnect with jittered exponential backoff until /quit."""
+    attempt = 0
+    headers = {"Authorization": f"Bearer {token}"} if token else None
+    while not conn["quit"]:
+        retry_after = 0.0
+        try:
+            async with websockets.connect(uri, additional_headers=headers) as ws:
+                if await handshake(ws, username):
+                    attempt = 0
+                    conn["ws"] = ws
+                    await recv_loop(ws)
+        except websockets.InvalidStatus as e:
+            # 503 from an overloaded server says how long to stay away
+            retry = e.response.headers.get("Retry-After", "")
+            retry_after = float(retry) if retry.isdigit() else 0.0
+            show(f"Could not connect to server at {uri}: {e}")
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            show(f"Could not connect to server at {uri}: {e}")
+        conn["ws"] = None
+        cache_call("disconnected")
+        if conn["quit"]:
+            return
+        # Jitter on top of Retry-After too, or the refused clients all return at once
+        delay = retry_after + backoff_delay(attempt)
+        attempt += 1
+        show(f"(Reconnecting in {delay:.1f}s)")
+        await asyncio.sleep(delay)
+
+
+def scripted_lines(args, username: str):
+    """What --bot / --replay send: join the room first, then messages or the file's lines."""
+    yield f"/create {args.room}"
+    yield f"/join {args.room}"
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as f:
+            yield from (line.rstrip("\n") for line in f)
+    else:
+        i = 0
+        while True:
+            i += 1
+            yield f"{username} message {i}"
+
 
 # Main entry point
-async def main():
+async def main(args):
     """
     Connects to server, registers username, and runs send/recv loops concurrently.
+    Lost connections are re-established and the session resumed in the background.
     """
+    global CACHE
     default_uri = DEFAULT_URI
-    uri = input(f"server uri (default {default_uri}): ").strip() or default_uri
-    username = input("username: ").strip()
+    uri = args.uri or input(f"server uri (default {default_uri}): ").strip() or default_uri
+    username = args.username or input("username: ").strip()
     if not username:
         print("username required. exiting.")
         return
 
+    RENDER.quiet = args.quiet
+    RENDER.start()
+    if HISTORY_CACHE:
+        try:
+            CACHE = HistoryCache(history_cache.cache_path(CACHE_DIR, uri, username),
+                                 max_rooms=CACHE_ROOMS, room_size=CACHE_ROOM_SIZE)
+        except (OSError, sqlite3.Error) as e:
+            show(f"(History cache off: {e})")
+    conn = {"ws": None, "quit": False}
+    state = {"room": args.room}
+    tasks = [asyncio.create_task(connection_loop(uri, username, conn, args.token))]
+    if args.bot or args.replay:
+        # +2: the /create and /join in front of the script
+        count = args.count + 2 if args.count else 0
+        tasks.append(asyncio.create_task(bot_loop(conn, state, scripted_lines(args, username), args.rate, count)))
+        tasks.append(asyncio.create_task(status_loop()))
+    else:
+        tasks.append(asyncio.create_task(send_loop(conn, state)))
     try:
-        async with websockets.connect(uri) as ws:
-            # Register
-            await ws.send(json.dumps({"type": "register", "username": username}, ensure_ascii=False))
+        done, pending = await asyncio.wait(tasks[:2], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
+        cache_call("close")
+        CACHE = None
+        await RENDER.stop()
+        if sys.stdin.isatty():
+            os.set_blocking(sys.stdin.fileno(), True)  # the stdin pipe reader left it non-blocking
 
-            # Wait for registered ack (optional — not strictly required if server doesn't ack)
-            try:
-                raw = await asyncio.wait_for(ws.recv(), timeout=2.0)
-                data = json.loads(raw)
-                if data.get("type") == "registered":
-                    print(f"Registered as {username}.")
-                else:
-                    # print server message (could be error)
-                    pretty_print_system(data)
-            except asyncio.TimeoutError:
-                # server didn't reply in time — proceed anyway
-                pass
-
-            # Run send and receive concurrently
-            send_task = asyncio.create_task(send_loop(ws, username))
-            recv_task = asyncio.create_task(recv_loop(ws))
-
-            done, pending = await asyncio.wait(
-                [send_task, recv_task],
-                return_when=asyncio.FIRST_COMPLETED,
-            )
 
-            for t in pending:
-                t.cancel()
-
-    except Exception as e:
-        print(f"Could not connect to server at {uri}: {e}")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chat CLI client")
+    parser.add_argument("--uri", help=f"server URI (default {DEFAULT_URI}; asked for if not given)")
+    parser.add_argument("--username", help="asked for if not given")
+    parser.add_argument("--token", default=AUTH_TOKEN, help="handshake token (python -m app.auth <username>)")
+    parser.add_argument("--room", default=DEFAULT_ROOM, help="current room at start (default %(default)s)")
+    parser.add_argument("--bot", action="store_true", help="send generated messages to --room")
+    parser.add_argument("--replay", metavar="FILE", help="send the lines of FILE (commands or messages)")
+    parser.add_argument("--rate", type=float, default=10, help="--bot/--replay lines per second; 0 = unpaced")
+    parser.add_argument("--count", type=int, default=0, help="--bot/--replay lines to send; 0 = all / forever")
+    parser.add_argument("--quiet", action="store_true", help="count chat messages instead of showing them")
+    args = parser.parse_args(argv)
+    if args.bot and args.replay:
+        parser.error("--bot and --replay are exclusive")
+    return args
 
 #  Entry point
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args()))
     except KeyboardInterrupt:
         print("\nbye")
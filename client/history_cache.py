@@ -0,0 +1,289 @@
+"""
+client/history_cache.py
+
+On-disk cache of room history for the CLI, one SQLite file per server and
+username. Messages are recorded as they arrive, so /history renders at
+once from disk and only asks the server for what came after.
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+from collections import OrderedDict, deque
+
+PAGE = 50  # messages per history request and per page shown
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    room TEXT NOT NULL, ms INTEGER NOT NULL, id TEXT NOT NULL, sender TEXT, content TEXT,
+    PRIMARY KEY (room, ms, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rooms (
+    room TEXT PRIMARY KEY, synced_ms INTEGER, synced_id TEXT, used INTEGER NOT NULL
+);
+"""
+
+
+def default_dir():
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "chat-cli")
+
+
+def cache_path(directory, uri, username):
+    """The cache file for `username` on the server at `uri`."""
+    server = re.sub(r"[^A-Za-z0-9._-]+", "_", uri.split("://", 1)[-1]).strip("_")
+    user = re.sub(r"[^A-Za-z0-9._-]+", "_", username)
+    return os.path.join(directory, f"{server}-{user}.sqlite3")
+
+
+def parse_cursor(cursor):
+    """(ms, id) for a "<ms>:<id>" cursor, or None."""
+    try:
+        ms, msg_id = str(cursor).split(":", 1)
+        return int(ms), msg_id
+    except ValueError:
+        return None
+
+
+def make_cursor(key):
+    return f"{key[0]}:{key[1]}"
+
+
+# ------------------------
+# Per-room state
+# ------------------------
+class RoomState:
+    """
+    The cached rows of one room hold every message from the oldest one up
+    to `synced_to` (ms, id) without a gap; rows after it came in while the
+    cache wasn't following the room and may have gaps before them.
+    `live` means the cache is current: the room is joined, and every
+    message since the last sync has been recorded, so /history needs no
+    request at all. It never outlives a connection.
+    """
+
+    __slots__ = ("synced_to", "count", "live")
+
+    def __init__(self, synced_to=None, count=0):
+        self.synced_to = synced_to
+        self.count = count
+        self.live = False
+
+
+# ------------------------
+# Cache
+# ------------------------
+class HistoryCache:
+    """
+    Keeps the newest `room_size` messages of at most `max_rooms` rooms; the
+    least recently used room is dropped whole. Writes are committed at most
+    every `commit_interval` seconds (WAL, no fsync per message).
+
+    history(), older() and replayed() hand back what to show from disk and
+    the request to send, if any; on_page() takes the server's reply. A
+    sync asks for pages after `synced_to` until one comes back short;
+    after `room_size // PAGE` full pages the gap is too big to fill, and
+    the room starts over from the newest page.
+    """
+
+    def __init__(self, path, max_rooms=100, room_size=1000, commit_interval=1.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # A second client with the same file waits at most this long for a lock
+        self.db = sqlite3.connect(path, timeout=0.2)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.max_rooms = max_rooms
+        self.room_size = max(room_size, PAGE)
+        self.commit_interval = commit_interval
+        self.rooms = OrderedDict()  # room -> RoomState, least recently used first
+        self.pending = {}  # room -> deque of (kind, cursor key, full pages so far), one per request sent
+        self.stats = {"cached": 0, "requests": 0, "fetched": 0}
+        self._commit_handle = None
+        counts = dict(self.db.execute("SELECT room, COUNT(*) FROM messages GROUP BY room"))
+        for room, ms, msg_id in self.db.execute("SELECT room, synced_ms, synced_id FROM rooms ORDER BY used"):
+            self.rooms[room] = RoomState((ms, msg_id) if ms is not None else None, counts.get(room, 0))
+
+    # -- bookkeeping --
+
+    def _room(self, room):
+        state = self.rooms.get(room)
+        if state is None:
+            state = self.rooms[room] = RoomState()
+            while len(self.rooms) > self.max_rooms:
+                old, _ = self.rooms.popitem(last=False)
+                self.db.execute("DELETE FROM messages WHERE room = ?", (old,))
+                self.db.execute("DELETE FROM rooms WHERE room = ?", (old,))
+        else:
+            self.rooms.move_to_end(room)
+        return state
+
+    def _store(self, room, state, messages):
+        """Insert history-shaped messages (dicts with id, timestamp, ...); returns their newest key."""
+        before = self.db.total_changes
+        self.db.executemany(
+            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?)",
+            [(room, m["timestamp"], str(m["id"]), m.get("sender"), m.get("content", "")) for m in messages])
+        state.count += self.db.total_changes - before
+        if state.count >= self.room_size + PAGE:
+            self._trim(room, state)
+        self._schedule_commit()
+        return max(((m["timestamp"], str(m["id"])) for m in messages), default=None)
+
+    def _trim(self, room, state):
+        # Dropping the oldest rows keeps the rest gap-free
+        row = self.db.execute("SELECT ms, id FROM messages WHERE room = ? ORDER BY ms DESC, id DESC "
+                              "LIMIT 1 OFFSET ?", (room, self.room_size - 1)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM messages WHERE room = ? AND (ms, id) < (?, ?)", (room, *row))
+            state.count = self.room_size
+
+    def _rows(self, room, upto, before=None, limit=PAGE):
+        """Up to `limit` rows at or below `upto` (and below `before`), oldest first."""
+        if upto is None:
+            return []
+        query = "SELECT ms, id, sender, content FROM messages WHERE room = ? AND (ms, id) <= (?, ?)"
+        args = [room, *upto]
+        if before is not None:
+            query += " AND (ms, id) < (?, ?)"
+            args += before
+        rows = self.db.execute(query + " ORDER BY ms DESC, id DESC LIMIT ?", (*args, limit)).fetchall()
+        return [{"id": msg_id, "sender": sender, "content": content, "timestamp": ms}
+                for ms, msg_id, sender, content in reversed(rows)]
+
+    def _oldest(self, room):
+        return self.db.execute("SELECT ms, id FROM messages WHERE room = ? ORDER BY ms, id LIMIT 1",
+                               (room,)).fetchone()
+
+    def _newest(self, room):
+        return self.db.execute("SELECT ms, id FROM messages WHERE room = ? ORDER BY ms DESC, id DESC LIMIT 1",
+                               (room,)).fetchone()
+
+    def _request(self, room, kind, cursor=None, pages=0):
+        self.pending.setdefault(room, deque()).append((kind, cursor, pages))
+        self.stats["requests"] += 1
+        payload = {"type": "history", "room": room, "limit": PAGE}
+        if cursor is not None:
+            payload[kind] = make_cursor(cursor)
+        return payload
+
+    # -- what the connection sees --
+
+    def add(self, room, msg_id, ms, sender, content):
+        """A live message; it extends the gap-free part only while the room is followed."""
+        state = self._room(room)
+        newest = self._store(room, state, [{"id": msg_id, "timestamp": ms, "sender": sender, "content": content}])
+        if state.live and (state.synced_to is None or newest > state.synced_to):
+            state.synced_to = newest
+
+    def replayed(self, room, since, messages, truncated):
+        """A resume replay of everything after `since`: back in step if that is where the cache stopped."""
+        state = self._room(room)
+        newest = self._store(room, state, messages)
+        if not truncated and since is not None and parse_cursor(since) == state.synced_to:
+            state.synced_to = max(newest or state.synced_to, state.synced_to)
+            state.live = True
+
+    def disconnected(self):
+        """Messages sent while away aren't recorded: stop trusting any room as current."""
+        for state in self.rooms.values():
+            state.live = False
+        self.pending.clear()
+
+    def left(self, room):
+        state = self.rooms.get(room)
+        if state is not None:
+            state.live = False
+
+    # -- /history --
+
+    def history(self, room):
+        """(cached messages to show now, request to send or None) for /history <room>."""
+        state = self._room(room)
+        cached = self._rows(room, state.synced_to)
+        self.stats["cached"] += len(cached)
+        if state.live:
+            return cached, None
+        if state.synced_to is None:
+            return cached, self._request(room, "newest")
+        return cached, self._request(room, "after", state.synced_to)
+
+    def older(self, room, cursor):
+        """(cached page before `cursor`, or [] and the request to send) for /history <room> more."""
+        state = self._room(room)
+        key = parse_cursor(cursor)
+        cached = self._rows(room, state.synced_to, before=key) if key is not None else []
+        if len(cached) == PAGE:
+            self.stats["cached"] += len(cached)
+            return cached, None
+        return [], self._request(room, "before", key)
+
+    def on_page(self, data, joined):
+        """
+        Take a history reply: returns the kind of request it answers
+        ("newest", "after" or "before") and the follow-up request or None.
+        `joined`: the room's live messages reach this client, so a finished
+        sync leaves it current.
+        """
+        room, messages = data.get("room"), data.get("messages", [])
+        queue = self.pending.get(room)
+        if not queue:
+            return "newest", None  # not ours (e.g. sent before a reconnect)
+        kind, cursor, pages = queue.popleft()
+        state = self._room(room)
+        self.stats["fetched"] += len(messages)
+        if kind == "before":
+            oldest = self._oldest(room)
+            # Joins up with the cache only if the cursor lies in its gap-free part
+            if None not in (oldest, cursor, state.synced_to) and oldest <= cursor <= state.synced_to:
+                self._store(room, state, messages)
+            return kind, None
+        if kind == "newest" and messages:
+            # Rows older than the newest page may have gaps: the page is where the cache starts
+            first = messages[0]
+            self.db.execute("DELETE FROM messages WHERE room = ? AND (ms, id) < (?, ?)",
+                            (room, first["timestamp"], str(first["id"])))
+            state.count = self.db.execute("SELECT COUNT(*) FROM messages WHERE room = ?", (room,)).fetchone()[0]
+        newest = self._store(room, state, messages)
+        if kind == "after" and len(messages) >= PAGE:
+            state.synced_to = newest
+            if pages + 1 >= self.room_size // PAGE:
+                self.db.execute("DELETE FROM messages WHERE room = ?", (room,))
+                state.count, state.synced_to = 0, None
+                return kind, self._request(room, "newest")
+            return kind, self._request(room, "after", newest, pages + 1)
+        if joined:
+            # Complete up to now; anything recorded after the page came in live since
+            state.synced_to = self._newest(room)
+            state.live = True
+        elif newest is not None:
+            state.synced_to = max(newest, state.synced_to) if state.synced_to else newest
+        return kind, None
+
+    # -- persistence --
+
+    def _schedule_commit(self):
+        if self._commit_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.commit()
+            return
+        self._commit_handle = loop.call_later(self.commit_interval, self.commit)
+
+    def commit(self):
+        self._commit_handle = None
+        # At most max_rooms rows; `used` is the LRU order
+        self.db.executemany(
+            "INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?)",
+            [(room, *(state.synced_to or (None, None)), i) for i, (room, state) in enumerate(self.rooms.items())])
+        self.db.commit()
+
+    def close(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+        self.commit()
+        self.db.close()
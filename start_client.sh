@@ -4,4 +4,4 @@ set -euo pipefail
 if [ -f .venv/bin/activate ]; then
   source .venv/bin/activate
 fi
-python -m client.cli
+python -m client.cli "$@"
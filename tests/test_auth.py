@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import pytest
+import websockets
+from app import auth, backplane, handlers, server
+from app.auth import TokenCache
+from app.backplane import LocalBackplane, LoopbackHub
+
+NOW = 1_700_000_000
+
+
+def test_tokens_verify_until_they_expire_and_only_with_our_key():
+    token = auth.issue("alice", ttl=60, now=NOW)
+    assert auth.verify(token, now=NOW + 59) == ("alice", NOW + 60)
+    assert auth.verify(token, now=NOW + 60) is None
+    header, claims, sig = token.split(".")
+    other = auth.issue("mallory", ttl=60, now=NOW).split(".")[1]
+    assert auth.verify(f"{header}.{other}.{sig}", now=NOW) is None  # claims swapped under alice's signature
+    unsigned = auth._b64(b'{"alg":"none"}')
+    assert auth.verify(f"{unsigned}.{claims}.", now=NOW) is None
+    for junk in ("", "a.b", "a.b.c", None):
+        assert auth.verify(junk, now=NOW) is None
+
+
+def test_auth_required_refuses_to_start_without_a_secret_of_its_own():
+    for public in ("", "dev-token", "change-me"):
+        with pytest.raises(RuntimeError, match="AUTH_SECRET"):
+            auth.check_secret(True, public)
+    auth.check_secret(False, "")
+    auth.check_secret(True, "not-in-the-repo")
+    env = {**os.environ, "AUTH_REQUIRED": "1", "AUTH_SECRET": ""}
+    started = subprocess.run([sys.executable, "-c", "import app.server"], env=env, capture_output=True, text=True)
+    assert started.returncode != 0 and "AUTH_SECRET" in started.stderr
+
+
+def test_cache_skips_the_crypto_for_known_tokens_and_forgets_expired_ones(monkeypatch):
+    calls = []
+    real = auth.verify
+    monkeypatch.setattr(auth, "verify", lambda token, now=None: calls.append(token) or real(token, now))
+    cache = TokenCache(size=2)
+    a, b, c = (auth.issue(name, ttl=60, now=NOW) for name in ("alice", "bob", "carol"))
+    assert [cache.authenticate(a, now=NOW) for _ in range(3)] == ["alice"] * 3
+    assert len(calls) == 1
+    cache.authenticate(b, now=NOW), cache.authenticate(a, now=NOW), cache.authenticate(c, now=NOW)
+    assert list(cache.entries) == [a, c]  # bob was least recently used
+    assert cache.authenticate(a, now=NOW + 61) is None and a not in cache.entries
+    assert cache.authenticate("forged.token.x", now=NOW) is None and len(cache.entries) == 1
+
+
+def test_handshake_rejects_before_the_upgrade_and_binds_the_user(monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_REQUIRED", True)
+    auth.CACHE.clear()
+
+    async def register(uri, username, token):
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        async with websockets.connect(uri, additional_headers=headers) as ws:
+            await ws.send(json.dumps({"type": "register", "username": username}))
+            return json.loads(await ws.recv())
+
+    async def scenario():
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear()
+        backplane.node = LocalBackplane(LoopbackHub(), "local")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+        seen = []
+        real_handler = server.handler
+
+        async def counting_handler(websocket):
+            seen.append(websocket)
+            await real_handler(websocket)
+
+        try:
+            async with websockets.serve(counting_handler, "127.0.0.1", 0,
+                                        process_request=auth.process_request) as srv:
+                uri = f"ws://127.0.0.1:{srv.sockets[0].getsockname()[1]}"
+                refused = []
+                for token in (None, "not-a-token", auth.issue("alice", ttl=-1)):
+                    with pytest.raises(websockets.InvalidStatus) as e:
+                        await register(uri, "alice", token)
+                    refused.append(e.value.response.status_code)
+                token = auth.issue("alice")
+                ok = await register(uri, "alice", token)
+                again = await register(uri, "alice", token)  # a reconnect: served from the cache
+                wrong = await register(uri, "bob", token)
+                return refused, len(seen), ok, again, wrong
+        finally:
+            await backplane.node.stop()
+
+    before = dict(auth.STATS)
+    refused, handled, ok, again, wrong = asyncio.run(scenario())
+    assert refused == [401, 401, 401] and handled == 3  # the refused ones never reached the handler
+    assert ok["type"] == again["type"] == "registered"
+    assert wrong == {"type": "error", "message": "Token was issued to another user."}
+    assert auth.STATS["verified"] - before["verified"] == 1 and auth.STATS["cached"] - before["cached"] == 2
@@ -0,0 +1,143 @@
+import asyncio
+import pytest
+from app import backplane, handlers
+from app.backplane import Backplane, LocalBackplane, LoopbackHub, IpcBackplane, IpcHub
+
+
+class Recorder:
+    # Callbacks for a bare backplane node standing in for another server
+    def __init__(self):
+        self.frames = []
+        self.events = []
+
+    async def on_frame(self, room, frame):
+        self.frames.append((room, frame))
+
+    def on_event(self, event):
+        self.events.append(event)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.remote_address = ("127.0.0.1", 1)
+
+    async def send(self, frame, text=None):
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_frames_reach_only_nodes_watching_the_room():
+    async def scenario():
+        hub = LoopbackHub()
+        a, b, c = LocalBackplane(hub, "a"), LocalBackplane(hub, "b"), LocalBackplane(hub, "c")
+        rb, rc = Recorder(), Recorder()
+        await a.start(Recorder().on_frame, Recorder().on_event)
+        await b.start(rb.on_frame, rb.on_event)
+        await c.start(rc.on_frame, rc.on_event)
+        b.watch("lobby")
+        a.publish("lobby", b"hi")
+        await settle()
+        return rb.frames, rc.frames
+
+    b_frames, c_frames = asyncio.run(scenario())
+    assert b_frames == [("lobby", b"hi")]
+    assert c_frames == []
+
+
+def test_a_backend_without_publish_fails_when_constructed():
+    class Forgetful(Backplane):
+        def publish(self, room, frame):
+            pass
+
+    with pytest.raises(TypeError, match="publish_event"):
+        Forgetful()
+
+
+def test_events_replicate_and_late_nodes_get_a_snapshot():
+    async def scenario():
+        hub = LoopbackHub()
+        a, b = LocalBackplane(hub, "a"), LocalBackplane(hub, "b")
+        rb = Recorder()
+        await a.start(Recorder().on_frame, Recorder().on_event)
+        await b.start(rb.on_frame, rb.on_event)
+        a.publish_event({"op": "online", "user": "alice"})
+        a.publish_event({"op": "create_room", "room": "lobby", "user": "alice"})
+        await settle()
+        late = LocalBackplane(hub, "c")
+        snapshot = await late.start(Recorder().on_frame, Recorder().on_event)
+        return rb.events, snapshot
+
+    events, snapshot = asyncio.run(scenario())
+    assert [e["op"] for e in events] == ["online", "create_room"]
+    assert all(e["node"] == "a" for e in events)
+    assert snapshot == {"rooms": {"lobby": {"alice"}}, "online": {"alice": "a"}}
+
+
+def test_handlers_publish_room_messages_to_other_nodes():
+    async def scenario():
+        hub = LoopbackHub()
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear()
+        backplane.node = LocalBackplane(hub, "local")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+        remote, rec = LocalBackplane(hub, "remote"), Recorder()
+        await remote.start(rec.on_frame, rec.on_event)
+        remote.watch("lobby")
+
+        ws = FakeWebSocket()
+        await handlers.register_user("alice", ws)
+        await handlers.handle_create_room("alice", {"room": "lobby"})
+        # bob lives on the remote node
+        remote.publish_event({"op": "online", "user": "bob"})
+        remote.publish_event({"op": "join", "room": "lobby", "user": "bob"})
+        await settle()
+        await handlers.handle_message("alice", {"room": "lobby", "message": "hello"})
+        await settle()
+        members = set(handlers.ROOMS["lobby"].members)
+        online = dict(handlers.ONLINE)
+        await handlers.unregister_user("alice", ws)
+        await settle()
+        backplane.node = LocalBackplane()
+        return rec, members, online
+
+    rec, members, online = asyncio.run(scenario())
+    assert members == {"alice", "bob"}
+    assert online == {"alice": "local", "bob": "remote"}
+    assert len(rec.frames) == 1 and b'"content":"hello"' in rec.frames[0][1]
+    assert rec.events[-1] == {"op": "offline", "user": "alice", "rooms": ["lobby"], "node": "local"}
+
+
+def test_ipc_hub_routes_frames_and_announces_dead_workers(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "hub.sock")
+        hub = await IpcHub(path).start()
+        a, b = IpcBackplane(path, "w0"), IpcBackplane(path, "w1")
+        ra, rb = Recorder(), Recorder()
+        await a.start(ra.on_frame, ra.on_event)
+        await b.start(rb.on_frame, rb.on_event)
+        b.watch("lobby")
+        a.publish_event({"op": "online", "user": "alice"})
+        a.publish_event({"op": "join", "room": "lobby", "user": "alice"})
+        await asyncio.sleep(0.05)
+        a.publish("lobby", b'{"type":"message"}')
+        a.publish("elsewhere", b"ignored")
+        await asyncio.sleep(0.05)
+        await a.stop()  # worker w0 goes away
+        await asyncio.sleep(0.05)
+        snapshot = await IpcBackplane(path, "w2").start(Recorder().on_frame, Recorder().on_event)
+        await b.stop()
+        await hub.stop()
+        return rb, snapshot
+
+    rb, snapshot = asyncio.run(scenario())
+    assert rb.frames == [("lobby", b'{"type":"message"}')]
+    assert [e["op"] for e in rb.events] == ["online", "join", "offline"]
+    assert rb.events[-1]["rooms"] == ["lobby"]
+    assert snapshot == {"rooms": {"lobby": set()}, "online": {}}
@@ -0,0 +1,107 @@
+import asyncio
+from app import broadcast
+from app.broadcast import Outbound, fanout, DROP_OLDEST, DROP_CONNECTION, BACKPRESSURE
+
+
+class FakeWebSocket:
+    # Records sent frames; `gate` lets a test stall the writer like a slow client
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def send(self, frame, text=None):
+        await self.gate.wait()
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+
+def test_fanout_delivers_to_every_member():
+    async def scenario():
+        sockets = [FakeWebSocket() for _ in range(5)]
+        outs = [Outbound(ws).start() for ws in sockets]
+        await fanout("hello", outs)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        for o in outs:
+            await o.stop()
+        return sockets
+
+    sockets = asyncio.run(scenario())
+    assert all(ws.sent == ["hello"] for ws in sockets)
+
+
+def test_slow_consumer_does_not_block_others():
+    async def scenario():
+        fast, slow = FakeWebSocket(), FakeWebSocket()
+        slow.gate.clear()
+        outs = [Outbound(slow, maxsize=2).start(), Outbound(fast, maxsize=2).start()]
+        for i in range(5):
+            await fanout(i, outs, policy=DROP_OLDEST)
+            await asyncio.sleep(0)
+        dropped = outs[0].dropped
+        for o in outs:
+            await o.stop()
+        return fast, dropped
+
+    fast, dropped = asyncio.run(scenario())
+    assert fast.sent == [0, 1, 2, 3, 4]
+    assert dropped > 0
+
+
+def test_drop_connection_policy_closes_slow_socket():
+    async def scenario():
+        slow = FakeWebSocket()
+        slow.gate.clear()
+        out = Outbound(slow, maxsize=1).start()
+        for i in range(4):
+            await fanout(i, [out], policy=DROP_CONNECTION)
+        await asyncio.sleep(0)
+        await out.stop()
+        return slow, out
+
+    slow, out = asyncio.run(scenario())
+    assert out.closed
+    assert slow.closed_with == broadcast.SLOW_CONSUMER_CLOSE_CODE
+
+
+def test_backpressure_policy_waits_for_room():
+    async def scenario():
+        slow = FakeWebSocket()
+        slow.gate.clear()
+        out = Outbound(slow, maxsize=1).start()
+        await fanout("a", [out], policy=BACKPRESSURE)
+        await asyncio.sleep(0)  # writer takes "a" and stalls
+        await fanout("b", [out], policy=BACKPRESSURE)  # fills the queue
+        pending = asyncio.ensure_future(fanout("c", [out], policy=BACKPRESSURE))
+        await asyncio.sleep(0.01)
+        waited = not pending.done()
+        slow.gate.set()
+        await asyncio.wait_for(pending, 1)
+        await asyncio.sleep(0.01)
+        await out.stop()
+        return slow, waited
+
+    slow, waited = asyncio.run(scenario())
+    assert waited
+    assert slow.sent == ["a", "b", "c"]
+
+
+def test_queued_frames_count_what_is_waiting():
+    async def scenario():
+        slow = FakeWebSocket()
+        slow.gate.clear()
+        before = broadcast.queued_frames()
+        out = Outbound(slow, maxsize=3).start()
+        for i in range(5):
+            out.offer(i, DROP_OLDEST)
+        await asyncio.sleep(0)  # the writer takes one and stalls on it
+        waiting = broadcast.queued_frames() - before
+        await out.stop()
+        return waiting, broadcast.queued_frames() - before
+
+    waiting, after = asyncio.run(scenario())
+    assert waiting == 2 and after == 0
@@ -0,0 +1,50 @@
+import asyncio
+import io
+import json
+from client import cli
+from client.cli import Renderer
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(json.loads(frame))
+
+
+def test_renderer_coalesces_lines_and_bounds_the_backlog():
+    async def scenario():
+        out = io.StringIO()
+        render = Renderer(out, fps=1000, scrollback=3).start()
+        for i in range(5):
+            render.show(f"line {i}")
+        assert out.getvalue() == ""  # nothing written until the next frame
+        await asyncio.sleep(0.01)
+        render.show("late")
+        await render.stop()
+        return out.getvalue().splitlines(), render
+
+    lines, render = asyncio.run(scenario())
+    assert lines == ["... 2 lines skipped ...", "line 2", "line 3", "line 4", "late"]
+    assert render.stats["writes"] == 2 and list(render.scrollback) == ["line 3", "line 4", "late"]
+
+
+def test_bot_loop_paces_scripted_lines():
+    async def scenario():
+        ws = FakeWebSocket()
+        conn, state = {"ws": ws, "quit": False}, {"room": None}
+        cli.RENDER = Renderer(io.StringIO(), fps=0)
+        lines = ["/join soak"] + [f"hello {i}" for i in range(100)]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await cli.bot_loop(conn, state, iter(lines), rate=1000, count=51)
+        return ws.sent, loop.time() - started - 1.0  # minus the wait for trailing deliveries
+
+    try:
+        sent, elapsed = asyncio.run(scenario())
+    finally:
+        cli.RENDER = Renderer()
+    assert sent[0] == {"type": "join_room", "room": "soak"}
+    assert sent[1] == {"type": "message", "room": "soak", "message": "hello 0"} and len(sent) == 51
+    assert 0.04 <= elapsed < 0.5
@@ -0,0 +1,15 @@
+import json
+from app import frames
+
+
+def test_message_frame_matches_client_shape():
+    frame = frames.message_frame("global", "alice", "héllo", "abc", 1000)
+    assert isinstance(frame, bytes)
+    assert json.loads(frame) == {
+        "type": "message",
+        "data": {"room": "global", "sender": "alice", "content": "héllo", "id": "abc", "ts": 1000},
+    }
+
+
+def test_error_frame_round_trips():
+    assert frames.loads(frames.error_frame("nope")) == {"type": "error", "message": "nope"}
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app import history
+from app.memdb import InMemoryCollection
+
+START = datetime(2024, 1, 1)
+
+
+def seeded_collection(n, room="r"):
+    coll = InMemoryCollection()
+    coll.docs = [
+        {"_id": str(ObjectId()), "room": room, "sender": "alice", "content": f"m{i}",
+         "timestamp": START + timedelta(milliseconds=i)}
+        for i in range(n)
+    ]
+    return coll
+
+
+def run(coro):
+    history.BUFFERS.clear()
+    return asyncio.run(coro)
+
+
+def test_start_creates_room_timestamp_index():
+    async def scenario():
+        coll = InMemoryCollection()
+        await history.start(coll)
+        return coll.indexes
+
+    indexes = run(scenario())
+    assert indexes[0][:2] == [("room", 1), ("timestamp", 1)]
+
+
+def test_newest_page_is_served_from_buffer_after_warmup():
+    async def scenario():
+        coll = seeded_collection(300)
+        await history.start(coll)
+        first = await history.fetch("r", 50)
+        second = await history.fetch("r", 50)
+        return coll.find_calls, first, second
+
+    find_calls, first, second = run(scenario())
+    assert find_calls == 1
+    assert [e[3] for e in first] == [f"m{i}" for i in range(250, 300)]
+    assert first == second
+
+
+def test_before_cursor_walks_back_through_all_history():
+    async def scenario():
+        coll = seeded_collection(300)
+        await history.start(coll)
+        seen = []
+        page = await history.fetch("r", 50)
+        while page:
+            seen = page + seen
+            page = await history.fetch("r", 50, before=history.parse_cursor(history.make_cursor(page[0])))
+        return seen
+
+    seen = run(scenario())
+    assert [e[3] for e in seen] == [f"m{i}" for i in range(300)]
+
+
+def test_after_cursor_and_unpersisted_messages_come_from_buffer():
+    async def scenario():
+        coll = seeded_collection(10)
+        await history.start(coll)
+        page = await history.fetch("r", 50)
+        cursor = history.parse_cursor(history.make_cursor(page[-1]))
+        history.record("r", str(ObjectId()), history.to_ms(START + timedelta(seconds=5)), "bob", "fresh")
+        calls = coll.find_calls
+        newer = await history.fetch("r", 50, after=cursor)
+        return newer, coll.find_calls - calls
+
+    newer, extra_calls = run(scenario())
+    assert [e[3] for e in newer] == ["fresh"]
+    assert extra_calls == 0
+
+
+def test_page_payload_exposes_cursors():
+    entry = (1000, "abc", "alice", "hi")
+    payload = history.page_payload("r", [entry])
+    assert payload["before"] == payload["after"] == "1000:abc"
+    assert history.parse_cursor(payload["before"]) == (1000, "abc")
+    assert history.parse_cursor("garbage") is None
+
+
+def test_concurrent_fetches_of_a_cold_room_share_one_query():
+    async def scenario():
+        coll = seeded_collection(300)
+        await history.start(coll)
+        pages = await asyncio.gather(*(history.fetch("r", 50) for _ in range(20)))
+        return coll.find_calls, pages
+
+    find_calls, pages = run(scenario())
+    assert find_calls == 1
+    assert all(p == pages[0] for p in pages)
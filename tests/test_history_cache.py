@@ -0,0 +1,105 @@
+from app import history
+from client.history_cache import PAGE, HistoryCache, parse_cursor
+
+
+def message(i):
+    return {"id": f"m{i:05d}", "timestamp": 1000 + i, "sender": "alice", "content": f"hello {i}"}
+
+
+def answer(log, payload):
+    """The server's reply to a history request for a room whose messages are `log`."""
+    entries = [(m["timestamp"], m["id"], m["sender"], m["content"]) for m in log]
+    limit = payload["limit"]
+    if "after" in payload:
+        entries = [e for e in entries if e[:2] > parse_cursor(payload["after"])][:limit]
+    elif "before" in payload:
+        entries = [e for e in entries if e[:2] < parse_cursor(payload["before"])][-limit:]
+    else:
+        entries = entries[-limit:]
+    return history.page_payload(payload["room"], entries)
+
+
+def sync(cache, log, payload, joined=False):
+    """Answer requests until the cache stops asking; returns the kinds answered."""
+    kinds = []
+    while payload is not None:
+        kind, payload = cache.on_page(answer(log, payload), joined)
+        kinds.append(kind)
+    return kinds
+
+
+def test_history_shows_the_cache_and_fetches_only_what_is_newer(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    log = [message(i) for i in range(120)]
+    cache = HistoryCache(path)
+    cached, payload = cache.history("lobby")
+    assert cached == [] and payload == {"type": "history", "room": "lobby", "limit": PAGE}
+    assert sync(cache, log, payload) == ["newest"]
+    cache.close()
+
+    log += [message(i) for i in range(120, 150)]
+    cache = HistoryCache(path)  # a restarted client
+    cached, payload = cache.history("lobby")
+    assert cached == log[70:120] and payload["after"] == "1119:m00119"
+    assert sync(cache, log, payload, joined=True) == ["after"]
+    assert cache.stats == {"cached": 50, "requests": 1, "fetched": 30}
+    # Joined and in step: live messages keep it current, no request needed
+    cache.add("lobby", "m00150", 1150, "bob", "live")
+    cached, payload = cache.history("lobby")
+    assert payload is None and cached[-2:] == [log[-1], {**message(150), "sender": "bob", "content": "live"}]
+    cache.disconnected()
+    assert cache.history("lobby")[1]["after"] == "1150:m00150"
+
+
+def test_messages_recorded_while_not_following_dont_hide_a_gap(tmp_path):
+    cache = HistoryCache(str(tmp_path / "cache.sqlite3"))
+    log = [message(i) for i in range(100)]
+    sync(cache, log[:60], cache.history("lobby")[1])
+    for m in log[80:85]:  # seen, but what came between wasn't
+        cache.add("lobby", m["id"], m["timestamp"], m["sender"], m["content"])
+    cached, payload = cache.history("lobby")
+    assert cached[-1] == log[59] and payload["after"] == "1059:m00059"
+    sync(cache, log, payload, joined=True)
+    assert cache.history("lobby") == (log[-PAGE:], None)
+
+
+def test_a_gap_too_big_to_page_through_starts_over(tmp_path):
+    cache = HistoryCache(str(tmp_path / "cache.sqlite3"), room_size=2 * PAGE)
+    log = [message(i) for i in range(10)]
+    sync(cache, log, cache.history("lobby")[1])
+    log += [message(i) for i in range(10, 1000)]
+    assert sync(cache, log, cache.history("lobby")[1], joined=True) == ["after", "after", "newest"]
+    assert cache.history("lobby") == (log[-PAGE:], None)
+    assert cache.rooms["lobby"].count == PAGE
+
+
+def test_rooms_are_capped_and_the_least_recently_used_one_goes(tmp_path):
+    cache = HistoryCache(str(tmp_path / "cache.sqlite3"), max_rooms=2, room_size=PAGE)
+    log = [message(i) for i in range(300)]
+    for room in ("a", "b"):
+        for m in log:
+            cache.add(room, m["id"], m["timestamp"], m["sender"], m["content"])
+    count = cache.db.execute("SELECT COUNT(*) FROM messages WHERE room = 'a'").fetchone()[0]
+    assert count < 2 * PAGE and count == cache.rooms["a"].count
+    cache.history("a")  # b is now the least recently used
+    cache.add("c", "x", 1, "carol", "hi")
+    assert list(cache.rooms) == ["a", "c"]
+    assert cache.db.execute("SELECT COUNT(*) FROM messages WHERE room = 'b'").fetchone()[0] == 0
+
+
+def test_older_pages_and_a_resume_replay(tmp_path):
+    cache = HistoryCache(str(tmp_path / "cache.sqlite3"))
+    log = [message(i) for i in range(200)]
+    sync(cache, log, cache.history("lobby")[1], joined=True)
+    cached, payload = cache.older("lobby", "1150:m00150")
+    assert cached == [] and payload["before"] == "1150:m00150"
+    assert sync(cache, log, payload) == ["before"]  # joins up with the cache, so it is kept
+    assert cache.older("lobby", "1150:m00150") == (log[100:150], None)
+
+    cache.disconnected()
+    log += [message(i) for i in range(200, 210)]
+    cache.replayed("lobby", "1199:m00199", log[200:], truncated=False)
+    assert cache.history("lobby") == (log[-PAGE:], None)
+    cache.disconnected()
+    cache.replayed("lobby", "1209:m00209", [message(300)], truncated=True)
+    assert cache.history("lobby")[1]["after"] == "1209:m00209"
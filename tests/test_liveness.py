@@ -0,0 +1,114 @@
+import asyncio
+from app import handlers, liveness
+from app.broadcast import Outbound
+from app.liveness import PING_FRAME, Reaper, TimerWheel
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed_with = None
+
+    async def send(self, frame, text=None):
+        pass
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+
+def reaper(clock, **kwargs):
+    async def on_evict(username, ws):
+        pass
+    return Reaper(on_evict, clock=clock, **{"heartbeat": 10, "idle_timeout": 30, "tick": 1, **kwargs})
+
+
+def test_wheel_returns_keys_once_their_tick_passes():
+    wheel = TimerWheel(tick=1, slots=8)
+    wheel.advance(100)
+    wheel.schedule("a", 102.5)
+    n = wheel.schedule("b", 105)
+    assert wheel.advance(101.9) == []
+    assert wheel.advance(102.0) == ["a"]
+    wheel.cancel("b", n)
+    assert wheel.advance(200) == [] and len(wheel) == 0
+
+
+def test_silent_connection_is_pinged_then_evicted():
+    clock = Clock()
+    r = reaper(clock)
+    ws, out = FakeWebSocket(), Outbound(FakeWebSocket())
+    r.add(ws, "alice", out)
+    clock.now += 10
+    assert r.check() == []
+    assert out.queue.get_nowait() == PING_FRAME
+    clock.now += 19
+    assert r.check() == [] and out.depth() == 0  # pinged once, not every tick
+    clock.now += 1
+    assert r.check() == [("alice", ws)]
+    assert ws not in r.conns
+
+
+def test_activity_pushes_the_deadline_back():
+    clock = Clock()
+    r = reaper(clock)
+    ws, out = FakeWebSocket(), Outbound(FakeWebSocket())
+    r.add(ws, "alice", out)
+    for _ in range(10):
+        clock.now += 8
+        r.touch(ws)
+        assert r.check() == []
+    assert out.depth() == 0
+    r.remove(ws)
+    clock.now += 100
+    assert r.check() == [] and len(r.wheel) == 0
+
+
+def test_evictions_are_batched_per_tick():
+    clock = Clock()
+    r = reaper(clock, heartbeat=0, batch=3)
+    sockets = [FakeWebSocket() for _ in range(7)]
+    for i, ws in enumerate(sockets):
+        r.add(ws, f"u{i}", Outbound(ws))
+    clock.now += 30
+    assert len(r.check()) == 3
+    clock.now += 1
+    assert len(r.check()) == 3
+    clock.now += 1
+    assert len(r.check()) == 1
+    assert r.stats["evicted"] == 7 and not r.conns
+
+
+def test_report_names_the_connections_holding_memory():
+    clock = Clock()
+    r = reaper(clock)
+    quiet, busy = FakeWebSocket(), FakeWebSocket()
+    r.add(quiet, "quiet", Outbound(quiet))
+    out = Outbound(busy)
+    r.add(busy, "busy", out)
+    out.offer(b"x" * 100)
+    out.offer(b"y" * 50)
+    report = r.report(top=1)
+    assert report["connections"] == 2 and report["bytes"] == 150
+    assert report["top"][0]["user"] == "busy" and report["top"][0]["outbound_frames"] == 2
+
+
+def test_evicted_user_leaves_users_and_rooms():
+    async def scenario():
+        ws = FakeWebSocket()
+        await handlers.register_user("idler", ws)
+        handlers.MEMBERSHIP.create("lobby", "idler")
+        await handlers.evict_idle("idler", ws)
+        await asyncio.sleep(0)
+        return ws
+
+    ws = asyncio.run(scenario())
+    assert "idler" not in handlers.USERS
+    assert "idler" not in handlers.MEMBERSHIP.members("lobby")
+    assert ws.closed_with == liveness.IDLE_CLOSE_CODE
@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+import queue
+from app import logger as log
+from app.logger import AsyncQueueHandler, JsonFormatter, Sampler
+
+
+def record(msg, *args, level=logging.INFO, **extra):
+    rec = logging.LogRecord("test", level, __file__, 1, msg, args, None)
+    rec.__dict__.update(extra)
+    return rec
+
+
+def test_sampler_caps_each_template_per_window():
+    now = [0.0]
+    sampler = Sampler(burst=3, window=1.0, clock=lambda: now[0])
+    passed = [sampler.filter(record("User %s connected.", i)) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert sampler.filter(record("Other %s", 1))  # separate template
+    assert sampler.filter(record("Boom %s", 1, level=logging.WARNING))
+    now[0] = 1.5
+    rec = record("User %s connected.", 11)
+    assert sampler.filter(rec) and rec.suppressed == 7
+
+
+def test_handler_defers_formatting_and_never_blocks():
+    q = queue.Queue(maxsize=2)
+    handler = AsyncQueueHandler(q)
+    formatted = []
+
+    class Arg:
+        def __str__(self):
+            formatted.append(1)
+            return "arg"
+
+    for _ in range(3):
+        handler.handle(record("value %s", Arg()))
+    assert q.qsize() == 2 and handler.dropped == 1
+    assert formatted == []  # the writer thread builds the message
+    assert q.get_nowait().getMessage() == "value arg"
+
+
+def test_json_lines_carry_extra_fields():
+    line = json.loads(JsonFormatter().format(record("User %s connected.", "bob", user="bob", suppressed=4)))
+    assert line["msg"] == "User bob connected." and line["user"] == "bob"
+    assert line["suppressed"] == 4 and line["level"] == "INFO" and line["ts"].endswith("+00:00")
+
+
+def test_pipeline_writes_through_the_listener():
+    sink = io.StringIO()
+    log.configure(sink, fmt="json")
+    try:
+        log.get_logger("test.pipeline").info("hello %s", "world", extra={"room": "lobby"})
+        log.shutdown()  # flushes the queue
+        line = json.loads(sink.getvalue().splitlines()[-1])
+        assert line == {**line, "logger": "test.pipeline", "msg": "hello world", "room": "lobby"}
+    finally:
+        log.configure()
@@ -0,0 +1,46 @@
+import pytest
+from app.membership import Membership, MembershipError
+
+
+def test_join_leave_keep_both_directions_in_sync():
+    m = Membership()
+    assert m.create("lobby", "alice")
+    assert not m.create("lobby", "bob")  # existing room: joined instead
+    assert m.join("lobby", "carol") and not m.join("nowhere", "carol")
+    assert m.members("lobby") == {"alice", "bob", "carol"}
+    assert m.rooms["lobby"].members is m.members("lobby")
+    assert m.leave("lobby", "bob") and not m.leave("lobby", "bob")
+    assert m.rooms_of("bob") == set() and "bob" not in m.user_rooms
+
+
+def test_a_users_rooms_are_all_a_disconnect_has_to_leave():
+    m = Membership(max_rooms_per_user=100)
+    for i in range(50):
+        m.create(f"r{i}", "owner")
+    m.join("r3", "alice"), m.join("r7", "alice")
+    assert sorted(m.rooms_of("alice")) == ["r3", "r7"]
+    for name in list(m.rooms_of("alice")):
+        assert m.leave(name, "alice")
+    assert m.members("r3") == {"owner"} and m.rooms_of("alice") == set() and "alice" not in m.user_rooms
+
+
+def test_limits_apply_to_local_requests_only():
+    m = Membership(max_rooms_per_user=2, max_users_per_room=2)
+    m.create("a", "alice"), m.create("b", "alice")
+    with pytest.raises(MembershipError, match="at most 2 rooms"):
+        m.create("c", "alice")
+    assert "c" not in m
+    m.join("a", "bob")
+    with pytest.raises(MembershipError, match="full"):
+        m.join("a", "carol")
+    m.join("a", "alice")  # already a member: not a new join
+    m.join("a", "carol", enforce=False)  # replicated from another node
+    assert m.members("a") == {"alice", "bob", "carol"}
+
+
+def test_load_replaces_a_rooms_members():
+    m = Membership()
+    m.create("lobby", "alice")
+    m.load("lobby", {"bob"})
+    assert m.members("lobby") == {"bob"} and m.rooms_of("alice") == set()
+    assert m.rooms_of("bob") == {"lobby"}
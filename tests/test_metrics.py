@@ -0,0 +1,87 @@
+import asyncio
+import json
+import pytest
+from app import metrics, protocol, server, handlers
+from app.metrics import Collected, Counter, Histogram
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    # Metrics made by a test leave the process-wide registry afterwards
+    before = list(metrics.REGISTRY)
+    yield
+    metrics.REGISTRY[:] = before
+
+
+def scrape():
+    return metrics.render().decode()
+
+
+def test_counter_and_histogram_render_in_text_format():
+    hits = Counter("test_hits_total", "Hits.", ["path"])
+    hits.labels('a "quoted" path').inc(2)
+    latency = Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+    text = scrape()
+    assert "# TYPE test_hits_total counter" in text
+    assert 'test_hits_total{path="a \\"quoted\\" path"} 2' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="1.0"} 3' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "test_latency_seconds_count 4" in text and "test_latency_seconds_sum 3.65" in text
+
+
+def test_collected_metrics_read_state_at_scrape_time():
+    state = {"n": 1}
+    Collected("test_state", "State.", lambda: state["n"])
+    state["n"] = 7
+    assert "test_state 7" in scrape()
+
+
+def test_disabled_metrics_bind_noop_children(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    off = Counter("test_off_total", "Off.", ["kind"])
+    off.labels("x").inc()
+    assert off.labels("x") is metrics._NOOP
+    assert "test_off_total{" not in scrape()
+
+
+def test_dispatch_is_timed_per_command():
+    class FakeWebSocket:
+        async def send(self, frame, text=None):
+            pass
+
+    async def scenario():
+        ws = FakeWebSocket()
+        await handlers.register_user("metered", ws)
+        await server.dispatch(ws, "metered", json.dumps({"type": "list_rooms"}).encode(), "json", None)
+        await server.dispatch(ws, "metered", b"{not json", "json", None)
+        await handlers.unregister_user("metered", ws)
+
+    rooms = protocol.DISPATCH_SECONDS.labels("list_rooms")
+    count, errors = sum(rooms.counts), server.PROTOCOL_ERRORS.labels().value
+    asyncio.run(scenario())
+    assert sum(rooms.counts) == count + 1
+    assert server.PROTOCOL_ERRORS.labels().value == errors + 1
+
+
+def test_endpoint_serves_metrics_and_404s_the_rest():
+    async def get(port, path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def scenario():
+        srv = await metrics.serve("127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        try:
+            return await get(port, "/metrics"), await get(port, "/")
+        finally:
+            srv.close()
+
+    ok, missing = asyncio.run(scenario())
+    assert ok.startswith(b"HTTP/1.1 200") and b"chat_frames_in_total" in ok
+    assert missing.startswith(b"HTTP/1.1 404")
@@ -1,6 +1,10 @@
+import threading
+import time
 import pytest
-from app.models import User, Room, Message
-from datetime import datetime. timedelta
+from bson import ObjectId
+from app import history, models
+from app.models import User, Room, Message, MessageRecord
+from datetime import datetime, timedelta
 
 def test_user_model_defauts():
     # Basic field assignment and defaults
@@ -40,4 +44,41 @@ def test_message_timestamp_ordering():
 def test_invalid_username_length_raises():
     long_name = "x" * 200
     with pytest.raises(Exception):
-        User(username=long_name)
\ No newline at end of file
+        User(username=long_name)
+
+def test_message_record_matches_the_stored_schema():
+    rec = MessageRecord("60d5f483f8d2e3b1c8e4b8a1", "r", "alice", "hi")
+    doc = rec.to_document()
+    assert Message.model_validate(doc).model_dump(by_alias=True) == doc
+    assert ObjectId.is_valid(rec.id)
+    assert history.to_ms(doc["timestamp"]) == rec.ms
+
+
+def test_message_record_ids_and_timestamps_increase():
+    records = [MessageRecord(None, "r", "a", str(i)) for i in range(1000)]
+    assert [r.id for r in records] == sorted(r.id for r in records)
+    assert all(a.ms <= b.ms for a, b in zip(records, records[1:]))
+
+
+def test_ids_carry_into_the_seconds_instead_of_wrapping(monkeypatch):
+    now = time.time_ns()
+    monkeypatch.setattr(models.time, "time_ns", lambda: now)  # all within one millisecond
+    first = models._next_id()
+    monkeypatch.setattr(models, "_id_count", 0xFFFFFF)  # the last counter value of this second
+    keys = [first] + [models._next_id() for _ in range(3)]
+    assert keys == sorted(keys) and len({k[1] for k in keys}) == 4
+    assert {k[0] for k in keys} == {first[0]}
+    assert keys[2][1][-6:] == "000000" and int(keys[2][1][:8], 16) == int(first[1][:8], 16) + 1
+    assert all(ObjectId.is_valid(k[1]) for k in keys)
+
+
+def test_ids_stay_unique_across_threads():
+    keys = [[] for _ in range(4)]
+    threads = [threading.Thread(target=lambda out: out.extend(models._next_id() for _ in range(20_000)),
+                                args=(out,)) for out in keys]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({i for out in keys for _, i in out}) == 80_000
+    assert all(out == sorted(out) for out in keys)  # per thread: ms never back, ids increasing
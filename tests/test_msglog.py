@@ -0,0 +1,143 @@
+import asyncio
+import os
+import threading
+import pytest
+from bson import ObjectId
+from app import history, search
+from app.memdb import InMemoryCollection
+from app.msglog import JournaledCollection, MessageLog, Segment
+
+BASE_MS = 1_700_000_000_000
+
+
+def message(room, i, ms=None):
+    return {"_id": str(ObjectId()), "user_id": "u", "room": room, "sender": f"user{i % 3}",
+            "content": f"message {i} " + ("apple" if i % 5 == 0 else "pear"),
+            "timestamp": history.from_ms(BASE_MS + i // 3 if ms is None else ms), "is_read": False}
+
+
+def open_log(tmp_path, **kwargs):
+    kwargs = {"index_interval": 256, "fsync_interval": 0, "maintenance_interval": 0, **kwargs}
+    return MessageLog(str(tmp_path / "messages"), **kwargs)
+
+
+def segment_files(tmp_path, suffix=".log"):
+    return sorted(name for _, _, names in os.walk(tmp_path / "messages") for name in names if name.endswith(suffix))
+
+
+def test_history_and_search_pages_match_the_in_memory_collection(tmp_path, monkeypatch):
+    async def pages(coll):
+        monkeypatch.setattr(history, "collection", coll)
+        monkeypatch.setattr(search, "collection", coll)
+        newest = await history._query("a", 20)
+        middle = (newest[5][0], newest[5][1])
+        older = await history._query("a", 50, before=middle)
+        newer = await history._query("a", 50, after=(older[3][0], older[3][1]))
+        ranked = await search._stored("a", ["apple"], 2, 5, None)
+        return newest, older, newer, ranked, await coll.count_documents({"room": "b"})
+
+    async def scenario():
+        docs = [message("ab"[i % 2], i) for i in range(600)]
+        memory, log = InMemoryCollection("messages"), open_log(tmp_path)
+        for i in range(0, len(docs), 50):
+            await memory.insert_many([dict(d) for d in docs[i:i + 50]])
+            await log.insert_many([dict(d) for d in docs[i:i + 50]])
+        try:
+            return await pages(memory), await pages(log), log.stats
+        finally:
+            await log.close()
+
+    expected, got, stats = asyncio.run(scenario())
+    assert got == expected
+    assert [len(p) for p in got[:3]] == [20, 50, 50] and got[4] == 300
+    assert stats["appended"] == 600 and stats["commits"] >= 1
+
+
+def test_reopen_indexes_sealed_segments_and_cuts_a_torn_tail(tmp_path, monkeypatch):
+    scanned_on = set()
+    scan_file = Segment.scan_file
+
+    def record(seg, interval):
+        scanned_on.add(threading.get_ident())
+        return scan_file(seg, interval)
+
+    monkeypatch.setattr(Segment, "scan_file", record)
+
+    async def scenario():
+        log = open_log(tmp_path, segment_bytes=4000)
+        await log.insert_many([message("a", i) for i in range(300)])
+        await log.close()
+        active = os.path.join(log.rooms["a"].path, segment_files(tmp_path)[-1])
+        with open(active, "ab") as f:
+            f.write(b"\x40\x00\x00\x00half a record")  # a write cut short by a crash
+        reopened = open_log(tmp_path, segment_bytes=4000)
+        scanned_on.clear()
+        # Both wait for one recovery, run off the event loop
+        room, same = await asyncio.gather(reopened._room("a"), reopened._room("a"))
+        await reopened.insert_many([message("a", 300)])
+        pages = await reopened.find({"room": "a"}).sort("timestamp", -1).limit(3).to_list(length=3)
+        await reopened.close()
+        return room, same, pages
+
+    room, same, pages = asyncio.run(scenario())
+    assert room is same and len(room.segments) > 5
+    assert scanned_on and threading.get_ident() not in scanned_on  # the torn segment had to be scanned
+    assert len(segment_files(tmp_path, ".idx")) == len(segment_files(tmp_path))
+    assert room.next_seq == 302  # seq n is the n-th message appended
+    assert [d["content"] for d in pages] == ["message 300 apple", "message 299 pear", "message 298 pear"]
+
+
+def test_retention_drops_old_segments_and_compaction_merges_small_ones(tmp_path):
+    day = 86_400_000
+
+    async def scenario():
+        # One segment per day, as in a quiet room: 10 small files
+        log = open_log(tmp_path, segment_seconds=86_400, retention_days=3)
+        for d in range(10):
+            await log.insert_many([message("quiet", d * 10 + i, ms=BASE_MS + d * day + i) for i in range(10)])
+        before = len(log.rooms["quiet"].segments)
+        dropped, merged = await log.maintain(now_ms=BASE_MS + 10 * day)
+        docs = await log.find({"room": "quiet"}).to_list()
+        await log.insert_many([message("quiet", 100, ms=BASE_MS + 10 * day)])
+        await log.close()
+        reopened = open_log(tmp_path)
+        after = await reopened.find({"room": "quiet"}).sort("timestamp", 1).to_list()
+        return before, dropped, merged, docs, len((await reopened._room("quiet")).segments), after
+
+    before, dropped, merged, docs, segments, after = asyncio.run(scenario())
+    assert before == 10 and dropped == 7 and merged == 1
+    assert [d["content"].split()[1] for d in docs] == [str(i) for i in range(70, 100)]
+    assert segments == 3 and len(after) == 31  # days 7-8 merged, day 9, and day 10 rolled over by age
+    assert segment_files(tmp_path) == [f"{seq:020d}.log" for seq in (71, 91, 101)]
+
+
+def test_directory_is_locked_to_one_process(tmp_path):
+    async def scenario():
+        first, second = open_log(tmp_path), open_log(tmp_path)
+        await first.start()
+        try:
+            with pytest.raises(RuntimeError, match="in use"):
+                await second.start()
+        finally:
+            await first.close()
+        await second.start()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_journaled_collection_replays_its_last_state(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "users.jsonl")
+        users = JournaledCollection("users", path)
+        await users.update_one({"_id": "alice"}, {"$addToSet": {"rooms": "lobby"}}, upsert=True)
+        await users.update_one({"_id": "alice"}, {"$addToSet": {"rooms": {"$each": ["dev", "ops"]}}})
+        await users.update_one({"_id": "alice"}, {"$pull": {"rooms": "ops"}})
+        await users.insert_one({"_id": "bob", "rooms": []})
+        users.close()
+        again = JournaledCollection("users", path)
+        return await again.find_one({"_id": "alice"}), len(again.docs), again.lines
+
+    alice, count, lines = asyncio.run(scenario())
+    assert alice == {"_id": "alice", "rooms": ["lobby", "dev"]}
+    assert count == 2 and lines == 4
@@ -0,0 +1,123 @@
+import asyncio
+import time
+import pytest
+import websockets
+from app import overload, protocol, server
+from app.overload import Controller, NORMAL, REJECT, THROTTLE, SHED
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+ROOMS = {"lobby": {"alice", "bob"}, "other": {"carol"}, "stadium": {f"fan{i}" for i in range(50)}}
+
+
+def controller(clock, queued=None, **kwargs):
+    depth = queued if queued is not None else [0]
+    return Controller(lag=(0.05, 0.1, 0.25), queued=(100, 200, 400), cooldown=2.0, expensive_rate=2,
+                      room_fanout=6, members=ROOMS.get, measure_queued=lambda: depth[0], clock=clock, **kwargs)
+
+
+def test_level_rises_at_once_and_falls_one_step_per_cooldown():
+    clock, depth = Clock(), [0]
+    c = controller(clock, depth)
+    c.lags = {0: 0.3}
+    assert c.update() == SHED
+    c.lags = {0: 0.0, 1: 0.07}  # the worst loop counts
+    for expected in (SHED, SHED, THROTTLE, THROTTLE, REJECT, REJECT):
+        assert c.update() == expected
+        clock.now += 1.0
+    c.lags = {0: 0.06}  # back above REJECT's threshold: the calm period starts over
+    clock.now += 5
+    assert c.update() == REJECT
+    c.lags = {0: 0.0}
+    depth[0] = 250  # queued frames alone
+    assert c.update() == THROTTLE
+
+
+def test_a_level_still_refusing_work_holds():
+    clock = Clock()
+    c = controller(clock)
+    c.lags = {0: 0.3}
+    c.update()
+    c.lags = {0: 0.0}
+    message = protocol.COMMANDS["message"]
+    for _ in range(6):  # the shed clients keep trying, so it only looks calm
+        clock.now += 1.0
+        c.refuse(message, {"room": "stadium"}), c.refuse(message, {"room": "stadium"})
+        assert c.update() == SHED
+    for expected in (SHED, THROTTLE, THROTTLE, REJECT, REJECT, NORMAL):  # a cooldown after the last refusal
+        clock.now += 1.0
+        assert c.update() == expected
+
+
+def test_one_stall_is_smoothed_away():
+    c = controller(Clock())
+    for _ in range(10):
+        c.sample(0, 0.001)
+    c.sample(0, 0.15)  # a GC pass
+    assert c.update() == NORMAL
+    for _ in range(10):
+        c.sample(0, 0.15)  # sustained
+    assert c.update() == THROTTLE
+
+
+def test_commands_are_shed_in_priority_order():
+    clock = Clock()
+    c = controller(clock)
+    history, message, pong = (protocol.COMMANDS[t] for t in ("history", "message", "pong"))
+    chat = {"room": "lobby", "message": "hi"}
+    c.level = REJECT
+    assert all(c.refuse(history, {}) is None for _ in range(10))
+    c.level = THROTTLE
+    assert [c.refuse(history, {}) is None for _ in range(3)] == [True, True, False]
+    assert c.refuse(protocol.COMMANDS["search"], {}) is None  # its own budget
+    assert all(c.refuse(message, chat) is None for _ in range(10))
+    c.level = SHED
+    # Six deliveries a second per room: three messages to two members
+    assert [c.refuse(message, chat) is None for _ in range(4)] == [True, True, True, False]
+    assert c.refuse(message, {"room": "other"}) is None
+    stadium = {"room": "stadium", "message": "goal"}
+    assert [c.refuse(message, stadium) is None for _ in range(2)] == [True, False]  # capped at the budget
+    assert c.refuse(pong, {}) is None
+    clock.now += 1.0
+    assert c.refuse(history, {}) is None and c.refuse(message, chat) is None
+    assert c.stats == {"connection": 0, "expensive": 1, "chat": 2}
+
+
+def test_overloaded_server_refuses_handshakes_with_retry_after(monkeypatch):
+    c = Controller(lag=(0.05, 10, 10), interval=0.01, cooldown=0.2)
+    monkeypatch.setattr(overload, "controller", c)
+
+    async def handler(websocket):
+        await websocket.send("hi")
+
+    async def connect(uri):
+        async with websockets.connect(uri) as ws:
+            return await ws.recv()
+
+    async def scenario():
+        c.task = asyncio.create_task(c.probe(0, evaluate=True))
+        try:
+            async with websockets.serve(handler, "127.0.0.1", 0, process_request=server.process_request) as srv:
+                uri = f"ws://127.0.0.1:{srv.sockets[0].getsockname()[1]}"
+                assert await connect(uri) == "hi"
+                for _ in range(5):
+                    time.sleep(0.1)  # the loop is stuck
+                    await asyncio.sleep(0.02)
+                assert c.level == REJECT
+                with pytest.raises(websockets.InvalidStatus) as refused:
+                    await connect(uri)
+                await asyncio.sleep(1.0)  # lag decays, then one cooldown
+                return refused.value.response, c.level, await connect(uri)
+        finally:
+            c.task.cancel()
+
+    response, level, greeting = asyncio.run(scenario())
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert level == NORMAL and greeting == "hi" and c.stats["connection"] == 1
@@ -0,0 +1,65 @@
+import asyncio
+from app.memdb import InMemoryCollection
+from app.models import Message
+from app.persistence import MessageWriter
+
+
+class SlowCollection(InMemoryCollection):
+    # Simulates a MongoDB that takes a while to acknowledge writes
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(self.delay)
+        return await super().insert_many(documents, ordered=ordered)
+
+
+def make_message(i):
+    return Message(user_id="60d5f483f8d2e3b1c8e4b8a1", room="r", sender="alice", content=f"m{i}")
+
+
+def test_flushes_when_batch_is_full():
+    async def scenario():
+        coll = InMemoryCollection()
+        writer = MessageWriter(coll, batch_size=10, interval=60).start()
+        for i in range(25):
+            writer.submit(make_message(i))
+        await asyncio.sleep(0.01)
+        full_batches = coll.insert_calls
+        await writer.close()
+        return coll, full_batches, writer.metrics()
+
+    coll, full_batches, metrics = asyncio.run(scenario())
+    assert full_batches == 2          # two full batches went out without waiting for the timer
+    assert len(coll.docs) == 25       # the partial batch was drained on close
+    assert metrics["max_batch_size"] == 10
+    assert coll.docs[0]["room"] == "r" and coll.docs[0]["content"] == "m0"
+
+
+def test_flushes_after_interval():
+    async def scenario():
+        coll = InMemoryCollection()
+        writer = MessageWriter(coll, batch_size=1000, interval=0.02).start()
+        writer.submit(make_message(0))
+        await asyncio.sleep(0.1)
+        written = len(coll.docs)
+        await writer.close()
+        return written
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_slow_mongo_bounds_memory_and_never_blocks_submit():
+    async def scenario():
+        coll = SlowCollection(delay=0.05)
+        writer = MessageWriter(coll, batch_size=5, interval=0.01, max_pending=20).start()
+        accepted = [writer.submit(make_message(i)) for i in range(100)]
+        await writer.close()
+        return coll, accepted, writer.metrics()
+
+    coll, accepted, metrics = asyncio.run(scenario())
+    assert accepted.count(True) == 20
+    assert metrics["dropped"] == 80
+    assert len(coll.docs) == 20
+    assert metrics["max_flush_ms"] >= 40
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import threading
+from app import backplane, handlers, server
+from app.backplane import LocalBackplane, LoopbackHub
+from app.membership import Membership
+from app.presence import ONLINE, ROOMS, Presence
+
+
+def presence(window=0.01):
+    sent = []
+    online, membership = {}, Membership(max_rooms_per_user=10_000, max_users_per_room=10_000)
+    p = Presence(online, membership, lambda username, frame: sent.append((username, json.loads(frame))), window)
+    return p, online, membership, sent
+
+
+def go_online(p, online, user):
+    online[user] = "local"
+    p.note({"op": "online", "user": user})
+
+
+def go_offline(p, online, membership, user):
+    del online[user]
+    rooms = [name for name in list(membership.rooms_of(user)) if membership.leave(name, user)]
+    p.note({"op": "offline", "user": user, "rooms": rooms})
+
+
+def test_pages_follow_the_next_cursor_and_stay_sorted():
+    p, online, membership, _ = presence()
+    for name in ("dave", "alice", "erin", "carol", "bob"):
+        online[name] = "local"
+    users, after = [], None
+    while True:
+        page = p.users_page(after=after, limit=2)
+        assert page["total"] == 5 and len(page["users"]) <= 2
+        users += page["users"]
+        if page["next"] is None:
+            break
+        after = page["next"]
+    assert users == ["alice", "bob", "carol", "dave", "erin"]
+    # Kept in step with events rather than sorted again
+    go_online(p, online, "bea")
+    go_offline(p, online, membership, "carol")
+    assert p.users == sorted(online) and p.users_page(limit=3)["users"] == ["alice", "bea", "bob"]
+
+    membership.create("lobby", "alice"), membership.join("lobby", "bob"), membership.create("dev", "bob")
+    membership.catalog.add("archived")  # known, but nobody in it
+    page = p.rooms_page(limit=1)
+    assert page == {"type": "room_list", "rooms": [{"name": "dev", "members": 1}], "active": 2, "total": 3,
+                    "next": "dev"}
+    assert p.rooms_page(after="dev", limit=1)["rooms"] == [{"name": "lobby", "members": 2}]
+    assert p.users_page("lobby")["users"] == ["alice", "bob"]
+
+
+def test_snapshots_hold_while_other_loops_add_rooms_and_users():
+    p, online, membership, _ = presence()
+
+    def shard(k):
+        # What a home loop and a connection's loop do meanwhile
+        for i in range(3000):
+            membership.create(f"room{k}-{i}", f"user{k}-{i}")
+            with membership.lock:
+                online[f"user{k}-{i}"] = "local"
+
+    threads = [threading.Thread(target=shard, args=(k,)) for k in range(3)]
+    for t in threads:
+        t.start()
+    while any(t.is_alive() for t in threads):
+        p.reset()  # sort afresh each time, copying the indexes mid-change
+        p.users_page(), p.rooms_page()
+    p.reset()
+    assert p.users_page()["total"] == p.rooms_page()["active"] == 9000
+
+
+def test_changes_within_a_window_are_coalesced():
+    p, online, membership, sent = presence()
+
+    async def scenario():
+        go_online(p, online, "bob")
+        p.subscribe("alice", ONLINE)
+        go_offline(p, online, membership, "bob")  # a flapping connection...
+        go_online(p, online, "bob")               # ...is no change at all
+        go_online(p, online, "carol")
+        go_online(p, online, "dave")
+        go_offline(p, online, membership, "dave")
+        await asyncio.sleep(0.05)
+        go_offline(p, online, membership, "carol")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert sent == [
+        ("alice", {"type": "user_delta", "room": None, "added": ["carol"], "removed": []}),
+        ("alice", {"type": "user_delta", "room": None, "added": [], "removed": ["carol"]}),
+    ]
+
+
+def test_a_mass_disconnect_is_one_frame_per_subscriber_and_topic():
+    p, online, membership, sent = presence()
+    for i in range(1000):
+        go_online(p, online, f"user{i}")
+        membership.create("lobby", f"user{i}")
+    watchers = ["w1", "w2", "w3"]
+    for w in watchers:
+        p.subscribe(w, ("users", "lobby"))
+        p.subscribe(w, ROOMS)
+
+    async def scenario():
+        for i in range(1000):
+            go_offline(p, online, membership, f"user{i}")
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert sorted(u for u, _ in sent) == sorted(watchers * 2)
+    deltas = [f for u, f in sent if u == "w1"]
+    assert {"type": "room_delta", "created": [], "members": {"lobby": 0}} in deltas
+    users = next(f for f in deltas if f["type"] == "user_delta")
+    assert users["room"] == "lobby" and len(users["removed"]) == 1000 and users["added"] == []
+    assert p.stats["delta_frames"] == 6
+
+
+def test_room_deltas_and_dropping_subscribers():
+    p, online, membership, sent = presence()
+
+    async def scenario():
+        p.subscribe("alice", ROOMS)
+        p.subscribe("bob", ROOMS)
+        membership.create("lobby", "carol")
+        p.note({"op": "create_room", "user": "carol", "room": "lobby"})
+        membership.join("lobby", "dave")
+        p.note({"op": "join", "user": "dave", "room": "lobby"})
+        await asyncio.sleep(0.05)
+        p.drop("bob")
+        membership.leave("lobby", "dave")
+        p.note({"op": "leave", "user": "dave", "room": "lobby"})
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    first = {"type": "room_delta", "created": ["lobby"], "members": {"lobby": 2}}
+    assert sorted(sent[:2], key=lambda s: s[0]) == [("alice", first), ("bob", first)]
+    assert sent[2:] == [("alice", {"type": "room_delta", "created": [], "members": {"lobby": 1}})]
+    assert "bob" not in p.topics_of and p.subscribers == {ROOMS: {"alice"}}
+
+
+def test_list_commands_page_and_subscribe_through_the_server(monkeypatch):
+    monkeypatch.setattr(handlers.PRESENCE, "window", 0.01)
+
+    class FakeWebSocket:
+        def __init__(self):
+            self.frames = []
+
+        async def send(self, frame, text=None):
+            self.frames.append(json.loads(frame))
+
+    async def command(ws, username, obj):
+        await server.dispatch(ws, username, json.dumps(obj).encode(), "json", None)
+
+    async def scenario():
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear(), handlers.PRESENCE.reset()
+        backplane.node = LocalBackplane(LoopbackHub(), "local")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        try:
+            await handlers.register_user("alice", alice)
+            await command(alice, "alice", {"type": "list_rooms", "subscribe": True})
+            await handlers.register_user("bob", bob)
+            await command(bob, "bob", {"type": "create_room", "room": "lobby"})
+            await asyncio.sleep(0.05)
+            await command(alice, "alice", {"type": "list_users", "limit": 1})
+            await asyncio.sleep(0.01)  # the outbox writes in the background
+            await handlers.unregister_user("alice", alice)
+            return alice.frames
+        finally:
+            await backplane.node.stop()
+
+    frames = asyncio.run(scenario())
+    assert frames[0] == {"type": "room_list", "rooms": [], "active": 0, "total": 0, "next": None}
+    assert {"type": "room_delta", "created": ["lobby"], "members": {"lobby": 1}} in frames
+    assert frames[-1] == {"type": "user_list", "room": None, "users": ["alice"], "total": 2, "next": "alice"}
+    assert not handlers.PRESENCE.topics_of
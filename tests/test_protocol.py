@@ -0,0 +1,59 @@
+import json
+import pytest
+from app import protocol, handlers  # handlers registers the commands
+from app.config import MAX_MESSAGE_LENGTH
+from app.protocol import ProtocolError, parse
+
+
+def frame(obj):
+    return json.dumps(obj).encode()
+
+
+def test_client_field_names_map_to_canonical_ones():
+    cmd, data = parse(frame({"type": "message", "room": "lobby", "content": "hi"}))
+    assert cmd.handler is handlers.handle_message and cmd.rate_limited
+    assert data == {"room": "lobby", "message": "hi"}
+    cmd, data = parse(frame({"type": "join_room", "name": "lobby"}))
+    assert cmd.handler is handlers.handle_join_room and data == {"room": "lobby"}
+
+
+def test_defaults_fill_optional_fields():
+    _, data = parse(frame({"type": "history", "name": "lobby"}))
+    assert data == {"room": "lobby", "limit": 50, "before": None, "after": None}
+
+
+@pytest.mark.parametrize("obj, error", [
+    ({"type": "join_room"}, "'room' is required"),
+    ({"type": "history", "room": "lobby", "limit": "ten"}, "'limit' must be int"),
+    ({"type": "message", "room": "lobby", "message": ""}, "'message' must be"),
+    ({"type": "message", "room": "lobby", "message": "x" * (MAX_MESSAGE_LENGTH + 1)}, "'message' must be"),
+    ({"type": "dance"}, "Unknown message type"),
+])
+def test_invalid_commands_are_rejected(obj, error):
+    with pytest.raises(ProtocolError, match=error):
+        parse(frame(obj))
+
+
+def test_oversize_frames_are_rejected_before_decoding(monkeypatch):
+    def loads(raw):
+        raise AssertionError("decoded an oversize frame")
+    monkeypatch.setattr(protocol, "loads", loads)
+    with pytest.raises(ProtocolError, match="too large"):
+        parse(b"{" + b" " * protocol.MAX_FRAME_BYTES + b"}")
+
+
+def test_invalid_json_is_reported():
+    with pytest.raises(ProtocolError, match="Invalid JSON"):
+        parse(b"{not json")
+
+
+@pytest.mark.skipif(protocol.msgpack is None, reason="msgpack not installed")
+def test_msgpack_only_after_negotiation():
+    raw = protocol.msgpack.packb({"type": "message", "room": "lobby", "message": "hi"})
+    assert protocol.negotiate("msgpack") == "msgpack"
+    _, data = parse(raw, "msgpack")
+    assert data == {"room": "lobby", "message": "hi"}
+    # JSON still works on a MessagePack connection
+    assert parse(frame({"type": "pong"}), "msgpack")[1] == {}
+    with pytest.raises(ProtocolError, match="Invalid JSON"):
+        parse(raw, "json")
@@ -0,0 +1,91 @@
+import threading
+import time
+from app.utils import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_up_to_limit_then_reject():
+    clock = FakeClock()
+    rl = RateLimiter(limit=5, window=10, clock=clock)
+    assert [rl.allow("alice") for _ in range(6)] == [True] * 5 + [False]
+    assert rl.rejected == 1
+
+
+def test_tokens_refill_over_the_window():
+    clock = FakeClock()
+    rl = RateLimiter(limit=5, window=10, clock=clock)
+    for _ in range(5):
+        rl.allow("alice")
+    clock.now += 2  # 5 tokens / 10 s -> one token back
+    assert rl.allow("alice") is True
+    assert rl.allow("alice") is False
+
+
+def test_keys_are_independent():
+    clock = FakeClock()
+    rl = RateLimiter(limit=1, window=10, clock=clock)
+    assert rl.allow("alice") and rl.allow("bob")
+    assert not rl.allow("alice")
+
+
+def test_idle_keys_are_evicted():
+    clock = FakeClock()
+    rl = RateLimiter(limit=5, window=10, clock=clock)
+    for i in range(100):
+        rl.allow(f"user{i}")
+    clock.now += 11
+    rl.allow("active")
+    clock.now += 11
+    rl.allow("active")
+    assert len(rl) == 1
+
+
+def test_max_keys_caps_memory():
+    rl = RateLimiter(limit=5, window=10, max_keys=10, clock=FakeClock())
+    for i in range(50):
+        rl.allow(f"user{i}")
+    assert len(rl) <= 20  # two generations of at most max_keys
+
+
+def test_weighted_costs_share_one_bucket():
+    clock = FakeClock()
+    rl = RateLimiter(limit=10, window=1, clock=clock)
+    assert rl.allow("lobby", cost=6) and not rl.allow("lobby", cost=6) and rl.allow("lobby", cost=4)
+    assert not rl.allow("huge", cost=11)  # never fits
+    clock.now += 0.5
+    assert rl.allow("lobby", cost=5) and not rl.allow("lobby")
+
+
+class Yielding(str):
+    """A key whose every lookup lets another thread run: races show up at once."""
+
+    def __hash__(self):
+        time.sleep(0)
+        return str.__hash__(self)
+
+
+def test_concurrent_checks_share_one_budget():
+    # Every loop's connections check the same limiter; the other keys force rotations
+    rl = RateLimiter(limit=1000, window=1000, max_keys=50, clock=FakeClock())
+    allowed = []
+
+    def loop(k):
+        mine = 0
+        for i in range(2000):
+            mine += rl.allow(Yielding("alice"))
+            rl.allow(f"user{k}-{i}")
+        allowed.append(mine)
+
+    threads = [threading.Thread(target=loop, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(allowed) == 1000 and rl.rejected == 7000
@@ -0,0 +1,64 @@
+import asyncio
+from app import backplane, handlers, roomstore
+from app.backplane import LocalBackplane, LoopbackHub
+from app.memdb import InMemoryCollection
+from app.membership import Membership
+from app.roomstore import RoomStore
+
+
+class FakeWebSocket:
+    async def send(self, frame, text=None):
+        pass
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+def test_catalog_streams_in_batches_and_rooms_activate_on_join():
+    async def scenario():
+        rooms = InMemoryCollection("rooms")
+        await rooms.insert_many({"_id": f"room{i}", "created_by": "x"} for i in range(25))
+        m = Membership()
+        loaded = await RoomStore(rooms, InMemoryCollection("users"), batch_size=10).load_catalog(m.catalog)
+        return m, loaded
+
+    m, loaded = asyncio.run(scenario())
+    assert loaded == 25 and len(m.catalog) == 25 and m.rooms == {}
+    assert "room7" in m and not m.create("room7", "alice")  # known: joined, not created
+    assert set(m.rooms) == {"room7"} and m.members("room7") == {"alice"}
+    assert m.members("room8") == frozenset() and "room8" not in m.rooms
+
+
+def test_writes_go_through_and_register_restores_saved_rooms():
+    async def scenario():
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear()
+        backplane.node = LocalBackplane(LoopbackHub(), "local")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+        rooms, users = InMemoryCollection("rooms"), InMemoryCollection("users")
+        await roomstore.start(handlers.MEMBERSHIP.catalog, rooms, users)
+        try:
+            ws = FakeWebSocket()
+            await handlers.register_user("alice", ws)
+            await handlers.handle_create_room("alice", {"room": "lobby"})
+            await handlers.handle_create_room("alice", {"room": "dev"})
+            await handlers.handle_leave_room("alice", {"room": "dev"})
+            await handlers.unregister_user("alice", ws)
+            saved = dict(users.by_id["alice"])
+
+            # A restart: only the catalog comes back before anyone connects
+            handlers.MEMBERSHIP.clear()
+            await roomstore.start(handlers.MEMBERSHIP.catalog, rooms, users)
+            active_before = set(handlers.ROOMS)
+            await handlers.register_user("alice", ws)
+            restored = await handlers.restore_rooms("alice")
+            await handlers.unregister_user("alice", ws)
+            return saved, set(rooms.by_id), active_before, restored
+        finally:
+            roomstore.stop()
+            await backplane.node.stop()
+
+    saved, room_ids, active_before, restored = asyncio.run(scenario())
+    assert saved["rooms"] == ["lobby"] and "last_seen" in saved
+    assert room_ids == {"lobby", "dev"}
+    assert active_before == set()
+    assert restored == (["lobby"], {})
@@ -0,0 +1,47 @@
+import threading
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+from app import runtime
+from app.runtime import SelectiveDeflate
+
+
+def make_pair():
+    # server-side encoder and the matching client-side decoder
+    encoder = SelectiveDeflate(False, False, 12, 12, {"memLevel": 5})
+    decoder = PerMessageDeflate(False, False, 12, 12)
+    return encoder, decoder
+
+
+def test_small_frames_are_sent_uncompressed():
+    encoder, decoder = make_pair()
+    frame = encoder.encode(Frame(Opcode.TEXT, b'{"type":"message"}'))
+    assert frame.rsv1 is False
+    assert decoder.decode(frame).data == b'{"type":"message"}'
+
+
+def test_large_frames_are_compressed_and_decodable():
+    encoder, decoder = make_pair()
+    payload = b'{"type":"history","messages":[' + b'{"content":"hello"},' * 200 + b"{}]}"
+    frame = encoder.encode(Frame(Opcode.TEXT, payload))
+    assert frame.rsv1 is True
+    assert len(frame.data) < len(payload)
+    assert decoder.decode(frame).data == payload
+
+
+def test_bypass_flag_skips_compression_without_breaking_the_stream():
+    encoder, decoder = make_pair()
+    payload = b"x" * 4096
+    runtime.bypass_compression.on = True
+    try:
+        skipped = encoder.encode(Frame(Opcode.TEXT, payload))
+        # Another loop shard's thread writing meanwhile still compresses
+        elsewhere = []
+        thread = threading.Thread(target=lambda: elsewhere.append(make_pair()[0].encode(Frame(Opcode.TEXT, payload))))
+        thread.start()
+        thread.join()
+    finally:
+        runtime.bypass_compression.on = False
+    compressed = encoder.encode(Frame(Opcode.TEXT, payload))
+    assert skipped.rsv1 is False and elsewhere[0].rsv1 is True
+    assert decoder.decode(skipped).data == payload
+    assert decoder.decode(compressed).data == payload
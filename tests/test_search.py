@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+import pytest
+from app import search, history
+from app.memdb import InMemoryCollection
+
+
+@pytest.fixture(autouse=True)
+def fresh_index():
+    search.clear()
+    yield
+    search.clear()
+    search.collection = None
+
+
+def add(room, content, ms):
+    msg_id = str(ObjectId())
+    search.index(room, msg_id, ms, content)
+    return msg_id
+
+
+def test_full_segments_pack_postings_as_gaps():
+    segment = search.Segment()
+    for n in range(600):
+        words = {"common"} | ({"rare"} if n in (3, 500) else set()) | ({"once"} if n == 7 else set())
+        segment.add(bytes(12), n, words)
+    before = {w: list(segment.docs(w)) for w in ("common", "rare", "once", "nowhere")}
+    segment.install(segment.packed())
+    assert segment.postings is None and segment.words == ("common", "once", "rare")
+    assert len(segment.narrow) == 601 and set(segment.narrow) == {0, 1, 7}  # common's gaps + once
+    assert list(segment.wide) == [3, 497]  # a gap over 255
+    assert {w: list(segment.docs(w)) for w in before} == before
+    assert segment.count("common") == 600 and segment.count("nowhere") == 0
+
+
+def test_rank_puts_full_matches_first_newest_first(monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_SEGMENT_SIZE", 4)  # several segments
+    old_both = add("r", "deploy failed again", 1)
+    add("r", "the deploy went fine", 2)
+    for i in range(5):
+        add("r", f"chatter {i}", 3 + i)
+    new_both = add("r", "Deploy FAILED on staging", 10)
+    add("r", "tests failed", 11)
+    add("other", "deploy failed elsewhere", 12)
+    hits = search.rank("r", ["deploy", "failed"], 10)
+    assert [h[2] for h in hits[:2]] == [new_both, old_both]
+    assert len(hits) == 4 and hits[0][0] > hits[2][0]  # partial matches after, with lower scores
+    assert len(search.INDEXES["r"].segments) == 3
+
+
+def test_oldest_segments_are_evicted_over_budget(monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_SEGMENT_SIZE", 10)
+    monkeypatch.setattr(search, "SEARCH_MAX_MESSAGES", 25)
+    for i in range(40):
+        add("r", f"word{i % 3} hello", i)
+    index = search.INDEXES["r"]
+    assert search._indexed == index.count == 20 and index.floor_ms() == 20
+
+
+def test_search_hydrates_pages_and_falls_back_to_mongodb(monkeypatch):
+    async def scenario():
+        coll = InMemoryCollection("messages")
+        await search.start(coll)
+        # Older messages: only in MongoDB (from before this process started)
+        for i in range(3):
+            await coll.insert_many([{"_id": str(ObjectId()), "room": "r", "sender": "old", "content": f"release {i}",
+                                     "timestamp": history.from_ms(1000 + i)}])
+        ids = []
+        for i in range(3):
+            ms = 5000 + i
+            msg_id = add("r", f"release notes {i}", ms)
+            history.record("r", msg_id, ms, "new", f"release notes {i}")
+            ids.append(msg_id)
+        first, next_offset = await search.search("r", "release", limit=4)
+        second, last = await search.search("r", "release", limit=4, offset=next_offset)
+        return ids, first, next_offset, second, last
+
+    history.BUFFERS.pop("r", None)
+    try:
+        ids, first, next_offset, second, last = asyncio.run(scenario())
+    finally:
+        history.BUFFERS.pop("r", None)
+    assert [r["id"] for r in first[:3]] == ids[::-1] and first[0]["sender"] == "new"
+    assert first[3]["sender"] == "old" and next_offset == 4
+    assert [r["sender"] for r in second] == ["old", "old"] and last is None
@@ -0,0 +1,105 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import subprocess
+import sys
+import time
+import pytest
+from app import backplane, handlers, history, sessions
+from app.backplane import LocalBackplane, LoopbackHub
+from app.frames import loads
+from app.memdb import InMemoryCollection
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.remote_address = ("127.0.0.1", 1)
+
+    async def send(self, frame, text=None):
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+def test_session_tokens_verify_and_expire():
+    token = sessions.issue("alice")
+    assert sessions.verify(token) == "alice"
+    assert sessions.verify(token[:-3] + "AAA") is None
+    assert sessions.verify(token.replace(token.split(".")[0], "Ym9i")) is None  # "bob"
+    assert sessions.verify(token, now=time.time() + sessions.SESSION_TTL + 1) is None
+    assert sessions.verify("garbage") is None
+    for token in ("a.1.\u00e9", "\u00e9.\u00e9.\u00e9", "a.b.c", "..", "YQ.1." + "\x00" * 24):
+        assert sessions.verify(token) is None
+
+
+def test_sessions_are_never_signed_with_a_public_key():
+    # What a forger would compute from the old default secret
+    key = hashlib.sha256(b"chat-session:dev-token").digest()
+    payload = f"{base64.urlsafe_b64encode(b'alice').decode()}.{int(time.time() * 1000)}"
+    sig = base64.urlsafe_b64encode(hmac.new(key, payload.encode(), hashlib.sha256).digest()[:18]).decode()
+    assert sessions.verify(f"{payload}.{sig}") is None
+    for public in ("", "dev-token", "change-me"):
+        with pytest.raises(RuntimeError, match="SESSION_SECRET"):
+            sessions.check_secret(True, public)
+    sessions.check_secret(False, "")
+    sessions.check_secret(True, "not-in-the-repo")
+    env = {**os.environ, "SESSION_SECRET": "", "MONGO_URI": "memory://"}
+    for command, extra in ((["-m", "app.server", "--workers", "2"], {}),
+                           (["-c", "import app.sessions"], {"BACKPLANE": "redis"})):
+        started = subprocess.run([sys.executable, *command], env={**env, **extra}, capture_output=True, text=True,
+                                 timeout=30)
+        assert started.returncode != 0 and "SESSION_SECRET" in started.stderr
+
+
+def test_resume_rejoins_rooms_and_replays_only_missed_messages():
+    async def scenario():
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear()
+        history.BUFFERS.clear()
+        await history.start(InMemoryCollection())
+        backplane.node = LocalBackplane(LoopbackHub(), "n")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        await handlers.register_user("alice", alice)
+        await handlers.register_user("bob", bob)
+        await handlers.handle_create_room("alice", {"room": "lobby"})
+        await handlers.handle_join_room("bob", {"room": "lobby"})
+        await handlers.handle_message("alice", {"room": "lobby", "message": "m1"})
+        await asyncio.sleep(0.01)
+        seen = loads(bob.sent[-1])["data"]
+        cursor = f"{seen['ts']}:{seen['id']}"
+
+        await handlers.unregister_user("bob", bob)  # bob's connection drops
+        for i in (2, 3):
+            await handlers.handle_message("alice", {"room": "lobby", "message": f"m{i}"})
+        result = await handlers.resume_rooms("bob", {"lobby": cursor, "gone": None})
+        members = set(handlers.MEMBERSHIP.members("lobby"))
+        backplane.node = LocalBackplane()
+        return result, members
+
+    (joined, errors, replays), members = asyncio.run(scenario())
+    assert joined == ["lobby", "gone"] and errors == {}
+    assert members == {"alice", "bob"}
+    assert len(replays) == 1  # no cursor for "gone": nothing to replay
+    replay = loads(replays[0])
+    assert replay["type"] == "replay" and replay["room"] == "lobby"
+    assert [m["content"] for m in replay["messages"]] == ["m2", "m3"]
+    assert replay["truncated"] is False
+
+
+def test_resume_reports_rooms_the_limits_refuse():
+    async def scenario():
+        handlers.MEMBERSHIP.clear()
+        handlers.MEMBERSHIP.create("full", "owner")
+        handlers.MEMBERSHIP.max_users_per_room, limit = 1, handlers.MEMBERSHIP.max_users_per_room
+        try:
+            return await handlers.resume_rooms("bob", {"full": None})
+        finally:
+            handlers.MEMBERSHIP.max_users_per_room = limit
+
+    joined, errors, replays = asyncio.run(scenario())
+    assert joined == [] and "full" in errors["full"]
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+import pytest
+from app import backplane, handlers, server, shards
+from app.backplane import LocalBackplane, LoopbackHub
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.threads = set()  # which threads wrote to this socket
+
+    async def send(self, frame, text=None):
+        self.threads.add(threading.get_ident())
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+async def idle(shard):
+    await shard.closing.wait()
+
+
+def run_sharded(scenario, count=3):
+    async def outer():
+        await shards.start(idle, count)
+        try:
+            return await scenario()
+        finally:
+            await shards.stop()
+
+    return asyncio.run(outer())
+
+
+def test_call_runs_on_the_target_loop_and_returns_results_and_errors():
+    def where(x):
+        return threading.get_ident(), x * 2
+
+    async def slow(x):
+        await asyncio.sleep(0)
+        return shards.here().index, x
+
+    def fail():
+        raise ValueError("boom")
+
+    async def scenario():
+        other = shards.SHARDS[1]
+        thread, doubled = await shards.call(other, where, 21)
+        index, value = await shards.call(other, slow, "x")
+        with pytest.raises(ValueError, match="boom"):
+            await shards.call(other, fail)
+        inline = await shards.call(shards.MAIN, where, 1)
+        return thread, doubled, index, value, inline, other.thread.ident
+
+    thread, doubled, index, value, inline, other_thread = run_sharded(scenario)
+    assert thread == other_thread and doubled == 42
+    assert (index, value) == (1, "x")
+    assert inline == (threading.get_ident(), 2)
+    assert shards.SHARDS == [shards.MAIN]
+
+
+def test_a_burst_of_handoffs_wakes_the_loop_once():
+    async def scenario():
+        other = shards.SHARDS[1]
+        ran = []
+        before = other.stats["wakeups"]
+        for i in range(100):
+            other.submit(ran.append, i)
+        await shards.call(other, lambda: None)
+        return ran, other.stats["wakeups"] - before
+
+    ran, wakeups = run_sharded(scenario, count=2)
+    assert ran == list(range(100))  # in submission order
+    assert wakeups <= 2  # the burst, plus the call after it if the first pass already ran
+
+
+def test_rooms_live_on_their_home_loop_and_sockets_are_written_by_their_own():
+    async def scenario():
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear()
+        backplane.node = LocalBackplane(LoopbackHub(), "local")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+        try:
+            sockets = {}
+            for i, shard in enumerate(shards.SHARDS):
+                ws = sockets[f"user{i}"] = FakeWebSocket()
+                await shards.call(shard, handlers.register_user, f"user{i}", ws)
+            await server.dispatch(sockets["user0"], "user0", b'{"type":"create_room","room":"lobby"}', "json", None)
+            for name in ("user1", "user2"):
+                await server.dispatch(sockets[name], name, b'{"type":"join_room","room":"lobby"}', "json", None)
+            await server.dispatch(sockets["user1"], "user1", b'{"type":"message","room":"lobby","message":"hi"}',
+                                  "json", None)
+            await asyncio.sleep(0.05)  # the other loops' writers
+            members = set(handlers.MEMBERSHIP.members("lobby"))
+            for name, shard in zip(sockets, shards.SHARDS):
+                await shards.call(shard, handlers.unregister_user, name, sockets[name])
+            return sockets, members, set(handlers.MEMBERSHIP.members("lobby"))
+        finally:
+            await backplane.node.stop()
+
+    sockets, members, after = run_sharded(scenario)
+    assert members == {"user0", "user1", "user2"} and after == set()
+    for ws in sockets.values():
+        assert [m["data"]["content"] for m in ws.sent if m["type"] == "message"] == ["hi"]
+        assert len(ws.threads) == 1  # only ever written by the loop that registered it
+    assert len({next(iter(ws.threads)) for ws in sockets.values()}) == 3
+
+
+def test_a_rooms_user_list_is_read_on_its_home_loop(monkeypatch):
+    sorted_on = []
+    members = handlers._sorted_members
+
+    def record(room_name):
+        sorted_on.append(shards.here())
+        return members(room_name)
+
+    monkeypatch.setattr(handlers, "_sorted_members", record)
+
+    async def scenario():
+        handlers.USERS.clear(), handlers.MEMBERSHIP.clear(), handlers.ONLINE.clear()
+        backplane.node = LocalBackplane(LoopbackHub(), "local")
+        await backplane.node.start(handlers.deliver_remote, handlers.apply_event)
+        try:
+            # A room homed away from the main loop, where list_users runs
+            room = next(f"room{i}" for i in range(100) if shards.home(f"room{i}") is not shards.MAIN)
+            ws = FakeWebSocket()
+            await handlers.register_user("alice", ws)
+            for kind in ("create_room", "list_users"):
+                frame = json.dumps({"type": kind, "room": room}).encode()
+                await server.dispatch(ws, "alice", frame, "json", None)
+            await asyncio.sleep(0.05)  # the socket's writer
+            await handlers.unregister_user("alice", ws)
+            return ws, shards.home(room)
+        finally:
+            await backplane.node.stop()
+
+    ws, home = run_sharded(scenario)
+    assert sorted_on == [home]
+    assert [m["users"] for m in ws.sent if m["type"] == "user_list"] == [["alice"]]